@@ -7,6 +7,7 @@ import argparse
 from pathlib import Path
 
 from populationsim import run, add_run_args
+from populationsim.run import warmup
 
 
 def main():
@@ -17,7 +18,12 @@ def main():
     python -m populationsim
     or
     populationsim (if installed with the entry point)
+
+    ``populationsim warmup`` compiles the numba kernels into the numba cache instead.
     """
+    if sys.argv[1:2] == ["warmup"]:
+        return main_warmup(sys.argv[2:])
+
     parser = argparse.ArgumentParser(
         description="PopulationSim: Population Synthesis",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -36,5 +42,33 @@ def main():
         sys.exit(1)
 
 
+def main_warmup(argv):
+    """
+    Command-line entry point for populationsim warmup.
+    """
+    parser = argparse.ArgumentParser(
+        prog="populationsim warmup",
+        description="Compile the numba kernels into the numba cache",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    add_run_args(parser, multiprocess=False)
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        metavar="PATH",
+        help="numba cache dir (default: numba_cache_dir setting of the project)",
+    )
+    args = parser.parse_args(argv)
+
+    if not args.working_dir:
+        args.working_dir = Path.cwd()
+
+    try:
+        sys.exit(warmup(args))
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     main()
@@ -1,5 +1,8 @@
-from populationsim.balancing.simul_balancer import SimultaneousListBalancer
-from populationsim.balancing.single_balancer import ListBalancer
+from populationsim.balancing.simul_balancer import (
+    SimultaneousListBalancer,
+    np_simul_balance,
+)
+from populationsim.balancing.single_balancer import ListBalancer, np_balance
 from populationsim.balancing.wrappers import do_balancing, do_simul_balancing
 
 __all__ = [
@@ -7,4 +10,6 @@ __all__ = [
     "ListBalancer",
     "do_balancing",
     "do_simul_balancing",
+    "np_balance",
+    "np_simul_balance",
 ]
@@ -0,0 +1,488 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+# SQUAREM (squared extrapolation) acceleration of the list balancers
+#
+# The balancers are fixed-point iterations: each sweep over the controls maps
+# (weights, relaxation_factors) to an updated state. SQUAREM takes two plain sweeps
+# x1 = F(x0), x2 = F(x1), extrapolates along r = x1 - x0 and v = x2 - 2 x1 + x0
+#
+#   x' = x0 - 2 alpha r + alpha^2 v,    alpha = -|r| / |v|  (clamped to [-step_max, -1])
+#
+# and finishes with a stabilizing sweep F(x'). Extrapolation is done on log weights and
+# log relaxation factors so the extrapolated state stays positive. If the stabilizing
+# sweep changes the state more than the last plain sweep did (or is not finite) the
+# extrapolation is rejected and the balancer continues with a plain sweep from x2.
+#
+# Control importance is relaxed every IMPORTANCE_ADJUST_COUNT sweeps, which changes the
+# fixed-point map, so cycles never straddle an importance adjustment.
+
+import logging
+import numpy as np
+
+from populationsim.balancing.constants import (
+    DEFAULT_MAX_ITERATIONS,
+    MAX_DELTA,
+    MAX_DELTA32,
+    MAX_GAMMA,
+    MIN_GAMMA,
+    IMPORTANCE_ADJUST,
+    IMPORTANCE_ADJUST_COUNT,
+    MIN_IMPORTANCE,
+    MAX_RELAXATION_FACTOR,
+    MIN_CONTROL_VALUE,
+    ALT_MAX_DELTA,
+)
+
+logger = logging.getLogger(__name__)
+
+SQUAREM = "squarem"
+ACCELERATION_METHODS = [SQUAREM]
+
+# initial maximum extrapolation step length, and factor to grow (or shrink) it by
+SQUAREM_STEP_MAX0 = 1.0
+SQUAREM_STEP_FACTOR = 4.0
+SQUAREM_STEP_MAX = 1024.0
+
+
+def validate_acceleration(acceleration):
+    """
+    Normalize BALANCER_ACCELERATION setting value (None, False or name of method)
+    """
+    if not acceleration:
+        return None
+    if acceleration not in ACCELERATION_METHODS:
+        raise ValueError(
+            "unknown BALANCER_ACCELERATION '%s' (expected one of %s)"
+            % (acceleration, ACCELERATION_METHODS)
+        )
+    return acceleration
+
+
+def control_order(control_count, master_control_index):
+    """
+    control indexes in balancing order, with master control (if any) last
+    """
+    control_indexes = [c for c in range(control_count) if c != master_control_index]
+    if master_control_index is not None and master_control_index >= 0:
+        control_indexes.append(master_control_index)
+    return np.array(control_indexes, dtype=np.int32)
+
+
+def balancer_sweep_py(
+    control_indexes,
+    master_control_index,
+    incidence,
+    incidence2,
+    weights,
+    weights_lower_bound,
+    weights_upper_bound,
+    controls_constraint,
+    controls_importance,
+    importance_adjustment,
+    relaxation_factors,
+):
+    """
+    numpy version of balancer_sweep_numba
+    """
+    max_gamma_dif = 0.0
+
+    for c in control_indexes:
+
+        xx = (weights * incidence[c]).sum()
+
+        if c == master_control_index:
+            importance = controls_importance[c]
+        else:
+            importance = max(
+                controls_importance[c] * importance_adjustment, MIN_IMPORTANCE
+            )
+
+        if xx > 0:
+            yy = (weights * incidence2[c]).sum()
+            relaxed = max(
+                controls_constraint[c] * relaxation_factors[c], MIN_CONTROL_VALUE
+            )
+
+            gamma = 1.0 - (xx - relaxed) / (yy + relaxed / importance)
+            gamma = max(gamma, MIN_GAMMA)
+
+            weights *= np.exp(np.log(gamma) * incidence[c])
+            np.clip(weights, weights_lower_bound, weights_upper_bound, out=weights)
+
+            relaxation_factors[c] = min(
+                relaxation_factors[c] * (1.0 / gamma) ** (1.0 / importance),
+                MAX_RELAXATION_FACTOR,
+            )
+
+            max_gamma_dif = max(max_gamma_dif, abs(gamma - 1.0))
+
+    return max_gamma_dif
+
+
+def simul_balancer_sweep_py(
+    control_indexes,
+    master_control_index,
+    incidence,
+    incidence2,
+    parent_weights,
+    sub_weights,
+    weights_lower_bound,
+    weights_upper_bound,
+    sub_controls,
+    controls_importance,
+    importance_adjustment,
+    relaxation_factors,
+):
+    """
+    numpy version of simul_balancer_sweep_numba, vectorized over sub zones
+    """
+    max_gamma_dif = 0.0
+
+    for c in control_indexes:
+
+        if c == master_control_index:
+            importance = controls_importance[c]
+        else:
+            importance = max(
+                controls_importance[c] * importance_adjustment, MIN_IMPORTANCE
+            )
+
+        xx = sub_weights @ incidence[c]
+        yy = sub_weights @ incidence2[c]
+
+        zones = xx > 0
+        if not zones.any():
+            continue
+
+        relaxed = np.maximum(
+            sub_controls[zones, c] * relaxation_factors[zones, c], MIN_CONTROL_VALUE
+        )
+        gamma = 1.0 - (xx[zones] - relaxed) / (yy[zones] + relaxed / importance)
+        gamma = np.maximum(gamma, MIN_GAMMA)
+
+        sub_weights[zones] *= np.exp(np.outer(np.log(gamma), incidence[c]))
+        sub_weights[zones] = np.clip(
+            sub_weights[zones], weights_lower_bound, weights_upper_bound
+        )
+
+        relaxation_factors[zones, c] = np.minimum(
+            relaxation_factors[zones, c] * (1.0 / gamma) ** (1.0 / importance),
+            MAX_RELAXATION_FACTOR,
+        )
+
+        max_gamma_dif = max(max_gamma_dif, np.abs(gamma - 1.0).max())
+
+    # rescale so weight of each hh across sub zones sums to parent_weight
+    zone_sums = sub_weights.sum(axis=0)
+    valid = zone_sums > 0
+    sub_weights[:, valid] *= parent_weights[valid] / zone_sums[valid]
+
+    return max_gamma_dif
+
+
+def importance_adjustment(iteration):
+    """
+    importance adjustment in effect at balancer iteration (halved every IMPORTANCE_ADJUST_COUNT)
+    """
+    return 1.0 / float(IMPORTANCE_ADJUST ** (iteration // IMPORTANCE_ADJUST_COUNT))
+
+
+def squarem_balance(
+    sweep,
+    weights,
+    relaxation_factors,
+    weights_lower_bound,
+    weights_upper_bound,
+    sample_count,
+    max_iterations,
+    max_delta,
+):
+    """
+    Run balancer sweeps to convergence with SQUAREM extrapolation between sweeps
+
+    Parameters
+    ----------
+    sweep : callable
+        sweep(weights, relaxation_factors, importance_adjustment) -> max_gamma_dif
+        updates weights and relaxation_factors in place
+    weights : numpy.ndarray
+        initial weights (1-D, or zones x samples), modified in place
+    relaxation_factors : numpy.ndarray
+        initial relaxation factors, modified in place
+    weights_lower_bound, weights_upper_bound : numpy.ndarray
+        per-sample weight bounds
+    sample_count : int
+    max_iterations : int
+        maximum number of sweeps
+    max_delta : float
+        convergence threshold on mean absolute weight change per sweep
+
+    Returns
+    -------
+    weights, relaxation_factors, converged, no_progress, iterations, delta, max_gamma_dif
+    """
+
+    step_max = SQUAREM_STEP_MAX0
+    rejected = 0
+    extrapolated = 0
+
+    iteration = 0
+    delta = 0.0
+    max_gamma_dif = 0.0
+
+    def plain_sweep():
+        nonlocal iteration, delta, max_gamma_dif
+        weights_previous = weights.copy()
+        max_gamma_dif = sweep(
+            weights, relaxation_factors, importance_adjustment(iteration)
+        )
+        delta = np.abs(weights - weights_previous).sum() / float(sample_count)
+        iteration += 1
+        return delta < max_delta and max_gamma_dif < MAX_GAMMA, delta < ALT_MAX_DELTA
+
+    def finished(converged, no_progress):
+        logger.debug(
+            "squarem balancer %s sweeps, %s extrapolations (%s rejected)"
+            % (iteration, extrapolated, rejected)
+        )
+        return (
+            weights,
+            relaxation_factors,
+            converged,
+            no_progress,
+            # index of the last sweep, or max_iterations if not converged (like the plain
+            # balancers)
+            iteration - 1 if converged or no_progress else max_iterations,
+            delta,
+            max_gamma_dif,
+        )
+
+    while iteration < max_iterations:
+
+        epoch = iteration // IMPORTANCE_ADJUST_COUNT
+        if (
+            iteration + 4 > max_iterations
+            or (iteration + 2) // IMPORTANCE_ADJUST_COUNT != epoch
+        ):
+            # don't extrapolate across an importance adjustment
+            converged, no_progress = plain_sweep()
+            if converged or no_progress:
+                return finished(converged, no_progress)
+            continue
+
+        w0 = weights.copy()
+        r0 = relaxation_factors.copy()
+
+        converged, no_progress = plain_sweep()
+        if converged or no_progress:
+            return finished(converged, no_progress)
+        w1 = weights.copy()
+        r1 = relaxation_factors.copy()
+
+        converged, no_progress = plain_sweep()
+        if converged or no_progress:
+            return finished(converged, no_progress)
+        delta2 = delta
+        w2 = weights.copy()
+        r2 = relaxation_factors.copy()
+
+        # extrapolate log weights (of strictly positive weights) and log relaxation factors
+        positive = (w0 > 0) & (w1 > 0) & (w2 > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lw0, lw1, lw2 = (np.log(w[positive]) for w in (w0, w1, w2))
+            lr0, lr1, lr2 = (np.log(r) for r in (r0, r1, r2))
+
+        rw, rr = lw1 - lw0, lr1 - lr0
+        vw, vr = lw2 - lw1 - rw, lr2 - lr1 - rr
+        r_norm = np.sqrt((rw * rw).sum() + (rr * rr).sum())
+        v_norm = np.sqrt((vw * vw).sum() + (vr * vr).sum())
+
+        if not (v_norm > 0 and np.isfinite(r_norm) and np.isfinite(v_norm)):
+            continue
+
+        alpha = min(max(-r_norm / v_norm, -step_max), -1.0)
+        if alpha == -step_max:
+            step_max = min(step_max * SQUAREM_STEP_FACTOR, SQUAREM_STEP_MAX)
+        if alpha == -1.0:
+            # extrapolation would just reproduce the second plain sweep
+            continue
+
+        extrapolated += 1
+
+        weights[positive] = np.exp(lw0 - 2 * alpha * rw + alpha * alpha * vw)
+        np.clip(weights, weights_lower_bound, weights_upper_bound, out=weights)
+        relaxation_factors[:] = np.minimum(
+            np.exp(lr0 - 2 * alpha * rr + alpha * alpha * vr), MAX_RELAXATION_FACTOR
+        )
+
+        # stabilizing sweep from extrapolated state
+        converged, no_progress = plain_sweep()
+
+        if np.isfinite(delta) and np.isfinite(max_gamma_dif) and delta <= delta2:
+            if converged or no_progress:
+                return finished(converged, no_progress)
+            continue
+
+        # safeguard: extrapolation diverged, fall back to plain sweep from x2
+        rejected += 1
+        step_max = max(step_max / SQUAREM_STEP_FACTOR, SQUAREM_STEP_MAX0)
+        weights[:] = w2
+        relaxation_factors[:] = r2
+
+        converged, no_progress = plain_sweep()
+        if converged or no_progress:
+            return finished(converged, no_progress)
+
+    return finished(False, False)
+
+
+def np_balancer_squarem(
+    sample_count,
+    control_count,
+    master_control_index,
+    incidence,
+    weights_initial,
+    weights_lower_bound,
+    weights_upper_bound,
+    controls_constraint,
+    controls_importance,
+    max_iterations=DEFAULT_MAX_ITERATIONS,
+    use_numba=True,
+):
+    """
+    SQUAREM accelerated list balancer with the same arguments and results as np_balancer_numba
+    """
+
+    incidence = np.asarray(incidence, dtype=np.float64)
+    incidence2 = incidence * incidence
+    weights_lower_bound = np.asarray(weights_lower_bound, dtype=np.float64)
+    weights_upper_bound = np.asarray(weights_upper_bound, dtype=np.float64)
+    controls_constraint = np.asarray(controls_constraint, dtype=np.float64)
+    controls_importance = np.asarray(controls_importance, dtype=np.float64)
+
+    if master_control_index is None:
+        master_control_index = -1
+    control_indexes = control_order(control_count, master_control_index)
+
+    if use_numba:
+        from populationsim.balancing.balancers_numba import balancer_sweep_numba
+
+        kernel = balancer_sweep_numba
+    else:
+        kernel = balancer_sweep_py
+
+    def sweep(weights, relaxation_factors, adjustment):
+        return kernel(
+            control_indexes,
+            master_control_index,
+            incidence,
+            incidence2,
+            weights,
+            weights_lower_bound,
+            weights_upper_bound,
+            controls_constraint,
+            controls_importance,
+            adjustment,
+            relaxation_factors,
+        )
+
+    weights, relaxation_factors, converged, no_progress, iter, delta, max_gamma_dif = (
+        squarem_balance(
+            sweep,
+            np.array(weights_initial, dtype=np.float64),
+            np.ones(control_count, dtype=np.float64),
+            weights_lower_bound,
+            weights_upper_bound,
+            sample_count,
+            max_iterations,
+            MAX_DELTA32 if use_numba else MAX_DELTA,
+        )
+    )
+
+    # like np_balancer_numba, a balancer that stops making progress is deemed converged
+    return (
+        weights,
+        relaxation_factors,
+        (converged or no_progress, iter, delta, max_gamma_dif),
+    )
+
+
+def np_simul_balancer_squarem(
+    sample_count,
+    control_count,
+    zone_count,
+    master_control_index,
+    incidence,
+    parent_weights,
+    weights_lower_bound,
+    weights_upper_bound,
+    sub_weights,
+    parent_controls,
+    controls_importance,
+    sub_controls,
+    max_iterations=DEFAULT_MAX_ITERATIONS,
+    use_numba=True,
+):
+    """
+    SQUAREM accelerated simultaneous balancer with the same arguments and results as
+    np_simul_balancer_numba
+    """
+
+    incidence = np.asarray(incidence, dtype=np.float64)
+    incidence2 = incidence * incidence
+    parent_weights = np.asarray(parent_weights, dtype=np.float64)
+    weights_lower_bound = np.asarray(weights_lower_bound, dtype=np.float64)
+    weights_upper_bound = np.asarray(weights_upper_bound, dtype=np.float64)
+    controls_importance = np.asarray(controls_importance, dtype=np.float64)
+    sub_controls = np.asarray(sub_controls, dtype=np.float64)
+
+    # Normalize sub_controls to match parent_controls if provided
+    if parent_controls is not None:
+        totals = sub_controls.sum(axis=0)
+        scale_factors = np.ones_like(totals)
+        valid = totals > 0
+        scale_factors[valid] = parent_controls[valid] / totals[valid]
+        sub_controls = sub_controls * scale_factors
+
+    if master_control_index is None:
+        master_control_index = -1
+    control_indexes = control_order(control_count, master_control_index)
+
+    if use_numba:
+        from populationsim.balancing.balancers_numba import simul_balancer_sweep_numba
+
+        kernel = simul_balancer_sweep_numba
+    else:
+        kernel = simul_balancer_sweep_py
+
+    def sweep(weights, relaxation_factors, adjustment):
+        return kernel(
+            control_indexes,
+            master_control_index,
+            incidence,
+            incidence2,
+            parent_weights,
+            weights,
+            weights_lower_bound,
+            weights_upper_bound,
+            sub_controls,
+            controls_importance,
+            adjustment,
+            relaxation_factors,
+        )
+
+    weights, relaxation_factors, converged, no_progress, iter, delta, max_gamma_dif = (
+        squarem_balance(
+            sweep,
+            np.array(sub_weights, dtype=np.float64),
+            np.ones((zone_count, control_count), dtype=np.float64),
+            weights_lower_bound,
+            weights_upper_bound,
+            sample_count,
+            max_iterations,
+            MAX_DELTA32 if use_numba else MAX_DELTA,
+        )
+    )
+
+    return weights, relaxation_factors, (converged, iter, delta, max_gamma_dif)
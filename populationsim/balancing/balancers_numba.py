@@ -238,3 +238,141 @@ def np_simul_balancer_numba(
         relaxation_factors,
         (False, max_iterations, delta, max_gamma_dif),
     )
+
+
+@njit(fastmath=True, cache=True)
+def balancer_sweep_numba(
+    control_indexes,
+    master_control_index,
+    incidence,
+    incidence2,
+    weights,
+    weights_lower_bound,
+    weights_upper_bound,
+    controls_constraint,
+    controls_importance,
+    importance_adjustment,
+    relaxation_factors,
+):
+    """
+    One list balancer sweep over all controls, updating weights and relaxation_factors in place
+
+    Returns max_gamma_dif for the sweep.
+    """
+    sample_count = weights.shape[0]
+    max_gamma_dif = 0.0
+
+    for i in range(control_indexes.shape[0]):
+        c = control_indexes[i]
+        xx = 0.0
+        yy = 0.0
+        for j in range(sample_count):
+            xx += weights[j] * incidence[c, j]
+            yy += weights[j] * incidence2[c, j]
+
+        if c == master_control_index:
+            importance = controls_importance[c]
+        else:
+            importance = max(
+                controls_importance[c] * importance_adjustment, MIN_IMPORTANCE
+            )
+
+        if xx > 0.0:
+            relaxed = controls_constraint[c] * relaxation_factors[c]
+            if relaxed < MIN_CONTROL_VALUE:
+                relaxed = MIN_CONTROL_VALUE
+
+            gamma = 1.0 - (xx - relaxed) / (yy + relaxed / importance)
+            gamma = max(gamma, MIN_GAMMA)
+            log_gamma = np.log(gamma)
+
+            for j in range(sample_count):
+                new_w = weights[j] * np.exp(log_gamma * incidence[c, j])
+                weights[j] = min(
+                    max(new_w, weights_lower_bound[j]), weights_upper_bound[j]
+                )
+
+            relaxation_factors[c] = min(
+                relaxation_factors[c] * (1.0 / gamma) ** (1.0 / importance),
+                MAX_RELAXATION_FACTOR,
+            )
+
+            max_gamma_dif = max(max_gamma_dif, abs(gamma - 1.0))
+
+    return max_gamma_dif
+
+
+@njit(fastmath=True, cache=True)
+def simul_balancer_sweep_numba(
+    control_indexes,
+    master_control_index,
+    incidence,
+    incidence2,
+    parent_weights,
+    sub_weights,
+    weights_lower_bound,
+    weights_upper_bound,
+    sub_controls,
+    controls_importance,
+    importance_adjustment,
+    relaxation_factors,
+):
+    """
+    One simultaneous balancer sweep over all controls and sub zones, followed by the rescale
+    of sub zone weights to parent weights. Updates sub_weights and relaxation_factors in place.
+
+    Returns max_gamma_dif for the sweep.
+    """
+    zone_count, sample_count = sub_weights.shape
+    max_gamma_dif = 0.0
+
+    for i in range(control_indexes.shape[0]):
+        c = control_indexes[i]
+
+        if c == master_control_index:
+            importance = controls_importance[c]
+        else:
+            importance = max(
+                controls_importance[c] * importance_adjustment, MIN_IMPORTANCE
+            )
+
+        for z in range(zone_count):
+            xx = 0.0
+            yy = 0.0
+            for j in range(sample_count):
+                xx += sub_weights[z, j] * incidence[c, j]
+                yy += sub_weights[z, j] * incidence2[c, j]
+
+            if xx > 0.0:
+                relaxed = sub_controls[z, c] * relaxation_factors[z, c]
+                if relaxed < MIN_CONTROL_VALUE:
+                    relaxed = MIN_CONTROL_VALUE
+
+                gamma = 1.0 - (xx - relaxed) / (yy + relaxed / importance)
+                gamma = max(gamma, MIN_GAMMA)
+                log_gamma = np.log(gamma)
+
+                for j in range(sample_count):
+                    new_w = sub_weights[z, j] * np.exp(log_gamma * incidence[c, j])
+                    sub_weights[z, j] = min(
+                        max(new_w, weights_lower_bound[j]), weights_upper_bound[j]
+                    )
+
+                relaxation_factors[z, c] = min(
+                    relaxation_factors[z, c] * (1.0 / gamma) ** (1.0 / importance),
+                    MAX_RELAXATION_FACTOR,
+                )
+
+                max_gamma_dif = max(max_gamma_dif, abs(gamma - 1.0))
+
+    # rescale so weight of each hh across sub zones sums to parent_weight
+    for j in range(sample_count):
+        zone_sum = 0.0
+        for z in range(zone_count):
+            zone_sum += sub_weights[z, j]
+        if zone_sum > 0:
+            scale = parent_weights[j] / zone_sum
+            for z in range(zone_count):
+                sub_weights[z, j] *= scale
+
+    return max_gamma_dif
@@ -2,6 +2,9 @@
 
 # Convergence constants
 DEFAULT_MAX_ITERATIONS = 10000
+DUAL_NEWTON_MAX_ITERATIONS = 100
+# largest zone_count * control_count (the dual newton simul hessian is its square)
+DUAL_NEWTON_MAX_SIMUL_DUALS = 2000
 MAX_DELTA = 1.0e-9
 MAX_DELTA32 = 1.0e-5
 MAX_GAMMA = 1.0e-5
@@ -0,0 +1,363 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+# Dual Newton balancing engine (BALANCER_ENGINE: dual_newton)
+#
+# The list balancers solve a relaxed minimum discrimination information problem
+#
+#   min  sum_j w_j ln(w_j / w0_j) - w_j  +  sum_c importance_c T_c (z_c ln z_c - z_c)
+#   s.t. sum_j a_cj w_j = T_c z_c              for each control c
+#        lb_j <= w_j <= ub_j,  0 < z_c <= MAX_RELAXATION_FACTOR
+#
+# The coordinate balancers update one control multiplier at a time. Here we minimize the
+# (convex) dual over all control multipliers lambda at once:
+#
+#   w_j = clip(w0_j exp(a_j . lambda), lb_j, ub_j)     z_c = exp(-lambda_c / importance_c)
+#   gradient = A w - T z
+#   hessian  = A diag(w_j unclipped) A' + diag(T z / importance)
+#
+# with damped (backtracking) Newton steps. For the simultaneous balancer the per-household
+# parent weight constraints (sum over sub zones of w_zj = W_j) are eliminated in closed
+# form, so sub zone weights are a softmax over zones and the hessian couples zones through
+# each household's zone shares.
+#
+# Control importance is used as is, there is no importance adjustment schedule as in the
+# coordinate balancers.
+
+import logging
+import numpy as np
+
+from populationsim.balancing.constants import (
+    DEFAULT_MAX_ITERATIONS,
+    DUAL_NEWTON_MAX_ITERATIONS,
+    MAX_GAMMA,
+    MIN_CONTROL_VALUE,
+    MIN_IMPORTANCE,
+    MAX_RELAXATION_FACTOR,
+)
+
+logger = logging.getLogger(__name__)
+
+COORDINATE = "coordinate"
+DUAL_NEWTON = "dual_newton"
+BALANCER_ENGINES = [COORDINATE, DUAL_NEWTON]
+
+# Armijo sufficient decrease parameter and maximum step halvings in line search
+ARMIJO = 1.0e-4
+MAX_BACKTRACKS = 40
+
+# ridge added to the hessian diagonal (relative to its largest entry)
+HESSIAN_RIDGE = 1.0e-12
+
+
+def validate_engine(engine):
+    """
+    Normalize BALANCER_ENGINE setting value (None defaults to the coordinate balancers)
+    """
+    if engine is None:
+        return COORDINATE
+    if engine not in BALANCER_ENGINES:
+        raise ValueError(
+            "unknown BALANCER_ENGINE '%s' (expected one of %s)"
+            % (engine, BALANCER_ENGINES)
+        )
+    return engine
+
+
+def relaxation(lambdas, controls, importance):
+    """
+    relaxation factors and their dual objective terms for control multipliers lambdas
+
+    Returns
+    -------
+    z : numpy.ndarray
+        relaxation factors, exp(-lambda / importance) capped at MAX_RELAXATION_FACTOR
+    objective : float
+    curvature : numpy.ndarray
+        second derivative of the dual objective with respect to each lambda
+    """
+    log_z = -lambdas / importance
+    capped = log_z > np.log(MAX_RELAXATION_FACTOR)
+    log_z = np.minimum(log_z, np.log(MAX_RELAXATION_FACTOR))
+    z = np.exp(log_z)
+
+    # max over z of -lambda T z - importance T (z ln z - z)
+    objective = np.where(
+        capped,
+        -lambdas * controls * z - importance * controls * (z * log_z - z),
+        importance * controls * z,
+    ).sum()
+    curvature = np.where(capped, 0.0, controls * z / importance)
+
+    return z, objective, curvature
+
+
+def newton_step(gradient, hessian):
+    """
+    Newton direction -H^-1 g, with a small ridge for (nearly) singular hessians
+    """
+    ridge = HESSIAN_RIDGE * max(np.abs(np.diag(hessian)).max(), 1.0)
+    hessian = hessian + ridge * np.eye(len(gradient))
+    try:
+        return -np.linalg.solve(hessian, gradient)
+    except np.linalg.LinAlgError:
+        return -np.linalg.lstsq(hessian, gradient, rcond=None)[0]
+
+
+def minimize_dual(evaluate, lambdas, max_iterations):
+    """
+    Damped Newton minimization of a convex dual objective
+
+    Parameters
+    ----------
+    evaluate : callable
+        evaluate(lambdas, derivatives) -> (objective, gradient, hessian, state)
+        gradient and hessian are only required when derivatives is True
+    lambdas : numpy.ndarray
+        initial multipliers
+    max_iterations : int
+
+    Returns
+    -------
+    lambdas, state, converged, iterations, max_residual
+    """
+
+    objective, gradient, hessian, state = evaluate(lambdas, True)
+
+    for iteration in range(max_iterations):
+
+        if state["max_residual"] < MAX_GAMMA:
+            return lambdas, state, True, iteration, state["max_residual"]
+
+        step = newton_step(gradient, hessian)
+        slope = gradient @ step
+        if not slope < 0:
+            # not a descent direction (hessian numerically singular)
+            step = -gradient
+            slope = -(gradient @ gradient)
+
+        t = 1.0
+        for _ in range(MAX_BACKTRACKS):
+            trial_objective, _, _, _ = evaluate(lambdas + t * step, False)
+            if (
+                np.isfinite(trial_objective)
+                and trial_objective <= objective + ARMIJO * t * slope
+            ):
+                break
+            t /= 2
+        else:
+            # no progress possible along newton direction
+            return lambdas, state, False, iteration, state["max_residual"]
+
+        lambdas = lambdas + t * step
+        objective, gradient, hessian, state = evaluate(lambdas, True)
+
+    converged = state["max_residual"] < MAX_GAMMA
+    return lambdas, state, converged, max_iterations, state["max_residual"]
+
+
+def np_balancer_dual_newton(
+    sample_count,
+    control_count,
+    master_control_index,
+    incidence,
+    weights_initial,
+    weights_lower_bound,
+    weights_upper_bound,
+    controls_constraint,
+    controls_importance,
+    max_iterations=DEFAULT_MAX_ITERATIONS,
+):
+    """
+    Dual Newton list balancer with the same arguments and results as np_balancer_py
+
+    master_control_index is accepted for compatibility: all controls are balanced jointly.
+    """
+
+    incidence = np.asarray(incidence, dtype=np.float64)
+    weights_initial = np.asarray(weights_initial, dtype=np.float64)
+    lower = np.asarray(weights_lower_bound, dtype=np.float64)
+    upper = np.asarray(weights_upper_bound, dtype=np.float64)
+    controls = np.maximum(
+        np.asarray(controls_constraint, dtype=np.float64), MIN_CONTROL_VALUE
+    )
+    importance = np.maximum(
+        np.asarray(controls_importance, dtype=np.float64), MIN_IMPORTANCE
+    )
+
+    # controls no household contributes to can't be balanced (coordinate balancers skip them)
+    active = (incidence * weights_initial).sum(axis=1) > 0
+    a = incidence[active]
+
+    with np.errstate(divide="ignore"):
+        log_w0 = np.log(weights_initial)
+        log_lower = np.log(lower)
+        log_upper = np.log(upper)
+    positive = weights_initial > 0
+
+    def evaluate(lambdas, derivatives):
+        s = lambdas @ a
+        log_w = np.clip(log_w0 + s, log_lower, log_upper)
+        w = np.where(positive, np.exp(log_w), 0.0)
+        free = positive & (log_w0 + s > log_lower) & (log_w0 + s < log_upper)
+
+        # max over w in bounds of w s - (w ln(w / w0) - w)
+        with np.errstate(invalid="ignore"):
+            household_terms = np.where(positive, w * (s - log_w + log_w0) + w, 0.0)
+        z, relaxation_objective, curvature = relaxation(
+            lambdas, controls[active], importance[active]
+        )
+        objective = household_terms.sum() + relaxation_objective
+
+        gradient = hessian = None
+        weighted_totals = a @ w
+        relaxed = controls[active] * z
+        if derivatives:
+            gradient = weighted_totals - relaxed
+            hessian = (a * np.where(free, w, 0.0)) @ a.T + np.diag(curvature)
+
+        max_residual = (
+            np.abs(weighted_totals / relaxed - 1).max() if len(relaxed) else 0.0
+        )
+        state = {"weights": w, "z": z, "max_residual": max_residual}
+        return objective, gradient, hessian, state
+
+    iterations = min(max_iterations, DUAL_NEWTON_MAX_ITERATIONS)
+    lambdas, state, converged, iter, max_residual = minimize_dual(
+        evaluate, np.zeros(active.sum()), iterations
+    )
+
+    relaxation_factors = np.ones(control_count)
+    relaxation_factors[active] = state["z"]
+
+    weights_final = state["weights"]
+    delta = np.abs(weights_final - weights_initial).sum() / float(sample_count)
+
+    logger.debug(
+        "np_balancer_dual_newton converged %s iter %s max_residual %s"
+        % (converged, iter, max_residual)
+    )
+
+    return weights_final, relaxation_factors, (converged, iter, delta, max_residual)
+
+
+def np_simul_balancer_dual_newton(
+    sample_count,
+    control_count,
+    zone_count,
+    master_control_index,
+    incidence,
+    parent_weights,
+    weights_lower_bound,
+    weights_upper_bound,
+    sub_weights,
+    parent_controls,
+    controls_importance,
+    sub_controls,
+    max_iterations=DEFAULT_MAX_ITERATIONS,
+):
+    """
+    Dual Newton simultaneous balancer with the same arguments and results as
+    np_simul_balancer_py
+
+    Sub zone weights of each household always sum to its parent weight, so they also stay
+    within the [0, parent weight] bounds the simultaneous balancer is called with. Other
+    (tighter) bounds can't be enforced and raise a ValueError.
+
+    The hessian has (zone_count * control_count)**2 entries, see DUAL_NEWTON_MAX_SIMUL_DUALS.
+    """
+
+    incidence = np.asarray(incidence, dtype=np.float64)
+    parent_weights = np.asarray(parent_weights, dtype=np.float64)
+
+    if (np.asarray(weights_lower_bound) > 0).any() or (
+        np.asarray(weights_upper_bound) < parent_weights
+    ).any():
+        raise ValueError(
+            "dual_newton simul balancer only supports [0, parent weight] weight bounds"
+        )
+    sub_weights = np.asarray(sub_weights, dtype=np.float64)
+    sub_controls = np.asarray(sub_controls, dtype=np.float64)
+    importance = np.maximum(
+        np.asarray(controls_importance, dtype=np.float64), MIN_IMPORTANCE
+    )
+
+    # Normalize sub_controls to match parent_controls if provided
+    if parent_controls is not None:
+        totals = sub_controls.sum(axis=0)
+        scale_factors = np.ones_like(totals)
+        valid = totals > 0
+        scale_factors[valid] = parent_controls[valid] / totals[valid]
+        sub_controls = sub_controls * scale_factors
+
+    active = (incidence * parent_weights).sum(axis=1) > 0
+    a = incidence[active]
+    active_count = a.shape[0]
+
+    controls = np.maximum(sub_controls[:, active], MIN_CONTROL_VALUE).ravel()
+    zone_importance = np.tile(importance[active], zone_count)
+
+    with np.errstate(divide="ignore"):
+        log_w0 = np.log(sub_weights)
+
+    def evaluate(lambdas, derivatives):
+        # log weights before normalizing each household's zone shares (zones x samples)
+        log_u = log_w0 + lambdas.reshape(zone_count, active_count) @ a
+        log_norm = np.logaddexp.reduce(log_u, axis=0)
+        shares = np.exp(log_u - log_norm)
+        w = shares * parent_weights
+
+        # sum over households of W_j log sum_z w0_zj exp(a_j . lambda_z)
+        household_objective = (parent_weights * log_norm).sum()
+        z, relaxation_objective, curvature = relaxation(
+            lambdas, controls, zone_importance
+        )
+        objective = household_objective + relaxation_objective
+
+        weighted_totals = (w @ a.T).ravel()
+        relaxed = controls * z
+
+        gradient = hessian = None
+        if derivatives:
+            gradient = weighted_totals - relaxed
+
+            # A diag(W p_z) A' on the diagonal blocks minus A diag(W p_z p_z') A', built
+            # one (symmetric) pair of zone blocks at a time
+            hessian = np.empty((len(lambdas), len(lambdas)))
+            blocks = [
+                slice(zone * active_count, (zone + 1) * active_count)
+                for zone in range(zone_count)
+            ]
+            for z1 in range(zone_count):
+                x = a * w[z1]
+                for z2 in range(z1, zone_count):
+                    block = -(x @ (a * shares[z2]).T)
+                    if z1 == z2:
+                        block += x @ a.T
+                    hessian[blocks[z1], blocks[z2]] = block
+                    hessian[blocks[z2], blocks[z1]] = block.T
+            hessian[np.diag_indices_from(hessian)] += curvature
+
+        max_residual = (
+            np.abs(weighted_totals / relaxed - 1).max() if len(relaxed) else 0.0
+        )
+        state = {"weights": w, "z": z, "max_residual": max_residual}
+        return objective, gradient, hessian, state
+
+    iterations = min(max_iterations, DUAL_NEWTON_MAX_ITERATIONS)
+    lambdas, state, converged, iter, max_residual = minimize_dual(
+        evaluate, np.zeros(zone_count * active_count), iterations
+    )
+
+    relaxation_factors = np.ones((zone_count, control_count))
+    relaxation_factors[:, active] = state["z"].reshape(zone_count, active_count)
+
+    weights_final = state["weights"]
+    delta = np.abs(weights_final - sub_weights).sum() / float(sample_count)
+
+    logger.debug(
+        "np_simul_balancer_dual_newton converged %s iter %s max_residual %s"
+        % (converged, iter, max_residual)
+    )
+
+    return weights_final, relaxation_factors, (converged, iter, delta, max_residual)
@@ -2,21 +2,205 @@
 # See full license in LICENSE.txt.
 
 import logging
+from functools import partial
 import numpy as np
 import pandas as pd
 
+from populationsim.core import performance
 from populationsim.core.config import setting
 from populationsim.balancing.balancers import np_simul_balancer_py
-from populationsim.balancing.balancers_numba import np_simul_balancer_numba
+from populationsim.balancing.acceleration import (
+    SQUAREM,
+    np_simul_balancer_squarem,
+    validate_acceleration,
+)
+from populationsim.balancing.dual_newton import (
+    COORDINATE,
+    DUAL_NEWTON,
+    np_simul_balancer_dual_newton,
+    validate_engine,
+)
 from populationsim.balancing.constants import (
     MIN_CONTROL_VALUE,
     MIN_IMPORTANCE,
     DEFAULT_MAX_ITERATIONS,
+    DUAL_NEWTON_MAX_SIMUL_DUALS,
 )
+from populationsim.balancing.single_balancer import BALANCER_STATUS
 
 logger = logging.getLogger(__name__)
 
 
+def simul_balancers(acceleration, engine, use_numba):
+    """
+    Simul balancer functions for the acceleration, engine and use_numba settings
+
+    Returns
+    -------
+    balancer : function
+        simul balancer function of the engine
+    coordinate_balancer : function
+        coordinate simul balancer function (to fall back to if balancer does not converge)
+    """
+
+    if acceleration == SQUAREM:
+        coordinate_balancer = partial(np_simul_balancer_squarem, use_numba=use_numba)
+    elif use_numba:
+        from populationsim.balancing.balancers_numba import np_simul_balancer_numba
+
+        coordinate_balancer = np_simul_balancer_numba
+    else:
+        coordinate_balancer = np_simul_balancer_py
+
+    if engine == DUAL_NEWTON:
+        return np_simul_balancer_dual_newton, coordinate_balancer
+
+    return coordinate_balancer, coordinate_balancer
+
+
+def np_simul_balance(
+    incidence,
+    parent_weights,
+    sub_controls,
+    controls_importance,
+    master_control_index,
+    parent_controls=None,
+    max_iterations=DEFAULT_MAX_ITERATIONS // 10,
+    use_numba=False,
+    acceleration=None,
+    engine=None,
+):
+    """
+    Simultaneously balance the household weights of the sub zones of a parent zone, with
+    numpy arrays in and out
+
+    This is the array level SimultaneousListBalancer. Each household's sub zone weights sum to
+    its parent weight, starting from the parent weights apportioned by the sub zones' share
+    of the total households control. Households with zero parent weight are not balanced
+    (and get zero sub zone weights).
+
+    Parameters
+    ----------
+    incidence : numpy.ndarray(control_count, sample_count)
+        incidence of each control (row) for each household (column)
+    parent_weights : numpy.ndarray(sample_count,)
+        parent zone balanced (possibly integerized) aggregate target weights
+    sub_controls : numpy.ndarray(sub_zone_count, control_count)
+        controls of each sub zone
+    controls_importance : numpy.ndarray(control_count,)
+        importance weights of controls
+    master_control_index : int
+        index of the total households control
+    parent_controls : numpy.ndarray(control_count,), optional
+        parent zone controls (the sums of sub_controls if not given)
+    max_iterations : int
+    use_numba : bool
+    acceleration : str or None
+        convergence acceleration method ('squarem') or None for plain iteration
+    engine : str or None
+        balancing engine, 'coordinate' (default) or 'dual_newton'
+        (falls back to coordinate balancer if the dual newton balancer doesn't converge, or
+        if sub zones x controls exceed DUAL_NEWTON_MAX_SIMUL_DUALS)
+
+    Returns
+    -------
+    sub_weights : numpy.ndarray(sub_zone_count, sample_count)
+        balanced sub zone weights (zero for zero parent weight rows)
+    relaxation_factors : numpy.ndarray(sub_zone_count, control_count)
+    status : dict
+        converged, iter, delta and max_gamma_dif
+    """
+
+    parent_weights = np.asarray(parent_weights, dtype=np.float64)
+    sub_controls = np.ascontiguousarray(sub_controls, dtype=np.float64)
+    if parent_controls is None:
+        parent_controls = sub_controls.sum(axis=0)
+    parent_controls = np.asarray(parent_controls, dtype=np.float64)
+
+    # remove zero weight rows (they are added back to the result after balancing)
+    positive_weight_rows = parent_weights > 0
+    all_positive = positive_weight_rows.all()
+    logger.debug(
+        "%s positive weight rows out of %s"
+        % (positive_weight_rows.sum(), len(parent_weights))
+    )
+    if not all_positive:
+        incidence = np.asarray(incidence)[:, positive_weight_rows]
+        parent_weights = parent_weights[positive_weight_rows]
+    incidence = np.ascontiguousarray(incidence, dtype=np.float64)
+
+    control_count, sample_count = incidence.shape
+    zone_count = sub_controls.shape[0]
+    assert parent_controls.shape[0] == control_count
+    assert sub_controls.shape[1] == control_count
+
+    weights_lower_bound = np.zeros(sample_count)
+    weights_upper_bound = parent_weights.copy()
+
+    # set initial sub zone weights proportionate to number of households
+    total_hh = int(parent_controls[master_control_index])
+    sub_zone_hh_fractions = sub_controls[:, master_control_index] / total_hh
+    sub_weights = np.outer(sub_zone_hh_fractions, parent_weights)
+
+    parent_controls = np.maximum(parent_controls, MIN_CONTROL_VALUE)
+
+    # control relaxation importance weights (higher weights result in lower relaxation factor)
+    controls_importance = np.maximum(
+        np.asarray(controls_importance, dtype=np.float64), MIN_IMPORTANCE
+    )
+
+    acceleration = validate_acceleration(acceleration)
+    engine = validate_engine(engine)
+    if (
+        engine == DUAL_NEWTON
+        and zone_count * control_count > DUAL_NEWTON_MAX_SIMUL_DUALS
+    ):
+        logger.info(
+            "%s sub zones x %s controls too many for %s simul balancer, "
+            "using coordinate balancer" % (zone_count, control_count, engine)
+        )
+        performance.add_fallback("coordinate_balancer")
+        engine = COORDINATE
+    balancer, coordinate_balancer = simul_balancers(acceleration, engine, use_numba)
+
+    balancer_args = (
+        sample_count,
+        control_count,
+        zone_count,
+        master_control_index,
+        incidence,
+        parent_weights,
+        weights_lower_bound,
+        weights_upper_bound,
+        sub_weights,
+        parent_controls,
+        controls_importance,
+        sub_controls,
+        max_iterations,
+    )
+
+    # balance
+    weights_final, relaxation_factors, status = balancer(*balancer_args)
+
+    if not status[0] and balancer is not coordinate_balancer:
+        logger.warning(
+            "%s simul balancer did not converge after %s iterations, "
+            "falling back to coordinate balancer" % (engine, status[1])
+        )
+        performance.add_fallback("coordinate_balancer")
+        weights_final, relaxation_factors, status = coordinate_balancer(*balancer_args)
+
+    # sub zone weights with zero weight rows restored
+    if not all_positive:
+        sub_weights = np.zeros((zone_count, len(positive_weight_rows)))
+        sub_weights[:, positive_weight_rows] = weights_final[:zone_count]
+        weights_final = sub_weights
+
+    status = dict(zip(BALANCER_STATUS, status))
+
+    return weights_final, relaxation_factors, status
+
+
 class SimultaneousListBalancer:
     """
     Dual-zone simultaneous list balancer using Newton-Raphson method with control relaxation.
@@ -25,6 +209,8 @@ class SimultaneousListBalancer:
     ensuring that the total weight of each household across sub-zones sums to the parent hh weight.
 
     The resulting weights are float weights, so need to be integerized to integer household weights
+
+    This is the pandas adapter of np_simul_balance.
     """
 
     def __init__(
@@ -36,6 +222,8 @@ class SimultaneousListBalancer:
         total_hh_control_col,
         use_numba,
         numba_precision,
+        acceleration=None,
+        engine=None,
     ):
         """
 
@@ -54,6 +242,11 @@ class SimultaneousListBalancer:
             for use in sub_controls_df column names
         total_hh_control_col : str
             name of the total_hh control column
+        acceleration : str or None
+            convergence acceleration method ('squarem') or None for plain iteration
+        engine : str or None
+            balancing engine, 'coordinate' (default) or 'dual_newton'
+            (falls back to coordinate balancer if the dual newton balancer doesn't converge)
         """
         assert isinstance(incidence_table, pd.DataFrame)
         assert len(parent_weights.index) == len(incidence_table.index)
@@ -62,18 +255,8 @@ class SimultaneousListBalancer:
         assert "total" in controls
         assert "importance" in controls
 
-        # remove zero weight rows
-        # remember series so we can add zero weight rows back into result after balancing
-        self.positive_weight_rows = parent_weights > 0
-        logger.debug(
-            "%s positive weight rows out of %s"
-            % (self.positive_weight_rows.sum(), len(incidence_table.index))
-        )
-
-        self.incidence_table = incidence_table[self.positive_weight_rows]
-        self.weights = pd.DataFrame(
-            {"parent": parent_weights[self.positive_weight_rows]}
-        )
+        self.incidence_table = incidence_table
+        self.parent_weights = parent_weights
 
         self.controls = controls
         self.sub_control_zones = sub_control_zones
@@ -83,109 +266,35 @@ class SimultaneousListBalancer:
             total_hh_control_col
         )
 
-        self.balancer = np_simul_balancer_numba if use_numba else np_simul_balancer_py
+        self.acceleration = acceleration
+        self.engine = engine
+        self.use_numba = use_numba
         self.numba_precision = numba_precision
 
     def balance(self):
 
-        assert len(self.incidence_table.columns) == len(self.controls.index)
-        assert len(self.weights.index) == len(self.incidence_table.index)
-
-        self.weights["upper_bound"] = self.weights["parent"]
-        if "lower_bound" not in self.weights:
-            self.weights["lower_bound"] = 0.0
-
-        # set initial sub zone weights proportionate to number of households
-        total_hh_controls = self.controls.iloc[self.master_control_index]
-        total_hh = int(total_hh_controls["total"])
-        sub_zone_hh_fractions = total_hh_controls[self.sub_control_zones] / total_hh
-
-        # Using numpy outer product to create a matrix of sub_zone_hh_fractions for each hh rather than pandas looping
-        new_weights = np.outer(
-            self.weights["parent"], sub_zone_hh_fractions[self.sub_control_zones.values]
-        )
-        new_weights = pd.DataFrame(
-            new_weights,
-            index=self.weights.index,
-            columns=self.sub_control_zones.tolist(),
-        )
-
-        if len(set(new_weights.columns).intersection(self.weights.columns)) > 0:
-            self.weights.update(new_weights)
-        else:
-            self.weights = self.weights.join(new_weights)
-
-        self.controls["total"] = np.maximum(self.controls["total"], MIN_CONTROL_VALUE)
-
-        # control relaxation importance weights (higher weights result in lower relaxation factor)
-        self.controls["importance"] = np.maximum(
-            self.controls["importance"], MIN_IMPORTANCE
-        )
-
-        # prepare inputs as numpy  (no pandas)
-        sample_count = len(self.incidence_table.index)
-        control_count = len(self.incidence_table.columns)
-        zone_count = len(self.sub_control_zones)
-
-        master_control_index = self.master_control_index
-        incidence = self.incidence_table.values.transpose().astype(np.float64)
-
-        # FIXME - do we also need sample_weights? (as the spec suggests?)
-        parent_weights = np.asanyarray(self.weights["parent"]).astype(np.float64)
-
-        weights_lower_bound = np.asanyarray(self.weights["lower_bound"]).astype(
-            np.float64
-        )
-        weights_upper_bound = np.asanyarray(self.weights["upper_bound"]).astype(
-            np.float64
+        sub_weights, relaxation_factors, status = np_simul_balance(
+            self.incidence_table.values.T,
+            self.parent_weights.values,
+            self.controls[self.sub_control_zones].values.T,
+            self.controls["importance"].values,
+            self.master_control_index,
+            parent_controls=self.controls["total"].values,
+            max_iterations=setting(
+                "MAX_BALANCE_ITERATIONS_SIMULTANEOUS", DEFAULT_MAX_ITERATIONS
+            )
+            // 10,
+            use_numba=self.use_numba,
+            acceleration=self.acceleration,
+            engine=self.engine,
         )
 
-        parent_controls = np.asanyarray(self.controls["total"]).astype(np.float64)
-        controls_importance = np.asanyarray(self.controls["importance"]).astype(
-            np.float64
-        )
-
-        sub_controls = (
-            self.controls[self.sub_control_zones].values.astype("float").transpose()
-        )
-        sub_weights = (
-            self.weights[self.sub_control_zones].values.astype("float").transpose()
-        )
-
-        max_iterations = (
-            setting("MAX_BALANCE_ITERATIONS_SIMULTANEOUS", DEFAULT_MAX_ITERATIONS) // 10
-        )
-
-        # balance
-        weights_final, relaxation_factors, status = self.balancer(
-            sample_count,
-            control_count,
-            zone_count,
-            master_control_index,
-            incidence,
-            parent_weights,
-            weights_lower_bound,
-            weights_upper_bound,
-            sub_weights,
-            parent_controls,
-            controls_importance,
-            sub_controls,
-            max_iterations,
-            # max_delta=
-        )
-
-        status = dict(zip(("converged", "iter", "delta", "max_gamma_dif"), status))
-
-        # dataframe with sub_zone_weights in columns, and zero weight rows restored
+        # dataframe with sub_zone_weights in columns
         self.sub_zone_weights = pd.DataFrame(
-            weights_final[range(len(self.sub_control_zones))].transpose(),
-            index=self.weights.index,
+            sub_weights.T,
+            index=self.parent_weights.index,
             columns=self.sub_control_zones.tolist(),
         )
-        self.sub_zone_weights = self.sub_zone_weights.reindex(
-            self.positive_weight_rows.index
-        )
-        self.sub_zone_weights.fillna(value=0.0, inplace=True)
 
         # series mapping zone_id to column names
         self.sub_zone_ids = self.sub_control_zones.index.values
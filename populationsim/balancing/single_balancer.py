@@ -2,12 +2,24 @@
 # See full license in LICENSE.txt.
 
 import logging
+from functools import partial
 import numpy as np
 import pandas as pd
 
+from populationsim.core import performance
 from populationsim.balancing.balancers import np_balancer_py
-from populationsim.balancing.balancers_numba import np_balancer_numba
+from populationsim.balancing.acceleration import (
+    SQUAREM,
+    np_balancer_squarem,
+    validate_acceleration,
+)
+from populationsim.balancing.dual_newton import (
+    DUAL_NEWTON,
+    np_balancer_dual_newton,
+    validate_engine,
+)
 from populationsim.balancing.constants import (
+    DEFAULT_MAX_ITERATIONS,
     MAX_INT,
     MIN_IMPORTANCE,
     MIN_CONTROL_VALUE,
@@ -15,6 +27,185 @@ from populationsim.balancing.constants import (
 
 logger = logging.getLogger(__name__)
 
+BALANCER_STATUS = ("converged", "iter", "delta", "max_gamma_dif")
+
+
+def list_balancers(acceleration, engine, use_numba):
+    """
+    Balancer functions for the acceleration, engine and use_numba settings
+
+    Returns
+    -------
+    balancer : function
+        list balancer function of the engine
+    coordinate_balancer : function
+        coordinate list balancer function (to fall back to if balancer does not converge)
+    """
+
+    if acceleration == SQUAREM:
+        coordinate_balancer = partial(np_balancer_squarem, use_numba=use_numba)
+    elif use_numba:
+        # numba (and its compile cache) is only loaded when a numba balancer is used
+        from populationsim.balancing.balancers_numba import np_balancer_numba
+
+        coordinate_balancer = np_balancer_numba
+    else:
+        coordinate_balancer = np_balancer_py
+
+    if engine == DUAL_NEWTON:
+        return np_balancer_dual_newton, coordinate_balancer
+
+    return coordinate_balancer, coordinate_balancer
+
+
+def np_balance(
+    incidence,
+    initial_weights,
+    control_totals,
+    control_importance_weights=None,
+    lb_weights=None,
+    ub_weights=None,
+    master_control_index=None,
+    max_iterations=DEFAULT_MAX_ITERATIONS,
+    use_numba=False,
+    numba_precision="float64",
+    acceleration=None,
+    engine=None,
+):
+    """
+    Balance household weights to control totals, with numpy arrays in and out
+
+    This is the array level ListBalancer, for callers that already hold the incidence and
+    weights as arrays (e.g. batch drivers).
+
+    Parameters
+    ----------
+    incidence : numpy.ndarray(control_count, sample_count)
+        incidence of each control (row) for each household (column), of any numeric dtype
+        (float64 incidence is not copied)
+    initial_weights : numpy.ndarray(sample_count,)
+    control_totals : numpy.ndarray(control_count,)
+    control_importance_weights : numpy.ndarray(control_count,), optional
+        importance weights of controls (MIN_IMPORTANCE if not given)
+    lb_weights : numpy.ndarray(sample_count,) or scalar, optional
+        lower bound on balanced weights (0 if not given)
+    ub_weights : numpy.ndarray(sample_count,) or scalar, optional
+        upper bound on balanced weights (MAX_INT if not given)
+    master_control_index : int, optional
+        index of the total households control, or None
+    max_iterations : int
+    use_numba : bool
+    numba_precision : str
+        'float64' or 'float32' (numba balancers only)
+    acceleration : str or None
+        convergence acceleration method ('squarem') or None for plain iteration
+    engine : str or None
+        balancing engine, 'coordinate' (default) or 'dual_newton'
+        (falls back to coordinate balancer if the dual newton balancer doesn't converge)
+
+    Returns
+    -------
+    weights : numpy.ndarray(sample_count,)
+        balanced weights
+    relaxation_factors : numpy.ndarray(control_count,)
+    status : dict
+        converged, iter, delta and max_gamma_dif
+    """
+
+    # compact (e.g. uint8) incidence is balanced as float64, to not overflow when squared
+    incidence = np.asarray(incidence, dtype=np.float64)
+    control_count, sample_count = incidence.shape
+
+    control_totals = np.asarray(control_totals)
+    initial_weights = np.asarray(initial_weights, dtype=np.float64)
+    control_importance_weights = (
+        np.asarray(control_importance_weights)
+        if control_importance_weights is not None
+        else np.full(control_count, MIN_IMPORTANCE)
+    )
+    lb_weights = (
+        np.asarray(lb_weights, dtype=np.float64)
+        if lb_weights is not None
+        else np.zeros(sample_count)
+    )
+    ub_weights = (
+        np.asarray(ub_weights, dtype=np.float64)
+        if ub_weights is not None
+        else np.full(sample_count, MAX_INT)
+    )
+    master_control_index = -1 if master_control_index is None else master_control_index
+
+    # Validation
+    if not (-1 == master_control_index or 0 <= master_control_index < control_count):
+        raise ValueError(
+            f"master_control_index={master_control_index} is out of bounds"
+        )
+    assert initial_weights.shape[0] == sample_count
+    assert control_totals.shape[0] == control_count
+    assert control_importance_weights.shape[0] == control_count
+
+    # Prepare bounds
+    weights_lower_bound = (
+        np.full(sample_count, lb_weights) if lb_weights.size == 1 else lb_weights
+    )
+    weights_upper_bound = (
+        np.full(sample_count, ub_weights) if ub_weights.size == 1 else ub_weights
+    )
+
+    # Prepare controls
+    controls_constraint = np.maximum(control_totals, MIN_CONTROL_VALUE)
+    controls_importance = np.maximum(control_importance_weights, MIN_IMPORTANCE)
+
+    # Precision
+    if use_numba and numba_precision == "float32":
+        incidence = incidence.astype(np.float32)
+        initial_weights = initial_weights.astype(np.float32)
+        weights_lower_bound = weights_lower_bound.astype(np.float32)
+        weights_upper_bound = weights_upper_bound.astype(np.float32)
+        controls_constraint = controls_constraint.astype(np.float32)
+        controls_importance = controls_importance.astype(np.float32)
+
+    acceleration = validate_acceleration(acceleration)
+    engine = validate_engine(engine)
+    balancer, coordinate_balancer = list_balancers(acceleration, engine, use_numba)
+
+    logger.info(
+        "Balancing with engine=%s, Numba=%s, precision=%s, acceleration=%s",
+        engine,
+        use_numba,
+        numba_precision,
+        acceleration,
+    )
+
+    balancer_args = (
+        sample_count,
+        control_count,
+        master_control_index,
+        incidence,
+        initial_weights,
+        weights_lower_bound,
+        weights_upper_bound,
+        controls_constraint,
+        controls_importance,
+        max_iterations,
+    )
+
+    # Process balancing
+    weights_final, relaxation_factors, status = balancer(*balancer_args)
+
+    if not status[0] and balancer is not coordinate_balancer:
+        logger.warning(
+            "%s balancer did not converge after %s iterations, "
+            "falling back to coordinate balancer" % (engine, status[1])
+        )
+        performance.add_fallback("coordinate_balancer")
+        weights_final, relaxation_factors, status = coordinate_balancer(*balancer_args)
+
+    # Label the status
+    status = dict(zip(BALANCER_STATUS, status))
+
+    return weights_final, relaxation_factors, status
+
 
 class ListBalancer:
     """
@@ -26,6 +217,8 @@ class ListBalancer:
     relaxation.
 
     The resulting weights are float weights, so need to be integerized to integer household weights
+
+    This is the pandas adapter of np_balance.
     """
 
     def __init__(
@@ -40,6 +233,8 @@ class ListBalancer:
         max_iterations,
         use_numba,
         numba_precision,
+        acceleration=None,
+        engine=None,
     ):
         """
         Parameters
@@ -64,105 +259,50 @@ class ListBalancer:
             whether to use numba for performance optimization
         numba_precision : str
             precision of the Numba calculations, either 'float64' or 'float32'.
+        acceleration : str or None
+            convergence acceleration method ('squarem') or None for plain iteration
+        engine : str or None
+            balancing engine, 'coordinate' (default) or 'dual_newton'
+            (falls back to coordinate balancer if the dual newton balancer doesn't converge)
         """
 
         assert isinstance(incidence_table, pd.DataFrame)
         assert len(initial_weights) == len(incidence_table.index)
 
         self.incidence_table = incidence_table
-        self.incidence = incidence_table.values.T
         self.sample_count = len(incidence_table.index)
         self.control_count = len(incidence_table.columns)
         self.control_totals = np.asarray(control_totals)
         self.initial_weights = np.asarray(initial_weights, dtype=np.float64)
-        self.control_importance_weights = (
-            np.asarray(control_importance_weights)
-            if control_importance_weights is not None
-            else np.full(self.control_count, MIN_IMPORTANCE)
-        )
-        self.lb_weights = (
-            np.asarray(lb_weights, dtype=np.float64)
-            if lb_weights is not None
-            else np.zeros(self.sample_count)
-        )
-        self.ub_weights = (
-            np.asarray(ub_weights, dtype=np.float64)
-            if ub_weights is not None
-            else np.full(self.sample_count, MAX_INT)
-        )
+        self.control_importance_weights = control_importance_weights
+        self.lb_weights = lb_weights
+        self.ub_weights = ub_weights
+        self.master_control_index = master_control_index
         self.max_iterations = max_iterations
         self.use_numba = use_numba
         self.numba_precision = numba_precision
-        self.master_control_index = (
-            -1 if master_control_index is None else master_control_index
-        )
-
-        # Validation
-        if not (
-            -1 == self.master_control_index
-            or 0 <= self.master_control_index < self.control_count
-        ):
-            raise ValueError(
-                f"master_control_index={self.master_control_index} is out of bounds"
-            )
-        assert self.incidence.shape == (self.control_count, self.sample_count)
-        assert self.control_totals.shape[0] == self.control_count
-        assert self.control_importance_weights.shape[0] == self.control_count
-
-        # Prepare bounds
-        self.weights_lower_bound = (
-            np.full(self.sample_count, self.lb_weights)
-            if np.isscalar(self.lb_weights) or self.lb_weights.size == 1
-            else self.lb_weights
-        )
-        self.weights_upper_bound = (
-            np.full(self.sample_count, self.ub_weights)
-            if np.isscalar(self.ub_weights) or self.ub_weights.size == 1
-            else self.ub_weights
-        )
-
-        # Prepare controls
-        self.controls_constraint = np.maximum(self.control_totals, MIN_CONTROL_VALUE)
-        self.controls_importance = np.maximum(
-            self.control_importance_weights, MIN_IMPORTANCE
-        )
-
-        # Precision
-        if self.use_numba and self.numba_precision == "float32":
-            self.incidence = self.incidence.astype(np.float32)
-            self.initial_weights = self.initial_weights.astype(np.float32)
-            self.weights_lower_bound = self.weights_lower_bound.astype(np.float32)
-            self.weights_upper_bound = self.weights_upper_bound.astype(np.float32)
-            self.controls_constraint = self.controls_constraint.astype(np.float32)
-            self.controls_importance = self.controls_importance.astype(np.float32)
-
-        # Balancer function
-        self.balancer = np_balancer_numba if self.use_numba else np_balancer_py
+        self.acceleration = acceleration
+        self.engine = engine
 
     def balance(self):
-        logger.info(
-            "Balancing with Numba=%s, precision=%s",
-            self.use_numba,
-            self.numba_precision,
-        )
 
-        # Process balancing
-        weights_final, relaxation_factors, status = self.balancer(
-            self.sample_count,
-            self.control_count,
-            self.master_control_index,
-            self.incidence,
+        incidence = self.incidence_table.values.T
+
+        weights_final, relaxation_factors, status = np_balance(
+            incidence,
             self.initial_weights,
-            self.weights_lower_bound,
-            self.weights_upper_bound,
-            self.controls_constraint,
-            self.controls_importance,
-            self.max_iterations,
+            self.control_totals,
+            control_importance_weights=self.control_importance_weights,
+            lb_weights=self.lb_weights,
+            ub_weights=self.ub_weights,
+            master_control_index=self.master_control_index,
+            max_iterations=self.max_iterations,
+            use_numba=self.use_numba,
+            numba_precision=self.numba_precision,
+            acceleration=self.acceleration,
+            engine=self.engine,
         )
 
-        # Label the status
-        status = dict(zip(("converged", "iter", "delta", "max_gamma_dif"), status))
-
         # weights dataframe
         weights = pd.DataFrame(index=self.incidence_table.index)
         weights["initial"] = self.initial_weights
@@ -173,9 +313,8 @@ class ListBalancer:
         controls["control"] = np.maximum(self.control_totals, MIN_CONTROL_VALUE)
         controls["relaxation_factor"] = relaxation_factors
         controls["relaxed_control"] = controls.control * relaxation_factors
-        controls["weight_totals"] = [
-            round((self.incidence_table.loc[:, c] * weights["final"]).sum(), 2)
-            for c in controls.index
-        ]
+        controls["weight_totals"] = np.round(
+            np.dot(incidence, np.asarray(weights_final, dtype=np.float64)), 2
+        )
 
         return status, weights, controls
@@ -0,0 +1,191 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+"""
+Numba kernel warmup and shared JIT cache.
+
+The numba balancer kernels are compiled (and cached, since they are decorated with
+cache=True) on first call with each combination of argument types. By default numba caches
+them in __pycache__ directories next to the source, which may be read-only or different in
+every container, so each process pays the compile time again.
+
+The numba_cache_dir setting puts the cache in a shared directory instead (True for the
+numba subdirectory of config.get_cache_dir, or a path), and ``populationsim warmup``
+compiles every kernel signature the balancers use into it ahead of the run.
+"""
+
+import logging
+import os
+import time
+
+import numpy as np
+import numba
+import pandas as pd
+
+from populationsim.core import config
+from populationsim.balancing.acceleration import SQUAREM, np_simul_balancer_squarem
+from populationsim.balancing.balancers_numba import (
+    balancer_sweep_numba,
+    np_balancer_numba,
+    np_simul_balancer_numba,
+    simul_balancer_sweep_numba,
+)
+from populationsim.balancing.constants import DEFAULT_MAX_ITERATIONS
+from populationsim.balancing.single_balancer import ListBalancer
+
+logger = logging.getLogger(__name__)
+
+NUMBA_CACHE_DIR_NAME = "numba"
+
+# jit compiled kernels (numba dispatchers)
+KERNELS = [
+    np_balancer_numba,
+    np_simul_balancer_numba,
+    balancer_sweep_numba,
+    simul_balancer_sweep_numba,
+]
+
+PRECISIONS = ["float64", "float32"]
+ACCELERATIONS = [None, SQUAREM]
+
+# incidence tables built from a 2-D array transpose to Fortran order incidence arrays,
+# while those built column by column transpose to C order (and numba compiles each)
+INCIDENCE_LAYOUTS = ["C", "F"]
+
+
+def numba_cache_dir():
+    """
+    numba cache directory according to the numba_cache_dir setting
+
+    Returns
+    -------
+    cache_dir : str or None
+        None (numba default cache locations) if numba_cache_dir is not set
+    """
+
+    cache_dir = config.setting("numba_cache_dir", None)
+    if cache_dir is True:
+        cache_dir = os.path.join(config.get_cache_dir(), NUMBA_CACHE_DIR_NAME)
+
+    return cache_dir or None
+
+
+def set_numba_cache_dir(cache_dir):
+    """
+    Cache compiled kernels in cache_dir, in this process and in sub-processes started later
+
+    Numba reads NUMBA_CACHE_DIR when it is imported, so sub-processes get it from the
+    environment, while the kernels already loaded in this process are pointed at it.
+    """
+
+    cache_dir = os.path.abspath(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    os.environ["NUMBA_CACHE_DIR"] = cache_dir
+    numba.config.CACHE_DIR = cache_dir
+    for kernel in KERNELS:
+        kernel.enable_caching()
+
+    logger.info("numba cache dir %s" % cache_dir)
+
+
+def warmup_single_balancer(precision, acceleration, layout):
+
+    rng = np.random.default_rng(0)
+    sample_count = 20
+    control_count = 3
+
+    incidence = (rng.random((sample_count, control_count)) < 0.5).astype(int)
+    incidence[:, 0] = 1
+    weights = rng.uniform(5, 20, sample_count)
+
+    if layout == "F":
+        incidence_table = pd.DataFrame(incidence)
+    else:
+        incidence_table = pd.DataFrame(
+            {c: incidence[:, c] for c in range(control_count)}
+        )
+
+    balancer = ListBalancer(
+        incidence_table=incidence_table,
+        initial_weights=weights,
+        control_totals=incidence.T @ weights,
+        control_importance_weights=np.full(control_count, 1000.0),
+        lb_weights=np.zeros(sample_count),
+        ub_weights=weights * 5,
+        master_control_index=0,
+        max_iterations=DEFAULT_MAX_ITERATIONS,
+        use_numba=True,
+        numba_precision=precision,
+        acceleration=acceleration,
+    )
+    balancer.balance()
+
+
+def warmup_simul_balancer(acceleration):
+
+    # SimultaneousListBalancer.balance passes float64 arrays, whatever NUMBA_PRECISION is
+    rng = np.random.default_rng(0)
+    sample_count = 20
+    control_count = 3
+    zone_count = 2
+
+    incidence = (rng.random((control_count, sample_count)) < 0.5).astype(np.float64)
+    incidence[0] = 1
+    parent_weights = rng.uniform(5, 20, sample_count)
+    sub_weights = np.outer(np.full(zone_count, 1.0 / zone_count), parent_weights)
+    sub_controls = np.outer(np.full(zone_count, 0.5), incidence @ parent_weights)
+
+    if acceleration == SQUAREM:
+        balancer = np_simul_balancer_squarem
+    else:
+        balancer = np_simul_balancer_numba
+
+    balancer(
+        sample_count,
+        control_count,
+        zone_count,
+        0,
+        incidence,
+        parent_weights,
+        np.zeros(sample_count),
+        parent_weights.copy(),
+        sub_weights,
+        sub_controls.sum(axis=0),
+        np.full(control_count, 1000.0),
+        sub_controls,
+        DEFAULT_MAX_ITERATIONS // 10,
+    )
+
+
+def warmup():
+    """
+    Compile (or load from the numba cache) every kernel signature the balancers use
+
+    That is the list balancer kernels for each NUMBA_PRECISION and incidence array layout
+    and the simul balancer kernels, with and without SQUAREM acceleration.
+
+    Returns
+    -------
+    kernels : pandas.DataFrame
+        kernel name and its number of compiled signatures, indexed by kernel name
+    seconds : float
+        time taken to compile or load the kernels
+    """
+
+    t0 = time.perf_counter()
+    for acceleration in ACCELERATIONS:
+        for precision in PRECISIONS:
+            for layout in INCIDENCE_LAYOUTS:
+                warmup_single_balancer(precision, acceleration, layout)
+        warmup_simul_balancer(acceleration)
+    seconds = time.perf_counter() - t0
+
+    kernels = pd.DataFrame(
+        {
+            "kernel": [kernel.__name__ for kernel in KERNELS],
+            "signatures": [len(kernel.signatures) for kernel in KERNELS],
+        }
+    ).set_index("kernel")
+
+    return kernels, seconds
@@ -1,11 +1,25 @@
 import numpy as np
 import pandas as pd
+from populationsim.core import performance
 from populationsim.core.config import setting
 from populationsim.balancing.single_balancer import ListBalancer
 from populationsim.balancing.simul_balancer import SimultaneousListBalancer
 from populationsim.balancing.constants import DEFAULT_MAX_ITERATIONS
 
 
+def balancer_metrics(status):
+    """
+    performance telemetry metrics from balancer status
+    """
+    return {
+        "converged": bool(status["converged"]),
+        "iterations": status["iter"],
+        "delta": status["delta"],
+        "max_gamma_dif": status["max_gamma_dif"],
+    }
+
+
+@performance.recorded("balancing")
 def do_balancing(
     control_spec,
     total_hh_control_col,
@@ -114,13 +128,22 @@ def do_balancing(
         max_iterations=max_iterations,
         use_numba=use_numba,
         numba_precision=numba_precision,
+        acceleration=setting("BALANCER_ACCELERATION", None),
+        engine=setting("BALANCER_ENGINE", None),
     )
 
     status, weights, controls = balancer.balance()
 
+    performance.update(
+        households=balancer.sample_count,
+        controls=balancer.control_count,
+        **balancer_metrics(status),
+    )
+
     return status, weights, controls
 
 
+@performance.recorded("simul_balancing")
 def do_simul_balancing(
     incidence_df,
     parent_weights,
@@ -196,8 +219,17 @@ def do_simul_balancing(
         total_hh_control_col=total_hh_control_col,
         use_numba=use_numba,
         numba_precision=numba_precision,
+        acceleration=setting("BALANCER_ACCELERATION", None),
+        engine=setting("BALANCER_ENGINE", None),
     )
 
     status = balancer.balance()
 
+    performance.update(
+        households=len(incidence_df.index),
+        sub_zones=len(sub_control_zones),
+        controls=len(sub_control_spec.index),
+        **balancer_metrics(status),
+    )
+
     return balancer.sub_zone_weights, status
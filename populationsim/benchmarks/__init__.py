@@ -0,0 +1,7 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+from populationsim.benchmarks.synthetic import generate_project
+from populationsim.benchmarks.suite import SCALES, run_scale
+
+__all__ = ["SCALES", "generate_project", "run_scale"]
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import argparse
+
+import pandas as pd
+
+from populationsim.benchmarks.suite import (
+    SCALES,
+    append_history,
+    compare,
+    previous_result,
+    read_history,
+    run_scale,
+)
+
+PARAMS = [
+    ("households", int),
+    ("persons_per_household", float),
+    ("controls", int),
+    ("sparsity", float),
+    ("seed_zones", int),
+    ("sub_zones_per_parent", int),
+]
+
+
+def main():
+    """
+    Benchmark balancing, integerizing and expansion on synthetic problems of increasing scale
+
+    python -m populationsim.benchmarks --scales tiny small medium
+    python -m populationsim.benchmarks --scales small --households 20000 --controls 20
+    """
+    parser = argparse.ArgumentParser(
+        description="PopulationSim synthetic benchmarks",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--scales",
+        nargs="+",
+        default=["tiny", "small"],
+        choices=list(SCALES),
+        help="benchmark scales to run",
+    )
+    for param, param_type in PARAMS:
+        parser.add_argument(
+            "--%s" % param.replace("_", "-"),
+            type=param_type,
+            help="override %s of the selected scales" % param,
+        )
+    parser.add_argument(
+        "--history",
+        default="benchmark_history.json",
+        help="JSON file to append results to",
+    )
+    parser.add_argument(
+        "--work-dir",
+        help="keep generated projects and outputs in this directory",
+    )
+    parser.add_argument("--numba", action="store_true", help="set USE_NUMBA")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    history = read_history(args.history)
+
+    results = []
+    comparisons = []
+    for scale in args.scales:
+        params = dict(SCALES[scale])
+        for param, _ in PARAMS:
+            if getattr(args, param) is not None:
+                params[param] = getattr(args, param)
+
+        result = run_scale(scale, params, args.work_dir, args.numba, args.seed)
+        results.append(result)
+        comparisons.append(compare(result, previous_result(history, result)))
+
+    append_history(args.history, results)
+
+    with pd.option_context(
+        "display.width", 120, "display.float_format", "{:.3f}".format
+    ):
+        print(pd.concat(comparisons).to_string(index=False))
+    print("results appended to %s" % args.history)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from importlib import metadata
+
+import numpy as np
+import pandas as pd
+
+from populationsim.benchmarks.synthetic import generate_project
+from populationsim.core import config, inject, performance, pipeline, tracing
+from populationsim.steps.setup_data_structures import build_incidence_table
+
+logger = logging.getLogger(__name__)
+
+# synthetic problem parameters of the standard benchmark scales
+SCALES = {
+    "tiny": {
+        "households": 500,
+        "persons_per_household": 2.5,
+        "controls": 6,
+        "sparsity": 0.5,
+        "seed_zones": 2,
+        "sub_zones_per_parent": 2,
+    },
+    "small": {
+        "households": 5000,
+        "persons_per_household": 2.5,
+        "controls": 10,
+        "sparsity": 0.6,
+        "seed_zones": 4,
+        "sub_zones_per_parent": 4,
+    },
+    "medium": {
+        "households": 50000,
+        "persons_per_household": 2.5,
+        "controls": 16,
+        "sparsity": 0.7,
+        "seed_zones": 8,
+        "sub_zones_per_parent": 6,
+    },
+    "large": {
+        "households": 200000,
+        "persons_per_household": 2.5,
+        "controls": 24,
+        "sparsity": 0.8,
+        "seed_zones": 16,
+        "sub_zones_per_parent": 8,
+    },
+}
+
+MODELS = [
+    "input_pre_processor",
+    "setup_data_structures",
+    "initial_seed_balancing",
+    "meta_control_factoring",
+    "final_seed_balancing",
+    "integerize_final_seed_weights",
+    "sub_balancing.geography=TRACT",
+    "sub_balancing.geography=TAZ",
+    "expand_households",
+    "summarize",
+]
+
+# performance telemetry call kind -> benchmarked component
+# (integerizing includes the sequential fallbacks of simul_integerizing calls)
+TELEMETRY_COMPONENTS = {
+    "balancing": "ListBalancer",
+    "simul_balancing": "SimultaneousListBalancer",
+    "integerizing": "Integerizer",
+    "simul_integerizing": "SimulIntegerizer",
+}
+
+# model steps timed as components
+STEP_COMPONENTS = ["expand_households", "summarize"]
+
+COMPONENTS = (
+    ["build_incidence_table"] + list(TELEMETRY_COMPONENTS.values()) + STEP_COMPONENTS
+)
+
+
+def environment():
+    """
+    versions and platform, to tell apart results from different builds and machines
+    """
+
+    def version(package):
+        try:
+            return metadata.version(package)
+        except metadata.PackageNotFoundError:
+            return None
+
+    try:
+        git_commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(__file__),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_commit = None
+
+    return {
+        "populationsim": version("populationsim"),
+        "git_commit": git_commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "numba": version("numba"),
+        "ortools": version("ortools"),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_project(configs_dir, data_dir, output_dir, use_numba=False):
+    """
+    Run the benchmark models on a project and time the benchmarked components
+
+    Returns
+    -------
+    component_seconds : dict
+        component name -> seconds
+    component_calls : dict
+        component name -> number of calls
+    step_seconds : dict
+        model name -> seconds
+    """
+
+    inject.reinject_decorated_tables()
+    inject.add_injectable("configs_dir", [configs_dir])
+    inject.add_injectable("data_dir", data_dir)
+    inject.add_injectable("output_dir", output_dir)
+    inject.clear_cache()
+    tracing.config_logger()
+
+    config.override_setting("USE_NUMBA", use_numba)
+
+    step_seconds = {}
+    pipeline.open_pipeline()
+    try:
+        for model in MODELS:
+            t0 = time.perf_counter()
+            pipeline.run_model(model)
+            step_seconds[model] = time.perf_counter() - t0
+
+        telemetry = pd.concat(
+            [
+                pipeline.get_table(performance.performance_table_name(model))
+                for model in MODELS
+                if pipeline.is_table(performance.performance_table_name(model))
+            ]
+        )
+
+        control_spec = pipeline.get_table("control_spec")
+        households_df = pipeline.get_table("households")
+        persons_df = pipeline.get_table("persons")
+        crosswalk_df = pipeline.get_table("crosswalk")
+
+        t0 = time.perf_counter()
+        build_incidence_table(control_spec, households_df, persons_df, crosswalk_df)
+        incidence_seconds = time.perf_counter() - t0
+    finally:
+        pipeline.close_pipeline()
+        inject.clear_cache()
+
+    kinds = telemetry.groupby("kind")["seconds"].agg(["sum", "count"])
+    kinds = kinds.reindex(list(TELEMETRY_COMPONENTS), fill_value=0)
+
+    component_seconds = {"build_incidence_table": incidence_seconds}
+    component_calls = {"build_incidence_table": 1}
+    for kind, component in TELEMETRY_COMPONENTS.items():
+        component_seconds[component] = float(kinds.loc[kind, "sum"])
+        component_calls[component] = int(kinds.loc[kind, "count"])
+    for model in STEP_COMPONENTS:
+        component_seconds[model] = step_seconds[model]
+        component_calls[model] = 1
+
+    return component_seconds, component_calls, step_seconds
+
+
+def run_scale(scale, params, work_dir=None, use_numba=False, random_seed=0):
+    """
+    Generate a synthetic problem and benchmark it
+
+    Parameters
+    ----------
+    scale : str
+        scale name (for the history)
+    params : dict
+        generate_project keyword arguments
+    work_dir : str or None
+        directory for the generated project and its outputs (temporary directory if None)
+    use_numba : bool
+    random_seed : int
+
+    Returns
+    -------
+    result : dict
+        history entry with scale, params, environment, component seconds and calls and
+        model step seconds
+    """
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        project_dir = os.path.join(work_dir or temp_dir, scale)
+        output_dir = os.path.join(project_dir, "output")
+        os.makedirs(output_dir, exist_ok=True)
+
+        t0 = time.perf_counter()
+        configs_dir, data_dir = generate_project(
+            project_dir, random_seed=random_seed, **params
+        )
+        generate_seconds = time.perf_counter() - t0
+
+        seconds, calls, step_seconds = run_project(
+            configs_dir, data_dir, output_dir, use_numba
+        )
+
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "scale": scale,
+        "params": dict(params, random_seed=random_seed, use_numba=use_numba),
+        "environment": environment(),
+        "generate_seconds": generate_seconds,
+        "seconds": seconds,
+        "calls": calls,
+        "steps": step_seconds,
+        "total_seconds": sum(step_seconds.values()),
+    }
+
+
+def read_history(history_file):
+    if not os.path.exists(history_file):
+        return []
+    with open(history_file) as f:
+        return json.load(f)
+
+
+def append_history(history_file, results):
+    """
+    Append results to the JSON list of results in history_file
+    """
+    history = read_history(history_file) + results
+    with open(history_file, "w") as f:
+        json.dump(history, f, indent=2)
+
+
+def previous_result(history, result):
+    """
+    most recent history entry for the same scale and parameters as result, or None
+    """
+    for entry in reversed(history):
+        if entry["scale"] == result["scale"] and entry["params"] == result["params"]:
+            return entry
+    return None
+
+
+def compare(result, previous):
+    """
+    Table of component seconds of result and (if not None) of the previous result
+    """
+
+    rows = []
+    for component in COMPONENTS + ["total"]:
+        if component == "total":
+            seconds = result["total_seconds"]
+            previous_seconds = previous["total_seconds"] if previous else None
+        else:
+            seconds = result["seconds"][component]
+            previous_seconds = previous["seconds"].get(component) if previous else None
+        change = (seconds / previous_seconds - 1 if previous_seconds else np.nan) * 100
+        rows.append(
+            (
+                result["scale"],
+                component,
+                result["calls"].get(component, 1),
+                seconds,
+                previous_seconds,
+                change,
+            )
+        )
+
+    return pd.DataFrame(
+        rows,
+        columns=["scale", "component", "calls", "seconds", "previous", "change_pct"],
+    )
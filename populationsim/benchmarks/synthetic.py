@@ -0,0 +1,293 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import yaml
+
+logger = logging.getLogger(__name__)
+
+META_GEOGRAPHY = "REGION"
+SEED_GEOGRAPHY = "PUMA"
+GEOGRAPHIES = [META_GEOGRAPHY, SEED_GEOGRAPHY, "TRACT", "TAZ"]
+
+HOUSEHOLD_ID_COL = "hh_id"
+TOTAL_HH_CONTROL = "num_hh"
+
+# mean (true) expansion factor of the seed sample
+MEAN_EXPANSION_FACTOR = 25
+
+# household controls (and num_hh) are balanced at TAZ, person controls at TRACT,
+# except the last person control which is a REGION (meta) control
+CONTROL_GEOGRAPHIES = {"households": "TAZ", "persons": "TRACT"}
+
+LOGGING_CONFIG = {
+    "logging": {
+        "version": 1,
+        "disable_existing_loggers": True,
+        "root": {"level": "NOTSET", "handlers": ["console"]},
+        "loggers": {
+            "populationsim": {
+                "level": "INFO",
+                "handlers": ["console"],
+                "propagate": False,
+            },
+            "orca": {"level": "WARN", "handlers": ["console"], "propagate": False},
+        },
+        "handlers": {
+            "console": {
+                "class": "logging.StreamHandler",
+                "stream": "ext://sys.stdout",
+                "formatter": "simpleFormatter",
+                "level": "WARN",
+            },
+        },
+        "formatters": {
+            "simpleFormatter": {
+                "class": "logging.Formatter",
+                "format": "%(levelname)s - %(message)s",
+            },
+        },
+    }
+}
+
+
+def control_spec(controls):
+    """
+    Control spec for a synthetic problem with num_hh and controls household and person controls
+
+    Controls alternate between counts of households and of persons with a binary attribute
+    (H0, P1, H2, P3, ...).
+
+    Returns
+    -------
+    control_spec : pandas.DataFrame
+        controls.csv rows (target, geography, seed_table, importance, control_field, expression)
+    """
+
+    rows = [
+        (
+            TOTAL_HH_CONTROL,
+            "TAZ",
+            "households",
+            1000000000,
+            "HHBASE",
+            "(households.WGTP > 0) & (households.WGTP < np.inf)",
+        )
+    ]
+    for c in range(controls):
+        seed_table = "households" if c % 2 == 0 else "persons"
+        attribute = "%s%s" % (seed_table[0].upper(), c)
+        rows.append(
+            (
+                "%s_%s" % (seed_table, attribute),
+                CONTROL_GEOGRAPHIES[seed_table],
+                seed_table,
+                1000,
+                attribute,
+                "%s.%s == 1" % (seed_table, attribute),
+            )
+        )
+
+    spec = pd.DataFrame(
+        rows,
+        columns=[
+            "target",
+            "geography",
+            "seed_table",
+            "importance",
+            "control_field",
+            "expression",
+        ],
+    )
+
+    # last person control is a meta control
+    persons = spec.index[spec.seed_table == "persons"]
+    if len(persons):
+        spec.loc[persons[-1], "geography"] = META_GEOGRAPHY
+
+    return spec
+
+
+def settings(spec):
+    """
+    settings.yaml for a synthetic problem
+    """
+
+    geography_controls = {
+        g: spec.control_field[spec.geography == g].tolist() for g in GEOGRAPHIES
+    }
+    input_table_list = [
+        {
+            "tablename": "households",
+            "filename": "seed_households.csv",
+            "index_col": HOUSEHOLD_ID_COL,
+        },
+        {"tablename": "persons", "filename": "seed_persons.csv"},
+        {"tablename": "geo_cross_walk", "filename": "geo_cross_walk.csv"},
+    ] + [
+        {
+            "tablename": "%s_control_data" % g,
+            "filename": "%s_controls.csv" % g.lower(),
+        }
+        for g in GEOGRAPHIES
+        if geography_controls[g]
+    ]
+
+    return {
+        "NO_INTEGERIZATION_EVER": False,
+        "INTEGERIZE_WITH_BACKSTOPPED_CONTROLS": True,
+        "SUB_BALANCE_WITH_FLOAT_SEED_WEIGHTS": False,
+        "GROUP_BY_INCIDENCE_SIGNATURE": True,
+        "USE_SIMUL_INTEGERIZER": True,
+        "PERFORMANCE_TELEMETRY": True,
+        "geographies": GEOGRAPHIES,
+        "seed_geography": SEED_GEOGRAPHY,
+        "household_weight_col": "WGTP",
+        "household_id_col": HOUSEHOLD_ID_COL,
+        "total_hh_control": TOTAL_HH_CONTROL,
+        "max_expansion_factor": 5,
+        "min_expansion_factor": 0.2,
+        "input_table_list": input_table_list,
+    }
+
+
+def generate_project(
+    project_dir,
+    households,
+    persons_per_household,
+    controls,
+    sparsity,
+    seed_zones,
+    sub_zones_per_parent,
+    random_seed=0,
+):
+    """
+    Write a synthetic PopulationSim project (configs and data directories) to project_dir
+
+    Seed households are drawn at random and each is assigned a true expansion weight and a
+    TAZ in its PUMA. Control totals are aggregated from the true weights, so the problem is
+    feasible, while seed weights (WGTP) are a noisy version of the true weights so the
+    balancers have work to do.
+
+    Parameters
+    ----------
+    project_dir : str
+        directory for configs and data subdirectories (created if necessary)
+    households : int
+        number of seed households
+    persons_per_household : float
+        mean household size (at least 1)
+    controls : int
+        number of controls in addition to num_hh
+    sparsity : float
+        share of zero entries in control attribute (incidence) columns, in [0, 1)
+    seed_zones : int
+        number of PUMAs (seed zones)
+    sub_zones_per_parent : int
+        number of TRACTs per PUMA and of TAZs per TRACT
+    random_seed : int
+
+    Returns
+    -------
+    configs_dir, data_dir : str
+    """
+
+    if not 0 <= sparsity < 1:
+        raise ValueError("sparsity %s not in [0, 1)" % sparsity)
+    if persons_per_household < 1:
+        raise ValueError("persons_per_household %s < 1" % persons_per_household)
+
+    rng = np.random.default_rng(random_seed)
+
+    configs_dir = os.path.join(project_dir, "configs")
+    data_dir = os.path.join(project_dir, "data")
+    os.makedirs(configs_dir, exist_ok=True)
+    os.makedirs(data_dir, exist_ok=True)
+
+    # - geographies
+    taz_count = seed_zones * sub_zones_per_parent**2
+    crosswalk = pd.DataFrame({"TAZ": np.arange(taz_count) + 1})
+    crosswalk["TRACT"] = np.arange(taz_count) // sub_zones_per_parent + 1
+    crosswalk["PUMA"] = np.arange(taz_count) // sub_zones_per_parent**2 + 100
+    crosswalk[META_GEOGRAPHY] = 1
+
+    # - seed households with their true weights and zones
+    spec = control_spec(controls)
+    puma_index = rng.integers(seed_zones, size=households)
+    taz_index = puma_index * sub_zones_per_parent**2 + rng.integers(
+        sub_zones_per_parent**2, size=households
+    )
+    true_weights = rng.integers(1, 2 * MEAN_EXPANSION_FACTOR, size=households)
+
+    households_df = pd.DataFrame(
+        {
+            HOUSEHOLD_ID_COL: np.arange(households) + 1,
+            "PUMA": crosswalk.PUMA.values[taz_index],
+            "NP": 1 + rng.poisson(persons_per_household - 1, size=households),
+            "WGTP": np.maximum(
+                np.round(true_weights * rng.uniform(0.5, 1.5, size=households)), 1
+            ).astype(int),
+        }
+    )
+
+    persons_df = pd.DataFrame(
+        {HOUSEHOLD_ID_COL: np.repeat(households_df[HOUSEHOLD_ID_COL], households_df.NP)}
+    )
+    persons_df["per_num"] = persons_df.groupby(HOUSEHOLD_ID_COL).cumcount() + 1
+    persons_df["PUMA"] = np.repeat(households_df.PUMA.values, households_df.NP)
+
+    seed_tables = {"households": households_df, "persons": persons_df}
+    for row in spec[spec.target != TOTAL_HH_CONTROL].itertuples():
+        df = seed_tables[row.seed_table]
+        df[row.control_field] = (rng.random(len(df.index)) >= sparsity).astype(int)
+
+    # - controls from the true weights
+    incidence = pd.DataFrame({"HHBASE": np.ones(households, dtype=int)})
+    for row in spec[spec.target != TOTAL_HH_CONTROL].itertuples():
+        if row.seed_table == "households":
+            incidence[row.control_field] = households_df[row.control_field].values
+        else:
+            incidence[row.control_field] = (
+                persons_df.groupby(HOUSEHOLD_ID_COL)[row.control_field].sum().values
+            )
+
+    taz_totals = (
+        (incidence * true_weights[:, None])
+        .groupby(crosswalk.TAZ.values[taz_index])
+        .sum()
+        .reindex(crosswalk.TAZ, fill_value=0)
+    )
+    taz_totals = pd.concat([crosswalk.set_index("TAZ"), taz_totals], axis=1)
+
+    for geography in GEOGRAPHIES:
+        fields = spec.control_field[spec.geography == geography].tolist()
+        if not fields:
+            continue
+        id_cols = GEOGRAPHIES[: GEOGRAPHIES.index(geography)]
+        zone_totals = taz_totals.reset_index().groupby(geography)
+        df = zone_totals[id_cols].first().join(zone_totals[fields].sum())
+        df.reset_index()[[geography] + id_cols + fields].to_csv(
+            os.path.join(data_dir, "%s_controls.csv" % geography.lower()),
+            index=False,
+        )
+
+    households_df.to_csv(os.path.join(data_dir, "seed_households.csv"), index=False)
+    persons_df.to_csv(os.path.join(data_dir, "seed_persons.csv"), index=False)
+    crosswalk.to_csv(os.path.join(data_dir, "geo_cross_walk.csv"), index=False)
+
+    spec.to_csv(os.path.join(configs_dir, "controls.csv"), index=False)
+    with open(os.path.join(configs_dir, "settings.yaml"), "w") as f:
+        yaml.safe_dump(settings(spec), f, sort_keys=False)
+    with open(os.path.join(configs_dir, "logging.yaml"), "w") as f:
+        yaml.safe_dump(LOGGING_CONFIG, f, sort_keys=False)
+
+    logger.info(
+        "generated synthetic project with %s households %s persons %s TAZs in %s"
+        % (households, len(persons_df.index), taz_count, project_dir)
+    )
+
+    return configs_dir, data_dir
@@ -67,6 +67,11 @@ def rng_base_seed():
     return setting("rng_base_seed", 0)
 
 
+@inject.injectable()
+def rng_backend():
+    return setting("rng_backend", None)
+
+
 @inject.injectable(cache=True)
 def settings_file_name():
     return "settings.yaml"
@@ -0,0 +1,180 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+# Compact dtype policy (COMPACT_DTYPES setting) for incidence, control and weight tables:
+#   incidence columns       smallest unsigned int that holds the max value (uint8, uint16, ...)
+#   integer controls        int32
+#   household and zone ids  int32
+#   integer weights         int32
+#   float weights           float32 if NUMBA_PRECISION is 'float32', else float64
+# Columns are only downcast when this is lossless.
+
+import numpy as np
+import pandas as pd
+
+from populationsim.core import config
+
+UNSIGNED_DTYPES = (np.uint8, np.uint16, np.uint32)
+
+INT32_MIN = np.iinfo(np.int32).min
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def use_compact_dtypes():
+    return config.setting("COMPACT_DTYPES", False)
+
+
+def weight_dtype():
+    """
+    float dtype for balanced weights under the current settings
+    """
+    if (
+        use_compact_dtypes()
+        and config.setting("NUMBA_PRECISION", "float64") == "float32"
+    ):
+        return np.float32
+    return np.float64
+
+
+def integer_weight_dtype():
+    """
+    int dtype for integerized weights under the current settings
+    """
+    return np.int32 if use_compact_dtypes() else np.int64
+
+
+def smallest_unsigned_dtype(max_value):
+    for dtype in UNSIGNED_DTYPES:
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def _is_integral(values):
+    if pd.api.types.is_bool_dtype(values) or pd.api.types.is_integer_dtype(values):
+        return True
+    if pd.api.types.is_float_dtype(values):
+        return bool(np.all(np.mod(values, 1) == 0))
+    return False
+
+
+def _fits_int32(values):
+    return len(values) == 0 or (values.min() >= INT32_MIN and values.max() <= INT32_MAX)
+
+
+def compact_incidence(df, columns):
+    """
+    Downcast non-negative integral incidence columns to the smallest unsigned int dtype
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        incidence table (modified in place)
+    columns : list of str
+        incidence (control target) columns
+
+    Returns
+    -------
+    df : pandas.DataFrame
+    """
+
+    if not use_compact_dtypes():
+        return df
+
+    for c in columns:
+        values = df[c].values
+        if len(values) == 0 or not _is_integral(values) or values.min() < 0:
+            continue
+        df[c] = values.astype(smallest_unsigned_dtype(values.max()))
+
+    return df
+
+
+def compact_ids(df, columns, index=True):
+    """
+    Downcast integer id columns (and optionally the index) to int32 where the ids fit
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        table to compact (modified in place unless index is downcast)
+    columns : list of str
+        id columns to downcast (missing columns are ignored)
+    index : bool
+        whether to also downcast the (integer) index
+
+    Returns
+    -------
+    df : pandas.DataFrame
+    """
+
+    if not use_compact_dtypes():
+        return df
+
+    for c in columns:
+        if c not in df.columns:
+            continue
+        values = df[c].values
+        if pd.api.types.is_integer_dtype(values) and _fits_int32(values):
+            df[c] = values.astype(np.int32)
+
+    if (
+        index
+        and pd.api.types.is_integer_dtype(df.index)
+        and _fits_int32(df.index.values)
+    ):
+        df.index = df.index.astype(np.int32)
+
+    return df
+
+
+def compact_controls(df):
+    """
+    Downcast integral control columns to int32
+
+    Control totals may be float (e.g. factored meta controls) in which case they are left alone.
+    """
+
+    if not use_compact_dtypes():
+        return df
+
+    for c in df.columns:
+        values = df[c].values
+        if pd.api.types.is_integer_dtype(values) and _fits_int32(values):
+            df[c] = values.astype(np.int32)
+
+    return compact_ids(df, [], index=True)
+
+
+def compact_weights(df, id_columns):
+    """
+    Downcast a weight table to the compact weight, integer weight and id dtypes
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        weight table with float weight columns (e.g. 'balanced_weight'),
+        optional 'integer_weight' column, and household and geography id columns
+    id_columns : list of str
+        household id and geography columns
+
+    Returns
+    -------
+    df : pandas.DataFrame
+    """
+
+    if not use_compact_dtypes():
+        return df
+
+    float_dtype = weight_dtype()
+    for c in df.columns:
+        if c in id_columns:
+            continue
+        values = df[c].values
+        if c == "integer_weight":
+            if _is_integral(values) and _fits_int32(values):
+                df[c] = values.astype(np.int32)
+        elif pd.api.types.is_float_dtype(values):
+            df[c] = values.astype(float_dtype)
+
+    return compact_ids(df, id_columns, index=True)
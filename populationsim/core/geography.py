@@ -0,0 +1,216 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+"""
+Precomputed hierarchical zone maps.
+
+Steps that process one zone at a time used to slice their tables with a boolean mask per
+zone (e.g. incidence_df[incidence_df[seed_geography] == seed_id]), which is O(zones x rows).
+A GeographyIndex groups the row positions of the crosswalk and incidence table by the zone
+ids of each geography, and the zones of each geography by their parent zones, in CSR form
+(ids, offsets and positions), so that each zone's rows or sub zones are a single slice.
+
+The geography_index injectable is built in setup_data_structures, and rebuilt by
+geography_index() whenever it does not match the current crosswalk and incidence tables
+(e.g. in multiprocess sub-processes, whose tables are slices of the full tables).
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from populationsim.core import config, inject
+
+logger = logging.getLogger(__name__)
+
+INJECTABLE_NAME = "geography_index"
+
+
+class ZoneRows:
+    """
+    Row positions of a table grouped by zone id (CSR form)
+
+    Zone ids are in order of first appearance (as with Series.unique) and the rows of each
+    zone are in table order, so table.iloc[rows(zone_id)] is the same as slicing the table
+    with a boolean mask of the zone.
+
+    Parameters
+    ----------
+    zone_values : array-like
+        zone id of each table row
+    """
+
+    def __init__(self, zone_values):
+
+        codes, ids = pd.factorize(np.asarray(zone_values), sort=False)
+
+        # rows without a zone id (code -1) sort first, and are left out
+        positions = np.argsort(codes, kind="stable")
+        self.ids = np.asarray(ids)
+        self.positions = positions[(codes < 0).sum() :]
+        counts = np.bincount(codes[codes >= 0], minlength=len(ids))
+        self.offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(counts)
+
+        self._code_of = pd.Index(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def code(self, zone_id):
+        """
+        position of zone_id in ids (-1 if there are no rows for zone_id)
+        """
+        return self._code_of.get_indexer([zone_id])[0]
+
+    def rows(self, zone_id):
+        """
+        positions of the table rows of zone_id (in table order)
+        """
+        code = self.code(zone_id)
+        if code < 0:
+            return self.positions[:0]
+        return self.positions[self.offsets[code] : self.offsets[code + 1]]
+
+
+class GeographyIndex:
+    """
+    Zone maps of the crosswalk and incidence table for every geography
+
+    Parameters
+    ----------
+    crosswalk_df : pandas.DataFrame
+        crosswalk table with a column for each geography
+    incidence_df : pandas.DataFrame
+        incidence table with seed (and meta) geography columns
+    geographies : list of str
+        geographies from highest (meta) to lowest
+    """
+
+    def __init__(self, crosswalk_df, incidence_df, geographies):
+
+        self.geographies = list(geographies)
+
+        self.crosswalk_rows = {g: ZoneRows(crosswalk_df[g]) for g in self.geographies}
+        self.household_rows = {
+            g: ZoneRows(incidence_df[g])
+            for g in self.geographies
+            if g in incidence_df.columns
+        }
+
+        # zone id values, to check that index still matches tables
+        self._crosswalk_values = {g: crosswalk_df[g].values for g in self.geographies}
+        self._incidence_values = {
+            g: incidence_df[g].values for g in self.household_rows
+        }
+        self._incidence_index = incidence_df.index
+
+        # sub zones of zones, by (geography, sub_geography), built when first needed
+        self._sub_zones = {}
+
+    def matches(self, crosswalk_df, incidence_df):
+        """
+        Was this index built from (tables with the same zones as) crosswalk_df and incidence_df?
+        """
+
+        if not self._incidence_index.equals(incidence_df.index):
+            return False
+        for g, values in self._crosswalk_values.items():
+            if g not in crosswalk_df or not np.array_equal(
+                values, crosswalk_df[g].values
+            ):
+                return False
+        for g, values in self._incidence_values.items():
+            if g not in incidence_df or not np.array_equal(
+                values, incidence_df[g].values
+            ):
+                return False
+        return True
+
+    def zone_ids(self, geography):
+        """
+        zone ids of geography in crosswalk (in order of first appearance)
+        """
+        return self.crosswalk_rows[geography].ids
+
+    def crosswalk_positions(self, geography, zone_id):
+        """
+        crosswalk row positions of zone_id of geography
+        """
+        return self.crosswalk_rows[geography].rows(zone_id)
+
+    def household_positions(self, geography, zone_id):
+        """
+        incidence table row positions of the households in zone_id of (seed or meta) geography
+
+        The seed weights table has the same rows, in the same order, as the incidence table.
+        """
+        return self.household_rows[geography].rows(zone_id)
+
+    def sub_zone_ids(self, geography, zone_id, sub_geography):
+        """
+        ids of the sub_geography zones in zone_id of geography (in crosswalk order)
+
+        Same as crosswalk_df.loc[crosswalk_df[geography] == zone_id, sub_geography].unique()
+        """
+
+        key = (geography, sub_geography)
+        if key not in self._sub_zones:
+            self._sub_zones[key] = self._build_sub_zones(geography, sub_geography)
+        offsets, sub_ids = self._sub_zones[key]
+
+        code = self.crosswalk_rows[geography].code(zone_id)
+        if code < 0:
+            return sub_ids[:0]
+        return sub_ids[offsets[code] : offsets[code + 1]]
+
+    def _build_sub_zones(self, geography, sub_geography):
+        """
+        CSR offsets (by zone of geography) into their unique sub_geography zone ids
+        """
+
+        crosswalk_rows = self.crosswalk_rows[geography]
+        sub_values = self._crosswalk_values[sub_geography]
+
+        # crosswalk rows grouped by zone, then the first row of each (zone, sub zone) pair
+        zone_codes = np.repeat(
+            np.arange(len(crosswalk_rows)), np.diff(crosswalk_rows.offsets)
+        )
+        sub_values = sub_values[crosswalk_rows.positions]
+        pairs = pd.MultiIndex.from_arrays([zone_codes, sub_values])
+        first = ~pairs.duplicated()
+
+        counts = np.bincount(zone_codes[first], minlength=len(crosswalk_rows))
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+
+        return offsets, sub_values[first]
+
+
+def build_geography_index(crosswalk_df, incidence_df):
+    """
+    Build GeographyIndex of crosswalk_df and incidence_df and register it as injectable
+    """
+
+    geography_index = GeographyIndex(
+        crosswalk_df, incidence_df, config.setting("geographies")
+    )
+    inject.add_injectable(INJECTABLE_NAME, geography_index)
+
+    return geography_index
+
+
+def geography_index(crosswalk_df, incidence_df):
+    """
+    geography_index injectable, (re)built if it does not match crosswalk_df and incidence_df
+    """
+
+    geography_index = inject.get_injectable(INJECTABLE_NAME, None)
+    if geography_index is None or not geography_index.matches(
+        crosswalk_df, incidence_df
+    ):
+        logger.debug("building %s" % INJECTABLE_NAME)
+        geography_index = build_geography_index(crosswalk_df, incidence_df)
+
+    return geography_index
@@ -9,11 +9,12 @@ import multiprocessing
 import os
 import threading
 import time
+from contextlib import contextmanager
 
 import numpy as np
 import pandas as pd
-import psutil
 
+# psutil is imported where it is used, to keep importing populationsim cheap
 from populationsim.core import config, inject, util
 
 logger = logging.getLogger(__name__)
@@ -27,6 +28,18 @@ MEM_TICK = 0
 
 MEM_LOG_FILE_NAME = "mem.csv"
 OMNIBUS_LOG_FILE_NAME = "omnibus_mem.csv"
+STEP_MEM_LOG_FILE_NAME = "step_mem.csv"
+TABLE_MEM_LOG_FILE_NAME = "table_mem.csv"
+
+# seconds between rss samples while a model step is running
+STEP_MEM_SAMPLE_INTERVAL = 0.1
+
+# peak rss (bytes) of each model step run by this process
+STEP_PEAK_RSS = {}
+
+# share of memory_budget that loop-heavy steps may use before switching to chunked processing
+MEMORY_BUDGET_HEADROOM = 0.8
+MEMORY_BUDGET_MIN_CHUNK_ROWS = 10000
 
 SUMMARY_BIN_SIZE_IN_SECONDS = 15
 
@@ -191,6 +204,8 @@ def trace_memory_info(event, trace_ticks=0, force_garbage_collect=False):
     process_name = multiprocessing.current_process().name
     pid = os.getpid()
 
+    import psutil
+
     current_process = psutil.Process()
 
     if USS:
@@ -277,3 +292,212 @@ def shared_memory_size(data_buffers=None):
         shared_size += data_size
 
     return shared_size
+
+
+def current_rss():
+    import psutil
+
+    return psutil.Process().memory_info().rss
+
+
+class PeakRSSSampler(threading.Thread):
+    """
+    Daemon thread sampling the rss of the current process until stopped, to catch peaks
+    between trace_memory_info calls
+    """
+
+    def __init__(self, interval=STEP_MEM_SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        import psutil
+
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = self.process.memory_info().rss
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+        return self.peak
+
+
+def step_memory_traced():
+    """
+    Are model step and checkpointed table sizes logged (trace_step_memory setting)?
+    """
+
+    return config.setting("trace_step_memory", False)
+
+
+@contextmanager
+def trace_step_memory(model_name):
+    """
+    Attribute the rss growth and peak rss while running a model step to model_name
+
+    If trace_step_memory is set, appends a row with start, end and peak rss and the
+    peak rss delta (peak less start) of the step to step_mem.csv in the log directory.
+    With a memory_budget, which schedules multiprocess steps by the peak rss of earlier
+    sub-processes, the peak rss is sampled too, but not written to step_mem.csv.
+    """
+
+    traced = step_memory_traced()
+    if not traced and not config.setting("memory_budget", None):
+        yield
+        return
+
+    sampler = PeakRSSSampler()
+    start_rss = sampler.peak
+    sampler.start()
+    try:
+        yield
+    finally:
+        peak_rss = sampler.stop()
+        end_rss = current_rss()
+
+        STEP_PEAK_RSS[model_name] = peak_rss
+        check_global_hwm("rss", peak_rss, f"{model_name} peak")
+
+        logger.info(
+            f"{model_name} peak rss {util.GB(peak_rss)} "
+            f"(+{util.GB(peak_rss - start_rss)}) end rss {util.GB(end_rss)}"
+        )
+
+        if traced:
+            with mem_log_lock:
+                with config.open_log_file(
+                    STEP_MEM_LOG_FILE_NAME,
+                    "a",
+                    header="process,model,start_rss,end_rss,peak_rss,peak_rss_delta",
+                    prefix=True,
+                ) as log_file:
+                    print(
+                        f"{multiprocessing.current_process().name},"
+                        f"{model_name},"
+                        f"{start_rss},"
+                        f"{end_rss},"
+                        f"{peak_rss},"
+                        f"{peak_rss - start_rss}",
+                        file=log_file,
+                    )
+
+
+def trace_table_size(checkpoint_name, table_name, df):
+    """
+    Append the size of a table written at a checkpoint to table_mem.csv in the log directory
+
+    Only if trace_step_memory is set.
+    """
+
+    if not step_memory_traced():
+        return
+
+    with mem_log_lock:
+        with config.open_log_file(
+            TABLE_MEM_LOG_FILE_NAME,
+            "a",
+            header="process,checkpoint,table,size",
+            prefix=True,
+        ) as log_file:
+            print(
+                f"{multiprocessing.current_process().name},"
+                f"{checkpoint_name},"
+                f"{table_name},"
+                f'"{util.df_size(df)}"',
+                file=log_file,
+            )
+
+
+def memory_budget():
+    """
+    memory_budget setting (bytes) for this process, or None if there is no budget
+
+    The budget is shared equally by the sub-processes of a multiprocess step.
+    """
+
+    budget = config.setting("memory_budget", None)
+    if not budget:
+        return None
+
+    return int(budget / inject.get_injectable("num_processes", 1))
+
+
+def budget_chunk_rows(rows, row_bytes, trace_label):
+    """
+    Number of rows to process at a time so that rows of row_bytes fit within memory_budget
+
+    Returns
+    -------
+    chunk_rows : int
+        rows (all at once) if there is no memory_budget or they fit within the budget,
+        otherwise as many rows as fit (but at least MEMORY_BUDGET_MIN_CHUNK_ROWS)
+    """
+
+    budget = memory_budget()
+    if budget is None or rows == 0:
+        return rows
+
+    rss = current_rss()
+    available = MEMORY_BUDGET_HEADROOM * budget - rss
+    if rows * row_bytes <= available:
+        return rows
+
+    chunk_rows = max(int(available // max(row_bytes, 1)), MEMORY_BUDGET_MIN_CHUNK_ROWS)
+    chunk_rows = min(chunk_rows, rows)
+    logger.warning(
+        f"{trace_label}: {util.INT(rows)} rows ({util.GB(rows * row_bytes)}) "
+        f"with rss {util.GB(rss)} exceed memory_budget {util.GB(budget)}, "
+        f"processing {util.INT(chunk_rows)} rows at a time"
+    )
+
+    return chunk_rows
+
+
+def near_memory_budget(trace_label):
+    """
+    Is rss of this process within MEMORY_BUDGET_HEADROOM of its memory_budget?
+    """
+
+    budget = memory_budget()
+    if budget is None:
+        return False
+
+    rss = current_rss()
+    near = rss >= MEMORY_BUDGET_HEADROOM * budget
+    if near:
+        logger.warning(
+            f"{trace_label}: rss {util.GB(rss)} near memory_budget {util.GB(budget)}"
+        )
+
+    return near
+
+
+def processes_within_budget(num_processes, process_rss, trace_label):
+    """
+    Number of sub-processes (at most num_processes) whose combined rss fits memory_budget
+
+    Parameters
+    ----------
+    num_processes : int
+    process_rss : int or None
+        expected peak rss of each sub-process (e.g. largest peak of earlier sub-processes)
+    trace_label : str
+    """
+
+    budget = config.setting("memory_budget", None)
+    if not budget or not process_rss:
+        return num_processes
+
+    processes = max(1, min(num_processes, int(budget // process_rss)))
+    if processes < num_processes:
+        logger.warning(
+            f"{trace_label}: reducing num_processes from {num_processes} to {processes} "
+            f"(sub-process peak rss {util.GB(process_rss)}, "
+            f"memory_budget {util.GB(budget)})"
+        )
+
+    return processes
@@ -13,7 +13,7 @@ import numpy as np
 import pandas as pd
 import yaml
 
-from populationsim.core import config, inject, mem, pipeline, tracing, util
+from populationsim.core import config, inject, mem, pipeline, profiling, tracing, util
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +21,9 @@ multiprocessing.set_start_method("spawn", force=True)
 
 LAST_CHECKPOINT = "_"
 
+# largest step peak rss reported by each sub-process (for memory_budget)
+SUB_PROCESS_PEAK_RSS = {}
+
 """
 mp_tasks - activitysim multiprocessing overview
 
@@ -875,7 +878,13 @@ def run_simulation(queue, step_info, resume_after, shared_data_buffer):
             raise e
 
         tracing.log_runtime(model_name=model, start_time=t1)
-        queue.put({"model": model, "time": time.time() - t1})
+        queue.put(
+            {
+                "model": model,
+                "time": time.time() - t1,
+                "peak_rss": mem.STEP_PEAK_RSS.get(model),
+            }
+        )
 
     tracing.print_elapsed_time("run (%s models)" % len(models), t0)
 
@@ -1038,6 +1047,10 @@ def run_sub_simulations(
                     f"{process.name} {model_name} : {tracing.format_elapsed_time(msg['time'])}"
                 )
                 mem.trace_memory_info(f"{process.name}.{model_name}.completed")
+                if msg.get("peak_rss"):
+                    SUB_PROCESS_PEAK_RSS[process.name] = max(
+                        msg["peak_rss"], SUB_PROCESS_PEAK_RSS.get(process.name, 0)
+                    )
 
     def check_proc_status():
         # we want to drop 'completed' breadcrumb when it happens, lest we terminate
@@ -1304,6 +1317,10 @@ def run_multiprocess(injectables):
     fail_fast = config.setting("fail_fast")
     info(f"run_multiprocess fail_fast: {fail_fast}")
 
+    # sub-processes write their step profiles to the same profiling directory
+    if config.setting("instrument", None):
+        injectables = dict(injectables, profile_dir=profiling.profile_dir())
+
     def skip_phase(phase):
         skip = old_breadcrumbs and old_breadcrumbs.get(step_name, {}).get(phase, False)
         if skip:
@@ -1324,6 +1341,15 @@ def run_multiprocess(injectables):
         num_processes = step_info["num_processes"]
         slice_info = step_info.get("slice", None)
 
+        # fewer sub-processes if as many as earlier steps used would exceed memory_budget
+        if num_processes > 1 and not skip_phase("apportion"):
+            num_processes = mem.processes_within_budget(
+                num_processes,
+                max(SUB_PROCESS_PEAK_RSS.values(), default=None),
+                step_name,
+            )
+            step_info["num_processes"] = num_processes
+
         if num_processes == 1:
             sub_proc_names = [step_name]
         else:
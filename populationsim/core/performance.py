@@ -0,0 +1,202 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+"""
+Per-zone performance telemetry for balancing and integerizing calls.
+
+When the PERFORMANCE_TELEMETRY setting is True, every do_balancing, do_simul_balancing,
+do_integerizing and do_simul_integerizing call records one row of metrics (zone, problem
+size, iterations, solver timings, status and fallbacks taken). The rows recorded while
+running a model step are written to a performance_<model> pipeline table when the step
+completes, and optionally exported to the output directory as csv or parquet
+(PERFORMANCE_TELEMETRY_EXPORT).
+"""
+
+import functools
+import logging
+import re
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from populationsim.core import config, inject
+
+logger = logging.getLogger(__name__)
+
+PERFORMANCE_TABLE_PREFIX = "performance_"
+EXPORT_FORMATS = ["csv", "parquet"]
+
+# (geography, zone_id) of the zones being processed, innermost last
+_ZONES = []
+
+# metrics dicts of the calls in progress, innermost last
+_CALLS = []
+
+# metrics dicts of all calls recorded in the current step, in the order they started
+_RECORDS = []
+
+
+def enabled():
+    return bool(config.setting("PERFORMANCE_TELEMETRY", False))
+
+
+def performance_table_name(model_name):
+    """
+    pipeline table name for model_name (e.g. performance_sub_balancing_geography_TAZ)
+
+    Model args (e.g. '.geography=TAZ') are replaced by underscores, so the name is a valid
+    Python identifier (and PyTables natural name).
+    """
+    return PERFORMANCE_TABLE_PREFIX + re.sub(r"\W+", "_", model_name).strip("_")
+
+
+@contextmanager
+def zone(geography, zone_id):
+    """
+    Attribute calls recorded within the context to zone_id of geography
+    """
+    _ZONES.append((geography, zone_id))
+    try:
+        yield
+    finally:
+        _ZONES.pop()
+
+
+@contextmanager
+def call(kind, **metrics):
+    """
+    Time a balancing or integerizing call and record its metrics
+
+    Yields the metrics dict of the call so results (iterations, status, ...) can be added to
+    it once they are known. Nothing is recorded unless PERFORMANCE_TELEMETRY is enabled.
+
+    Parameters
+    ----------
+    kind : str
+        kind of call (e.g. 'balancing' or 'simul_integerizing')
+    metrics
+        problem size metrics known when the call starts
+    """
+
+    if not enabled():
+        yield {}
+        return
+
+    geography, zone_id = _ZONES[-1] if _ZONES else (None, None)
+    record = {"kind": kind, "geography": geography, "zone_id": zone_id}
+    record.update(metrics)
+
+    _RECORDS.append(record)
+    _CALLS.append(record)
+    t0 = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - t0
+        _CALLS.pop()
+
+
+def recorded(kind):
+    """
+    Decorator recording each call of the decorated function as a call of the given kind
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with call(kind):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def update(**metrics):
+    """
+    Add metrics to the innermost call
+    """
+    if _CALLS:
+        _CALLS[-1].update(metrics)
+
+
+def add_elapsed(name, t0):
+    """
+    Add seconds elapsed since perf_counter t0 to metric name of the innermost call
+
+    Returns
+    -------
+    t : float
+        current perf_counter, to time the next phase
+    """
+    t = time.perf_counter()
+    if _CALLS:
+        _CALLS[-1][name] = _CALLS[-1].get(name, 0.0) + (t - t0)
+    return t
+
+
+def add_fallback(fallback):
+    """
+    Note a fallback (e.g. 'sequential_integerizing') taken by the innermost call
+    """
+    if _CALLS:
+        _CALLS[-1].setdefault("fallbacks", []).append(fallback)
+
+
+def clear():
+    del _RECORDS[:]
+
+
+def write_table(model_name):
+    """
+    Add the calls recorded while running model_name to the pipeline (and export them)
+
+    Parameters
+    ----------
+    model_name : str
+        model name as listed in settings models (e.g. 'sub_balancing.geography=TAZ')
+    """
+
+    if not _RECORDS:
+        return
+
+    df = pd.DataFrame(_RECORDS)
+    clear()
+
+    df.insert(0, "model", model_name)
+    if "fallbacks" not in df:
+        df["fallbacks"] = None
+    df["fallbacks"] = df["fallbacks"].map(
+        lambda fallbacks: ";".join(fallbacks) if isinstance(fallbacks, list) else ""
+    )
+
+    # plain str and float columns, as PyTables pickles mixed object columns
+    for column in df.select_dtypes(include="object").columns:
+        values = df[column].dropna()
+        if len(values) and values.map(lambda v: isinstance(v, (bool, np.bool_))).all():
+            df[column] = df[column].astype(float)
+        else:
+            df[column] = df[column].fillna("").astype(str)
+
+    # timings and fallbacks after the zone and problem size columns
+    last_columns = ["fallbacks", "seconds"]
+    df = df[[c for c in df.columns if c not in last_columns] + last_columns]
+
+    table_name = performance_table_name(model_name)
+    logger.info("adding table %s with %s calls" % (table_name, len(df.index)))
+    inject.add_table(table_name, df)
+
+    export = config.setting("PERFORMANCE_TELEMETRY_EXPORT", None)
+    if export:
+        if export not in EXPORT_FORMATS:
+            raise ValueError(
+                "unknown PERFORMANCE_TELEMETRY_EXPORT '%s' (expected one of %s)"
+                % (export, EXPORT_FORMATS)
+            )
+        file_path = config.output_file_path("%s.%s" % (table_name, export))
+        if export == "csv":
+            df.to_csv(file_path, index=False)
+        else:
+            df.to_parquet(file_path, index=False)
@@ -3,11 +3,23 @@
 import datetime as dt
 import logging
 import os
+import warnings
 
 import pandas as pd
+import tables
 from orca import orca
 
-from populationsim.core import config, inject, mem, random, tracing, util
+from populationsim.core import (
+    config,
+    inject,
+    mem,
+    performance,
+    profiling,
+    random,
+    time_budget,
+    tracing,
+    util,
+)
 from populationsim.core.tracing import print_elapsed_time
 
 logger = logging.getLogger(__name__)
@@ -204,7 +216,11 @@ def write_df(df, table_name, checkpoint_name=None):
 
     store = get_pipeline_store()
 
-    store[pipeline_table_key(table_name, checkpoint_name)] = df
+    # checkpoint names are model names, whose args (e.g. sub_balancing.geography=TAZ) are
+    # not natural names, which doesn't matter as tables are read by key
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", tables.NaturalNameWarning)
+        store[pipeline_table_key(table_name, checkpoint_name)] = df
 
     store.flush()
 
@@ -298,6 +314,7 @@ def add_checkpoint(checkpoint_name):
             % (checkpoint_name, table_name, util.df_size(df))
         )
         write_df(df, table_name, checkpoint_name)
+        mem.trace_table_size(checkpoint_name, table_name, df)
 
         # remember which checkpoint it was last written
         _PIPELINE.last_checkpoint[table_name] = checkpoint_name
@@ -499,38 +516,26 @@ def run_model(model_name):
         checkpoint = intermediate_checkpoint(model_name)
 
     inject.set_step_args(args)
+    performance.clear()
+    time_budget.begin_step(model_name)
 
     mem.trace_memory_info(f"pipeline.run_model {model_name} start")
 
     t0 = print_elapsed_time()
     logger.info(f"#run_model running step {step_name}")
 
-    instrument = config.setting("instrument", None)
-    if instrument is not None:
-        try:
-            from pyinstrument import Profiler
-        except ImportError:
-            instrument = False
-    if isinstance(instrument, (list, set, tuple)):
-        if step_name not in instrument:
-            instrument = False
-        else:
-            instrument = True
-
-    if instrument:
-        with Profiler() as profiler:
+    with mem.trace_step_memory(model_name):
+        with profiling.instrumented(model_name, step_name):
             orca.run([step_name])
-        out_file = config.profiling_file_path(f"{step_name}.html")
-        with open(out_file, "wt") as f:
-            f.write(profiler.output_html())
-    else:
-        orca.run([step_name])
 
     t0 = print_elapsed_time(
         "#run_model completed step '%s'" % model_name, t0, debug=True
     )
     mem.trace_memory_info(f"pipeline.run_model {model_name} finished")
 
+    performance.write_table(model_name)
+    time_budget.end_step(model_name)
+
     inject.set_step_args(None)
 
     _PIPELINE.rng().end_step(model_name)
@@ -563,6 +568,7 @@ def open_pipeline(resume_after=None, mode="a"):
     _PIPELINE.is_open = True
 
     get_rn_generator().set_base_seed(inject.get_injectable("rng_base_seed", 0))
+    get_rn_generator().set_backend(inject.get_injectable("rng_backend", None))
 
     if resume_after:
         # open existing pipeline
@@ -660,6 +666,7 @@ def run(models, resume_after=None, memory_sidecar_process=None):
 
     t0 = print_elapsed_time()
 
+    time_budget.reset(models)
     open_pipeline(resume_after)
     t0 = print_elapsed_time("open_pipeline", t0)
 
@@ -0,0 +1,152 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+"""
+Model step profiling.
+
+The instrument setting (True for all steps, or a list of step or model names) profiles
+pipeline.run_model of the selected steps, in the main process as well as in multiprocess
+sub-processes. The instrument_profiler setting selects the profiler:
+
+pyinstrument (default)
+    writes a <step>.html sampling profile to the profiling directory (if pyinstrument
+    is installed)
+cprofile
+    writes the raw profile to the profiling directory as <model>.prof (for snakeviz,
+    pstats, ...) and appends the top profile_top_n functions by own time to
+    profile_hotspots.csv in the log directory
+"""
+
+import cProfile
+import csv
+import logging
+import os
+import pstats
+import re
+from contextlib import contextmanager
+
+from populationsim.core import config, inject
+
+logger = logging.getLogger(__name__)
+
+HOTSPOTS_FILE_NAME = "profile_hotspots.csv"
+HOTSPOTS_HEADER = "model,rank,function,file,line,ncalls,tottime,cumtime"
+
+DEFAULT_TOP_N = 25
+
+PYINSTRUMENT = "pyinstrument"
+CPROFILE = "cprofile"
+PROFILERS = [PYINSTRUMENT, CPROFILE]
+
+
+def instrument_step(model_name, step_name):
+    """
+    Is model_name (or its step step_name) selected by the instrument setting?
+    """
+
+    instrument = config.setting("instrument", None)
+    if isinstance(instrument, (list, set, tuple)):
+        return model_name in instrument or step_name in instrument
+    return bool(instrument)
+
+
+def instrument_profiler():
+
+    profiler = config.setting("instrument_profiler", PYINSTRUMENT)
+    if profiler not in PROFILERS:
+        raise RuntimeError("instrument_profiler '%s' not in %s" % (profiler, PROFILERS))
+    return profiler
+
+
+def profile_dir():
+    """
+    profiling directory, created if necessary (to be shared with sub-processes)
+    """
+    return os.path.dirname(config.profiling_file_path(""))
+
+
+def profile_file_name(model_name):
+
+    file_name = "%s.prof" % re.sub(r"\W+", "_", model_name)
+
+    prefix = inject.get_injectable("log_file_prefix", None)
+    if prefix:
+        file_name = "%s-%s" % (prefix, file_name)
+
+    return file_name
+
+
+def hotspots(stats, top_n):
+    """
+    Top top_n functions of pstats.Stats stats by own (total) time
+
+    Returns
+    -------
+    rows : list of tuples
+        (function, file, line, ncalls, tottime, cumtime), most expensive first
+    """
+
+    rows = [
+        (function, file, line, ncalls, round(tottime, 6), round(cumtime, 6))
+        for (file, line, function), (_, ncalls, tottime, cumtime, _) in (
+            stats.stats.items()
+        )
+    ]
+    rows.sort(key=lambda row: row[4], reverse=True)
+
+    return rows[:top_n]
+
+
+@contextmanager
+def instrumented(model_name, step_name):
+    """
+    Profile step step_name of model_name with the instrument_profiler, if instrumented
+    """
+
+    if not instrument_step(model_name, step_name):
+        yield
+    elif instrument_profiler() == CPROFILE:
+        with profiled(model_name):
+            yield
+    else:
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            yield
+            return
+
+        with Profiler() as profiler:
+            yield
+        out_file = config.profiling_file_path(f"{step_name}.html")
+        with open(out_file, "wt") as f:
+            f.write(profiler.output_html())
+
+
+@contextmanager
+def profiled(model_name):
+    """
+    Profile the code run within the context and write the results for model_name
+    """
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+
+        file_path = config.profiling_file_path(profile_file_name(model_name))
+        profiler.dump_stats(file_path)
+
+        top_n = config.setting("profile_top_n", DEFAULT_TOP_N)
+        stats = pstats.Stats(profiler)
+        with config.open_log_file(
+            HOTSPOTS_FILE_NAME, "a", header=HOTSPOTS_HEADER, prefix=True
+        ) as f:
+            writer = csv.writer(f, lineterminator="\n")
+            for rank, row in enumerate(hotspots(stats, top_n), start=1):
+                writer.writerow((model_name, rank) + row)
+
+        logger.info(
+            "profiled %s in %s (%.3f seconds)" % (model_name, file_path, stats.total_tt)
+        )
@@ -17,6 +17,21 @@ logger = logging.getLogger(__name__)
 _MAX_SEED = 1 << 32
 _SEED_MASK = 0xFFFFFFFF
 
+# random number backends (rng_backend setting)
+MT19937 = "mt19937"
+PHILOX = "philox"
+RNG_BACKENDS = [MT19937, PHILOX]
+
+# Philox-4x32-10 multipliers and key schedule (Weyl) constants
+PHILOX_M0 = np.uint64(0xD2511F53)
+PHILOX_M1 = np.uint64(0xCD9E8D57)
+PHILOX_W0 = np.uint64(0x9E3779B9)
+PHILOX_W1 = np.uint64(0xBB67AE85)
+PHILOX_ROUNDS = 10
+
+_WORD_MASK = np.uint64(_SEED_MASK)
+_WORD_SHIFT = np.uint64(32)
+
 
 def hash32(s):
     """
@@ -34,6 +49,113 @@ def hash32(s):
     return int(h, base=16) & _SEED_MASK
 
 
+def validate_rng_backend(backend):
+    """
+    Normalize rng_backend setting value (None or name of backend)
+    """
+    if not backend:
+        return MT19937
+    if backend not in RNG_BACKENDS:
+        raise ValueError(
+            "unknown rng_backend '%s' (expected one of %s)" % (backend, RNG_BACKENDS)
+        )
+    return backend
+
+
+def philox4x32(counters, key, rounds=PHILOX_ROUNDS):
+    """
+    Philox-4x32 counter-based generator (Salmon et al. 2011), vectorized over counters
+
+    Parameters
+    ----------
+    counters : numpy.ndarray
+        uint32 array of shape (..., 4), one 128 bit counter per block
+    key : array-like
+        two uint32 key words (shared by all counters)
+    rounds : int
+
+    Returns
+    -------
+    blocks : numpy.ndarray
+        uint32 array with the same shape as counters, four random words per counter
+    """
+
+    c0, c1, c2, c3 = (counters[..., i].astype(np.uint64) for i in range(4))
+    k0, k1 = (np.uint64(k) for k in key)
+
+    for r in range(rounds):
+        if r > 0:
+            k0 = (k0 + PHILOX_W0) & _WORD_MASK
+            k1 = (k1 + PHILOX_W1) & _WORD_MASK
+        p0 = PHILOX_M0 * c0
+        p1 = PHILOX_M1 * c2
+        c0, c1, c2, c3 = (
+            (p1 >> _WORD_SHIFT) ^ c1 ^ k0,
+            p1 & _WORD_MASK,
+            (p0 >> _WORD_SHIFT) ^ c3 ^ k1,
+            p0 & _WORD_MASK,
+        )
+
+    return np.stack([c0, c1, c2, c3], axis=-1).astype(np.uint32)
+
+
+def philox_random(rows, draws, key, base_seed):
+    """
+    Counter-based uniform random numbers in range [0, 1) for draws of row streams
+
+    Draw d of the stream of row r is half of the Philox block for counter
+    (d // 2, base_seed, r low word, r high word), so it depends only on key, base_seed,
+    row and draw number and never on the other rows drawn with it.
+
+    Parameters
+    ----------
+    rows : numpy.ndarray
+        int64 row (index) values
+    draws : numpy.ndarray
+        uint64 draw numbers, of shape (len(rows), n)
+    key : tuple of int
+        two uint32 key words (e.g. channel and step seeds)
+    base_seed : int
+
+    Returns
+    -------
+    rands : numpy.ndarray
+        float64 array with the same shape as draws
+    """
+
+    rows = rows.astype(np.int64).view(np.uint64)[:, np.newaxis]
+
+    counters = np.empty(draws.shape + (4,), dtype=np.uint32)
+    counters[..., 0] = draws >> np.uint64(1)
+    counters[..., 1] = int(base_seed) & _SEED_MASK
+    counters[..., 2] = rows & _WORD_MASK
+    counters[..., 3] = rows >> _WORD_SHIFT
+
+    words = philox4x32(counters, key)
+    second = (draws & np.uint64(1)).astype(bool)
+    a = np.where(second, words[..., 2], words[..., 0])
+    b = np.where(second, words[..., 3], words[..., 1])
+
+    # 53 bit doubles, the same way as numpy random_sample
+    return ((a >> 5) * 67108864.0 + (b >> 6)) / 9007199254740992.0
+
+
+def rng_for_seed(seed, backend=MT19937):
+    """
+    numpy RandomState seeded with seed (list of uint32 ints)
+
+    For the philox backend, the RandomState draws from a Philox bit generator keyed by seed.
+    """
+
+    if backend == PHILOX:
+        key = 0
+        for s in seed:
+            key = (key << 32) | (int(s) & _SEED_MASK)
+        return np.random.RandomState(np.random.Philox(key=key))
+
+    return np.random.RandomState(seed)
+
+
 class SimpleChannel:
     """
 
@@ -62,11 +184,17 @@ class SimpleChannel:
     We do read in the whole households and persons tables at start time, so we could note the
     max index values. But we might then want a way to ensure stability between the test, example,
     and full datasets. I am punting on this for now.
+
+    With the philox backend there is no reseeding at all: the rands of every row are
+    counter-based (see philox_random), keyed by channel and step seeds with the base seed
+    and the full row index in the counter, so the rands for a whole df are computed at once
+    and do not depend on which other rows (or which process) they are drawn with.
     """
 
-    def __init__(self, channel_name, base_seed, domain_df, step_name):
+    def __init__(self, channel_name, base_seed, domain_df, step_name, backend=MT19937):
 
         self.base_seed = base_seed
+        self.backend = backend
 
         # ensure that every channel is different, even for the same df index values and max_steps
         self.channel_name = channel_name
@@ -205,6 +333,24 @@ class SimpleChannel:
 
             yield prng
 
+    def _philox_random_for_df(self, df, n):
+        """
+        n counter-based rands for each row in df, starting at each row's offset
+        """
+
+        # assert no dupes
+        assert len(df.index.unique()) == len(df.index)
+
+        offsets = self.row_states["offset"].loc[df.index].values.astype(np.uint64)
+        draws = offsets[:, np.newaxis] + np.arange(n, dtype=np.uint64)
+
+        return philox_random(
+            df.index.values,
+            draws,
+            (self.channel_seed, self.step_seed),
+            self.base_seed,
+        )
+
     def random_for_df(self, df, step_name, n=1):
         """
         Return n floating point random numbers in range [0, 1) for each row in df
@@ -238,10 +384,13 @@ class SimpleChannel:
         assert self.step_name
         assert self.step_name == step_name
 
-        # - reminder: prng must be called when yielded as generated sequence, not serialized
-        generators = self._generators_for_df(df)
+        if self.backend == PHILOX:
+            rands = self._philox_random_for_df(df, n)
+        else:
+            # - reminder: prng must be called when yielded as generated sequence, not serialized
+            generators = self._generators_for_df(df)
 
-        rands = np.asanyarray([prng.rand(n) for prng in generators])
+            rands = np.asanyarray([prng.rand(n) for prng in generators])
         # update offset for rows we handled
         self.row_states.loc[df.index, "offset"] += n
         return rands
@@ -286,6 +435,9 @@ class SimpleChannel:
                 return x.values
             return x
 
+        if self.backend == PHILOX:
+            return self._philox_normal_for_df(df, mu, sigma, lognormal, size)
+
         # - reminder: prng must be called when yielded as generated sequence, not serialized
         generators = self._generators_for_df(df)
 
@@ -316,6 +468,53 @@ class SimpleChannel:
 
         return rands
 
+    def _philox_normal_for_df(self, df, mu, sigma, lognormal, size):
+        """
+        normal (or lognormal) rands for each row in df from pairs of counter-based rands
+        (Box-Muller transform)
+        """
+
+        n = 1 if size is None else int(size)
+        u = self._philox_random_for_df(df, 2 * n)
+        z = np.sqrt(-2.0 * np.log1p(-u[:, :n])) * np.cos(2.0 * np.pi * u[:, n:])
+
+        if size is None:
+            z = z[:, 0]
+            mu = np.asanyarray(mu)
+            sigma = np.asanyarray(sigma)
+        else:
+            mu = np.asanyarray(mu).reshape(-1, 1)
+            sigma = np.asanyarray(sigma).reshape(-1, 1)
+
+        rands = z * sigma + mu
+        if lognormal:
+            rands = np.exp(rands)
+
+        self.row_states.loc[df.index, "offset"] += 2 * n
+
+        return rands
+
+    def _philox_choice_for_df(self, df, a, size, replace):
+        """
+        numpy.random.choice(a, size, replace) for each row in df from counter-based rands
+
+        Returns the concatenated choices and the number of rands used per row.
+        """
+
+        a = np.arange(a) if np.isscalar(a) else np.asanyarray(a)
+
+        if replace:
+            u = self._philox_random_for_df(df, size)
+            positions = (u * len(a)).astype(np.int64)
+            rands_used = size
+        else:
+            # first size of a random permutation of a
+            u = self._philox_random_for_df(df, len(a))
+            positions = np.argsort(u, axis=1, kind="stable")[:, :size]
+            rands_used = len(a)
+
+        return a[positions].ravel(), rands_used
+
     def choice_for_df(self, df, step_name, a, size, replace):
         """
         Apply numpy.random.choice once for each row in df
@@ -355,6 +554,11 @@ class SimpleChannel:
         assert self.step_name
         assert self.step_name == step_name
 
+        if self.backend == PHILOX:
+            sample, rands_used = self._philox_choice_for_df(df, a, size, replace)
+            self.row_states.loc[df.index, "offset"] += rands_used
+            return sample
+
         # initialize the generator iterator
         generators = self._generators_for_df(df)
 
@@ -383,6 +587,7 @@ class Random(object):
         self.step_name = None
         self.step_seed = None
         self.base_seed = 0
+        self.backend = MT19937
         self.global_rng = np.random.RandomState()
 
     def get_channel_for_df(self, df):
@@ -422,7 +627,7 @@ class Random(object):
         self.step_seed = hash32(step_name)
 
         seed = [self.base_seed, self.step_seed]
-        self.global_rng = np.random.RandomState(seed)
+        self.global_rng = rng_for_seed(seed, self.backend)
 
         for c in self.channels:
             self.channels[c].begin_step(self.step_name)
@@ -485,7 +690,7 @@ class Random(object):
             )
 
             channel = SimpleChannel(
-                channel_name, self.base_seed, domain_df, self.step_name
+                channel_name, self.base_seed, domain_df, self.step_name, self.backend
             )
 
             self.channels[channel_name] = channel
@@ -540,6 +745,28 @@ class Random(object):
             logger.debug("Set random seed base to %s" % seed)
             self.base_seed = seed
 
+    def set_backend(self, backend=None):
+        """
+        Select the random number backend for all random streams
+
+        mt19937 (the default) reseeds a numpy RandomState for every row, so existing seeds
+        replay exactly. philox computes the rands of all rows at once from counter-based
+        Philox streams (and draws global and external rngs from Philox bit generators).
+
+        Must be called before first step (before any channels are added or rands are consumed)
+
+        Parameters
+        ----------
+        backend : str or None
+            mt19937, philox or None (mt19937)
+        """
+
+        if self.step_name is not None or self.channels:
+            raise RuntimeError("Can only call set_backend before the first step.")
+
+        self.backend = validate_rng_backend(backend)
+        logger.debug("Set random backend to %s" % self.backend)
+
     def get_global_rng(self):
         """
         Return a numpy random number generator for use within current step.
@@ -570,7 +797,7 @@ class Random(object):
         """
 
         seed = [self.base_seed, hash32(one_off_step_name)]
-        return np.random.RandomState(seed)
+        return rng_for_seed(seed, self.backend)
 
     def random_for_df(self, df, n=1):
         """
@@ -0,0 +1,344 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+"""
+Run level time budget for integerizer solves.
+
+INTEGIZER_TIMEOUT limits each solve, so a hard zone can take that long on every try
+(backstopped, unbackstopped and sequential fallbacks alike). With the INTEGERIZER_TIME_BUDGET
+setting (in seconds), the solves of the whole run share a budget instead, handed out as
+per-solve time limits:
+
+* the budget left when an integerizing step starts is split evenly between it and the
+  integerizing steps still to run (in the models list of the run)
+* a step queues its zones, and each zone gets an even share of what is left of the step's
+  budget, or more, if the other queued zones are predicted (from the solve seconds of the
+  step's completed zones) to need less than their share
+* each solve gets what is left of its zone's share, but no more than INTEGIZER_TIMEOUT
+
+A solve is predicted to take as many seconds per unit of problem size (households x sub zones
+x controls) as the solves before it took. Solves whose time limit is less than
+MIN_SOLVE_SECONDS, or less than their predicted seconds, are not attempted: the integerizers smart round the zone
+instead and report the downgrade (logged as a warning, noted as a time_budget_smart_round
+fallback in the performance telemetry, and summarized when the step completes).
+
+With multiprocessing, each process has a budget of its own.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from populationsim.core import config, performance
+
+logger = logging.getLogger(__name__)
+
+# steps that integerize (model names are step names with optional .args)
+INTEGERIZING_STEPS = [
+    "integerize_final_seed_weights",
+    "sub_balancing",
+    "repop_balancing",
+]
+
+# solves with less time than this are downgraded to smart rounding
+MIN_SOLVE_SECONDS = 0.1
+
+DOWNGRADE_FALLBACK = "time_budget_smart_round"
+
+
+class TimeBudget:
+    """
+    Seconds of integerizer solve time left in the run, and how they are shared out
+
+    Parameters
+    ----------
+    seconds : float
+        solve seconds for the whole run
+    """
+
+    def __init__(self, seconds):
+
+        self.seconds = float(seconds)
+        self.spent = 0.0
+
+        # problem size and seconds of all solves, to predict solve seconds
+        self.solved_size = 0.0
+        self.solved_seconds = 0.0
+
+        # (model_name, trace_label) of the solves downgraded to smart rounding
+        self.downgrades = []
+
+        self.model_name = None
+        self.step_seconds = None
+        self.step_spent = 0.0
+        self.zones_queued = 0
+        self.zones_done = 0
+
+        self.zone_seconds = None
+        self.zone_spent = 0.0
+
+        # block integerizing threads solve concurrently
+        self.lock = threading.Lock()
+
+    @property
+    def remaining(self):
+        return max(self.seconds - self.spent, 0.0)
+
+    def begin_step(self, model_name, pending_steps):
+        """
+        Give the step an even share of the budget left with the pending_steps still to run
+        """
+        self.model_name = model_name
+        self.step_seconds = self.remaining / (1 + pending_steps)
+        self.step_spent = 0.0
+        self.zones_queued = 0
+        self.zones_done = 0
+        self.zone_seconds = None
+
+    def begin_zone(self):
+        """
+        Share out the step's budget left to the next queued zone
+        """
+
+        step_left = max(self.step_seconds - self.step_spent, 0.0)
+        zones_left = max(self.zones_queued - self.zones_done, 1)
+
+        self.zone_seconds = step_left / zones_left
+        if self.zones_done > 0:
+            # take what the other queued zones are not predicted to need
+            predicted = (zones_left - 1) * self.step_spent / self.zones_done
+            self.zone_seconds = max(self.zone_seconds, step_left - predicted)
+
+        self.zone_spent = 0.0
+
+    def end_zone(self):
+        self.zones_done += 1
+        self.zone_seconds = None
+
+    def predicted_seconds(self, size):
+        if self.solved_size == 0:
+            return 0.0
+        return size * self.solved_seconds / self.solved_size
+
+    def seconds_left(self):
+        """
+        Seconds left for the next solve, in the run, step and zone
+        """
+
+        seconds_left = self.remaining
+        if self.step_seconds is not None:
+            seconds_left = min(seconds_left, self.step_seconds - self.step_spent)
+        if self.zone_seconds is not None:
+            seconds_left = min(seconds_left, self.zone_seconds - self.zone_spent)
+
+        return max(seconds_left, 0.0)
+
+    def timeout(self, timeout_in_seconds, size):
+        """
+        Time limit for a solve of problem size size, or None if it should not be attempted
+
+        Returns
+        -------
+        timeout : float or None
+        """
+
+        seconds_left = self.seconds_left()
+
+        if seconds_left >= timeout_in_seconds:
+            return timeout_in_seconds
+
+        if seconds_left < max(MIN_SOLVE_SECONDS, self.predicted_seconds(size)):
+            return None
+
+        return seconds_left
+
+    def add_solve(self, size, seconds):
+        self.spent += seconds
+        self.step_spent += seconds
+        self.zone_spent += seconds
+        self.solved_size += size
+        self.solved_seconds += seconds
+
+
+# budget of the current run (None unless INTEGERIZER_TIME_BUDGET is set)
+_BUDGET = None
+
+# models of the current run, to find the integerizing steps still to run
+_MODELS = None
+
+
+def enabled():
+    return bool(config.setting("INTEGERIZER_TIME_BUDGET", None))
+
+
+def reset(models=None):
+    """
+    Start the next run (of models, by default those of the models setting) with a full budget
+    """
+    global _BUDGET, _MODELS
+    _BUDGET = None
+    _MODELS = list(models) if models is not None else None
+
+
+def budget():
+    """
+    TimeBudget of the current run, or None if there is no INTEGERIZER_TIME_BUDGET
+    """
+    global _BUDGET
+    if not enabled():
+        return None
+    if _BUDGET is None:
+        _BUDGET = TimeBudget(config.setting("INTEGERIZER_TIME_BUDGET"))
+    return _BUDGET
+
+
+def is_integerizing_step(model_name):
+    return model_name.split(".", 1)[0] in INTEGERIZING_STEPS
+
+
+def begin_step(model_name):
+    """
+    Give model_name its share of the run's budget, if it is an integerizing step
+    """
+
+    run_budget = budget()
+    if run_budget is None or not is_integerizing_step(model_name):
+        return
+
+    models = _MODELS if _MODELS is not None else config.setting("models", None) or []
+    pending = models[models.index(model_name) + 1 :] if model_name in models else []
+    pending_steps = len([m for m in pending if is_integerizing_step(m)])
+
+    run_budget.begin_step(model_name, pending_steps)
+    logger.info(
+        "integerizer time budget %.1f of %.1f seconds left, %.1f for %s"
+        % (
+            run_budget.remaining,
+            run_budget.seconds,
+            run_budget.step_seconds,
+            model_name,
+        )
+    )
+
+
+def end_step(model_name):
+    """
+    Summarize the solve seconds model_name spent and the solves it downgraded
+    """
+
+    run_budget = budget()
+    if run_budget is None or run_budget.model_name != model_name:
+        return
+
+    downgrades = [
+        trace_label
+        for model, trace_label in run_budget.downgrades
+        if model == model_name
+    ]
+    logger.info(
+        "integerizer time budget: %s spent %.1f seconds solving, %.1f of %.1f left"
+        % (model_name, run_budget.step_spent, run_budget.remaining, run_budget.seconds)
+    )
+    if downgrades:
+        logger.warning(
+            "integerizer time budget: %s smart rounded %s solves without solving: %s"
+            % (model_name, len(downgrades), downgrades)
+        )
+
+    run_budget.model_name = None
+    run_budget.step_seconds = None
+
+
+def queue(zone_count):
+    """
+    Queue the zones the current step will integerize (in performance.zone contexts)
+    """
+    run_budget = budget()
+    if run_budget is not None and run_budget.model_name is not None:
+        run_budget.zones_queued += zone_count
+
+
+@contextmanager
+def zone():
+    """
+    Integerize a queued zone within the context
+    """
+
+    run_budget = budget()
+    if run_budget is None or run_budget.model_name is None:
+        yield
+        return
+
+    run_budget.begin_zone()
+    try:
+        yield
+    finally:
+        run_budget.end_zone()
+
+
+def timeout(timeout_in_seconds, size, trace_label=""):
+    """
+    Time limit for an integerizer solve, or None if it should be downgraded to smart rounding
+
+    Downgrades are reported (see module docstring).
+
+    Parameters
+    ----------
+    timeout_in_seconds : int
+        INTEGIZER_TIMEOUT
+    size : int
+        problem size (households x sub zones x controls)
+    trace_label : str
+
+    Returns
+    -------
+    timeout : float or None
+    """
+
+    run_budget = budget()
+    if run_budget is None:
+        return timeout_in_seconds
+
+    with run_budget.lock:
+        solve_timeout = run_budget.timeout(timeout_in_seconds, size)
+        if solve_timeout is None:
+            run_budget.downgrades.append((run_budget.model_name, trace_label))
+
+    if solve_timeout is None:
+        logger.warning(
+            "integerizer time budget exhausted for %s: smart rounding instead of solving "
+            "(%.2f seconds left for the solve, %.2f predicted, %.1f of %.1f left in the run)"
+            % (
+                trace_label,
+                run_budget.seconds_left(),
+                run_budget.predicted_seconds(size),
+                run_budget.remaining,
+                run_budget.seconds,
+            )
+        )
+        performance.add_fallback(DOWNGRADE_FALLBACK)
+
+    return solve_timeout
+
+
+def add_solve(size, t0):
+    """
+    Charge the seconds since perf_counter t0 taken by a solve of problem size size
+    """
+
+    run_budget = budget()
+    if run_budget is None:
+        return
+
+    seconds = time.perf_counter() - t0
+    with run_budget.lock:
+        run_budget.add_solve(size, seconds)
+
+
+def downgrades():
+    """
+    (model_name, trace_label) of the solves downgraded to smart rounding so far in the run
+    """
+    run_budget = budget()
+    return list(run_budget.downgrades) if run_budget is not None else []
@@ -1,3 +1,5 @@
+from populationsim.integerizing.single_integerizer import np_integerize
+from populationsim.integerizing.simul_integerizer import np_simul_integerize
 from populationsim.integerizing.wrappers import (
     do_integerizing,
     do_simul_integerizing,
@@ -10,4 +12,6 @@ __all__ = [
     "do_integerizing",
     "do_simul_integerizing",
     "do_sequential_integerizing",
+    "np_integerize",
+    "np_simul_integerize",
 ]
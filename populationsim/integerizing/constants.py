@@ -9,3 +9,9 @@ CVX_SOLVER = "GLPK_MI"
 # 'C' for C-style row-major order, 'F' for Fortran-style column-major order
 # Note: cvxpy is deprecating 'F' order, so we use 'C' order.
 ORDER = "C"
+
+# Maximum number of parameterized cvxpy problems (one per problem shape) kept for reuse
+CVX_PROBLEM_CACHE_SIZE = 8
+
+# status of solves not attempted for lack of INTEGERIZER_TIME_BUDGET (smart rounded instead)
+STATUS_TIME_BUDGET = "TIME_BUDGET"
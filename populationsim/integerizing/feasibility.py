@@ -0,0 +1,157 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+"""
+Feasibility pre-screen for the simultaneous integerizer.
+
+The simul integerizer LP rounds up the residual weights x of each sub zone so that the
+number of households rounded up equals the total households shortfall, while each control
+total x.incidence stays within bounds set by lp_right_hand_side and its relaxations. When a single sub zone cannot meet its constraints the whole LP is
+infeasible, and do_simul_integerizing has to integerize every sub zone sequentially to find
+out which one it was.
+
+infeasible_sub_zones checks the LP arrays for the conditions that make a sub zone infeasible
+whatever the other sub zones do, for all sub zones at once, so that those can be smart rounded
+without solving. The checks are necessary but not sufficient conditions for feasibility, so
+the LP may still be infeasible for the sub zones that pass.
+"""
+
+import numpy as np
+
+# infeasibility reasons
+IMPOSSIBLE_TOTAL = "impossible_total"
+NO_CONTRIBUTING_HOUSEHOLDS = "no_contributing_households"
+RESID_SUM_MISMATCH = "resid_sum_mismatch"
+
+# tolerance for comparing float LP bounds
+EPSILON = 1e-6
+
+
+def infeasible_sub_zones(
+    sub_int_weights,
+    sub_float_weights,
+    sub_incidence,
+    lp_right_hand_side,
+    relax_ge_upper_bound,
+    hh_constraint_ge_bound,
+    total_hh_sub_control_index,
+    parent_incidence,
+    parent_lp_right_hand_side,
+    parent_hh_constraint_ge_bound,
+    total_hh_parent_control_index=-1,
+):
+    """
+    Find the sub zones whose simul integerizer LP constraints cannot be met
+
+    Each control total x.incidence of a sub zone must be at least lp_right_hand_side
+    - relax_ge_upper_bound, and at most the lesser of twice lp_right_hand_side and
+    hh_constraint_ge_bound (parent control totals are the sums over all sub zones, so their
+    upper bounds apply to each sub zone too). A sub zone is flagged, most fundamental reason
+    last, for a
+
+    resid_sum_mismatch
+        total households shortfall larger than the households with a residual weight can
+        make up, when those contributing to a control that is already met (with no room
+        above its lp_right_hand_side) cannot be rounded up at all, and those contributing to
+        any other control only as far as its upper bound allows
+    no_contributing_households
+        control total that must be rounded up but that no household that can be rounded up
+        contributes to
+    impossible_total
+        total households shortfall that is negative or larger than the number of households
+        with a residual weight, or a control total that cannot be reached even by rounding up
+        the households with the largest incidence
+
+    Parameters
+    ----------
+    sub_int_weights : numpy.ndarray(sub_zone_count, sample_count) int
+    sub_float_weights : numpy.ndarray(sub_zone_count, sample_count) float
+    sub_incidence : numpy.ndarray(sample_count, sub_control_count) float
+    lp_right_hand_side : numpy.ndarray(sub_zone_count, sub_control_count) float
+    relax_ge_upper_bound : numpy.ndarray(sub_zone_count, sub_control_count) float
+    hh_constraint_ge_bound : numpy.ndarray(sub_zone_count, sub_control_count) float
+    total_hh_sub_control_index : int
+    parent_incidence : numpy.ndarray(sample_count, parent_control_count) float
+    parent_lp_right_hand_side : numpy.ndarray(parent_control_count,) float
+    parent_hh_constraint_ge_bound : numpy.ndarray(parent_control_count,) float
+    total_hh_parent_control_index : int
+        parent control the LP has no constraints for (if any, as in its parent_lp)
+
+    Returns
+    -------
+    reasons : numpy.ndarray(sub_zone_count,) of str
+        reason each sub zone cannot be integerized, or '' if none was found
+    """
+
+    sub_zone_count = sub_float_weights.shape[0]
+
+    total_hh_right_hand_side = lp_right_hand_side[:, total_hh_sub_control_index]
+
+    # sub and parent controls side by side, without the total households controls
+    is_control = np.ones(sub_incidence.shape[1], dtype=bool)
+    is_control[total_hh_sub_control_index] = False
+    is_parent_control = np.arange(parent_incidence.shape[1]) != (
+        total_hh_parent_control_index
+    )
+    parent_control_count = is_parent_control.sum()
+    incidence = np.hstack(
+        [sub_incidence[:, is_control], parent_incidence[:, is_parent_control]]
+    )
+    upper_bound = np.hstack(
+        [
+            np.minimum(2 * lp_right_hand_side, hh_constraint_ge_bound)[:, is_control],
+            np.broadcast_to(
+                np.minimum(
+                    2 * parent_lp_right_hand_side, parent_hh_constraint_ge_bound
+                )[is_parent_control],
+                (sub_zone_count, parent_control_count),
+            ),
+        ]
+    )
+    lower_bound = (lp_right_hand_side - relax_ge_upper_bound)[:, is_control]
+
+    # households with a residual weight (x_max of 1) in each sub zone
+    can_round_up = sub_float_weights != sub_int_weights
+    round_up_count = can_round_up.sum(axis=1)
+
+    # households that cannot be rounded up, as they contribute to a control already met
+    contributes = (incidence > 0).astype(np.float64)
+    met = (upper_bound < EPSILON).astype(np.float64)
+    can_round_up &= (met @ contributes.T) == 0
+    free_count = can_round_up.sum(axis=1)
+
+    # number of the rest contributing to each control, by sub zone
+    contributing_count = can_round_up.astype(np.float64) @ contributes
+
+    # households contributing to a control can be rounded up by at most (in total)
+    # its upper bound over their least incidence
+    min_incidence = np.where(incidence > 0, incidence, np.inf).min(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        capacity = np.where(contributing_count > 0, upper_bound / min_incidence, 0) + (
+            free_count[:, np.newaxis] - contributing_count
+        )
+    max_total = np.minimum(
+        total_hh_right_hand_side[:, np.newaxis],
+        contributing_count[:, : lower_bound.shape[1]],
+    ) * np.amax(sub_incidence[:, is_control], axis=0, initial=0)
+
+    reasons = np.full(sub_zone_count, "", dtype=object)
+
+    resid_sum_mismatch = (total_hh_right_hand_side > free_count + EPSILON) | (
+        total_hh_right_hand_side[:, np.newaxis] > capacity + EPSILON
+    ).any(axis=1)
+    reasons[resid_sum_mismatch] = RESID_SUM_MISMATCH
+
+    no_contributing_households = (
+        (contributing_count[:, : lower_bound.shape[1]] == 0) & (lower_bound > EPSILON)
+    ).any(axis=1)
+    reasons[no_contributing_households] = NO_CONTRIBUTING_HOUSEHOLDS
+
+    impossible_total = (
+        (total_hh_right_hand_side < 0)
+        | (total_hh_right_hand_side > round_up_count + EPSILON)
+        | (max_total + EPSILON < lower_bound).any(axis=1)
+    )
+    reasons[impossible_total] = IMPOSSIBLE_TOTAL
+
+    return reasons
@@ -2,17 +2,191 @@
 # See full license in LICENSE.txt.
 
 import logging
+import threading
+import time
+from collections import OrderedDict
+from populationsim.core import performance
 from populationsim.integerizing.constants import (
     STATUS_SUCCESS,
     STATUS_FEASIBLE,
     STATUS_OPTIMAL,
     CVX_SOLVER,
+    CVX_PROBLEM_CACHE_SIZE,
     ORDER,
 )
 import numpy as np
 
 logger = logging.getLogger(__name__)
 
+LOG_OVERFLOW = -725
+
+# per thread (blocks of sub zones may be integerized concurrently) problem caches
+_thread_local = threading.local()
+
+
+def problem_cache():
+    """
+    Parameterized problems by kind and shape, least recently used first, of this thread
+    """
+    if not hasattr(_thread_local, "problems"):
+        _thread_local.problems = OrderedDict()
+    return _thread_local.problems
+
+
+def cached_problem(key, build_problem):
+    """
+    Get the parameterized problem for key from the problem cache, building it if not cached
+
+    Canonicalizing a cvxpy problem often costs more than solving it. Problems built on
+    cvx.Parameters are DPP-compliant, so cvxpy canonicalizes them on their first solve only,
+    and zones with the same problem shape reuse them by setting new parameter values.
+    Each thread's cache holds its CVX_PROBLEM_CACHE_SIZE most recently used problems.
+
+    Parameters
+    ----------
+    key : tuple
+        problem kind and shape
+    build_problem : function
+        returns a new problem dict (cvx.Problem, decision variable x and cvx.Parameters
+        by name) for key
+
+    Returns
+    -------
+    problem : dict
+    """
+
+    cache = problem_cache()
+
+    problem = cache.pop(key, None)
+    if problem is None:
+        problem = build_problem()
+        assert problem["problem"].is_dpp()
+        logger.debug("built cvx problem %s" % (key,))
+
+    cache[key] = problem
+    while len(cache) > CVX_PROBLEM_CACHE_SIZE:
+        cache.popitem(last=False)
+
+    return problem
+
+
+def solve_problem(problem, values, timeout_in_seconds, max_iters, x_hint=None):
+    """
+    Set the parameter values of a parameterized problem and solve it, warm started from
+    x_hint if given
+
+    Parameters
+    ----------
+    problem : dict
+        as returned by cached_problem
+    values : dict
+        parameter values by parameter name
+    timeout_in_seconds : float
+    max_iters : int
+    x_hint : numpy.ndarray, optional
+        starting value of the problem's decision variable x
+
+    Returns
+    -------
+    status : str
+        cvxpy status (if the solver raises, a cached problem still has the status and
+        variable values of its previous solve, so they must not be used)
+    """
+
+    import cvxpy as cvx
+
+    for name, value in values.items():
+        problem["parameters"][name].value = np.asanyarray(value, dtype=float)
+
+    assert (
+        CVX_SOLVER in cvx.installed_solvers()
+    ), "CVX Solver '%s' not in installed solvers %s." % (
+        CVX_SOLVER,
+        cvx.installed_solvers(),
+    )
+
+    if x_hint is not None:
+        problem["x"].value = np.reshape(x_hint, problem["x"].shape).astype(float)
+
+    prob = problem["problem"]
+    prob.solve(
+        solver=CVX_SOLVER,
+        verbose=True,
+        warm_start=x_hint is not None,
+        max_iters=max_iters,
+        cplex_params={"timelimit": timeout_in_seconds},
+    )
+
+    return prob.status
+
+
+def build_integerizer_problem(sample_count, control_count):
+    """
+    Build the parameterized single-integerizer problem solved by np_integerizer_cvx
+
+    Returns
+    -------
+    problem : dict
+        cvx.Problem, decision variable x and cvx.Parameters by name
+    """
+
+    import cvxpy as cvx
+
+    def vec(x, order="C"):
+        """Set the order of the vector to C or F Once."""
+        return cvx.vec(x, order=order)
+
+    parameters = {
+        "incidence": cvx.Parameter((sample_count, control_count)),
+        "log_resid_weights": cvx.Parameter(sample_count),
+        "control_importance_weights": cvx.Parameter(control_count),
+        "lp_right_hand_side": cvx.Parameter(control_count),
+        "relax_ge_upper_bound": cvx.Parameter(control_count),
+        "hh_constraint_ge_bound": cvx.Parameter(control_count),
+        "max_x": cvx.Parameter((1, sample_count)),
+        "total_hh_constraint": cvx.Parameter(),
+    }
+    incidence = parameters["incidence"]
+    control_importance_weights = parameters["control_importance_weights"]
+    lp_right_hand_side = parameters["lp_right_hand_side"]
+
+    # - Decision variables for optimization
+    x = cvx.Variable((1, sample_count))
+
+    # - Create positive continuous constraint relaxation variables
+    relax_le = cvx.Variable(control_count)
+    relax_ge = cvx.Variable(control_count)
+
+    # - Set objective
+
+    objective = cvx.Maximize(
+        cvx.sum(cvx.multiply(parameters["log_resid_weights"], vec(x)))
+        - cvx.sum(cvx.multiply(control_importance_weights, relax_le))
+        - cvx.sum(cvx.multiply(control_importance_weights, relax_ge))
+    )
+
+    constraints = [
+        # - inequality constraints
+        vec(x @ incidence) - relax_le >= 0,
+        vec(x @ incidence) - relax_le <= lp_right_hand_side,
+        vec(x @ incidence) + relax_ge >= lp_right_hand_side,
+        vec(x @ incidence) + relax_ge <= parameters["hh_constraint_ge_bound"],
+        x >= 0.0,
+        x <= parameters["max_x"],
+        relax_le >= 0.0,
+        relax_le <= lp_right_hand_side,
+        relax_ge >= 0.0,
+        relax_ge <= parameters["relax_ge_upper_bound"],
+        # - equality constraint for the total households control
+        cvx.sum(x) == parameters["total_hh_constraint"],
+    ]
+
+    return {
+        "problem": cvx.Problem(objective, constraints),
+        "x": x,
+        "parameters": parameters,
+    }
+
 
 def np_integerizer_cvx(
     incidence,
@@ -24,12 +198,17 @@ def np_integerizer_cvx(
     relax_ge_upper_bound,
     hh_constraint_ge_bound,
     timeout_in_seconds,
+    x_max=None,
+    x_hint=None,
 ):
     """
     cvx-based single-integerizer function taking numpy data types and conforming to a
     standard function signature that allows it to be swapped interchangeably with alternate
     LP implementations.
 
+    The problem is cached by sample and control count (see cached_problem), so zones of
+    the same shape are only canonicalized once.
+
     Parameters
     ----------
     incidence : numpy.ndarray(control_count, sample_count) float
@@ -40,7 +219,13 @@ def np_integerizer_cvx(
     lp_right_hand_side : numpy.ndarray(control_count,) float
     relax_ge_upper_bound : numpy.ndarray(control_count,) float
     hh_constraint_ge_bound : numpy.ndarray(control_count,) float
-    timeout_in_seconds : int
+    timeout_in_seconds : float
+    x_max : numpy.ndarray(sample_count,) float, optional
+        upper bounds of the residual weight variables (by default 1.0, or 0.0 for zero
+        resid_weights)
+    x_hint : numpy.ndarray(sample_count,) float, optional
+        starting point for the solver (e.g. smart rounded resid_weights), passed as a
+        warm start (used by solvers that support it, ignored by others)
 
     Returns
     -------
@@ -50,9 +235,7 @@ def np_integerizer_cvx(
 
     import cvxpy as cvx
 
-    def vec(x, order="C"):
-        """Set the order of the vector to C or F Once."""
-        return cvx.vec(x, order=order)
+    t0 = time.perf_counter()
 
     STATUS_TEXT = {
         cvx.OPTIMAL: STATUS_OPTIMAL,
@@ -68,79 +251,160 @@ def np_integerizer_cvx(
     incidence = incidence.T
     sample_count, control_count = incidence.shape
 
-    # - Decision variables for optimization
-    x = cvx.Variable((1, sample_count))
-
-    # - Create positive continuous constraint relaxation variables
-    relax_le = cvx.Variable(control_count)
-    relax_ge = cvx.Variable(control_count)
+    problem = cached_problem(
+        ("integerizer", sample_count, control_count),
+        lambda: build_integerizer_problem(sample_count, control_count),
+    )
 
     # FIXME - could ignore as handled by constraint?
     control_importance_weights[total_hh_control_index] = 0
 
-    # - Set objective
-
-    objective = cvx.Maximize(
-        cvx.sum(cvx.multiply(log_resid_weights, vec(x)))
-        - cvx.sum(cvx.multiply(control_importance_weights, relax_le))
-        - cvx.sum(cvx.multiply(control_importance_weights, relax_ge))
-    )
-
-    total_hh_constraint = lp_right_hand_side[total_hh_control_index]
-
     # 1.0 unless resid_weights is zero
-    max_x = (~(resid_weights == 0.0)).astype(float).reshape((1, -1))
-
-    constraints = [
-        # - inequality constraints
-        vec(x @ incidence) - relax_le >= 0,
-        vec(x @ incidence) - relax_le <= lp_right_hand_side,
-        vec(x @ incidence) + relax_ge >= lp_right_hand_side,
-        vec(x @ incidence) + relax_ge <= hh_constraint_ge_bound,
-        x >= 0.0,
-        x <= max_x,
-        relax_le >= 0.0,
-        relax_le <= lp_right_hand_side,
-        relax_ge >= 0.0,
-        relax_ge <= relax_ge_upper_bound,
-        # - equality constraint for the total households control
-        cvx.sum(x) == total_hh_constraint,
-    ]
-
-    prob = cvx.Problem(objective, constraints)
+    if x_max is None:
+        x_max = (~(resid_weights == 0.0)).astype(float)
+
+    values = {
+        "incidence": incidence,
+        "log_resid_weights": log_resid_weights,
+        "control_importance_weights": control_importance_weights,
+        "lp_right_hand_side": lp_right_hand_side,
+        "relax_ge_upper_bound": relax_ge_upper_bound,
+        "hh_constraint_ge_bound": hh_constraint_ge_bound,
+        "max_x": np.reshape(x_max, (1, -1)),
+        "total_hh_constraint": lp_right_hand_side[total_hh_control_index],
+    }
 
-    assert (
-        CVX_SOLVER in cvx.installed_solvers()
-    ), "CVX Solver '%s' not in installed solvers %s." % (
-        CVX_SOLVER,
-        cvx.installed_solvers(),
-    )
     logger.info("integerizing with '%s' solver." % CVX_SOLVER)
 
+    t0 = performance.add_elapsed("build_seconds", t0)
+    status = None
     try:
-        prob.solve(
-            solver=CVX_SOLVER,
-            verbose=True,
-            max_iters=CVX_MAX_ITERS,
-            cplex_params={"timelimit": timeout_in_seconds},
+        status = solve_problem(
+            problem,
+            values,
+            timeout_in_seconds,
+            CVX_MAX_ITERS,
+            x_hint=None if x_hint is None else np.minimum(x_hint, x_max),
         )
     except cvx.SolverError:
         logging.exception(
             "Solver error encountered in weight discretization. Weights will be rounded."
         )
+    performance.add_elapsed("solve_seconds", t0)
 
-    status_text = STATUS_TEXT[prob.status]
+    status_text = STATUS_TEXT[status]
 
     if status_text in STATUS_SUCCESS:
+        x = problem["x"]
         assert x.value is not None
         resid_weights_out = np.asarray(x.value)[0]
     else:
-        assert x.value is None
         resid_weights_out = resid_weights
 
     return resid_weights_out, status_text
 
 
+def build_simul_integerizer_problem(
+    sub_zone_count, sample_count, sub_control_count, parent_control_count
+):
+    """
+    Build the parameterized simul-integerizer problem solved by np_simul_integerizer_cvx
+
+    Returns
+    -------
+    problem : dict
+        cvx.Problem, decision variable x and cvx.Parameters by name
+    """
+
+    import cvxpy as cvx
+
+    def vec(x, order="C"):
+        """Set the order of the vector to C or F Once."""
+        return cvx.vec(x, order=order)
+
+    parameters = {
+        "sub_incidence": cvx.Parameter((sample_count, sub_control_count)),
+        "parent_incidence": cvx.Parameter((sample_count, parent_control_count)),
+        "log_resid_weights": cvx.Parameter(sub_zone_count * sample_count),
+        "log_parent_resid_weights": cvx.Parameter(sample_count),
+        "sub_control_importance": cvx.Parameter(sub_control_count),
+        "parent_countrol_importance": cvx.Parameter(parent_control_count),
+        "lp_right_hand_side": cvx.Parameter((sub_zone_count, sub_control_count)),
+        "relax_ge_upper_bound": cvx.Parameter((sub_zone_count, sub_control_count)),
+        "hh_constraint_ge_bound": cvx.Parameter((sub_zone_count, sub_control_count)),
+        "total_hh_right_hand_side": cvx.Parameter(sub_zone_count),
+        "parent_lp_right_hand_side": cvx.Parameter(parent_control_count),
+        "parent_relax_ge_upper_bound": cvx.Parameter(parent_control_count),
+        "parent_hh_constraint_ge_bound": cvx.Parameter(parent_control_count),
+        "x_max": cvx.Parameter((sub_zone_count, sample_count)),
+    }
+    sub_incidence = parameters["sub_incidence"]
+    parent_incidence = parameters["parent_incidence"]
+    sub_control_importance = parameters["sub_control_importance"]
+    parent_countrol_importance = parameters["parent_countrol_importance"]
+    lp_right_hand_side = parameters["lp_right_hand_side"]
+    parent_lp_right_hand_side = parameters["parent_lp_right_hand_side"]
+
+    # - Decision variables for optimization
+    x = cvx.Variable((sub_zone_count, sample_count))
+
+    # - Create positive continuous constraint relaxation variables
+    relax_le = cvx.Variable((sub_zone_count, sub_control_count))
+    relax_ge = cvx.Variable((sub_zone_count, sub_control_count))
+
+    parent_relax_le = cvx.Variable(parent_control_count)
+    parent_relax_ge = cvx.Variable(parent_control_count)
+
+    # - Set objective
+
+    # subzone and parent objective and relaxation penalties
+    # note: cvxpy overloads * so * in following is matrix multiplication
+    objective = cvx.Maximize(
+        cvx.sum(cvx.multiply(parameters["log_resid_weights"], vec(x)))
+        + cvx.sum(
+            cvx.multiply(
+                parameters["log_parent_resid_weights"], vec(cvx.sum(x, axis=0))
+            )
+        )
+        - cvx.sum(relax_le @ sub_control_importance)
+        - cvx.sum(relax_ge @ sub_control_importance)
+        - cvx.sum(cvx.multiply(parent_countrol_importance, parent_relax_le))
+        - cvx.sum(cvx.multiply(parent_countrol_importance, parent_relax_ge))
+    )
+
+    constraints = [
+        (x @ sub_incidence) - relax_le >= 0,
+        (x @ sub_incidence) - relax_le <= lp_right_hand_side,
+        (x @ sub_incidence) + relax_ge >= lp_right_hand_side,
+        (x @ sub_incidence) + relax_ge <= parameters["hh_constraint_ge_bound"],
+        x >= 0.0,
+        x <= parameters["x_max"],
+        relax_le >= 0.0,
+        relax_le <= lp_right_hand_side,
+        relax_ge >= 0.0,
+        relax_ge <= parameters["relax_ge_upper_bound"],
+        # - equality constraint for the total households control
+        cvx.sum(x, axis=1) == parameters["total_hh_right_hand_side"],
+        vec(cvx.sum(x, axis=0) @ parent_incidence) - parent_relax_le >= 0,
+        vec(cvx.sum(x, axis=0) @ parent_incidence) - parent_relax_le
+        <= parent_lp_right_hand_side,
+        vec(cvx.sum(x, axis=0) @ parent_incidence) + parent_relax_ge
+        >= parent_lp_right_hand_side,
+        vec(cvx.sum(x, axis=0) @ parent_incidence) + parent_relax_ge
+        <= parameters["parent_hh_constraint_ge_bound"],
+        parent_relax_le >= 0.0,
+        parent_relax_le <= parent_lp_right_hand_side,
+        parent_relax_ge >= 0.0,
+        parent_relax_ge <= parameters["parent_relax_ge_upper_bound"],
+    ]
+
+    return {
+        "problem": cvx.Problem(objective, constraints),
+        "x": x,
+        "parameters": parameters,
+    }
+
+
 def np_simul_integerizer_cvx(
     sub_int_weights,
     parent_countrol_importance,
@@ -160,12 +424,17 @@ def np_simul_integerizer_cvx(
     total_hh_sub_control_index,
     total_hh_parent_control_index,
     timeout_in_seconds,
+    x_max=None,
+    x_hint=None,
 ):
     """
     cvx-based simul-integerizer function taking numpy data types and conforming to a
     standard function signature that allows it to be swapped interchangeably with alternate
     LP implementations.
 
+    The problem is cached by sub zone, sample and control counts (see cached_problem), so
+    problems of the same shape are only canonicalized once.
+
     Parameters
     ----------
     sub_int_weights : numpy.ndarray(sub_zone_count, sample_count) int
@@ -184,7 +453,13 @@ def np_simul_integerizer_cvx(
     hh_constraint_ge_bound : numpy.ndarray(sub_zone_count, sub_control_count) float
     parent_resid_weights : numpy.ndarray(sample_count,) float
     total_hh_sub_control_index : int
-    timeout_in_seconds : int
+    timeout_in_seconds : float
+    x_max : numpy.ndarray(sub_zone_count, sample_count) float, optional
+        upper bounds of the residual weight variables (by default 1.0, or 0.0 where
+        sub_float_weights are integers)
+    x_hint : numpy.ndarray(sub_zone_count, sample_count) float, optional
+        starting point for the solver (e.g. smart rounded sub_resid_weights), passed as a
+        warm start (used by solvers that support it, ignored by others)
 
     Returns
     -------
@@ -197,9 +472,7 @@ def np_simul_integerizer_cvx(
 
     import cvxpy as cvx
 
-    def vec(x, order="C"):
-        """Set the order of the vector to C or F Once."""
-        return cvx.vec(x, order=order)
+    t0 = time.perf_counter()
 
     STATUS_TEXT = {
         cvx.OPTIMAL: "OPTIMAL",
@@ -216,20 +489,22 @@ def np_simul_integerizer_cvx(
     _, parent_control_count = parent_incidence.shape
     sub_zone_count, _ = sub_float_weights.shape
 
-    # - Decision variables for optimization
-    x = cvx.Variable((sub_zone_count, sample_count))
+    problem = cached_problem(
+        (
+            "simul_integerizer",
+            sub_zone_count,
+            sample_count,
+            sub_control_count,
+            parent_control_count,
+        ),
+        lambda: build_simul_integerizer_problem(
+            sub_zone_count, sample_count, sub_control_count, parent_control_count
+        ),
+    )
 
     # x range is 0.0 to 1.0 unless resid_weights is zero, in which case constrain x to 0.0
-    x_max = (~(sub_float_weights == sub_int_weights)).astype(float)
-
-    # - Create positive continuous constraint relaxation variables
-    relax_le = cvx.Variable((sub_zone_count, sub_control_count))
-    relax_ge = cvx.Variable((sub_zone_count, sub_control_count))
-
-    parent_relax_le = cvx.Variable(parent_control_count)
-    parent_relax_ge = cvx.Variable(parent_control_count)
-
-    # - Set objective
+    if x_max is None:
+        x_max = (~(sub_float_weights == sub_int_weights)).astype(float)
 
     # can probably ignore as handled by constraint
     sub_control_importance[total_hh_sub_control_index] = 0
@@ -238,7 +513,6 @@ def np_simul_integerizer_cvx(
     if total_hh_parent_control_index > 0:
         parent_countrol_importance[total_hh_parent_control_index] = 0
 
-    LOG_OVERFLOW = -725
     log_resid_weights = np.log(
         np.maximum(sub_resid_weights, np.exp(LOG_OVERFLOW))
     ).flatten(ORDER)
@@ -249,69 +523,46 @@ def np_simul_integerizer_cvx(
     ).flatten(ORDER)
     assert not np.isnan(log_parent_resid_weights).any()
 
-    # subzone and parent objective and relaxation penalties
-    # note: cvxpy overloads * so * in following is matrix multiplication
-    objective = cvx.Maximize(
-        cvx.sum(cvx.multiply(log_resid_weights, vec(x)))
-        + cvx.sum(cvx.multiply(log_parent_resid_weights, vec(cvx.sum(x, axis=0))))
-        - cvx.sum(relax_le @ sub_control_importance)
-        - cvx.sum(relax_ge @ sub_control_importance)
-        - cvx.sum(cvx.multiply(parent_countrol_importance, parent_relax_le))
-        - cvx.sum(cvx.multiply(parent_countrol_importance, parent_relax_ge))
-    )
-
-    constraints = [
-        (x @ sub_incidence) - relax_le >= 0,
-        (x @ sub_incidence) - relax_le <= lp_right_hand_side,
-        (x @ sub_incidence) + relax_ge >= lp_right_hand_side,
-        (x @ sub_incidence) + relax_ge <= hh_constraint_ge_bound,
-        x >= 0.0,
-        x <= x_max,
-        relax_le >= 0.0,
-        relax_le <= lp_right_hand_side,
-        relax_ge >= 0.0,
-        relax_ge <= relax_ge_upper_bound,
-        # - equality constraint for the total households control
-        cvx.sum(x, axis=1) == total_hh_right_hand_side,
-        vec(cvx.sum(x, axis=0) @ parent_incidence) - parent_relax_le >= 0,
-        vec(cvx.sum(x, axis=0) @ parent_incidence) - parent_relax_le
-        <= parent_lp_right_hand_side,
-        vec(cvx.sum(x, axis=0) @ parent_incidence) + parent_relax_ge
-        >= parent_lp_right_hand_side,
-        vec(cvx.sum(x, axis=0) @ parent_incidence) + parent_relax_ge
-        <= parent_hh_constraint_ge_bound,
-        parent_relax_le >= 0.0,
-        parent_relax_le <= parent_lp_right_hand_side,
-        parent_relax_ge >= 0.0,
-        parent_relax_ge <= parent_relax_ge_upper_bound,
-    ]
-
-    prob = cvx.Problem(objective, constraints)
+    values = {
+        "sub_incidence": sub_incidence,
+        "parent_incidence": parent_incidence,
+        "log_resid_weights": log_resid_weights,
+        "log_parent_resid_weights": log_parent_resid_weights,
+        "sub_control_importance": sub_control_importance,
+        "parent_countrol_importance": parent_countrol_importance,
+        "lp_right_hand_side": lp_right_hand_side,
+        "relax_ge_upper_bound": relax_ge_upper_bound,
+        "hh_constraint_ge_bound": hh_constraint_ge_bound,
+        "total_hh_right_hand_side": total_hh_right_hand_side,
+        "parent_lp_right_hand_side": parent_lp_right_hand_side,
+        "parent_relax_ge_upper_bound": parent_relax_ge_upper_bound,
+        "parent_hh_constraint_ge_bound": parent_hh_constraint_ge_bound,
+        "x_max": x_max,
+    }
 
-    assert (
-        CVX_SOLVER in cvx.installed_solvers()
-    ), "CVX Solver '%s' not in installed solvers %s." % (
-        CVX_SOLVER,
-        cvx.installed_solvers(),
-    )
     logger.info("simul_integerizing with '%s' solver." % CVX_SOLVER)
 
+    t0 = performance.add_elapsed("build_seconds", t0)
+    status = None
     try:
-        prob.solve(
-            solver=CVX_SOLVER,
-            verbose=True,
-            max_iters=CVX_MAX_ITERS,
-            cplex_params={"timelimit": timeout_in_seconds},
+        status = solve_problem(
+            problem,
+            values,
+            timeout_in_seconds,
+            CVX_MAX_ITERS,
+            x_hint=None if x_hint is None else np.minimum(x_hint, x_max),
         )
     except cvx.SolverError as e:
         logging.warning("Solver error in SimulIntegerizer: %s" % e)
+    performance.add_elapsed("solve_seconds", t0)
 
     # if we got a result
-    if np.any(x.value):
+    x = problem["x"]
+    if status is not None and np.any(x.value):
         resid_weights_out = np.asarray(x.value)
     else:
         resid_weights_out = sub_resid_weights
 
-    status_text = STATUS_TEXT[prob.status]
+    status_text = STATUS_TEXT[status]
 
     return resid_weights_out, status_text
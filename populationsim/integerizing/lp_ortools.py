@@ -1,7 +1,10 @@
 # PopulationSim
 # See full license in LICENSE.txt.
 
+import time
+
 import numpy as np
+from populationsim.core import performance
 from populationsim.integerizing.constants import (
     STATUS_OPTIMAL,
     STATUS_FEASIBLE,
@@ -19,6 +22,8 @@ def np_integerizer_ortools(
     relax_ge_upper_bound,
     hh_constraint_ge_bound,
     timeout_in_seconds,
+    x_max=None,
+    x_hint=None,
 ):
     """
     ortools single-integerizer function taking numpy data types and conforming to a
@@ -36,7 +41,13 @@ def np_integerizer_ortools(
     lp_right_hand_side : numpy.ndarray(control_count,) float
     relax_ge_upper_bound : numpy.ndarray(control_count,) float
     hh_constraint_ge_bound : numpy.ndarray(control_count,) float
-    timeout_in_seconds : int
+    timeout_in_seconds : float
+    x_max : numpy.ndarray(sample_count,) float, optional
+        upper bounds of the residual weight variables (by default 1.0, or 0.0 for zero
+        resid_weights)
+    x_hint : numpy.ndarray(sample_count,) float, optional
+        starting point for the solver (e.g. smart rounded resid_weights), passed as a
+        solution hint (used by solvers that take MIP starts, ignored by others)
 
     Returns
     -------
@@ -57,6 +68,8 @@ def np_integerizer_ortools(
 
     control_count, sample_count = incidence.shape
 
+    t0 = time.perf_counter()
+
     # - Instantiate a mixed-integer solver
     solver = pywraplp.Solver(
         "IntegerizeCbc", pywraplp.Solver.CBC_MIXED_INTEGER_PROGRAMMING
@@ -69,11 +82,16 @@ def np_integerizer_ortools(
     hh_constraint_le = [None] * control_count
     hh_constraint_ge = [None] * control_count
 
+    # max_x == 0.0 if float_weights is an int, otherwise 1.0
+    if x_max is None:
+        x_max = 1.0 - (resid_weights == 0.0)
+
     # - Create binary integer variables
     for hh in range(0, sample_count):
-        # max_x == 0.0 if float_weights is an int, otherwise 1.0
-        max_x = 1.0 - (resid_weights[hh] == 0.0)
-        x[hh] = solver.NumVar(0.0, max_x, "x_" + str(hh))
+        x[hh] = solver.NumVar(0.0, x_max[hh], "x_" + str(hh))
+
+    if x_hint is not None:
+        solver.SetHint(x, np.minimum(x_hint, x_max).tolist())
 
     # - Create positive continuous constraint relaxation variables
     for c in range(0, control_count):
@@ -155,11 +173,13 @@ def np_integerizer_ortools(
     for hh in range(0, sample_count):
         constraint_eq.SetCoefficient(x[hh], 1.0)
 
-    solver.set_time_limit(timeout_in_seconds * 1000)
+    solver.set_time_limit(int(timeout_in_seconds * 1000))
 
     solver.EnableOutput()
 
+    t0 = performance.add_elapsed("build_seconds", t0)
     result_status = solver.Solve()
+    performance.add_elapsed("solve_seconds", t0)
 
     status_text = STATUS_TEXT[result_status]
 
@@ -192,6 +212,8 @@ def np_simul_integerizer_ortools(
     total_hh_sub_control_index,
     total_hh_parent_control_index,
     timeout_in_seconds,
+    x_max=None,
+    x_hint=None,
 ):
     """
     ortools-based siuml-integerizer function taking numpy data types and conforming to a
@@ -217,7 +239,13 @@ def np_simul_integerizer_ortools(
     parent_resid_weights : numpy.ndarray(sample_count,) float
     total_hh_sub_control_index : int
     total_hh_parent_control_index : int
-    timeout_in_seconds : int
+    timeout_in_seconds : float
+    x_max : numpy.ndarray(sub_zone_count, sample_count) float, optional
+        upper bounds of the residual weight variables (by default 1.0, or 0.0 where
+        sub_float_weights are integers)
+    x_hint : numpy.ndarray(sub_zone_count, sample_count) float, optional
+        starting point for the solver (e.g. smart rounded sub_resid_weights), passed as a
+        solution hint (used by solvers that take MIP starts, ignored by others)
 
     Returns
     -------
@@ -253,15 +281,18 @@ def np_simul_integerizer_ortools(
     if total_hh_parent_control_index > 0:
         parent_countrol_importance[total_hh_parent_control_index] = 0
 
+    t0 = time.perf_counter()
+
     # - Instantiate a mixed-integer solver
     solver = pywraplp.Solver(
         "SimulIntegerizeCbc", pywraplp.Solver.CBC_MIXED_INTEGER_PROGRAMMING
     )
     solver.EnableOutput()
-    solver.set_time_limit(timeout_in_seconds * 1000)
+    solver.set_time_limit(int(timeout_in_seconds * 1000))
 
     # x_max is 1.0 unless resid_weights is zero, in which case constrain x to 0.0
-    x_max = (~(sub_float_weights == sub_int_weights)).astype(float)
+    if x_max is None:
+        x_max = (~(sub_float_weights == sub_int_weights)).astype(float)
 
     # - Create resid weight variables
     x = {}
@@ -269,6 +300,9 @@ def np_simul_integerizer_ortools(
         for hh in range(sample_count):
             x[z, hh] = solver.NumVar(0.0, x_max[z, hh], "x[%s,%s]" % (z, hh))
 
+    if x_hint is not None:
+        solver.SetHint(list(x.values()), np.minimum(x_hint, x_max).ravel().tolist())
+
     # - Create positive continuous constraint relaxation variables
     relax_le = {}
     relax_ge = {}
@@ -396,7 +430,9 @@ def np_simul_integerizer_ortools(
                 )
                 parent_constraint_ge[c].SetCoefficient(parent_relax_ge[c], 1.0)
 
+    t0 = performance.add_elapsed("build_seconds", t0)
     result_status = solver.Solve()
+    performance.add_elapsed("solve_seconds", t0)
 
     status_text = STATUS_TEXT[result_status]
 
@@ -0,0 +1,248 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+"""
+Integerizer presolve that merges households with identical incidence.
+
+Within one zone many households have the same incidence for the zone's controls, yet the
+integerizer LPs have one residual weight variable per household (per sub zone). With the
+INTEGERIZER_PRESOLVE setting, households with identical incidence rows are merged into one
+variable per group, bounded by the number of group members with a residual weight, and with
+the mean log residual weight of those members as objective coefficient. The smaller LP is
+solved, and each group's solution is handed back to its members in descending residual weight
+order (as the full LP would, since members only differ in objective coefficient).
+
+Because the merged objective coefficient is the mean of its members', the solution is not
+always the same as that of the full LP.
+"""
+
+import logging
+
+import numpy as np
+
+from populationsim.integerizing.constants import STATUS_SUCCESS
+
+logger = logging.getLogger(__name__)
+
+# same floor as the integerizers use for log(resid_weights)
+LOG_OVERFLOW = -725
+
+
+class HouseholdGroups:
+    """
+    Households of an integerizer problem grouped by identical incidence rows
+
+    Groups are numbered in order of their first household.
+
+    Parameters
+    ----------
+    incidence : numpy.ndarray(sample_count, control_count)
+    """
+
+    def __init__(self, incidence):
+
+        _, first_rows, group_ids = np.unique(
+            incidence, axis=0, return_index=True, return_inverse=True
+        )
+        group_ids = group_ids.reshape(-1)
+
+        # renumber groups in order of first appearance
+        order = np.argsort(first_rows, kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+
+        self.first_rows = first_rows[order]
+        self.group_ids = rank[group_ids]
+
+    @property
+    def sample_count(self):
+        return len(self.group_ids)
+
+    @property
+    def group_count(self):
+        return len(self.first_rows)
+
+    def sum(self, values):
+        """
+        Sum per household values (along the last axis) over the members of each group
+        """
+
+        values = np.asanyarray(values, dtype=np.float64)
+        rows = values.reshape(-1, self.sample_count)
+
+        # offset group ids by row, so that a single bincount sums every row
+        ids = (
+            np.arange(rows.shape[0])[:, np.newaxis] * self.group_count + self.group_ids
+        )
+        sums = np.bincount(
+            ids.ravel(),
+            weights=rows.ravel(),
+            minlength=rows.shape[0] * self.group_count,
+        )
+
+        return sums.reshape(values.shape[:-1] + (self.group_count,))
+
+    def resid_weights(self, resid_weights, x_max):
+        """
+        Merged residual weights: geometric mean of the residual weights of the group members
+        that can be rounded up (1.0 for groups with none)
+
+        Parameters
+        ----------
+        resid_weights : numpy.ndarray(..., sample_count) float
+        x_max : numpy.ndarray(..., sample_count) float
+            upper bounds (0.0 or 1.0) of the household variables
+        """
+
+        log_resid_weights = np.log(np.maximum(resid_weights, np.exp(LOG_OVERFLOW)))
+        counts = self.sum(x_max)
+        log_sums = self.sum(log_resid_weights * x_max)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean_log = np.where(counts > 0, log_sums / counts, 0.0)
+
+        return np.exp(mean_log)
+
+    def disaggregate(self, merged_x, x_max, resid_weights):
+        """
+        Hand each group's solution back to its members, in descending residual weight order
+
+        Parameters
+        ----------
+        merged_x : numpy.ndarray(..., group_count) float
+            solution of the merged LP
+        x_max : numpy.ndarray(..., sample_count) float
+            upper bounds (0.0 or 1.0) of the household variables
+        resid_weights : numpy.ndarray(..., sample_count) float
+
+        Returns
+        -------
+        x : numpy.ndarray(..., sample_count) float
+        """
+
+        x_max = np.asanyarray(x_max, dtype=np.float64)
+        group_ids = np.broadcast_to(self.group_ids, x_max.shape)
+
+        # households by group, then by descending residual weight
+        order = np.lexsort((-resid_weights, group_ids), axis=-1)
+        sorted_group_ids = np.take_along_axis(group_ids, order, axis=-1)
+        sorted_x_max = np.take_along_axis(x_max, order, axis=-1)
+
+        # capacity of the members ahead of each household in its group
+        ahead = np.cumsum(sorted_x_max, axis=-1) - sorted_x_max
+        bounds = self.sum(x_max)
+        group_start = np.cumsum(bounds, axis=-1) - bounds
+        ahead -= np.take_along_axis(group_start, sorted_group_ids, axis=-1)
+
+        sorted_x = np.clip(
+            np.take_along_axis(merged_x, sorted_group_ids, axis=-1) - ahead,
+            0.0,
+            sorted_x_max,
+        )
+
+        x = np.empty_like(sorted_x)
+        np.put_along_axis(x, order, sorted_x, axis=-1)
+
+        return x
+
+
+def integerize_merged(integerizer_func, incidence, resid_weights, **lp):
+    """
+    Solve a single integerizer LP with households with identical incidence merged
+
+    Parameters
+    ----------
+    integerizer_func : function
+        single integerizer LP function (e.g. lp_ortools.np_integerizer_ortools)
+    incidence : numpy.ndarray(control_count, sample_count) float
+    resid_weights : numpy.ndarray(sample_count,) float
+    lp : dict
+        other integerizer_func arguments (except log_resid_weights and x_max)
+
+    Returns
+    -------
+    resid_weights_out : numpy.ndarray(sample_count,)
+    status_text : str
+    """
+
+    groups = HouseholdGroups(incidence.T)
+    x_max = (resid_weights != 0.0).astype(float)
+    merged_resid_weights = groups.resid_weights(resid_weights, x_max)
+    logger.debug(
+        "presolve merged %s households into %s", groups.sample_count, groups.group_count
+    )
+
+    if lp.get("x_hint") is not None:
+        lp["x_hint"] = groups.sum(lp["x_hint"])
+
+    merged_x, status = integerizer_func(
+        incidence=incidence[:, groups.first_rows],
+        resid_weights=merged_resid_weights,
+        log_resid_weights=np.log(merged_resid_weights),
+        x_max=groups.sum(x_max),
+        **lp,
+    )
+
+    if status not in STATUS_SUCCESS:
+        return resid_weights, status
+
+    return groups.disaggregate(merged_x, x_max, resid_weights), status
+
+
+def simul_integerize_merged(integerizer_func, lp, timeout_in_seconds, x_hint=None):
+    """
+    Solve a simul integerizer LP with households with identical incidence merged
+
+    Parameters
+    ----------
+    integerizer_func : function
+        simul integerizer LP function (e.g. lp_ortools.np_simul_integerizer_ortools)
+    lp : dict
+        integerizer_func arguments by name, as built by SimulIntegerizer.lp_problem
+    timeout_in_seconds : float
+    x_hint : numpy.ndarray(sub_zone_count, sample_count) float, optional
+        starting point for the solver
+
+    Returns
+    -------
+    resid_weights_out : numpy.ndarray(sub_zone_count, sample_count)
+    status_text : str
+    """
+
+    sub_incidence = lp["sub_incidence"]
+    parent_incidence = lp["parent_incidence"]
+    sub_resid_weights = lp["sub_resid_weights"]
+
+    groups = HouseholdGroups(np.hstack([sub_incidence, parent_incidence]))
+    x_max = (lp["sub_float_weights"] != lp["sub_int_weights"]).astype(float)
+    logger.debug(
+        "presolve merged %s households into %s", groups.sample_count, groups.group_count
+    )
+
+    merged_x, status = integerizer_func(
+        groups.sum(lp["sub_int_weights"]),
+        lp["parent_countrol_importance"],
+        lp["parent_relax_ge_upper_bound"],
+        lp["sub_control_importance"],
+        groups.sum(lp["sub_float_weights"]),
+        groups.resid_weights(sub_resid_weights, x_max),
+        lp["lp_right_hand_side"],
+        lp["parent_hh_constraint_ge_bound"],
+        sub_incidence[groups.first_rows],
+        parent_incidence[groups.first_rows],
+        lp["total_hh_right_hand_side"],
+        lp["relax_ge_upper_bound"],
+        lp["parent_lp_right_hand_side"],
+        lp["hh_constraint_ge_bound"],
+        groups.resid_weights(lp["parent_resid_weights"], x_max.max(axis=0)),
+        lp["total_hh_sub_control_index"],
+        lp["total_hh_parent_control_index"],
+        timeout_in_seconds=timeout_in_seconds,
+        x_max=groups.sum(x_max),
+        x_hint=None if x_hint is None else groups.sum(x_hint),
+    )
+
+    if status not in STATUS_SUCCESS:
+        return sub_resid_weights, status
+
+    return groups.disaggregate(merged_x, x_max, sub_resid_weights), status
@@ -2,18 +2,566 @@
 # See full license in LICENSE.txt.
 
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import numpy as np
 import pandas as pd
 
-from populationsim.core import config
+from populationsim.core import config, performance, time_budget
+from populationsim.integerizing.constants import (
+    STATUS_FEASIBLE,
+    STATUS_OPTIMAL,
+    STATUS_SUCCESS,
+    STATUS_TIME_BUDGET,
+)
 from populationsim.integerizing.smart_round import smart_round
-from populationsim.integerizing import lp_ortools, lp_cvx
+from populationsim.integerizing import feasibility, lp_ortools, lp_cvx, presolve
 
 logger = logging.getLogger(__name__)
 
+# LP arrays with a row per sub zone
+SUB_ZONE_ARRAYS = [
+    "sub_int_weights",
+    "sub_float_weights",
+    "sub_resid_weights",
+    "lp_right_hand_side",
+    "total_hh_right_hand_side",
+    "relax_ge_upper_bound",
+    "hh_constraint_ge_bound",
+    "sub_control_totals",
+]
+
+
+def parent_lp(
+    parent_incidence,
+    sub_float_weights,
+    sub_num_households,
+    parent_lp_right_hand_side=None,
+):
+    """
+    Build the parent control arrays of the simul integerizer LP for a set of sub zones
+
+    Parameters
+    ----------
+    parent_incidence : numpy.ndarray(sample_count, parent_control_count) float
+    sub_float_weights : numpy.ndarray(sub_zone_count, sample_count) float
+    sub_num_households : numpy.ndarray(sub_zone_count, 1) float
+        relaxed total households control of each sub zone
+    parent_lp_right_hand_side : numpy.ndarray(parent_control_count,) float, optional
+        parent control shortfalls to integerize the sub zones to, if not those of their
+        balanced sub_float_weights
+
+    Returns
+    -------
+    parent : dict of str to numpy.ndarray
+        parent_resid_weights, parent_lp_right_hand_side, parent_relax_ge_upper_bound,
+        parent_hh_constraint_ge_bound and parent_max_possible_control_values
+    """
+
+    sub_int_weights = sub_float_weights.astype(int)
+    sub_resid_weights = sub_float_weights % 1.0
+
+    # note:
+    # sum(sub_int_weights) might be different from parent_float_weights.astype(int)
+    # parent_resid_weights might be > 1.0, OK as we are using in objective, not for rounding
+    parent_float_weights = np.sum(sub_float_weights, axis=0)
+    parent_int_weights = np.sum(sub_int_weights, axis=0)
+    parent_resid_weights = np.sum(sub_resid_weights, axis=0)
+
+    if parent_lp_right_hand_side is None:
+        # - parent control totals based on sub_zone balanced weights
+        relaxed_parent_control_totals = np.dot(parent_float_weights, parent_incidence)
+
+        parent_lp_right_hand_side = np.round(relaxed_parent_control_totals) - np.dot(
+            parent_int_weights, parent_incidence
+        )
+    parent_lp_right_hand_side = np.maximum(parent_lp_right_hand_side, 0.0)
+
+    # - create the inequality constraint upper bounds
+    parent_num_households = np.sum(sub_num_households)
+
+    parent_max_possible_control_values = (
+        np.amax(parent_incidence, axis=0) * parent_num_households
+    )
+    parent_relax_ge_upper_bound = np.maximum(
+        parent_max_possible_control_values - parent_lp_right_hand_side, 0
+    )
+    parent_hh_constraint_ge_bound = np.maximum(
+        parent_max_possible_control_values, parent_lp_right_hand_side
+    )
+
+    return {
+        "parent_resid_weights": parent_resid_weights,
+        "parent_lp_right_hand_side": parent_lp_right_hand_side,
+        "parent_relax_ge_upper_bound": parent_relax_ge_upper_bound,
+        "parent_hh_constraint_ge_bound": parent_hh_constraint_ge_bound,
+        "parent_max_possible_control_values": parent_max_possible_control_values,
+    }
+
+
+def round_sub_zones(lp, resid_weights):
+    """
+    Smart round the sub zone weights of the LP to their total households controls
+
+    Parameters
+    ----------
+    lp : dict of str to numpy.ndarray
+        LP arrays, as returned by SimulIntegerizer.lp_problem
+    resid_weights : numpy.ndarray(sub_zone_count, sample_count) float
+        residual weights as solved (highest rounded up first)
+
+    Returns
+    -------
+    integerized_weights : numpy.ndarray(sub_zone_count, sample_count) int
+    """
+
+    total_household_controls = lp["sub_control_totals"][
+        :, lp["total_hh_sub_control_index"]
+    ].flatten()
+    integerized_weights = np.empty_like(lp["sub_int_weights"])
+
+    for i in range(len(integerized_weights)):
+        integerized_weights[i] = smart_round(
+            lp["sub_int_weights"][i], resid_weights[i], total_household_controls[i]
+        )
+
+    return integerized_weights
+
+
+def simul_lp(
+    sub_incidence,
+    parent_incidence,
+    sub_float_weights,
+    sub_control_totals,
+    sub_control_importance,
+    parent_control_importance,
+    total_hh_sub_control_index,
+):
+    """
+    Build the arrays (right hand sides, bounds and incidence) of the integerizing LP
+
+    Parameters
+    ----------
+    sub_incidence : numpy.ndarray(sample_count, sub_control_count) float
+    parent_incidence : numpy.ndarray(sample_count, parent_control_count) float
+    sub_float_weights : numpy.ndarray(sub_zone_count, sample_count) float
+    sub_control_totals : numpy.ndarray(sub_zone_count, sub_control_count) int
+    sub_control_importance : numpy.ndarray(sub_control_count,) float
+    parent_control_importance : numpy.ndarray(parent_control_count,) float
+    total_hh_sub_control_index : int
+
+    Returns
+    -------
+    lp : dict of str to numpy.ndarray
+        LP arrays by integerizer_func argument name,
+        plus sub_control_totals and parent_max_possible_control_values
+    """
+
+    # - subzone
+
+    # FIXME - shouldn't need this?
+    total_hh_parent_control_index = -1
+
+    sub_int_weights = sub_float_weights.astype(int)
+    sub_resid_weights = sub_float_weights % 1.0
+
+    relaxed_sub_control_totals = np.dot(sub_float_weights, sub_incidence)
+
+    # lp_right_hand_side
+    lp_right_hand_side = np.round(relaxed_sub_control_totals) - np.dot(
+        sub_int_weights, sub_incidence
+    )
+    lp_right_hand_side = np.maximum(lp_right_hand_side, 0.0)
+
+    # inequality constraint upper bounds
+    sub_num_households = relaxed_sub_control_totals[:, (total_hh_sub_control_index,)]
+    sub_max_control_values = np.amax(sub_incidence, axis=0) * sub_num_households
+    relax_ge_upper_bound = np.maximum(sub_max_control_values - lp_right_hand_side, 0)
+    hh_constraint_ge_bound = np.maximum(sub_max_control_values, lp_right_hand_side)
+
+    # equality constraint for the total households control
+    total_hh_right_hand_side = lp_right_hand_side[:, total_hh_sub_control_index]
+
+    # - parent
+    parent = parent_lp(parent_incidence, sub_float_weights, sub_num_households)
+
+    return {
+        "sub_int_weights": sub_int_weights,
+        "parent_countrol_importance": parent_control_importance,
+        "parent_relax_ge_upper_bound": parent["parent_relax_ge_upper_bound"],
+        "sub_control_importance": sub_control_importance,
+        "sub_float_weights": sub_float_weights,
+        "sub_resid_weights": sub_resid_weights,
+        "lp_right_hand_side": lp_right_hand_side,
+        "parent_hh_constraint_ge_bound": parent["parent_hh_constraint_ge_bound"],
+        "sub_incidence": sub_incidence,
+        "parent_incidence": parent_incidence,
+        "total_hh_right_hand_side": total_hh_right_hand_side,
+        "relax_ge_upper_bound": relax_ge_upper_bound,
+        "parent_lp_right_hand_side": parent["parent_lp_right_hand_side"],
+        "hh_constraint_ge_bound": hh_constraint_ge_bound,
+        "parent_resid_weights": parent["parent_resid_weights"],
+        "total_hh_sub_control_index": total_hh_sub_control_index,
+        "total_hh_parent_control_index": total_hh_parent_control_index,
+        "sub_control_totals": sub_control_totals,
+        "parent_max_possible_control_values": parent[
+            "parent_max_possible_control_values"
+        ],
+    }
+
+
+def block_lp(lp, zones, parent_lp_right_hand_side=None):
+    """
+    Build the LP arrays for a block of the sub zones of lp
+
+    Parameters
+    ----------
+    lp : dict of str to numpy.ndarray
+        LP arrays of all sub zones, as returned by simul_lp
+    zones : numpy.ndarray of int
+        (positional) indexes of the block's sub zones
+    parent_lp_right_hand_side : numpy.ndarray(parent_control_count,) float, optional
+        parent control shortfalls for the block, by default those of the block's own
+        balanced weights (the parent controls apportioned by balanced weights)
+
+    Returns
+    -------
+    lp : dict of str to numpy.ndarray
+    """
+
+    block = dict(lp)
+    for name in SUB_ZONE_ARRAYS:
+        block[name] = lp[name][zones]
+
+    sub_num_households = np.dot(
+        block["sub_float_weights"],
+        lp["sub_incidence"][:, (lp["total_hh_sub_control_index"],)],
+    )
+    block.update(
+        parent_lp(
+            lp["parent_incidence"],
+            block["sub_float_weights"],
+            sub_num_households,
+            parent_lp_right_hand_side,
+        )
+    )
+
+    return block
+
+
+def solve_lp(
+    lp, integerizer_func, timeout_in_seconds, presolve_lp=False, trace_label=""
+):
+    """
+    Solve the integerizer LP, within what is left of INTEGERIZER_TIME_BUDGET
+
+    Parameters
+    ----------
+    lp : dict of str to numpy.ndarray
+        LP arrays, as returned by simul_lp or block_lp
+    integerizer_func : function
+        simul integerizer LP function (e.g. lp_ortools.np_simul_integerizer_ortools)
+    timeout_in_seconds : float
+    presolve_lp : bool
+        merge households with identical incidence into a single LP variable per sub zone
+    trace_label : str
+
+    Returns
+    -------
+    resid_weights_out : numpy.ndarray(sub_zone_count, sample_count) float
+    status_text : str
+        STATUS_TIME_BUDGET (and sub_resid_weights) if INTEGERIZER_TIME_BUDGET has not
+        enough time left to solve
+    """
+
+    sub_zone_count, sample_count = lp["sub_resid_weights"].shape
+    size = (
+        sub_zone_count
+        * sample_count
+        * (lp["sub_incidence"].shape[1] + lp["parent_incidence"].shape[1])
+    )
+    timeout_in_seconds = time_budget.timeout(timeout_in_seconds, size, trace_label)
+    if timeout_in_seconds is None:
+        return lp["sub_resid_weights"], STATUS_TIME_BUDGET
+
+    t0 = time.perf_counter()
+
+    # smart rounded sub_resid_weights as starting point for the solver
+    x_hint = np.array(
+        [
+            smart_round(np.zeros_like(zone_int_weights), zone_resid_weights, total)
+            for zone_int_weights, zone_resid_weights, total in zip(
+                lp["sub_int_weights"],
+                lp["sub_resid_weights"],
+                lp["total_hh_right_hand_side"],
+            )
+        ],
+        dtype=np.float64,
+    )
+
+    if presolve_lp:
+        resid_weights_out, status_text = presolve.simul_integerize_merged(
+            integerizer_func, lp, timeout_in_seconds, x_hint=x_hint
+        )
+    else:
+        resid_weights_out, status_text = integerizer_func(
+            lp["sub_int_weights"],
+            lp["parent_countrol_importance"],
+            lp["parent_relax_ge_upper_bound"],
+            lp["sub_control_importance"],
+            lp["sub_float_weights"],
+            lp["sub_resid_weights"],
+            lp["lp_right_hand_side"],
+            lp["parent_hh_constraint_ge_bound"],
+            lp["sub_incidence"],
+            lp["parent_incidence"],
+            lp["total_hh_right_hand_side"],
+            lp["relax_ge_upper_bound"],
+            lp["parent_lp_right_hand_side"],
+            lp["hh_constraint_ge_bound"],
+            lp["parent_resid_weights"],
+            lp["total_hh_sub_control_index"],
+            lp["total_hh_parent_control_index"],
+            timeout_in_seconds=timeout_in_seconds,
+            x_hint=x_hint,
+        )
+
+    time_budget.add_solve(size, t0)
+
+    return resid_weights_out, status_text
+
+
+def solve_blocks(lp, solve, block_size, block_threads=1, trace_label=""):
+    """
+    Solve the integerizer LP in blocks of block_size (SIMUL_INTEGERIZER_BLOCK_SIZE) sub zones
+
+    The LP has a variable per sub zone and household, and can get too large to solve
+    within INTEGIZER_TIMEOUT for parents with many sub zones. The sub zones are
+    partitioned into blocks, and the LPs of all blocks but the last are solved with the
+    parent controls apportioned to them by their balanced weights (in parallel, with
+    block_threads threads). The last block is then solved for what remains of the parent
+    control shortfalls, reconciling the parent totals (or, if that fails, for its own
+    apportioned shortfalls).
+
+    Parameters
+    ----------
+    lp : dict of str to numpy.ndarray
+        LP arrays of all sub zones, as returned by simul_lp
+    solve : function
+        solves a block's LP arrays, returning resid_weights_out and status_text (e.g.
+        solve_lp with its other arguments bound)
+    block_size : int
+    block_threads : int
+    trace_label : str
+
+    Returns
+    -------
+    resid_weights_out : numpy.ndarray(sub_zone_count, sample_count) float
+        residual weights as solved, or sub_resid_weights if any block failed
+    status_text : str
+        STATUS_OPTIMAL if all blocks were, STATUS_FEASIBLE if all succeeded, or the
+        status of the first block that failed
+    """
+
+    sub_zone_count = len(lp["sub_resid_weights"])
+    blocks = [
+        np.arange(start, min(start + block_size, sub_zone_count))
+        for start in range(0, sub_zone_count, block_size)
+    ]
+    logger.info(
+        "SimulIntegerizer %s solving %s sub zones in %s blocks"
+        % (trace_label, sub_zone_count, len(blocks))
+    )
+    performance.update(blocks=len(blocks))
+
+    def solve_block(zones):
+        return solve(block_lp(lp, zones))
+
+    if block_threads > 1:
+        with ThreadPoolExecutor(max_workers=block_threads) as executor:
+            results = list(executor.map(solve_block, blocks[:-1]))
+    else:
+        results = [solve_block(zones) for zones in blocks[:-1]]
+
+    statuses = [status for _, status in results]
+    failed = [status for status in statuses if status not in STATUS_SUCCESS]
+    if failed:
+        return lp["sub_resid_weights"], failed[0]
+
+    resid_weights_out = np.array(lp["sub_resid_weights"], dtype=np.float64)
+    for zones, (block_resid_weights, _) in zip(blocks, results):
+        resid_weights_out[zones] = block_resid_weights
+
+    # - the last block integerizes to what remains of the parent control shortfalls
+    # once the other blocks' (possibly fractional) solutions are smart rounded
+    repair_zones = blocks[-1]
+    solved = np.concatenate(blocks[:-1])
+    rounded_up = round_sub_zones(lp, resid_weights_out) - lp["sub_int_weights"]
+    parent_shortfall = lp["parent_lp_right_hand_side"] - np.dot(
+        rounded_up[solved].sum(axis=0), lp["parent_incidence"]
+    )
+    block_resid_weights, status = solve(block_lp(lp, repair_zones, parent_shortfall))
+
+    if status not in STATUS_SUCCESS + [STATUS_TIME_BUDGET]:
+        logger.warning(
+            "SimulIntegerizer %s parent repair block failed with status %s. "
+            "Integerizing it to its own parent control shortfalls."
+            % (trace_label, status)
+        )
+        block_resid_weights, status = solve_block(repair_zones)
+
+    resid_weights_out[repair_zones] = block_resid_weights
+
+    if status not in STATUS_SUCCESS:
+        return lp["sub_resid_weights"], status
+
+    if all(block_status == STATUS_OPTIMAL for block_status in statuses + [status]):
+        return resid_weights_out, STATUS_OPTIMAL
+
+    return resid_weights_out, STATUS_FEASIBLE
+
+
+def np_simul_integerize(
+    sub_incidence,
+    parent_incidence,
+    sub_float_weights,
+    sub_control_totals,
+    sub_control_importance,
+    parent_control_importance,
+    total_hh_sub_control_index,
+    use_cvxpy=False,
+    timeout_in_seconds=60,
+    presolve_lp=False,
+    block_size=0,
+    block_threads=1,
+    trace_label="",
+):
+    """
+    Simultaneously integerize the balanced sub zone weights of a parent zone, with numpy
+    arrays in and out
+
+    This is the array level SimulIntegerizer: the residual weights of all sub zones are
+    rounded up by solving a single LP for the sub zone and parent controls (in blocks of
+    block_size sub zones, if there are more), then smart rounded to each sub zone's total
+    households control. Households with zero weight in all sub zones are not integerized
+    (and get zero integerized weights).
+
+    Parameters
+    ----------
+    sub_incidence : numpy.ndarray(sub_control_count, sample_count)
+        incidence of each sub zone control (row) for each household (column)
+    parent_incidence : numpy.ndarray(parent_control_count, sample_count)
+        incidence of each parent control (not a sub zone control) for each household
+    sub_float_weights : numpy.ndarray(sub_zone_count, sample_count)
+        balanced sub zone weights to integerize
+    sub_control_totals : numpy.ndarray(sub_zone_count, sub_control_count)
+    sub_control_importance : numpy.ndarray(sub_control_count,)
+    parent_control_importance : numpy.ndarray(parent_control_count,)
+    total_hh_sub_control_index : int
+        index of the total households control in the sub zone controls
+    use_cvxpy : bool
+        solve with cvxpy rather than ortools
+    timeout_in_seconds : float
+        solver time limit (less if INTEGERIZER_TIME_BUDGET has less time left)
+    presolve_lp : bool
+        merge households with identical incidence into a single LP variable per sub zone
+    block_size : int
+        solve the LP in blocks of block_size sub zones, if there are more (0 for no blocks)
+    block_threads : int
+        threads to solve blocks with
+    trace_label : str
+
+    Returns
+    -------
+    integerized_weights : numpy.ndarray(sub_zone_count, sample_count) int
+        (zero for zero weight rows)
+    status : str
+        as defined in STATUS_TEXT and STATUS_SUCCESS
+    """
+
+    if use_cvxpy:
+        integerizer_func = lp_cvx.np_simul_integerizer_cvx
+    else:
+        integerizer_func = lp_ortools.np_simul_integerizer_ortools
+
+    sub_float_weights = np.asarray(sub_float_weights, dtype=np.float64)
+
+    # remove zero weight rows (they are added back to the result after integerizing)
+    positive_weight_rows = sub_float_weights.sum(axis=0) > 0
+    all_positive = positive_weight_rows.all()
+    if not all_positive:
+        sub_incidence = np.asarray(sub_incidence)[:, positive_weight_rows]
+        parent_incidence = np.asarray(parent_incidence)[:, positive_weight_rows]
+        sub_float_weights = sub_float_weights[:, positive_weight_rows]
+
+    lp = simul_lp(
+        sub_incidence=np.asarray(sub_incidence).T.astype(np.float64),
+        parent_incidence=np.asarray(parent_incidence).T.astype(np.float64),
+        sub_float_weights=sub_float_weights,
+        sub_control_totals=np.asanyarray(sub_control_totals).astype(np.int64),
+        sub_control_importance=np.asanyarray(sub_control_importance).astype(np.float64),
+        parent_control_importance=np.asanyarray(parent_control_importance).astype(
+            np.float64
+        ),
+        total_hh_sub_control_index=total_hh_sub_control_index,
+    )
+
+    parent_hh_constraint_ge_bound = lp["parent_hh_constraint_ge_bound"]
+    parent_max_possible_control_values = lp["parent_max_possible_control_values"]
+
+    # how could this not be the case?
+    if not (parent_hh_constraint_ge_bound == parent_max_possible_control_values).all():
+        print("\nSimulIntegerizer integerizing", trace_label)
+        logger.warning(
+            "parent_hh_constraint_ge_bound != parent_max_possible_control_values"
+        )
+        logger.warning(
+            "parent_hh_constraint_ge_bound:      %s" % parent_hh_constraint_ge_bound
+        )
+        logger.warning(
+            "parent_max_possible_control_values: %s"
+            % parent_max_possible_control_values
+        )
+        print("\n")
+        # assert (parent_hh_constraint_ge_bound == parent_max_possible_control_values).all()
+
+    solve = partial(
+        solve_lp,
+        integerizer_func=integerizer_func,
+        timeout_in_seconds=timeout_in_seconds,
+        presolve_lp=presolve_lp,
+        trace_label=trace_label,
+    )
+
+    sub_zone_count = len(sub_float_weights)
+    if 0 < block_size < sub_zone_count:
+        resid_weights_out, status_text = solve_blocks(
+            lp, solve, block_size, block_threads, trace_label
+        )
+    else:
+        resid_weights_out, status_text = solve(lp)
+
+    # smart round resid_weights_out for each sub_zone
+    integerized_weights = round_sub_zones(lp, resid_weights_out)
+
+    # integerized weights with zero weight rows restored
+    if not all_positive:
+        sub_zone_weights = np.zeros(
+            (sub_zone_count, len(positive_weight_rows)),
+            dtype=integerized_weights.dtype,
+        )
+        sub_zone_weights[:, positive_weight_rows] = integerized_weights
+        integerized_weights = sub_zone_weights
+
+    return integerized_weights, status_text
+
 
 class SimulIntegerizer:
+    """
+    pandas adapter of np_simul_integerize
+    """
 
     def __init__(
         self,
@@ -56,155 +604,102 @@ class SimulIntegerizer:
 
         assert total_hh_control_col not in self.parent_countrol_cols
 
-        self.trace_label = trace_label
-
-        # Choose the integerizer function based on configuration
-        if config.setting("USE_CVXPY", False):
-            self.integerizer_func = lp_cvx.np_simul_integerizer_cvx
-        else:
-            self.integerizer_func = lp_ortools.np_simul_integerizer_ortools
-
-        self.timeout_in_seconds = config.setting("INTEGIZER_TIMEOUT", 60)
-
-    def integerize(self):
-
-        # - subzone
-
-        total_hh_sub_control_index = self.sub_controls_df.columns.get_loc(
+        self.total_hh_sub_control_index = self.sub_controls_df.columns.get_loc(
             self.total_hh_control_col
         )
 
-        # FIXME - shouldn't need this?
-        total_hh_parent_control_index = -1
-
-        sub_incidence = self.incidence_df[self.sub_controls_df.columns]
-        sub_incidence = sub_incidence.values.astype(np.float64)
-
-        sub_float_weights = self.sub_weights.values.transpose().astype(np.float64)
-        sub_int_weights = sub_float_weights.astype(int)
-        sub_resid_weights = sub_float_weights % 1.0
-
-        # print "sub_float_weights\n", sub_float_weights
-        # print "sub_int_weights\n", sub_int_weights
-        # print "sub_resid_weights\n", sub_resid_weights
-
-        sub_control_totals = np.asanyarray(self.sub_controls_df).astype(np.int64)
-        sub_control_importance = np.asanyarray(self.sub_control_importance).astype(
-            np.float64
-        )
+        self.trace_label = trace_label
 
-        relaxed_sub_control_totals = np.dot(sub_float_weights, sub_incidence)
+        self.use_cvxpy = config.setting("USE_CVXPY", False)
 
-        # lp_right_hand_side
-        lp_right_hand_side = np.round(relaxed_sub_control_totals) - np.dot(
-            sub_int_weights, sub_incidence
-        )
-        lp_right_hand_side = np.maximum(lp_right_hand_side, 0.0)
+        self.timeout_in_seconds = config.setting("INTEGIZER_TIMEOUT", 60)
 
-        # inequality constraint upper bounds
-        sub_num_households = relaxed_sub_control_totals[
-            :, (total_hh_sub_control_index,)
-        ]
-        sub_max_control_values = np.amax(sub_incidence, axis=0) * sub_num_households
-        relax_ge_upper_bound = np.maximum(
-            sub_max_control_values - lp_right_hand_side, 0
+        # merge households with identical incidence into a single LP variable per sub zone
+        self.presolve = config.setting("INTEGERIZER_PRESOLVE", False)
+
+        # solve the LP in blocks of sub zones if there are more than block_size of them
+        self.block_size = config.setting("SIMUL_INTEGERIZER_BLOCK_SIZE", 0)
+        self.block_threads = config.setting("SIMUL_INTEGERIZER_BLOCK_THREADS", 1)
+
+    def sub_incidence(self):
+        # (sub_control_count, sample_count) view of incidence_df
+        return self.incidence_df[self.sub_controls_df.columns].values.T
+
+    def parent_incidence(self):
+        # (parent_control_count, sample_count) view of incidence_df
+        return self.incidence_df[self.parent_countrol_cols].values.T
+
+    def lp_problem(self):
+        """
+        Build the arrays (right hand sides, bounds and incidence) of the integerizing LP
+
+        Returns
+        -------
+        lp : dict of str to numpy.ndarray
+            as returned by simul_lp
+        """
+
+        return simul_lp(
+            sub_incidence=self.sub_incidence().T.astype(np.float64),
+            parent_incidence=self.parent_incidence().T.astype(np.float64),
+            sub_float_weights=self.sub_weights.values.transpose().astype(np.float64),
+            sub_control_totals=np.asanyarray(self.sub_controls_df).astype(np.int64),
+            sub_control_importance=np.asanyarray(self.sub_control_importance).astype(
+                np.float64
+            ),
+            parent_control_importance=np.asanyarray(
+                self.parent_countrol_importance
+            ).astype(np.float64),
+            total_hh_sub_control_index=self.total_hh_sub_control_index,
         )
-        hh_constraint_ge_bound = np.maximum(sub_max_control_values, lp_right_hand_side)
-
-        # equality constraint for the total households control
-        total_hh_right_hand_side = lp_right_hand_side[:, total_hh_sub_control_index]
-
-        # - parent
-        parent_incidence = self.incidence_df[self.parent_countrol_cols]
-        parent_incidence = parent_incidence.values.astype(np.float64)
-
-        # note:
-        # sum(sub_int_weights) might be different from parent_float_weights.astype(int)
-        # parent_resid_weights might be > 1.0, OK as we are using in objective, not for rounding
-        parent_float_weights = np.sum(sub_float_weights, axis=0)
-        parent_int_weights = np.sum(sub_int_weights, axis=0)
-        parent_resid_weights = np.sum(sub_resid_weights, axis=0)
-
-        # print "parent_float_weights\n", parent_float_weights
-        # print "parent_int_weights\n", parent_int_weights
-        # print "parent_resid_weights\n", parent_resid_weights
-
-        # - parent control totals based on sub_zone balanced weights
-        relaxed_parent_control_totals = np.dot(parent_float_weights, parent_incidence)
 
-        parent_countrol_importance = np.asanyarray(
-            self.parent_countrol_importance
-        ).astype(np.float64)
-
-        parent_lp_right_hand_side = np.round(relaxed_parent_control_totals) - np.dot(
-            parent_int_weights, parent_incidence
+    def infeasible_sub_zones(self):
+        """
+        Screen the LP for sub zones that cannot be integerized, without solving it
+
+        Returns
+        -------
+        reasons : pandas.Series
+            reason (see feasibility.infeasible_sub_zones) each sub zone cannot be integerized,
+            or '' if none was found, indexed by sub zone (sub_weights column)
+        """
+
+        lp = self.lp_problem()
+
+        reasons = feasibility.infeasible_sub_zones(
+            sub_int_weights=lp["sub_int_weights"],
+            sub_float_weights=lp["sub_float_weights"],
+            sub_incidence=lp["sub_incidence"],
+            lp_right_hand_side=lp["lp_right_hand_side"],
+            relax_ge_upper_bound=lp["relax_ge_upper_bound"],
+            hh_constraint_ge_bound=lp["hh_constraint_ge_bound"],
+            total_hh_sub_control_index=lp["total_hh_sub_control_index"],
+            parent_incidence=lp["parent_incidence"],
+            parent_lp_right_hand_side=lp["parent_lp_right_hand_side"],
+            parent_hh_constraint_ge_bound=lp["parent_hh_constraint_ge_bound"],
+            total_hh_parent_control_index=lp["total_hh_parent_control_index"],
         )
-        parent_lp_right_hand_side = np.maximum(parent_lp_right_hand_side, 0.0)
 
-        # - create the inequality constraint upper bounds
-        parent_num_households = np.sum(sub_num_households)
+        return pd.Series(reasons, index=self.sub_weights.columns)
 
-        parent_max_possible_control_values = (
-            np.amax(parent_incidence, axis=0) * parent_num_households
-        )
-        parent_relax_ge_upper_bound = np.maximum(
-            parent_max_possible_control_values - parent_lp_right_hand_side, 0
-        )
-        parent_hh_constraint_ge_bound = np.maximum(
-            parent_max_possible_control_values, parent_lp_right_hand_side
-        )
+    def integerize(self):
 
-        # how could this not be the case?
-        if not (
-            parent_hh_constraint_ge_bound == parent_max_possible_control_values
-        ).all():
-            print("\nSimulIntegerizer integerizing", self.trace_label)
-            logger.warning(
-                "parent_hh_constraint_ge_bound != parent_max_possible_control_values"
-            )
-            logger.warning(
-                "parent_hh_constraint_ge_bound:      %s" % parent_hh_constraint_ge_bound
-            )
-            logger.warning(
-                "parent_max_possible_control_values: %s"
-                % parent_max_possible_control_values
-            )
-            print("\n")
-            # assert (parent_hh_constraint_ge_bound == parent_max_possible_control_values).all()
-
-        resid_weights_out, status_text = self.integerizer_func(
-            sub_int_weights,
-            parent_countrol_importance,
-            parent_relax_ge_upper_bound,
-            sub_control_importance,
-            sub_float_weights,
-            sub_resid_weights,
-            lp_right_hand_side,
-            parent_hh_constraint_ge_bound,
-            sub_incidence,
-            parent_incidence,
-            total_hh_right_hand_side,
-            relax_ge_upper_bound,
-            parent_lp_right_hand_side,
-            hh_constraint_ge_bound,
-            parent_resid_weights,
-            total_hh_sub_control_index,
-            total_hh_parent_control_index,
+        integerized_weights, status_text = np_simul_integerize(
+            self.sub_incidence(),
+            self.parent_incidence(),
+            self.sub_weights.values.transpose(),
+            self.sub_controls_df.values,
+            self.sub_control_importance.values,
+            self.parent_countrol_importance.values,
+            self.total_hh_sub_control_index,
+            use_cvxpy=self.use_cvxpy,
             timeout_in_seconds=self.timeout_in_seconds,
+            presolve_lp=self.presolve,
+            block_size=self.block_size,
+            block_threads=self.block_threads,
+            trace_label=self.trace_label,
         )
 
-        # smart round resid_weights_out for each sub_zone
-        total_household_controls = sub_control_totals[
-            :, total_hh_sub_control_index
-        ].flatten()
-        integerized_weights = np.empty_like(sub_int_weights)
-
-        sub_zone_count = len(self.sub_weights.columns)
-        for i in range(sub_zone_count):
-            integerized_weights[i] = smart_round(
-                sub_int_weights[i], resid_weights_out[i], total_household_controls[i]
-            )
-
         # integerized_weights df: one column of integerized weights per sub_zone
         self.integerized_weights = pd.DataFrame(
             data=integerized_weights.T,
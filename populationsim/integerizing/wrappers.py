@@ -2,9 +2,11 @@ import logging
 import numpy as np
 import pandas as pd
 
-from populationsim.core import config
+from populationsim.core import config, performance
+from populationsim.integerizing.constants import STATUS_TIME_BUDGET
 from populationsim.integerizing.single_integerizer import Integerizer
 from populationsim.integerizing.simul_integerizer import SimulIntegerizer
+from populationsim.integerizing.smart_round import smart_round
 
 logger = logging.getLogger(__name__)
 
@@ -139,6 +141,94 @@ def reshape_result(
     return integer_weights_df
 
 
+def screen_simul_integerizing(
+    incidence_df,
+    sub_weights,
+    sub_controls_df,
+    control_spec,
+    total_hh_control_col,
+):
+    """
+    Find sub zones that simultaneous integerization cannot integerize, without solving
+
+    Parameters
+    ----------
+    incidence_df
+    sub_weights
+    sub_controls_df
+    control_spec
+    total_hh_control_col
+
+    Returns
+    -------
+    reasons : pandas.Series
+        reason (see feasibility.infeasible_sub_zones) each infeasible sub zone cannot be
+        integerized, indexed by sub zone id (empty if all sub zones passed the screen)
+    """
+
+    zero_weight_rows = sub_weights.sum(axis=1) == 0
+
+    integerizer = SimulIntegerizer(
+        incidence_df[~zero_weight_rows],
+        sub_weights[~zero_weight_rows],
+        sub_controls_df,
+        control_spec,
+        total_hh_control_col,
+    )
+
+    # sub_weights columns are in the same order as sub_controls_df rows
+    reasons = integerizer.infeasible_sub_zones()
+    reasons.index = sub_controls_df.index
+
+    return reasons[reasons != ""]
+
+
+def smart_round_sub_zones(
+    sub_weights,
+    sub_controls_df,
+    total_hh_control_col,
+    sub_control_zones,
+    sub_geography,
+):
+    """
+    Smart round balanced sub zone weights to the total households controls, without solving
+
+    (the same weights do_integerizing returns for sub zones whose integerizer fails)
+
+    Returns
+    -------
+    rounded_weights_df : pandas.DataFrame
+        canonical form weight table, with columns for 'balanced_weight', 'integer_weight'
+        plus columns for household id, and sub_geography zone ids
+    """
+
+    rounded_weights_list = []
+    for zone_id, zone_name in list(sub_control_zones.items()):
+
+        weights = sub_weights[zone_name]
+
+        # zero weight rows are omitted, as they are by the integerizers
+        nonzero = (weights != 0).values
+        float_weights = weights.values[nonzero].astype(np.float64)
+        integer_weights = np.zeros(len(weights.index), dtype=int)
+        integer_weights[nonzero] = smart_round(
+            float_weights.astype(int),
+            float_weights % 1.0,
+            sub_controls_df.loc[zone_id, total_hh_control_col],
+        )
+
+        zone_weights_df = pd.DataFrame(index=list(range(0, len(weights.index))))
+        zone_weights_df[weights.index.name] = weights.index
+        zone_weights_df[sub_geography] = zone_id
+        zone_weights_df["balanced_weight"] = weights.values
+        zone_weights_df["integer_weight"] = integer_weights
+
+        rounded_weights_list.append(zone_weights_df)
+
+    return pd.concat(rounded_weights_list)
+
+
+@performance.recorded("integerizing")
 def do_integerizing(
     trace_label,
     control_spec,
@@ -190,6 +280,10 @@ def do_integerizing(
 
     total_hh_control_value = control_totals[total_hh_control_col]
 
+    performance.update(
+        households=len(float_weights.index), controls=len(incidence_table.columns)
+    )
+
     status = None
     if config.setting("INTEGERIZE_WITH_BACKSTOPPED_CONTROLS") and len(
         control_totals
@@ -233,7 +327,11 @@ def do_integerizing(
         )
 
     # if we either tried backstopped controls or failed, or never tried at all
-    if status not in STATUS_SUCCESS:
+    # (but not if the time budget ran out, as the retry would not get any time either)
+    if status not in STATUS_SUCCESS + [STATUS_TIME_BUDGET]:
+
+        if status is not None:
+            performance.add_fallback("unbackstopped_controls")
 
         ##########################################
         # - unbackstopped partial control_totals
@@ -271,11 +369,17 @@ def do_integerizing(
             "Integerizer status for unbackstopped %s: %s" % (trace_label, status)
         )
 
-    if status not in STATUS_SUCCESS:
+    performance.update(status=status)
+
+    if status == STATUS_TIME_BUDGET:
+        # downgrade to smart rounding already reported by time_budget.timeout
+        pass
+    elif status not in STATUS_SUCCESS:
         logger.error(
             "Integerizer failed for %s status %s. "
             "Returning smart-rounded original weights" % (trace_label, status)
         )
+        performance.add_fallback("smart_round")
     elif status != "OPTIMAL":
         logger.warning(
             "Integerizer status non-optimal for %s status %s." % (trace_label, status)
@@ -286,6 +390,7 @@ def do_integerizing(
     return integerized_weights, status
 
 
+@performance.recorded("simul_integerizing")
 def do_simul_integerizing(
     trace_label,
     incidence_df,
@@ -300,10 +405,13 @@ def do_simul_integerizing(
 
     Wrapper around simultaneous integerizer to handle solver failure for infeasible subzones.
 
-    Simultaneous integerize balanced float sub_weights,
+    Unless SCREEN_INTEGERIZER_FEASIBILITY is False, the integerizer LP is first screened for
+    sub zones that cannot be integerized, which are smart rounded without solving.
+    Simultaneous integerize balanced float sub_weights of the remaining sub zones,
     If simultaneous integerization fails, integerize serially to identify infeasible subzones,
     remove and smart_round infeasible subzones, and try simultaneous integerization again.
     (That ought to succeed, but if not, then fall back to all sequential integerization)
+    If INTEGERIZER_TIME_BUDGET has not enough time left to solve, smart round all sub zones.
     Finally combine all results into a single result dataframe.
 
     Parameters
@@ -331,6 +439,97 @@ def do_simul_integerizing(
         plus columns for household id, and sub_geography zone ids
     """
 
+    performance.update(
+        households=len(incidence_df.index),
+        sub_zones=len(sub_control_zones),
+        controls=len(control_spec.index),
+    )
+
+    if not config.setting("SCREEN_INTEGERIZER_FEASIBILITY", True):
+        return simul_integerize_sub_zones(
+            trace_label,
+            incidence_df,
+            sub_weights,
+            sub_controls_df,
+            control_spec,
+            total_hh_control_col,
+            sub_geography,
+            sub_control_zones,
+        )
+
+    # smart round sub zones that can't be integerized, without trying
+    infeasible = screen_simul_integerizing(
+        incidence_df,
+        sub_weights,
+        sub_controls_df,
+        control_spec,
+        total_hh_control_col,
+    )
+
+    if len(infeasible) == 0:
+        return simul_integerize_sub_zones(
+            trace_label,
+            incidence_df,
+            sub_weights,
+            sub_controls_df,
+            control_spec,
+            total_hh_control_col,
+            sub_geography,
+            sub_control_zones,
+        )
+
+    performance.add_fallback("screened_smart_round")
+
+    for reason, zone_ids in infeasible.groupby(infeasible).groups.items():
+        logger.warning(
+            "do_simul_integerizing smart rounding %s %s sub zones for %s: %s"
+            % (len(zone_ids), reason, trace_label, list(zone_ids))
+        )
+
+    infeasible_zones = sub_control_zones.index.isin(infeasible.index)
+    rounded_weights_df = smart_round_sub_zones(
+        sub_weights,
+        sub_controls_df,
+        total_hh_control_col,
+        sub_control_zones[infeasible_zones],
+        sub_geography,
+    )
+
+    if infeasible_zones.all():
+        return rounded_weights_df
+
+    sub_control_zones = sub_control_zones[~infeasible_zones]
+    integerized_weights_df = simul_integerize_sub_zones(
+        trace_label,
+        incidence_df,
+        sub_weights[sub_control_zones],
+        sub_controls_df.loc[sub_control_zones.index],
+        control_spec,
+        total_hh_control_col,
+        sub_geography,
+        sub_control_zones,
+    )
+
+    return pd.concat([integerized_weights_df, rounded_weights_df])
+
+
+def simul_integerize_sub_zones(
+    trace_label,
+    incidence_df,
+    sub_weights,
+    sub_controls_df,
+    control_spec,
+    total_hh_control_col,
+    sub_geography,
+    sub_control_zones,
+):
+    """
+    Simultaneous integerize balanced float sub_weights, falling back to sequential
+    integerization (and smart rounding) of sub zones if that fails.
+
+    Parameters and results as for do_simul_integerizing
+    """
+
     # try simultaneous integerization of all subzones
     status, integerized_weights_df = try_simul_integerizing(
         trace_label,
@@ -343,12 +542,26 @@ def do_simul_integerizing(
         sub_control_zones,
     )
 
+    performance.update(status=status)
+
     if status in STATUS_SUCCESS:
         logger.info(
             "do_simul_integerizing succeeded for %s status %s. " % (trace_label, status)
         )
         return integerized_weights_df
 
+    if status == STATUS_TIME_BUDGET:
+        # downgrade already reported by time_budget.timeout, smart round all sub zones
+        return smart_round_sub_zones(
+            sub_weights,
+            sub_controls_df,
+            total_hh_control_col,
+            sub_control_zones,
+            sub_geography,
+        )
+
+    performance.add_fallback("sequential_integerizing")
+
     logger.warning(
         "do_simul_integerizing failed for %s status %s. " % (trace_label, status)
     )
@@ -419,6 +632,7 @@ def do_simul_integerizing(
         % (len(rounded_zone_ids), trace_label)
     )
 
+    performance.add_fallback("retry_simul_integerizing")
     status, integerized_weights_df = try_simul_integerizing(
         "retry_%s" % trace_label,
         incidence_df,
@@ -430,6 +644,8 @@ def do_simul_integerizing(
         sub_control_zones,
     )
 
+    performance.update(status=status)
+
     if status in STATUS_SUCCESS:
         # we successfully simul_integerized the sequentially feasible sub zones, so we can
         # return the simul_integerized results along with the rounded_weights for the infeasibles
@@ -525,14 +741,15 @@ def do_sequential_integerizing(
 
         sub_trace_label = "%s_%s_%s" % (trace_label, sub_geography, zone_id)
 
-        integer_weights, status = do_integerizing(
-            trace_label=sub_trace_label,
-            control_spec=control_spec,
-            control_totals=sub_controls_df.loc[zone_id],
-            incidence_table=incidence_df[control_spec.target],
-            float_weights=weights,
-            total_hh_control_col=total_hh_control_col,
-        )
+        with performance.zone(sub_geography, zone_id):
+            integer_weights, status = do_integerizing(
+                trace_label=sub_trace_label,
+                control_spec=control_spec,
+                control_totals=sub_controls_df.loc[zone_id],
+                incidence_table=incidence_df[control_spec.target],
+                float_weights=weights,
+                total_hh_control_col=total_hh_control_col,
+            )
 
         zone_weights_df = pd.DataFrame(index=list(range(0, len(integer_weights.index))))
         zone_weights_df[weights.index.name] = weights.index
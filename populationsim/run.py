@@ -7,11 +7,11 @@ import sys
 import warnings
 import contextlib
 import io
-import numpy as np
 import time
 from datetime import timedelta
 
-from populationsim.core import config, inject, mem, pipeline, tracing
+# populationsim.core (pandas, orca, ...) is imported where it is used, so the command
+# line (e.g. --help) and 'import populationsim' don't pay for it up front
 
 logger = logging.getLogger(__name__)
 
@@ -132,6 +132,8 @@ def add_run_args(parser, multiprocess=True):
 
 
 def validate_injectable(name):
+    from populationsim.core import inject
+
     try:
         dir_paths = inject.get_injectable(name)
     except RuntimeError:
@@ -153,6 +155,8 @@ def validate_injectable(name):
 
 
 def handle_standard_args(args, multiprocess=True):
+    from populationsim.core import config, inject
+
     def inject_arg(name, value, cache=False):
         assert name in INJECTABLES
         inject.add_injectable(name, value, cache=cache)
@@ -223,6 +227,7 @@ def handle_standard_args(args, multiprocess=True):
 
 
 def cleanup_output_files():
+    from populationsim.core import config, tracing
 
     tracing.delete_trace_files()
 
@@ -242,6 +247,39 @@ def cleanup_output_files():
     tracing.delete_output_files("omx")
 
 
+def warmup(args):
+    """
+    Compile the numba balancer kernels into the numba cache ahead of a run.
+
+    The cache directory is '--cache-dir' if given, else the project's numba_cache_dir
+    setting (numba's default cache locations if that is not set either).
+
+    returns:
+        int: sys.exit exit code
+    """
+
+    from populationsim.core import tracing
+    from populationsim.balancing import warmup
+
+    tracing.config_logger(basic=True)
+
+    cache_dir = args.cache_dir
+    if cache_dir is None:
+        handle_standard_args(args, multiprocess=False)
+        cache_dir = warmup.numba_cache_dir()
+
+    if cache_dir:
+        warmup.set_numba_cache_dir(cache_dir)
+
+    kernels, seconds = warmup.warmup()
+    logger.info(
+        "warmed up numba kernels in %s (%.3f seconds)\n%s"
+        % (cache_dir or "default numba cache", seconds, kernels.to_string())
+    )
+
+    return 0
+
+
 def run(args):
     """
     Run the models. Specify a project folder using the '--working_dir' option,
@@ -253,6 +291,10 @@ def run(args):
         int: sys.exit exit code
     """
 
+    import numpy as np
+
+    from populationsim.core import config, inject, mem, pipeline, tracing
+
     # register steps and other injectables
     if not inject.is_injectable("preload_injectables"):
         pass
@@ -260,6 +302,12 @@ def run(args):
     tracing.config_logger(basic=True)
     handle_standard_args(args)  # possibly update injectables
 
+    # shared numba cache (inherited by multiprocess sub-processes via NUMBA_CACHE_DIR)
+    if config.setting("numba_cache_dir", None):
+        from populationsim.balancing import warmup
+
+        warmup.set_numba_cache_dir(warmup.numba_cache_dir())
+
     if config.setting("rotate_logs", False):
         config.rotate_log_directory()
 
@@ -6,11 +6,182 @@ import logging
 import pandas as pd
 import numpy as np
 
-from populationsim.core import pipeline, inject, config
+from populationsim.core import pipeline, inject, config, mem
 from populationsim.core.helper import get_weight_table
 
 logger = logging.getLogger(__name__)
 
+# bytes of choose_in_groups temporaries per choice (merged values, groups and sort order)
+CHOOSE_ROW_BYTES = 64
+
+
+def _segmented_cumsum(values, offsets):
+    """
+    cumsum of values within each CSR segment, accumulated in the same order as np.cumsum
+    """
+
+    sizes = np.diff(offsets)
+    position = np.arange(len(values)) - np.repeat(offsets[:-1], sizes)
+
+    # rows grouped by their position within their segment
+    rows_by_position = np.argsort(position, kind="stable")
+    position_counts = np.bincount(position)
+    position_starts = np.cumsum(position_counts) - position_counts
+
+    result = values.astype(np.float64)
+    for k in range(1, len(position_counts)):
+        rows = rows_by_position[
+            position_starts[k] : position_starts[k] + position_counts[k]
+        ]
+        result[rows] = result[rows - 1] + result[rows]
+
+    return result
+
+
+def group_cumulative_probabilities(group_ids, hh_ids, sample_weights):
+    """
+    Build per-group cumulative household choice probabilities in CSR form
+
+    Probabilities are the hh sample_weights normalized within each group, and are
+    accumulated and normalized the same way as np.random.choice does. Groups whose
+    sample_weights sum to zero have no probabilities (NaN cdf), and can't be chosen from.
+
+    Parameters
+    ----------
+    group_ids : numpy.ndarray
+        group_id of each household (group ids are 0..group_count-1)
+    hh_ids : numpy.ndarray
+        household id of each household
+    sample_weights : numpy.ndarray
+        sample weight of each household
+
+    Returns
+    -------
+    offsets : numpy.ndarray
+        start of each group's households in hh_ids and cdf (len group_count + 1)
+    hh_ids : numpy.ndarray
+        household ids sorted by group (in original order within each group)
+    cdf : numpy.ndarray
+        cumulative choice probability of each household within its group
+    """
+
+    order = np.argsort(group_ids, kind="stable")
+    group_sizes = np.bincount(group_ids)
+    offsets = np.zeros(len(group_sizes) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(group_sizes)
+
+    weights = sample_weights[order]
+    group_totals = np.add.reduceat(weights, offsets[:-1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        probs = weights / np.repeat(group_totals, group_sizes)
+
+        cdf = _segmented_cumsum(probs, offsets)
+        cdf /= np.repeat(cdf[offsets[1:] - 1], group_sizes)
+
+    return offsets, hh_ids[order], cdf
+
+
+def choose_in_groups(group_ids, offsets, cdf, rands):
+    """
+    For each (group_id, rand) pair, choose the position (in CSR arrays) of a group member
+
+    This is a batched equivalent of cdf[start:end].searchsorted(rand, side="right")
+    for each group, done with a single sort of the cdf values and the rands.
+
+    Parameters
+    ----------
+    group_ids : numpy.ndarray
+        group id for each choice
+    offsets : numpy.ndarray
+        CSR offsets of the groups in cdf
+    cdf : numpy.ndarray
+        cumulative choice probabilities of group members
+    rands : numpy.ndarray
+        uniform random number for each choice
+
+    Returns
+    -------
+    choices : numpy.ndarray
+        position in cdf of the chosen group member for each choice
+    """
+
+    # like np.random.choice, don't choose from groups without probabilities
+    if np.isnan(cdf[offsets[group_ids + 1] - 1]).any():
+        raise ValueError("probabilities contain NaN")
+
+    cdf_groups = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    # sort cdf values and rands together by group and value,
+    # with cdf values before rands on ties (side="right")
+    values = np.concatenate([cdf, rands])
+    groups = np.concatenate([cdf_groups, group_ids])
+    is_rand = np.concatenate(
+        [np.zeros(len(cdf), dtype=bool), np.ones(len(rands), dtype=bool)]
+    )
+    merged = np.lexsort((is_rand, values, groups))
+
+    # number of cdf values preceding each rand in merged order
+    cdf_count = np.cumsum(~is_rand[merged])
+    rand_rows = merged[is_rand[merged]] - len(cdf)
+
+    choices = np.empty(len(rands), dtype=np.int64)
+    choices[rand_rows] = cdf_count[is_rand[merged]]
+
+    # don't run off the end of the group (in case cdf of last member rounds below rand)
+    return np.minimum(choices, offsets[group_ids + 1] - 1)
+
+
+def expand_weights(weights, sort_cols):
+    """
+    Expand weight table by integer_weight, so there is one row per desired hh, sorted by sort_cols
+
+    Rather than sorting the expanded table, the (much smaller) weight table is sorted and each
+    column is expanded separately with its own dtype. Index labels are the row positions in the
+    unsorted expansion, just as if the expanded table had been (stably) sorted.
+
+    Parameters
+    ----------
+    weights : pandas.DataFrame
+        weight table with integer_weight column
+    sort_cols : list of str
+
+    Returns
+    -------
+    expanded_weights : pandas.DataFrame
+    """
+
+    sort_order = np.lexsort([weights[c].values for c in reversed(sort_cols)])
+
+    counts = weights["integer_weight"].values.astype(np.int64)
+    starts = np.cumsum(counts) - counts
+
+    sorted_counts = counts[sort_order]
+    sorted_starts = np.cumsum(sorted_counts) - sorted_counts
+    index = np.repeat(starts[sort_order] - sorted_starts, sorted_counts)
+    index += np.arange(len(index))
+
+    return pd.DataFrame(
+        {
+            c: np.repeat(weights[c].values[sort_order], sorted_counts)
+            for c in weights.columns
+        },
+        index=index,
+    )
+
+
+def sort_within_zones(df, geography_cols, sort_col):
+    """
+    (stable) sort df, whose rows are already in geography_cols order, by sort_col within zones
+    """
+
+    zone_change = np.zeros(len(df.index), dtype=bool)
+    for c in geography_cols:
+        values = df[c].values
+        zone_change[1:] |= values[1:] != values[:-1]
+    zone_ids = np.cumsum(zone_change)
+
+    return df.take(np.lexsort((df[sort_col].values, zone_ids)))
+
 
 @inject.step()
 def expand_households():
@@ -41,18 +212,13 @@ def expand_households():
     weights = weights[geography_cols + [household_id_col, "integer_weight"]]
 
     # - expand weights table by integer_weight, so there is one row per desired hh
-    weight_cols = weights.columns.values
-    weights_np = np.repeat(weights.values, weights.integer_weight.values, axis=0)
-    expanded_weights = pd.DataFrame(data=weights_np, columns=weight_cols)
+    # sorted by geography and household_id_col (which is really group_id if grouped)
+    # so results are repeatable regardless of weight table order
+    # i.e. which could vary depending on whether we ran single or multi process due to apportioned/coalesce
+    expanded_weights = expand_weights(weights, geography_cols + [household_id_col])
 
     if config.setting("GROUP_BY_INCIDENCE_SIGNATURE"):
 
-        # get these in a repeatable order so np.random.choice behaves the same regardless of weight table order
-        # i.e. which could vary depending on whether we ran single or multi process due to apportioned/coalesce
-        expanded_weights = expanded_weights.sort_values(
-            geography_cols + [household_id_col]
-        )
-
         # the household_id_col is really the group_id
         expanded_weights.rename(columns={household_id_col: "group_id"}, inplace=True)
 
@@ -62,28 +228,41 @@ def expand_households():
             [household_id_col, "group_id", "sample_weight"]
         ]
 
-        # for each group, lists of hh_ids and their sample_weights (as relative probabiliities)
-        # [ [ [<group_0_hh_id_list>], [<group_0_hh_prob_list>] ],
-        #   [ [<group_1_hh_id_list>], [<group_1_hh_prob_list>] ], ... ]
-        HH_IDS = 0
-        HH_PROBS = 1
-        grouper = household_groups.groupby("group_id")
-        group_hh_probs = [0] * len(grouper)
-        for group_id, df in grouper:
-            hh_ids = list(df[household_id_col])
-            probs = list(df.sample_weight / df.sample_weight.sum())
-            group_hh_probs[group_id] = [hh_ids, probs]
+        # CSR form of the hh_ids of each group and their cumulative probabilities
+        offsets, hh_ids, hh_cdf = group_cumulative_probabilities(
+            household_groups["group_id"].values,
+            household_groups[household_id_col].values,
+            household_groups["sample_weight"].values,
+        )
 
         # get a repeatable random number sequence generator for consistent choice results
         prng = pipeline.get_rn_generator().get_external_rng("expand_households")
 
         # now make a hh_id choice for each group_id in expanded_weights
-        def chooser(group_id):
-            hh_ids = group_hh_probs[group_id][HH_IDS]
-            hh_probs = group_hh_probs[group_id][HH_PROBS]
-            return prng.choice(hh_ids, p=hh_probs)
+        # (one uniform per row, in row order, exactly as prng.choice would draw them)
+        rands = prng.random_sample(len(expanded_weights.index))
+        group_ids = expanded_weights.group_id.values.astype(np.int64)
 
-        expanded_weights[household_id_col] = expanded_weights.group_id.apply(chooser)
+        # choose in chunks of rows if all at once would exceed memory_budget
+        # (choices are independent, so results are the same)
+        chunk_rows = mem.budget_chunk_rows(
+            len(rands), CHOOSE_ROW_BYTES, "expand_households"
+        )
+        if chunk_rows < len(rands):
+            choices = np.concatenate(
+                [
+                    choose_in_groups(
+                        group_ids[start : start + chunk_rows],
+                        offsets,
+                        hh_cdf,
+                        rands[start : start + chunk_rows],
+                    )
+                    for start in range(0, len(rands), chunk_rows)
+                ]
+            )
+        else:
+            choices = choose_in_groups(group_ids, offsets, hh_cdf, rands)
+        expanded_weights[household_id_col] = hh_ids[choices]
 
         # FIXME - omit in production?
         del expanded_weights["group_id"]
@@ -115,8 +294,17 @@ def expand_households():
             % (op, prev_hhs, dropped_hhs, added_hhs, final_hhs)
         )
 
-    # sort this so results will be consistent whether single or multiprocessing, GROUP_BY_INCIDENCE_SIGNATURE, etc...
-    expanded_weights = expanded_weights.sort_values(geography_cols + [household_id_col])
+        # sort this so results will be consistent whether single or multiprocessing, GROUP_BY_INCIDENCE_SIGNATURE, etc...
+        expanded_weights = expanded_weights.sort_values(
+            geography_cols + [household_id_col]
+        )
+
+    elif config.setting("GROUP_BY_INCIDENCE_SIGNATURE"):
+
+        # rows are still in geography order, so just need to sort chosen hh_ids within zones
+        expanded_weights = sort_within_zones(
+            expanded_weights, geography_cols, household_id_col
+        )
 
     repop = inject.get_step_arg("repop", default=False)
     inject.add_table("expanded_household_ids", expanded_weights, replace=repop)
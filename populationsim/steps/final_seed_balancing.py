@@ -4,14 +4,15 @@
 import logging
 import pandas as pd
 
-from populationsim.core import inject
+from populationsim.core import inject, performance
+from populationsim.core.geography import geography_index
 from populationsim.core.helper import (
     get_weight_table,
     get_control_table,
     weight_table_name,
 )
 from populationsim.balancing import do_balancing
-
+from populationsim.core.dtypes import weight_dtype
 
 logger = logging.getLogger(__name__)
 
@@ -77,27 +78,32 @@ def final_seed_balancing(settings, crosswalk, control_spec, incidence_table):
     # run balancer for each seed geography
     weight_list = []
 
-    seed_ids = crosswalk_df[seed_geography].unique()
+    geo_index = geography_index(crosswalk_df, incidence_df)
+
+    seed_ids = geo_index.zone_ids(seed_geography)
     for seed_id in seed_ids:
 
         logger.info("final_seed_balancing seed id %s" % seed_id)
 
-        seed_incidence_df = incidence_df[incidence_df[seed_geography] == seed_id]
-
-        status, weights_df, controls_df = do_balancing(
-            control_spec=control_spec,
-            total_hh_control_col=total_hh_control_col,
-            max_expansion_factor=max_expansion_factor,
-            min_expansion_factor=min_expansion_factor,
-            absolute_lower_bound=absolute_lower_bound,
-            absolute_upper_bound=absolute_upper_bound,
-            incidence_df=seed_incidence_df,
-            control_totals=seed_controls_df.loc[seed_id],
-            initial_weights=seed_incidence_df["sample_weight"],
-            use_hard_constraints=hard_constraints,
-            use_numba=use_numba,
-            numba_precision=numba_precision,
-        )
+        seed_incidence_df = incidence_df.iloc[
+            geo_index.household_positions(seed_geography, seed_id)
+        ]
+
+        with performance.zone(seed_geography, seed_id):
+            status, weights_df, controls_df = do_balancing(
+                control_spec=control_spec,
+                total_hh_control_col=total_hh_control_col,
+                max_expansion_factor=max_expansion_factor,
+                min_expansion_factor=min_expansion_factor,
+                absolute_lower_bound=absolute_lower_bound,
+                absolute_upper_bound=absolute_upper_bound,
+                incidence_df=seed_incidence_df,
+                control_totals=seed_controls_df.loc[seed_id],
+                initial_weights=seed_incidence_df["sample_weight"],
+                use_hard_constraints=hard_constraints,
+                use_numba=use_numba,
+                numba_precision=numba_precision,
+            )
 
         logger.info("seed_balancer status: %s" % status)
         if not status["converged"]:
@@ -110,6 +116,6 @@ def final_seed_balancing(settings, crosswalk, control_spec, incidence_table):
         relaxation_factors[seed_id] = controls_df["relaxation_factor"]
 
     # bulk concat all seed level results
-    final_seed_weights = pd.concat(weight_list)
+    final_seed_weights = pd.concat(weight_list).astype(weight_dtype())
 
     inject.add_column(seed_weight_table_name, "balanced_weight", final_seed_weights)
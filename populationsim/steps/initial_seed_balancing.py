@@ -4,10 +4,11 @@
 import logging
 import pandas as pd
 
-from populationsim.core import inject
+from populationsim.core import inject, performance
+from populationsim.core.geography import geography_index
 from populationsim.balancing import do_balancing
 from populationsim.core.helper import get_control_table, weight_table_name
-
+from populationsim.core.dtypes import compact_weights
 
 logger = logging.getLogger(__name__)
 
@@ -67,27 +68,32 @@ def initial_seed_balancing(settings, crosswalk, control_spec, incidence_table):
     weight_list = []
     sample_weight_list = []
 
-    seed_ids = crosswalk_df[seed_geography].unique()
+    geo_index = geography_index(crosswalk_df, incidence_df)
+
+    seed_ids = geo_index.zone_ids(seed_geography)
     for seed_id in seed_ids:
 
         logger.info("initial_seed_balancing seed id %s" % seed_id)
 
-        seed_incidence_df = incidence_df[incidence_df[seed_geography] == seed_id]
-
-        status, weights_df, controls_df = do_balancing(
-            control_spec=seed_control_spec,
-            total_hh_control_col=total_hh_control_col,
-            max_expansion_factor=max_expansion_factor,
-            min_expansion_factor=min_expansion_factor,
-            absolute_upper_bound=absolute_upper_bound,
-            absolute_lower_bound=absolute_lower_bound,
-            incidence_df=seed_incidence_df,
-            control_totals=seed_controls_df.loc[seed_id],
-            initial_weights=seed_incidence_df["sample_weight"],
-            use_hard_constraints=hard_constraints,
-            use_numba=use_numba,
-            numba_precision=numba_precision,
-        )
+        seed_incidence_df = incidence_df.iloc[
+            geo_index.household_positions(seed_geography, seed_id)
+        ]
+
+        with performance.zone(seed_geography, seed_id):
+            status, weights_df, controls_df = do_balancing(
+                control_spec=seed_control_spec,
+                total_hh_control_col=total_hh_control_col,
+                max_expansion_factor=max_expansion_factor,
+                min_expansion_factor=min_expansion_factor,
+                absolute_upper_bound=absolute_upper_bound,
+                absolute_lower_bound=absolute_lower_bound,
+                incidence_df=seed_incidence_df,
+                control_totals=seed_controls_df.loc[seed_id],
+                initial_weights=seed_incidence_df["sample_weight"],
+                use_hard_constraints=hard_constraints,
+                use_numba=use_numba,
+                numba_precision=numba_precision,
+            )
 
         logger.info("seed_balancer status: %s" % status)
         if not status["converged"]:
@@ -124,5 +130,9 @@ def initial_seed_balancing(settings, crosswalk, control_spec, incidence_table):
             "preliminary_balanced_weight"
         ]
 
+    seed_weights_df = compact_weights(
+        seed_weights_df, [seed_geography, settings.get("household_id_col", "hh_id")]
+    )
+
     repop = inject.get_step_arg("repop", default=False)
     inject.add_table(weight_table_name(seed_geography), seed_weights_df, replace=repop)
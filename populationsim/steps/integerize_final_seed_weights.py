@@ -5,8 +5,10 @@ import logging
 
 import pandas as pd
 
-from populationsim.core import inject
+from populationsim.core import inject, performance, time_budget
+from populationsim.core.geography import ZoneRows, geography_index
 from populationsim.integerizing import do_integerizing
+from populationsim.core.dtypes import integer_weight_dtype
 from populationsim.core.helper import (
     get_control_table,
     weight_table_name,
@@ -59,33 +61,40 @@ def integerize_final_seed_weights(settings, crosswalk, control_spec, incidence_t
     # run balancer for each seed geography
     weight_list = []
 
-    seed_ids = crosswalk_df[seed_geography].unique()
+    geo_index = geography_index(crosswalk_df, incidence_df)
+    seed_weight_rows = ZoneRows(seed_weights_df[seed_geography])
+
+    seed_ids = geo_index.zone_ids(seed_geography)
+    time_budget.queue(len(seed_ids))
     for seed_id in seed_ids:
 
         logger.info("integerize_final_seed_weights seed id %s" % seed_id)
 
         # slice incidence rows for this seed geography
-        seed_incidence = incidence_df[incidence_df[seed_geography] == seed_id]
+        seed_incidence = incidence_df.iloc[
+            geo_index.household_positions(seed_geography, seed_id)
+        ]
 
-        balanced_seed_weights = seed_weights_df.loc[
-            seed_weights_df[seed_geography] == seed_id, "balanced_weight"
+        balanced_seed_weights = seed_weights_df["balanced_weight"].iloc[
+            seed_weight_rows.rows(seed_id)
         ]
 
         trace_label = "%s_%s" % (seed_geography, seed_id)
 
-        integer_weights, status = do_integerizing(
-            trace_label=trace_label,
-            control_spec=control_spec,
-            control_totals=seed_controls_df.loc[seed_id],
-            incidence_table=seed_incidence[control_cols],
-            float_weights=balanced_seed_weights,
-            total_hh_control_col=total_hh_control_col,
-        )
+        with performance.zone(seed_geography, seed_id), time_budget.zone():
+            integer_weights, status = do_integerizing(
+                trace_label=trace_label,
+                control_spec=control_spec,
+                control_totals=seed_controls_df.loc[seed_id],
+                incidence_table=seed_incidence[control_cols],
+                float_weights=balanced_seed_weights,
+                total_hh_control_col=total_hh_control_col,
+            )
 
         weight_list.append(integer_weights)
 
     # bulk concat all seed level results
-    integer_seed_weights = pd.concat(weight_list)
+    integer_seed_weights = pd.concat(weight_list).astype(integer_weight_dtype())
 
     inject.add_column(
         weight_table_name(seed_geography), "integer_weight", integer_seed_weights
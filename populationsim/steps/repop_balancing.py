@@ -4,7 +4,8 @@
 import logging
 import pandas as pd
 
-from populationsim.core import inject
+from populationsim.core import inject, performance, time_budget
+from populationsim.core.geography import ZoneRows, geography_index
 from populationsim.core.helper import (
     get_control_table,
     weight_table_name,
@@ -12,7 +13,7 @@ from populationsim.core.helper import (
 )
 from populationsim.balancing import do_balancing
 from populationsim.integerizing import do_integerizing
-
+from populationsim.core.dtypes import compact_weights
 
 logger = logging.getLogger(__name__)
 
@@ -65,24 +66,32 @@ def repop_balancing(settings, crosswalk, control_spec, incidence_table):
     # run balancer for each low geography
     low_weight_list = []
 
-    seed_ids = crosswalk_df[seed_geography].unique()
+    geo_index = geography_index(crosswalk_df, incidence_df)
+    seed_weight_rows = ZoneRows(all_seed_weights_df[seed_geography])
+
+    seed_ids = geo_index.zone_ids(seed_geography)
+    time_budget.queue(
+        sum(
+            len(geo_index.sub_zone_ids(seed_geography, seed_id, low_geography))
+            for seed_id in seed_ids
+        )
+    )
     for seed_id in seed_ids:
 
         logger.info("initial_seed_balancing seed id %s" % seed_id)
 
-        seed_incidence_df = incidence_df[incidence_df[seed_geography] == seed_id]
-        seed_crosswalk_df = crosswalk_df[crosswalk_df[seed_geography] == seed_id]
+        seed_incidence_df = incidence_df.iloc[
+            geo_index.household_positions(seed_geography, seed_id)
+        ]
 
         # initial seed weights in series indexed by hh id
-        seed_weights_df = all_seed_weights_df[
-            all_seed_weights_df[seed_geography] == seed_id
-        ]
+        seed_weights_df = all_seed_weights_df.iloc[seed_weight_rows.rows(seed_id)]
         seed_weights_df = seed_weights_df.set_index(household_id_col)
 
         # number of hh in seed zone (for scaling low zone weights)
         seed_zone_hh_count = seed_controls_df[total_hh_control_col].loc[seed_id]
 
-        low_ids = seed_crosswalk_df[low_geography].unique()
+        low_ids = geo_index.sub_zone_ids(seed_geography, seed_id, low_geography)
         for low_id in low_ids:
 
             trace_label = "%s_%s_%s_%s" % (
@@ -104,20 +113,21 @@ def repop_balancing(settings, crosswalk, control_spec, incidence_table):
             initial_weights = seed_weights_df["balanced_weight"] * scaling_factor
 
             # - balance
-            status, weights_df, controls_df = do_balancing(
-                control_spec=low_control_spec,
-                total_hh_control_col=total_hh_control_col,
-                max_expansion_factor=max_expansion_factor,
-                min_expansion_factor=min_expansion_factor,
-                absolute_upper_bound=absolute_upper_bound,
-                absolute_lower_bound=absolute_lower_bound,
-                incidence_df=seed_incidence_df,
-                control_totals=low_controls_df.loc[low_id],
-                initial_weights=initial_weights,
-                use_hard_constraints=hard_constraints,
-                use_numba=use_numba,
-                numba_precision=numba_precision,
-            )
+            with performance.zone(low_geography, low_id):
+                status, weights_df, controls_df = do_balancing(
+                    control_spec=low_control_spec,
+                    total_hh_control_col=total_hh_control_col,
+                    max_expansion_factor=max_expansion_factor,
+                    min_expansion_factor=min_expansion_factor,
+                    absolute_upper_bound=absolute_upper_bound,
+                    absolute_lower_bound=absolute_lower_bound,
+                    incidence_df=seed_incidence_df,
+                    control_totals=low_controls_df.loc[low_id],
+                    initial_weights=initial_weights,
+                    use_hard_constraints=hard_constraints,
+                    use_numba=use_numba,
+                    numba_precision=numba_precision,
+                )
 
             logger.info(
                 "repop_balancing balancing %s status: %s" % (trace_label, status)
@@ -130,14 +140,15 @@ def repop_balancing(settings, crosswalk, control_spec, incidence_table):
             zone_weights_df["balanced_weight"] = weights_df["final"]
 
             # - integerize
-            integer_weights, status = do_integerizing(
-                trace_label=trace_label,
-                control_spec=control_spec,
-                control_totals=low_controls_df.loc[low_id],
-                incidence_table=seed_incidence_df,
-                float_weights=weights_df["final"],
-                total_hh_control_col=total_hh_control_col,
-            )
+            with performance.zone(low_geography, low_id), time_budget.zone():
+                integer_weights, status = do_integerizing(
+                    trace_label=trace_label,
+                    control_spec=control_spec,
+                    control_totals=low_controls_df.loc[low_id],
+                    incidence_table=seed_incidence_df,
+                    float_weights=weights_df["final"],
+                    total_hh_control_col=total_hh_control_col,
+                )
 
             logger.info("repop_balancing integerizing status: %s" % status)
 
@@ -164,6 +175,7 @@ def repop_balancing(settings, crosswalk, control_spec, incidence_table):
         .reset_index(drop=True)
     )
     low_weights_df = pd.concat([low_weights_df, crosswalk_df], axis=1)
+    low_weights_df = compact_weights(low_weights_df, geographies + [household_id_col])
 
     inject.add_table(weight_table_name(low_geography), low_weights_df, replace=True)
     inject.add_table(
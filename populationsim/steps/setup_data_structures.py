@@ -10,6 +10,14 @@ import numpy as np
 
 from populationsim.core import inject, pipeline, config
 from populationsim.core.assign import assign_variable
+from populationsim.core.geography import build_geography_index
+from populationsim.core.dtypes import (
+    use_compact_dtypes,
+    compact_incidence,
+    compact_ids,
+    compact_controls,
+    compact_weights,
+)
 from populationsim.core.helper import control_table_name, get_control_data_table
 
 logger = logging.getLogger(__name__)
@@ -128,7 +136,29 @@ def add_geography_columns(incidence_table, households_df, crosswalk_df):
     return incidence_table
 
 
-def build_control_table(geo, control_spec, crosswalk_df):
+def build_control_table(geo, control_spec, crosswalk_df, control_data=None):
+    """
+    Build the controls table of geo, with its own controls and the totals of the controls of
+    the geographies beneath it
+
+    Parameters
+    ----------
+    geo : str
+    control_spec : pandas.DataFrame
+    crosswalk_df : pandas.DataFrame
+        sub zones not in crosswalk_df are dropped, unless their control data has a geo column
+    control_data : dict of str to pandas.DataFrame, optional
+        control data tables by geography, filled as they are read, so that building the
+        controls tables of all geographies reads each control data table once
+
+    Returns
+    -------
+    controls : pandas.DataFrame
+        one row per zone, one column per control target
+    """
+
+    if control_data is None:
+        control_data = {}
 
     # control_geographies is list with target geography and the geographies beneath it
     control_geographies = config.setting("geographies")
@@ -150,31 +180,32 @@ def build_control_table(geo, control_spec, crosswalk_df):
             continue
 
         # control_data for this geography
-        control_data_df = get_control_data_table(g)
+        if g not in control_data:
+            control_data[g] = get_control_data_table(g)
+        control_data_df = control_data[g]
 
-        control_data_columns = [geo] + spec.control_field.tolist()
+        control_fields = spec.control_field.tolist()
 
         if g == geo:
             # for top level, we expect geo_col, and need to group and sum
             assert geo in control_data_df.columns
-            controls = control_data_df[control_data_columns]
-            controls.set_index(geo, inplace=True)
+            controls = control_data_df[[geo] + control_fields].set_index(geo)
         else:
             # aggregate sub geography control totals to the target geo level
 
-            # add geo_col to control_data table
-            if geo not in control_data_df.columns:
+            # geo id of each control_data row, from its geo_col if it has one
+            if geo in control_data_df.columns:
+                zone_ids = control_data_df[geo]
+            else:
                 # create series mapping sub_geo id to geo id
                 sub_to_geog = (
                     crosswalk_df[[g, geo]].groupby(g, as_index=True).min()[geo]
                 )
 
-                control_data_df[geo] = control_data_df[g].map(sub_to_geog)
+                zone_ids = control_data_df[g].map(sub_to_geog).rename(geo)
 
             # aggregate (sum) controls to geo level
-            controls = (
-                control_data_df[control_data_columns].groupby(geo, as_index=True).sum()
-            )
+            controls = control_data_df[control_fields].groupby(zone_ids).sum()
 
         controls_list.append(controls)
 
@@ -254,20 +285,93 @@ def build_crosswalk_table():
     return crosswalk
 
 
+def incidence_signature_groups(incidence_table, columns):
+    """
+    Group identical incidence rows by packing each row into a single uint64 signature key
+
+    Each column is encoded (by offset from its min value for integer columns, otherwise by
+    position in its sorted unique values) and the codes are packed (mixed radix) into one key per
+    row, so that sorting the keys sorts the rows lexicographically, just as groupby would.
+    If the key space is too large to pack into 64 bits, we fall back to finding the unique
+    rows of the code matrix.
+
+    Parameters
+    ----------
+    incidence_table : pandas.DataFrame
+    columns : list of str
+        columns whose values make up the signature
+
+    Returns
+    -------
+    first_rows : numpy.ndarray
+        position in incidence_table of the first row of each group (in group order)
+    group_ids : numpy.ndarray
+        group id (position in first_rows) of each row of incidence_table
+    """
+
+    codes = []
+    radixes = []
+    for c in columns:
+        values = incidence_table[c].values
+        if np.issubdtype(values.dtype, np.integer) and len(values) > 0:
+            # integer columns (e.g. incidence counts) are encoded by offset, without sorting
+            min_value = values.min()
+            column_codes = (values - min_value).astype(np.uint64)
+            radix = int(values.max()) - int(min_value) + 1
+        else:
+            uniques, column_codes = np.unique(values, return_inverse=True)
+            column_codes = column_codes.reshape(-1).astype(np.uint64)
+            radix = len(uniques)
+        codes.append(column_codes)
+        radixes.append(radix)
+
+    if np.prod(radixes, dtype=object) <= np.iinfo(np.uint64).max:
+        keys = np.zeros(len(incidence_table.index), dtype=np.uint64)
+        for column_codes, radix in zip(codes, radixes):
+            keys = keys * np.uint64(radix) + column_codes
+        _, first_rows, group_ids = np.unique(
+            keys, return_index=True, return_inverse=True
+        )
+    else:
+        _, first_rows, group_ids = np.unique(
+            np.column_stack(codes), return_index=True, return_inverse=True, axis=0
+        )
+
+    return first_rows, group_ids.reshape(-1)
+
+
 def build_grouped_incidence_table(incidence_table, control_spec, seed_geography):
 
     hh_incidence_table = incidence_table
     household_id_col = config.setting("household_id_col")
 
     hh_groupby_cols = list(control_spec.target) + [seed_geography]
-    hh_grouper = hh_incidence_table.groupby(hh_groupby_cols)
-    group_incidence_table = hh_grouper.max()
-    group_incidence_table["sample_weight"] = hh_grouper.sum()["sample_weight"]
-    group_incidence_table["group_size"] = hh_grouper.count()["sample_weight"]
-    group_incidence_table = group_incidence_table.reset_index()
+    first_rows, group_ids = incidence_signature_groups(
+        hh_incidence_table, hh_groupby_cols
+    )
+
+    # signature columns are the same for every hh in group, take max of any other columns
+    group_incidence_table = hh_incidence_table[hh_groupby_cols].iloc[first_rows]
+    group_incidence_table = group_incidence_table.reset_index(drop=True)
+    hh_grouper = hh_incidence_table.drop(columns=hh_groupby_cols).groupby(group_ids)
+    for c, values in hh_grouper.max().items():
+        group_incidence_table[c] = values
+    group_incidence_table["sample_weight"] = hh_grouper["sample_weight"].sum()
+    group_incidence_table["group_size"] = hh_grouper["sample_weight"].count()
 
     # Enforce int64 to join large tables
     group_incidence_table = group_incidence_table.astype(np.int64)
+    group_incidence_table = compact_incidence(
+        group_incidence_table, control_spec.target
+    )
+    group_incidence_table = compact_ids(
+        group_incidence_table,
+        [
+            c
+            for c in group_incidence_table.columns
+            if c not in control_spec.target.values
+        ],
+    )
 
     logger.info(
         "grouped incidence table has %s entries, ungrouped has %s"
@@ -275,13 +379,9 @@ def build_grouped_incidence_table(incidence_table, control_spec, seed_geography)
     )
 
     # add group_id of each hh to hh_incidence_table
-    group_incidence_table["group_id"] = group_incidence_table.index.astype(np.int64)
-    hh_incidence_table["group_id"] = pd.merge(
-        hh_incidence_table[hh_groupby_cols],
-        group_incidence_table[hh_groupby_cols + ["group_id"]],
-        on=hh_groupby_cols,
-        how="left",
-    ).group_id.values
+    id_dtype = np.int32 if use_compact_dtypes() else np.int64
+    group_incidence_table["group_id"] = group_incidence_table.index.astype(id_dtype)
+    hh_incidence_table["group_id"] = group_ids.astype(id_dtype)
 
     # it doesn't really matter what the incidence_table index is until we create population
     # when we need to expand each group to constituent households
@@ -293,6 +393,7 @@ def build_grouped_incidence_table(incidence_table, control_spec, seed_geography)
     # explicitly provide hh_id as a column to make it easier for use when expanding population
     household_groups = hh_incidence_table[["group_id", "sample_weight"]].copy()
     household_groups[household_id_col] = household_groups.index.astype(np.int64)
+    household_groups = compact_weights(household_groups, ["group_id", household_id_col])
 
     return group_incidence_table, household_groups
 
@@ -387,8 +488,11 @@ def setup_data_structures(settings, households, persons):
     )
     inject.add_table("control_spec", control_spec)
 
+    control_data = {}
     for g in geographies:
-        controls = build_control_table(g, control_spec, crosswalk_df)
+        controls = compact_controls(
+            build_control_table(g, control_spec, crosswalk_df, control_data)
+        )
         # Remove zones from xwalk missing from controls (e.g. zones with zero households)
         crosswalk_df = crosswalk_df[crosswalk_df[g].isin(controls.index)]
         inject.add_table(control_table_name(g), controls)
@@ -414,6 +518,9 @@ def setup_data_structures(settings, households, persons):
     hh_weight_col = config.setting("household_weight_col")
     incidence_table["sample_weight"] = households_df[hh_weight_col]
 
+    incidence_table = compact_incidence(incidence_table, control_spec.target)
+    incidence_table = compact_ids(incidence_table, geographies)
+
     if config.setting("GROUP_BY_INCIDENCE_SIGNATURE") and not config.setting(
         "NO_INTEGERIZATION_EVER", False
     ):
@@ -423,9 +530,13 @@ def setup_data_structures(settings, households, persons):
 
         inject.add_table("household_groups", household_groups)
         inject.add_table("incidence_table", group_incidence_table)
+        incidence_table = group_incidence_table
     else:
         inject.add_table("incidence_table", incidence_table)
 
+    # zone maps shared by the balancing, integerizing and summary steps
+    build_geography_index(crosswalk_df, incidence_table)
+
 
 @inject.step()
 def repop_setup_data_structures(households, persons):
@@ -489,9 +600,15 @@ def repop_setup_data_structures(households, persons):
     hh_weight_col = config.setting("household_weight_col")
     incidence_table["sample_weight"] = households_df[hh_weight_col]
 
+    incidence_table = compact_incidence(incidence_table, control_spec.target)
+    incidence_table = compact_ids(incidence_table, geographies)
+
     # rebuild control tables with only the low level controls (aggregated at higher levels)
+    control_data = {}
     for g in geographies:
-        controls = build_control_table(g, control_spec, crosswalk_df)
+        controls = compact_controls(
+            build_control_table(g, control_spec, crosswalk_df, control_data)
+        )
         pipeline.replace_table(control_table_name(g), controls)
 
     if config.setting("GROUP_BY_INCIDENCE_SIGNATURE") and not config.setting(
@@ -503,5 +620,8 @@ def repop_setup_data_structures(households, persons):
 
         pipeline.replace_table("household_groups", household_groups)
         pipeline.replace_table("incidence_table", group_incidence_table)
+        incidence_table = group_incidence_table
     else:
         pipeline.replace_table("incidence_table", incidence_table)
+
+    build_geography_index(crosswalk_df, incidence_table)
@@ -1,8 +1,10 @@
 # PopulationSim
 # See full license in LICENSE.txt.
 
+import gc
 import logging
 
+import numpy as np
 import pandas as pd
 
 from populationsim.balancing import do_simul_balancing
@@ -11,14 +13,15 @@ from populationsim.integerizing import (
     do_simul_integerizing,
     do_sequential_integerizing,
 )
-from populationsim.core import inject, config
+from populationsim.core import inject, config, mem, performance, time_budget
+from populationsim.core.geography import ZoneRows, geography_index
+from populationsim.core.dtypes import compact_weights
 from populationsim.core.helper import (
     get_control_table,
     weight_table_name,
     get_weight_table,
 )
 
-
 logger = logging.getLogger(__name__)
 
 
@@ -31,7 +34,7 @@ def balance_and_integerize(
     parent_geography,
     parent_id,
     sub_geographies,
-    crosswalk_df,
+    sub_ids,
     use_numba,
     numba_precision,
 ):
@@ -55,8 +58,8 @@ def balance_and_integerize(
         parent geography zone id
     sub_geographies : list(str)
         list of subgeographies in descending order
-    crosswalk_df : pandas.Dataframe
-        geo crosswork table sliced to current seed geography
+    sub_ids : array-like
+        ids of the sub_geographies[0] zones in parent zone
 
     Returns
     -------
@@ -66,12 +69,11 @@ def balance_and_integerize(
     """
     sub_geography = sub_geographies[0]
 
-    # only want subcontrol rows for current geography geo_id
-    sub_ids = crosswalk_df.loc[
-        crosswalk_df[parent_geography] == parent_id, sub_geography
-    ].unique()
-    # only want sub-control rows for this parent geography
-    sub_controls_df = sub_controls_df[sub_controls_df.index.isin(sub_ids)]
+    # only want sub-control rows for this parent geography (in sub_controls_df order)
+    sub_control_rows = sub_controls_df.index.get_indexer(sub_ids)
+    sub_controls_df = sub_controls_df.iloc[
+        np.unique(sub_control_rows[sub_control_rows >= 0])
+    ]
 
     # only care about the control columns
     incidence_df = incidence_df[control_spec.target]
@@ -199,21 +201,35 @@ def sub_balancing(settings, crosswalk, control_spec, incidence_table):
 
     integer_weights_list = []
 
+    geo_index = geography_index(crosswalk_df, incidence_df)
+    parent_weight_rows = ZoneRows(weights_df[parent_geography])
+
     # the incidence table is siloed by seed geography, se we handle each seed zone in turn
-    seed_ids = crosswalk_df[seed_geography].unique()
+    seed_ids = geo_index.zone_ids(seed_geography)
+    time_budget.queue(
+        sum(
+            len(
+                parent_controls_df.index.intersection(
+                    geo_index.sub_zone_ids(seed_geography, seed_id, parent_geography)
+                )
+            )
+            for seed_id in seed_ids
+        )
+    )
     for seed_num, seed_id in enumerate(seed_ids):
 
-        # slice incidence and crosswalk tables for this seed zone
-        seed_incidence_df = incidence_df[incidence_df[seed_geography] == seed_id]
-        seed_crosswalk_df = crosswalk_df[crosswalk_df[seed_geography] == seed_id]
+        # slice incidence table for this seed zone
+        seed_incidence_df = incidence_df.iloc[
+            geo_index.household_positions(seed_geography, seed_id)
+        ]
 
         # expects seed geography is siloed by meta_geography
         # (no seed_id is in more than one meta_geography zone)
-        assert len(seed_crosswalk_df[meta_geography].unique()) == 1
+        assert len(geo_index.sub_zone_ids(seed_geography, seed_id, meta_geography)) == 1
 
         # list of unique parent zone ids in this seed zone
         # (there will be just one if parent geography is seed)
-        parent_ids = seed_crosswalk_df[parent_geography].unique()
+        parent_ids = geo_index.sub_zone_ids(seed_geography, seed_id, parent_geography)
 
         # only want ones for which there are (non-zero) controls
         parent_ids = parent_controls_df.index.intersection(parent_ids)
@@ -226,7 +242,7 @@ def sub_balancing(settings, crosswalk, control_spec, incidence_table):
                 f"{parent_geography} {parent_id}"
             )
 
-            initial_weights = weights_df[weights_df[parent_geography] == parent_id]
+            initial_weights = weights_df.iloc[parent_weight_rows.rows(parent_id)]
             initial_weights = initial_weights.set_index(
                 settings.get("household_id_col")
             )
@@ -242,30 +258,50 @@ def sub_balancing(settings, crosswalk, control_spec, incidence_table):
                 seed_incidence_df.index
             ), "seed table and initial weights table do not match, possibly due to overlapping zones in crosswalk."
 
-            zone_weights_df = balance_and_integerize(
-                incidence_df=seed_incidence_df,
-                parent_weights=initial_weights,
-                sub_controls_df=sub_controls_df,
-                control_spec=control_spec,
-                total_hh_control_col=total_hh_control_col,
-                parent_geography=parent_geography,
-                parent_id=parent_id,
-                sub_geographies=sub_geographies,
-                crosswalk_df=seed_crosswalk_df,
-                use_numba=use_numba,
-                numba_precision=numba_precision,
-            )
+            with performance.zone(parent_geography, parent_id), time_budget.zone():
+                zone_weights_df = balance_and_integerize(
+                    incidence_df=seed_incidence_df,
+                    parent_weights=initial_weights,
+                    sub_controls_df=sub_controls_df,
+                    control_spec=control_spec,
+                    total_hh_control_col=total_hh_control_col,
+                    parent_geography=parent_geography,
+                    parent_id=parent_id,
+                    sub_geographies=sub_geographies,
+                    sub_ids=geo_index.sub_zone_ids(
+                        parent_geography, parent_id, geography
+                    ),
+                    use_numba=use_numba,
+                    numba_precision=numba_precision,
+                )
 
             # add higher level geography id columns to facilitate summaries
-            parent_geography_ids = crosswalk_df.loc[
-                crosswalk_df[parent_geography] == parent_id, parent_geographies
-            ].max(axis=0)
+            parent_geography_ids = (
+                crosswalk_df[parent_geographies]
+                .iloc[geo_index.crosswalk_positions(parent_geography, parent_id)]
+                .max(axis=0)
+            )
             for z in parent_geography_ids.index:
                 zone_weights_df[z] = parent_geography_ids[z]
 
             integer_weights_list.append(zone_weights_df)
 
+            # consolidate zone weights in a single (compact) table to free memory
+            if len(integer_weights_list) > 1 and mem.near_memory_budget(
+                f"sub_balancing {parent_geography} {parent_id}"
+            ):
+                integer_weights_list = [
+                    compact_weights(
+                        pd.concat(integer_weights_list),
+                        geographies + [settings.get("household_id_col")],
+                    )
+                ]
+                gc.collect()
+
     integer_weights_df = pd.concat(integer_weights_list)
+    integer_weights_df = compact_weights(
+        integer_weights_df, geographies + [settings.get("household_id_col")]
+    )
 
     logger.info(f"adding table {weight_table_name(geography)}")
     inject.add_table(weight_table_name(geography), integer_weights_df)
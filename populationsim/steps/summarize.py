@@ -5,8 +5,10 @@ import logging
 import os
 import pandas as pd
 import numpy as np
+from scipy import sparse
 
 from populationsim.core import inject, config
+from populationsim.core.geography import geography_index
 
 from populationsim.core.helper import get_control_table, get_weight_table
 
@@ -32,50 +34,141 @@ def out_table(table_name, df):
         inject.add_table(table_name, df, replace=repop)
 
 
-def summarize_geography(
-    geography, weight_col, hh_id_col, crosswalk_df, results_df, incidence_df
-):
+def zone_results(geographies, weight_col, hh_id_col, results_df, incidence_df):
+    """
+    Sum weighted incidence of every control for each combination of zones of geographies
 
-    # controls_table for current geography level
-    controls_table = get_control_table(geography)
-    control_names = controls_table.columns.tolist()
+    Builds a sparse zone-by-household indicator matrix (with weights as values) from the
+    weight table rows and multiplies it with the dense incidence table. Rows are grouped by
+    their own zone ids for all of geographies, so results can be rolled up to any of them
+    (see rollup_zone_results) without relying on the zones being nested in the crosswalk.
 
-    # only want zones from crosswalk for which non-zero control rows exist
-    zone_ids = crosswalk_df[geography].unique()
-    zone_ids = controls_table.index.intersection(zone_ids).astype(np.int64)
+    Parameters
+    ----------
+    geographies : list of str
+        zone geographies of weight table rows to aggregate by
+    weight_col : str
+        name of weight column in results_df
+    hh_id_col : str
+        name of household (or group) id column in results_df
+    results_df : pandas.DataFrame
+        weight table
+    incidence_df : pandas.DataFrame
+        incidence table indexed by household (or group) id
 
-    # Using numpy matrix multiplication for efficient aggregation
-    zone_results_df = results_df.loc[
-        results_df[geography].isin(zone_ids), [geography, hh_id_col, weight_col]
-    ]
+    Returns
+    -------
+    zone_results_df : pandas.DataFrame
+        one row per combination of zone ids in results_df (indexed by a MultiIndex with
+        one level per geography), one column per incidence_df column
+    """
+
+    zone_codes, zone_ids = pd.factorize(
+        pd.MultiIndex.from_frame(results_df[geographies]), sort=True
+    )
+    zone_ids = zone_ids.set_names(geographies)
+    hh_positions = incidence_df.index.get_indexer(results_df[hh_id_col])
+    assert (hh_positions >= 0).all()
+
+    results = weighted_incidence_totals(
+        zone_codes,
+        len(zone_ids),
+        hh_positions,
+        results_df[weight_col].to_numpy(),
+        incidence_df.to_numpy(),
+    )
+
+    return pd.DataFrame(data=results, columns=incidence_df.columns, index=zone_ids)
+
+
+def weighted_incidence_totals(zone_codes, zone_count, hh_positions, weights, incidence):
+    """
+    Sum weights times incidence rows by zone with a sparse zone-by-household indicator matrix
+
+    Totals are accumulated in float64 (whatever the weight and incidence dtypes) and are
+    returned as float64, or as the integer result type if weights and incidence are integers.
 
-    # get the weights and incidence for the zones
-    geo_vec = zone_results_df[geography]
-    weights = zone_results_df[weight_col].to_numpy()
-    incidence = incidence_df.loc[zone_results_df[hh_id_col], control_names]
+    Parameters
+    ----------
+    zone_codes : numpy.ndarray
+        zone position (0 to zone_count - 1) of each weight row
+    zone_count : int
+    hh_positions : numpy.ndarray
+        incidence row position of each weight row
+    weights : numpy.ndarray
+        weight of each weight row
+    incidence : numpy.ndarray
+        dense incidence array (households x controls)
+
+    Returns
+    -------
+    totals : numpy.ndarray
+        zone_count x controls array
+    """
+
+    indicator = sparse.csr_matrix(
+        (weights.astype(np.float64), (zone_codes, hh_positions)),
+        shape=(zone_count, incidence.shape[0]),
+    )
+
+    totals = np.asarray(indicator @ incidence.astype(np.float64))
+
+    result_type = np.result_type(weights.dtype, incidence.dtype)
+    if np.issubdtype(result_type, np.integer):
+        return totals.astype(result_type)
+    return totals
 
-    # multiply incidence by weights and append the geography vector
-    results = np.column_stack(
-        [np.transpose(np.transpose(incidence) * weights), geo_vec]
+
+def rollup_zone_results(zone_results_df, target_geography):
+    """
+    Aggregate zone results (from zone_results) to the zones of target_geography
+
+    Each row of zone_results_df is added to the target zone in its own target_geography
+    index level, so the geographies need not be nested.
+    """
+
+    target_codes, target_ids = pd.factorize(
+        zone_results_df.index.get_level_values(target_geography), sort=True
     )
 
-    # If empty, fill with zeros
-    if results.size == 0:
-        results = np.zeros((1, results.shape[1]))
+    indicator = sparse.csr_matrix(
+        (
+            np.ones(len(target_codes), dtype=np.int64),
+            (target_codes, np.arange(len(target_codes))),
+        ),
+        shape=(len(target_ids), len(target_codes)),
+    )
+    results = zone_results_df.to_numpy()
+    results = np.asarray(indicator @ results).astype(results.dtype)
+
+    return pd.DataFrame(data=results, columns=zone_results_df.columns, index=target_ids)
+
+
+def summarize_geography(geography, zone_results_df, zone_ids):
+
+    # controls_table for current geography level
+    controls_table = get_control_table(geography)
+    control_names = controls_table.columns.tolist()
+
+    # only want zones (from crosswalk) for which non-zero control rows exist
+    zone_ids = controls_table.index.intersection(zone_ids).astype(np.int64)
 
     logger.info("summarizing %s" % geography)
-    controls = [controls_table.loc[x].tolist() for x in zone_ids]
 
-    summary_df = (
-        pd.DataFrame(
-            data=results, columns=["%s_result" % c for c in control_names] + [geography]
-        )
-        .groupby(geography)
-        .sum()
+    # zones with no weight rows have zero results
+    results = zone_results_df.reindex(index=zone_ids, columns=control_names)
+    results = results.fillna(0).astype(zone_results_df.dtypes[control_names])
+
+    controls = controls_table.loc[zone_ids, control_names].to_numpy()
+
+    summary_df = pd.DataFrame(
+        data=results.to_numpy(),
+        columns=["%s_result" % c for c in control_names],
+        index=zone_ids,
     )
 
     controls_df = pd.DataFrame(
-        data=np.asanyarray(controls),
+        data=controls,
         columns=["%s_control" % c for c in control_names],
         index=zone_ids,
     )
@@ -100,9 +193,27 @@ def summarize_geography(
     return summary_df
 
 
-def meta_summary(
-    incidence_df, control_spec, top_geography, top_id, sub_geographies, hh_id_col
+def meta_summaries(
+    incidence_df, control_spec, meta_geography, meta_ids, sub_geographies, hh_id_col
 ):
+    """
+    Control summaries for all meta zones, aggregating each weight table in a single pass
+
+    Parameters
+    ----------
+    incidence_df : pandas.DataFrame
+    control_spec : pandas.DataFrame
+    meta_geography : str
+    meta_ids : array-like
+        meta zone ids to summarize
+    sub_geographies : list of str
+    hh_id_col : str
+
+    Returns
+    -------
+    summaries : dict
+        summary DataFrame (indexed by control_name) for each meta zone id
+    """
 
     if config.setting("NO_INTEGERIZATION_EVER", False):
         seed_weight_cols = ["preliminary_balanced_weight", "balanced_weight"]
@@ -115,32 +226,35 @@ def meta_summary(
         ]
         sub_weight_cols = ["balanced_weight", "integer_weight"]
 
-    incidence_df = incidence_df[incidence_df[top_geography] == top_id]
+    meta_ids = pd.Index(meta_ids)
 
     control_cols = control_spec.target.values
 
-    controls_df = get_control_table(top_geography)
-
-    # controls for this geography as series
-    controls = controls_df[control_cols].loc[top_id]
-
-    incidence = incidence_df[control_cols]
-
-    summary = pd.DataFrame(index=control_cols)
+    controls_df = get_control_table(meta_geography)
 
-    summary.index.name = "control_name"
+    incidence = incidence_df[control_cols].to_numpy()
 
-    summary["control_value"] = controls
+    # meta zone totals of weighted incidence, by summary column
+    totals = {}
 
     seed_geography = config.setting("seed_geography")
     seed_weights_df = get_weight_table(seed_geography)
 
+    # seed weights are one row per household (incidence row)
+    meta_codes = meta_ids.get_indexer(incidence_df[meta_geography])
+    in_meta = meta_codes >= 0
+    hh_positions = np.flatnonzero(in_meta)
+
     for c in seed_weight_cols:
         if c in seed_weights_df:
-            summary_col_name = "%s_%s" % (top_geography, c)
-            summary[summary_col_name] = incidence.multiply(
-                seed_weights_df[c], axis="index"
-            ).sum(axis=0)
+            weights = seed_weights_df[c].reindex(incidence_df.index).to_numpy()
+            totals["%s_%s" % (meta_geography, c)] = weighted_incidence_totals(
+                meta_codes[in_meta],
+                len(meta_ids),
+                hh_positions,
+                weights[in_meta],
+                incidence,
+            )
 
     for g in sub_geographies:
 
@@ -149,18 +263,38 @@ def meta_summary(
         if sub_weights is None:
             continue
 
-        sub_weights = sub_weights[sub_weights[top_geography] == top_id]
-
-        sub_weights = (
-            sub_weights[[hh_id_col] + sub_weight_cols].groupby(hh_id_col).sum()
+        meta_codes = meta_ids.get_indexer(sub_weights[meta_geography])
+        in_meta = meta_codes >= 0
+        hh_positions = incidence_df.index.get_indexer(
+            sub_weights[hh_id_col].to_numpy()[in_meta]
         )
+        assert (hh_positions >= 0).all()
 
         for c in sub_weight_cols:
-            summary["%s_%s" % (g, c)] = incidence.multiply(
-                sub_weights[c], axis="index"
-            ).sum(axis=0)
+            totals["%s_%s" % (g, c)] = weighted_incidence_totals(
+                meta_codes[in_meta],
+                len(meta_ids),
+                hh_positions,
+                sub_weights[c].to_numpy()[in_meta],
+                incidence,
+            )
+
+    summaries = {}
+    for i, meta_id in enumerate(meta_ids):
+
+        summary = pd.DataFrame(index=control_cols)
+
+        summary.index.name = "control_name"
+
+        # controls for this geography as series
+        summary["control_value"] = controls_df[control_cols].loc[meta_id]
+
+        for summary_col_name, meta_totals in totals.items():
+            summary[summary_col_name] = meta_totals[i]
+
+        summaries[meta_id] = summary
 
-    return summary
+    return summaries
 
 
 @inject.step()
@@ -192,17 +326,19 @@ def summarize(crosswalk, incidence_table, control_spec):
 
     hh_id_col = config.setting("household_id_col")
 
-    meta_ids = crosswalk_df[meta_geography].unique()
+    geo_index = geography_index(crosswalk_df, incidence_df)
+
+    meta_ids = geo_index.zone_ids(meta_geography)
+    meta_summary_dfs = meta_summaries(
+        incidence_df,
+        control_spec,
+        meta_geography,
+        meta_ids,
+        sub_geographies,
+        hh_id_col,
+    )
     for meta_id in meta_ids:
-        meta_summary_df = meta_summary(
-            incidence_df,
-            control_spec,
-            meta_geography,
-            meta_id,
-            sub_geographies,
-            hh_id_col,
-        )
-        out_table("%s_%s" % (meta_geography, meta_id), meta_summary_df)
+        out_table("%s_%s" % (meta_geography, meta_id), meta_summary_dfs[meta_id])
 
     hh_weights_summary = pd.DataFrame(index=incidence_df.index)
 
@@ -273,45 +409,27 @@ def summarize(crosswalk, incidence_table, control_spec):
         out_table("%s_aggregate" % (geography,), aggegrate_weights)
 
         summary_col = "integer_weight" if include_integer_colums else "balanced_weight"
-        df_seed = summarize_geography(
-            seed_geography,
+
+        # weighted incidence for each combination of this, seed and super geography
+        # zones of the weight table rows, rolled up to each of these geographies
+        summary_geographies = [seed_geography, geography] + super_geographies
+        geo_results_df = zone_results(
+            [geography, seed_geography] + super_geographies,
             summary_col,
             hh_id_col,
-            crosswalk_df,
             weights_df,
-            incidence_df,
-        )
-        out_table(
-            "%s_%s"
-            % (
-                geography,
-                seed_geography,
-            ),
-            df_seed,
+            incidence_df[control_spec.target],
         )
 
-        df_geo = summarize_geography(
-            geography, summary_col, hh_id_col, crosswalk_df, weights_df, incidence_df
-        )
-        out_table("%s" % (geography,), df_geo)
-
-        # Aggregate super geographies
-        for super_geo in super_geographies:
-            df_super = summarize_geography(
-                super_geo,
-                summary_col,
-                hh_id_col,
-                crosswalk_df,
-                weights_df,
-                incidence_df,
-            )
-            out_table(
-                "%s_%s"
-                % (
-                    geography,
-                    super_geo,
-                ),
-                df_super,
+        for summary_geography in summary_geographies:
+            df = summarize_geography(
+                summary_geography,
+                rollup_zone_results(geo_results_df, summary_geography),
+                geo_index.zone_ids(summary_geography),
             )
+            if summary_geography == geography:
+                out_table("%s" % (geography,), df)
+            else:
+                out_table("%s_%s" % (geography, summary_geography), df)
 
     out_table("hh_weights", hh_weights_summary)
@@ -3,14 +3,123 @@
 
 import logging
 import os
+
+import numpy as np
 import pandas as pd
 
-from populationsim.core import inject, config
+from populationsim.core import inject, config, mem
 
 logger = logging.getLogger(__name__)
 
 
+def seed_index_join_positions(hh_ids, seed_index):
+    """
+    Row positions for a left join of hh_ids to a (unique) seed table index
+
+    Returns
+    -------
+    left_rows : numpy.ndarray
+        position in hh_ids of each joined row (just all of them, in order)
+    right_rows : numpy.ndarray
+        position in seed table of each joined row (-1 if hh_id not in seed_index)
+    """
+    right_rows = seed_index.get_indexer(hh_ids)
+    left_rows = np.arange(len(right_rows))
+
+    return left_rows, right_rows
+
+
+def seed_column_join_positions(hh_ids, seed_hh_ids):
+    """
+    Row positions for a left join of hh_ids to the (non-unique) hh_id column of a seed table
+
+    Seed rows are grouped by hh_id in CSR form (offsets into seed rows sorted by hh_id),
+    so each hh_id expands to its seed rows (in seed table order) without any hashing
+    of the joined rows. hh_ids with no seed rows get a single unmatched row, as in a left merge.
+
+    Returns
+    -------
+    left_rows : numpy.ndarray
+        position in hh_ids of each joined row
+    right_rows : numpy.ndarray
+        position in seed table of each joined row (-1 for unmatched hh_ids)
+    """
+
+    seed_codes, seed_uniques = pd.factorize(seed_hh_ids)
+    seed_rows = np.argsort(seed_codes, kind="stable")
+    seed_counts = np.bincount(seed_codes, minlength=len(seed_uniques))
+    seed_offsets = np.cumsum(seed_counts) - seed_counts
+
+    codes = pd.Index(seed_uniques).get_indexer(hh_ids)
+    matched = codes >= 0
+    counts = np.where(matched, seed_counts[codes], 1)
+
+    left_rows = np.repeat(np.arange(len(codes)), counts)
+    row_starts = np.cumsum(counts) - counts
+    within = np.arange(len(left_rows)) - np.repeat(row_starts, counts)
+
+    right_rows = np.full(len(left_rows), -1, dtype=np.int64)
+    matched_rows = matched[left_rows]
+    right_rows[matched_rows] = seed_rows[
+        seed_offsets[codes[left_rows[matched_rows]]] + within[matched_rows]
+    ]
+
+    return left_rows, right_rows
+
+
+def take_join_columns(
+    left_df, right_df, left_rows, right_rows, on=None, allow_fill=None
+):
+    """
+    Build the joined table by taking left and right columns at join row positions
+
+    Result columns and dtypes are the same as a left pd.merge: shared key column 'on'
+    comes from left, other shared column names get _x/_y suffixes, and columns with
+    unmatched (-1) right rows are filled with missing values (upcasting ints to float).
+
+    allow_fill (default: whether there are any unmatched right_rows) can be given so that
+    the joined chunks of a larger join all have the dtypes of the whole join.
+    """
+
+    if allow_fill is None:
+        allow_fill = bool((right_rows < 0).any())
+    shared = set(left_df.columns).intersection(right_df.columns) - {on}
+
+    columns = {}
+    for c in left_df.columns:
+        name = "%s_x" % c if c in shared else c
+        columns[name] = left_df[c].values.take(left_rows)
+    for c in right_df.columns:
+        if c == on:
+            continue
+        name = "%s_y" % c if c in shared else c
+        values = right_df[c].values
+        columns[name] = pd.api.extensions.take(
+            values, right_rows, allow_fill=allow_fill
+        )
+        if allow_fill:
+            # upcast as if this chunk had unmatched rows
+            fill_dtype = pd.api.extensions.take(
+                values[:0], np.array([-1]), allow_fill=True
+            ).dtype
+            if columns[name].dtype != fill_dtype:
+                columns[name] = columns[name].astype(fill_dtype)
+
+    return pd.DataFrame(columns)
+
+
 def merge_seed_data(expanded_household_ids, seed_data_df, seed_columns, trace_label):
+    """
+    Join seed_columns of seed_data_df to expanded_household_ids, in chunks of rows
+
+    The join is done all at once (a single chunk) unless it would exceed memory_budget,
+    so the joined table can be written without ever holding all of it in memory.
+
+    Yields
+    ------
+    merged_df : pandas.DataFrame
+        joined rows of the next chunk
+    """
 
     seed_geography = config.setting("seed_geography")
     hh_col = config.setting("household_id_col")
@@ -37,19 +146,39 @@ def merge_seed_data(expanded_household_ids, seed_data_df, seed_columns, trace_la
     if right_on and hh_col not in df_columns:
         df_columns.append(hh_col)
 
-    merged_df = pd.merge(
-        how="left",
-        left=expanded_household_ids,
-        right=seed_data_df[df_columns],
-        left_on=hh_col,
-        right_index=right_index,
-        right_on=right_on,
+    if right_index:
+        left_rows, right_rows = seed_index_join_positions(
+            expanded_household_ids[hh_col], seed_data_df.index
+        )
+    else:
+        left_rows, right_rows = seed_column_join_positions(
+            expanded_household_ids[hh_col], seed_data_df[hh_col]
+        )
+
+    seed_data_df = seed_data_df[df_columns]
+
+    # bytes per joined row, to chunk the join within memory_budget
+    row_bytes = sum(
+        df.memory_usage(index=False).sum() / max(len(df.index), 1)
+        for df in [expanded_household_ids, seed_data_df]
     )
+    chunk_rows = mem.budget_chunk_rows(len(left_rows), row_bytes, trace_label)
+
+    allow_fill = bool((right_rows < 0).any())
+    for start in range(0, max(len(left_rows), 1), max(chunk_rows, 1)):
+        merged_df = take_join_columns(
+            expanded_household_ids,
+            seed_data_df,
+            left_rows[start : start + chunk_rows],
+            right_rows[start : start + chunk_rows],
+            on=right_on,
+            allow_fill=allow_fill,
+        )
 
-    if hh_col not in seed_columns:
-        del merged_df[hh_col]
+        if hh_col not in seed_columns:
+            del merged_df[hh_col]
 
-    return merged_df
+        yield merged_df
 
 
 @inject.step()
@@ -108,20 +237,23 @@ def write_synthetic_population(expanded_household_ids, households, persons, outp
             % synthetic_hh_col
         )
 
-    df = merge_seed_data(
-        expanded_household_ids,
-        households,
-        seed_columns=seed_columns,
-        trace_label=TABLE_NAME,
-    )
-
-    # synthetic_hh_id is index
-    df.rename(columns={"synthetic_hh_id": synthetic_hh_col}, inplace=True)
-    df.set_index(synthetic_hh_col, inplace=True)
-
     filename = options.get("filename", "%s.csv" % TABLE_NAME)
     file_path = os.path.join(output_dir, filename)
-    df.to_csv(file_path, index=True)
+
+    # written in chunks if the whole table would exceed memory_budget
+    for i, df in enumerate(
+        merge_seed_data(
+            expanded_household_ids,
+            households,
+            seed_columns=seed_columns,
+            trace_label=TABLE_NAME,
+        )
+    ):
+        # synthetic_hh_id is index
+        df.rename(columns={"synthetic_hh_id": synthetic_hh_col}, inplace=True)
+        df.set_index(synthetic_hh_col, inplace=True)
+
+        df.to_csv(file_path, index=True, mode="w" if i == 0 else "a", header=i == 0)
 
     # - persons
 
@@ -140,16 +272,18 @@ def write_synthetic_population(expanded_household_ids, households, persons, outp
             % synthetic_hh_col
         )
 
-    df = merge_seed_data(
-        expanded_household_ids,
-        persons,
-        seed_columns=seed_columns,
-        trace_label=TABLE_NAME,
-    )
-
-    # FIXME drop or rename old seed hh_id column?
-    df.rename(columns={"synthetic_hh_id": synthetic_hh_col}, inplace=True)
-
     filename = options.get("filename", "%s.csv" % TABLE_NAME)
     file_path = os.path.join(output_dir, filename)
-    df.to_csv(file_path, index=False)
+
+    for i, df in enumerate(
+        merge_seed_data(
+            expanded_household_ids,
+            persons,
+            seed_columns=seed_columns,
+            trace_label=TABLE_NAME,
+        )
+    ):
+        # FIXME drop or rename old seed hh_id column?
+        df.rename(columns={"synthetic_hh_id": synthetic_hh_col}, inplace=True)
+
+        df.to_csv(file_path, index=False, mode="w" if i == 0 else "a", header=i == 0)
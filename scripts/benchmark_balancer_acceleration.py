@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# PopulationSim
+# See full license in LICENSE.txt.
+
+"""
+Benchmark BALANCER_ACCELERATION against plain balancer iteration on the example datasets.
+
+Runs the balancing steps of each example twice, once with plain iteration and once with
+SQUAREM acceleration, and reports balancer calls, iterations and wall time in the list
+(seed and meta) balancer and the simultaneous (sub zone) balancer.
+
+    python scripts/benchmark_balancer_acceleration.py
+    python scripts/benchmark_balancer_acceleration.py --examples example_survey_weighting
+"""
+
+import argparse
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from populationsim.core import config, inject, pipeline, tracing
+from populationsim.balancing.single_balancer import ListBalancer
+from populationsim.balancing.simul_balancer import SimultaneousListBalancer
+
+EXAMPLES_DIR = Path(__file__).parent.parent / "examples"
+
+# example name -> (example dir, configs dir, data dir)
+EXAMPLES = {
+    "example_test": ("example_test", "configs", "data"),
+    "example_test_flex": ("example_test", "configs_flex", "data_flex"),
+    "example_survey_weighting": ("example_survey_weighting", "configs", "data"),
+}
+
+BALANCING_MODELS = [
+    "input_pre_processor",
+    "setup_data_structures",
+    "initial_seed_balancing",
+    "meta_control_factoring",
+    "final_seed_balancing",
+    "integerize_final_seed_weights",
+]
+
+# balancer kind -> list of (iterations, converged, seconds) for each balance() call
+calls = defaultdict(list)
+
+
+def record(kind, balance):
+    def timed_balance(self):
+        t0 = time.perf_counter()
+        result = balance(self)
+        seconds = time.perf_counter() - t0
+        status = result[0] if isinstance(result, tuple) else result
+        calls[kind].append((status["iter"], status["converged"], seconds))
+        return result
+
+    return timed_balance
+
+
+ListBalancer.balance = record("list", ListBalancer.balance)
+SimultaneousListBalancer.balance = record("simul", SimultaneousListBalancer.balance)
+
+
+def balancing_models():
+    """
+    models from settings (or the standard model list) up to the last balancing step
+    """
+    models = config.setting("models")
+    if not models:
+        geographies = config.setting("geographies")
+        seed_geography = config.setting("seed_geography")
+        sub_geographies = geographies[geographies.index(seed_geography) + 1 :]
+        models = BALANCING_MODELS + [
+            "sub_balancing.geography=%s" % g for g in sub_geographies
+        ]
+
+    last = max(i for i, m in enumerate(models) if "balancing" in m)
+    return models[: last + 1]
+
+
+def run_example(example, acceleration):
+
+    example_dir, configs_dir, data_dir = EXAMPLES[example]
+    example_dir = EXAMPLES_DIR / example_dir
+
+    calls.clear()
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        inject.reinject_decorated_tables()
+        inject.add_injectable("configs_dir", [str(example_dir / configs_dir)])
+        inject.add_injectable("data_dir", str(example_dir / data_dir))
+        inject.add_injectable("output_dir", output_dir)
+        inject.clear_cache()
+        tracing.config_logger()
+
+        config.override_setting("BALANCER_ACCELERATION", acceleration)
+
+        pipeline.run(models=balancing_models(), resume_after=None)
+        pipeline.close_pipeline()
+
+        inject.clear_cache()
+
+    return {kind: list(kind_calls) for kind, kind_calls in calls.items()}
+
+
+def summarize_calls(kind_calls):
+    return (
+        len(kind_calls),
+        sum(c[0] for c in kind_calls),
+        sum(bool(c[1]) for c in kind_calls),
+        sum(c[2] for c in kind_calls),
+    )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--examples",
+        nargs="+",
+        default=list(EXAMPLES),
+        choices=list(EXAMPLES),
+        help="examples to benchmark",
+    )
+    args = parser.parse_args()
+
+    rows = []
+    for example in args.examples:
+        plain = run_example(example, None)
+        accelerated = run_example(example, "squarem")
+        for kind in sorted(plain):
+            rows.append(
+                (example, kind)
+                + summarize_calls(plain[kind])
+                + summarize_calls(accelerated.get(kind, []))[1:]
+            )
+
+    header = "%-26s %-6s %6s %10s %10s %9s %9s %9s %9s %7s" % (
+        "example",
+        "kind",
+        "calls",
+        "iters",
+        "iters_acc",
+        "conv",
+        "conv_acc",
+        "secs",
+        "secs_acc",
+        "saved",
+    )
+    print(header)
+    print("-" * len(header))
+    for example, kind, n, iters, conv, secs, iters_acc, conv_acc, secs_acc in rows:
+        saved = 1.0 - secs_acc / secs if secs > 0 else 0.0
+        print(
+            "%-26s %-6s %6d %10d %10d %9d %9d %9.3f %9.3f %6.0f%%"
+            % (
+                example,
+                kind,
+                n,
+                iters,
+                iters_acc,
+                conv,
+                conv_acc,
+                secs,
+                secs_acc,
+                100 * saved,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,8 @@ import numpy.testing as npt
 import pytest
 import time
 
-from populationsim.balancing import ListBalancer
+from populationsim.balancing import ListBalancer, np_balance, np_simul_balance
+from populationsim.balancing import simul_balancer
 from populationsim.balancing.balancers import (
     np_balancer_py,
     np_simul_balancer_py,
@@ -16,6 +17,14 @@ from populationsim.balancing.balancers_numba import (
     np_balancer_numba,
     np_simul_balancer_numba,
 )
+from populationsim.balancing.acceleration import (
+    np_balancer_squarem,
+    np_simul_balancer_squarem,
+)
+from populationsim.balancing.dual_newton import (
+    DUAL_NEWTON,
+    np_simul_balancer_dual_newton,
+)
 from populationsim.balancing.constants import (
     DEFAULT_MAX_ITERATIONS,
     MIN_CONTROL_VALUE,
@@ -79,6 +88,40 @@ def test_Konduri(use_numba):
     assert status["converged"]
 
 
+@pytest.mark.parametrize("use_numba", [True, False])
+def test_compact_incidence(use_numba):
+
+    # compact (uint8) incidence should balance exactly like int64 incidence
+    incidence_table = pd.DataFrame(
+        {
+            "hh": [1, 1, 1, 1, 1, 1, 1, 1],
+            "persons": [1, 2, 3, 17, 2, 1, 20, 4],
+        }
+    )
+    initial_weights = np.ones(len(incidence_table.index))
+    control_totals = [20, 150]
+
+    results = []
+    for dtype in (np.int64, np.uint8):
+        balancer = ListBalancer(
+            incidence_table=incidence_table.astype(dtype),
+            initial_weights=initial_weights,
+            control_totals=control_totals,
+            control_importance_weights=[100000] * len(control_totals),
+            lb_weights=0,
+            ub_weights=30,
+            master_control_index=0,
+            max_iterations=DEFAULT_MAX_ITERATIONS,
+            use_numba=use_numba,
+            numba_precision="float64",
+        )
+        status, weights, controls = balancer.balance()
+        assert status["converged"]
+        results.append(weights.final.values)
+
+    npt.assert_array_equal(results[0], results[1])
+
+
 @pytest.mark.parametrize("dtype", [np.float32, np.float64])
 def test_balancer_compare_numba_vs_py(dtype):
     np.random.seed(42)
@@ -253,3 +296,391 @@ def test_simul_balancer_compare_numba_vs_py(dtype):
     assert s_numba["converged"], "Numba version did not converge"
     assert s_py["converged"], "Python version did not converge"
     # assert duration_numba < duration_py, "Numba version not at least 1x faster"
+
+
+@pytest.mark.parametrize("use_numba", [True, False])
+def test_squarem_balancer(use_numba):
+
+    # accelerated balancer should match the plain balancer fit in fewer iterations
+    np.random.seed(42)
+
+    sample_count = 500
+    control_count = 8
+
+    incidence = (np.random.rand(control_count, sample_count) < 0.3).astype(float)
+    incidence[0] = 1
+    weights_initial = np.random.uniform(1, 5, sample_count)
+    weights_lower_bound = np.zeros(sample_count)
+    weights_upper_bound = np.full(sample_count, 1.0e6)
+    controls_constraint = incidence @ (
+        weights_initial * np.random.uniform(0.5, 2.0, sample_count)
+    )
+    controls_importance = np.full(control_count, 1000.0)
+    master_control_index = 0
+
+    args = (
+        sample_count,
+        control_count,
+        master_control_index,
+        incidence,
+        weights_initial,
+        weights_lower_bound,
+        weights_upper_bound,
+        controls_constraint,
+        controls_importance,
+        DEFAULT_MAX_ITERATIONS,
+    )
+
+    balancer = np_balancer_numba if use_numba else np_balancer_py
+    w_plain, _, (converged_plain, iter_plain, _, _) = balancer(*args)
+    w_fast, _, (converged_fast, iter_fast, _, _) = np_balancer_squarem(
+        *args, use_numba=use_numba
+    )
+
+    assert converged_plain and converged_fast
+    assert iter_fast <= iter_plain
+    npt.assert_allclose(incidence @ w_fast, incidence @ w_plain, rtol=1e-3)
+
+
+@pytest.mark.parametrize("use_numba", [True, False])
+def test_squarem_simul_balancer(use_numba):
+
+    # accelerated simul balancer should match the plain simul balancer fit
+    np.random.seed(42)
+
+    sample_count = 100
+    control_count = 4
+    zone_count = 3
+
+    incidence = (np.random.rand(control_count, sample_count) < 0.4).astype(float)
+    incidence[0] = 1
+    parent_weights = np.random.uniform(5, 20, sample_count)
+    sub_weights = np.outer(np.full(zone_count, 1.0 / zone_count), parent_weights)
+    sub_controls = np.outer(
+        np.random.dirichlet(np.ones(zone_count)), incidence @ parent_weights
+    )
+
+    args = (
+        sample_count,
+        control_count,
+        zone_count,
+        0,
+        incidence,
+        parent_weights,
+        np.zeros(sample_count),
+        parent_weights,
+        sub_weights,
+        sub_controls.sum(axis=0),
+        np.full(control_count, 1000.0),
+        sub_controls,
+        DEFAULT_MAX_ITERATIONS // 10,
+    )
+
+    balancer = np_simul_balancer_numba if use_numba else np_simul_balancer_py
+    w_plain, _, _ = balancer(
+        *[a.copy() if isinstance(a, np.ndarray) else a for a in args]
+    )
+    w_fast, _, _ = np_simul_balancer_squarem(*args, use_numba=use_numba)
+
+    # sub zone weights still sum to parent weights
+    npt.assert_allclose(w_fast.sum(axis=0), parent_weights)
+    npt.assert_allclose(w_fast @ incidence.T, w_plain @ incidence.T, rtol=1e-3)
+
+
+@pytest.mark.parametrize("use_numba", [True, False])
+def test_squarem_balancer_not_converged(use_numba):
+
+    # balancers stopped at max_iterations report max_iterations, accelerated or not
+    np.random.seed(42)
+
+    sample_count = 50
+    control_count = 4
+
+    incidence = (np.random.rand(control_count, sample_count) < 0.3).astype(float)
+    incidence[0] = 1
+    weights_initial = np.random.uniform(1, 5, sample_count)
+    controls_constraint = incidence @ (
+        weights_initial * np.random.uniform(0.5, 2.0, sample_count)
+    )
+
+    args = (
+        sample_count,
+        control_count,
+        0,
+        incidence,
+        weights_initial,
+        np.zeros(sample_count),
+        np.full(sample_count, 1.0e6),
+        controls_constraint,
+        np.full(control_count, 1000.0),
+        5,
+    )
+
+    balancer = np_balancer_numba if use_numba else np_balancer_py
+    _, _, (converged_plain, iter_plain, _, _) = balancer(*args)
+    _, _, (converged_fast, iter_fast, _, _) = np_balancer_squarem(
+        *args, use_numba=use_numba
+    )
+
+    assert not converged_plain and not converged_fast
+    assert iter_plain == iter_fast == 5
+
+
+def test_dual_newton_balancer():
+
+    # dual newton engine should find the same weights as the coordinate balancer
+    incidence_table = pd.DataFrame(
+        {
+            "hh_1": [1, 1, 1, 0, 0, 0, 0, 0],
+            "hh_2": [0, 0, 0, 1, 1, 1, 1, 1],
+            "p1": [1, 1, 2, 1, 0, 1, 2, 1],
+            "p2": [1, 0, 1, 0, 2, 1, 1, 1],
+            "p3": [1, 1, 0, 2, 1, 0, 2, 0],
+        }
+    )
+    control_totals = [35, 65, 91, 65, 104]
+
+    results = {}
+    for engine in [None, DUAL_NEWTON]:
+        balancer = ListBalancer(
+            incidence_table=incidence_table,
+            initial_weights=np.ones(len(incidence_table.index)),
+            control_totals=control_totals,
+            control_importance_weights=[100000] * len(control_totals),
+            lb_weights=0,
+            ub_weights=30,
+            master_control_index=None,
+            max_iterations=DEFAULT_MAX_ITERATIONS,
+            use_numba=False,
+            numba_precision="float64",
+            engine=engine,
+        )
+        results[engine] = balancer.balance()
+
+    status, weights, controls = results[DUAL_NEWTON]
+    assert status["converged"]
+    assert status["iter"] < 20
+    npt.assert_almost_equal(controls["weight_totals"], control_totals, decimal=1)
+    npt.assert_allclose(weights.final, results[None][1].final, rtol=1e-3)
+
+
+def test_dual_newton_simul_balancer():
+
+    np.random.seed(42)
+
+    sample_count = 100
+    control_count = 4
+    zone_count = 3
+
+    incidence = (np.random.rand(control_count, sample_count) < 0.4).astype(float)
+    incidence[0] = 1
+    parent_weights = np.random.uniform(5, 20, sample_count)
+    sub_weights = np.outer(np.full(zone_count, 1.0 / zone_count), parent_weights)
+    sub_controls = np.outer(
+        np.random.dirichlet(np.ones(zone_count)), incidence @ parent_weights
+    )
+    controls_importance = np.full(control_count, 1000.0)
+    controls_importance[0] = 1.0e9
+
+    weights, relaxation_factors, (converged, iter, _, _) = (
+        np_simul_balancer_dual_newton(
+            sample_count,
+            control_count,
+            zone_count,
+            0,
+            incidence,
+            parent_weights,
+            np.zeros(sample_count),
+            parent_weights,
+            sub_weights,
+            sub_controls.sum(axis=0),
+            controls_importance,
+            sub_controls,
+            DEFAULT_MAX_ITERATIONS // 10,
+        )
+    )
+
+    assert converged
+    assert iter < 50
+    # sub zone weights sum to parent weights
+    npt.assert_allclose(weights.sum(axis=0), parent_weights)
+    # weighted totals match relaxed controls
+    npt.assert_allclose(
+        weights @ incidence.T, sub_controls * relaxation_factors, rtol=1e-4
+    )
+    # total households control is (nearly) unrelaxed
+    npt.assert_allclose(weights.sum(axis=1), sub_controls[:, 0], rtol=1e-4)
+
+
+def test_dual_newton_simul_balancer_bounds():
+
+    incidence = np.ones((1, 4))
+    parent_weights = np.full(4, 10.0)
+    sub_weights = np.full((2, 4), 5.0)
+    sub_controls = np.array([[15.0], [25.0]])
+
+    with pytest.raises(ValueError, match="weight bounds"):
+        np_simul_balancer_dual_newton(
+            4,
+            1,
+            2,
+            0,
+            incidence,
+            parent_weights,
+            np.zeros(4),
+            np.full(4, 8.0),
+            sub_weights,
+            sub_controls.sum(axis=0),
+            np.ones(1),
+            sub_controls,
+        )
+
+
+def test_dual_newton_simul_balance_size_fallback(monkeypatch):
+
+    np.random.seed(42)
+    incidence = (np.random.rand(4, 50) < 0.4).astype(float)
+    incidence[0] = 1
+    parent_weights = np.random.uniform(5, 20, 50)
+    sub_controls = np.outer([0.2, 0.3, 0.5], incidence @ parent_weights)
+
+    def balance(engine):
+        return np_simul_balance(
+            incidence,
+            parent_weights,
+            sub_controls,
+            np.full(4, 1000.0),
+            0,
+            engine=engine,
+        )
+
+    coordinate_weights, _, _ = balance(None)
+
+    # 3 sub zones x 4 controls is too many, so the coordinate balancer is used
+    monkeypatch.setattr(simul_balancer, "DUAL_NEWTON_MAX_SIMUL_DUALS", 11)
+    calls = []
+    monkeypatch.setattr(
+        simul_balancer,
+        "np_simul_balancer_dual_newton",
+        lambda *args: calls.append(args),
+    )
+    weights, _, _ = balance(DUAL_NEWTON)
+
+    assert not calls
+    npt.assert_array_equal(weights, coordinate_weights)
+
+
+def test_np_balance_matches_list_balancer():
+
+    incidence_table = pd.DataFrame(
+        {
+            "hh": [1, 1, 1, 1, 1, 1, 1, 1],
+            "persons": [1, 2, 3, 17, 2, 1, 20, 4],
+        }
+    )
+    control_totals = [[20, 150], [10, 60]]
+
+    for zone_control_totals in control_totals:
+        weights_final, _, status = np_balance(
+            incidence_table.values.T,
+            np.ones(len(incidence_table.index)),
+            zone_control_totals,
+            control_importance_weights=[100000, 100000],
+            ub_weights=30,
+            master_control_index=0,
+        )
+        assert status["converged"]
+
+        status, list_weights, _ = ListBalancer(
+            incidence_table=incidence_table,
+            initial_weights=np.ones(len(incidence_table.index)),
+            control_totals=zone_control_totals,
+            control_importance_weights=[100000, 100000],
+            lb_weights=0,
+            ub_weights=30,
+            master_control_index=0,
+            max_iterations=DEFAULT_MAX_ITERATIONS,
+            use_numba=False,
+            numba_precision="float64",
+        ).balance()
+        npt.assert_array_equal(weights_final, list_weights.final.values)
+
+
+@pytest.mark.parametrize(
+    "use_numba, acceleration, engine",
+    [
+        (False, None, None),
+        (True, None, None),
+        (False, "squarem", None),
+        (False, None, DUAL_NEWTON),
+    ],
+)
+def test_np_balance_inputs_unchanged(use_numba, acceleration, engine):
+
+    np.random.seed(42)
+
+    incidence = np.random.randint(0, 3, (3, 20)).astype(np.float64)
+    incidence[0] = 1
+    initial_weights = np.random.uniform(1, 10, 20)
+    control_totals = np.dot(incidence, np.random.uniform(1, 10, 20))
+    control_importance_weights = pd.Series([1e9, 1000.5, 1000.5])
+    lb_weights = np.zeros(20)
+    ub_weights = np.full(20, 100.0)
+
+    # float64 inputs are not copied by conversion, so must not be changed by balancing
+    inputs = [
+        incidence,
+        initial_weights,
+        control_totals,
+        control_importance_weights,
+        lb_weights,
+        ub_weights,
+    ]
+    copies = [value.copy() for value in inputs]
+
+    np_balance(
+        incidence,
+        initial_weights,
+        control_totals,
+        control_importance_weights=control_importance_weights,
+        lb_weights=lb_weights,
+        ub_weights=ub_weights,
+        master_control_index=0,
+        use_numba=use_numba,
+        acceleration=acceleration,
+        engine=engine,
+    )
+
+    for value, copy in zip(inputs, copies):
+        npt.assert_array_equal(value, copy)
+
+
+def test_np_simul_balance_zero_weight_rows():
+
+    np.random.seed(42)
+
+    sample_count = 20
+    control_count = 3
+    zone_count = 2
+
+    incidence = np.random.randint(0, 3, (control_count, sample_count)).astype(float)
+    incidence[0] = 1
+    parent_weights = np.random.uniform(1, 10, sample_count)
+    parent_weights[[3, 7]] = 0
+    sub_controls = np.dot(
+        np.random.dirichlet([1] * zone_count, sample_count).T * parent_weights,
+        incidence.T,
+    )
+
+    sub_weights, _, status = np_simul_balance(
+        incidence,
+        parent_weights,
+        sub_controls,
+        np.full(control_count, 1000.0),
+        master_control_index=0,
+    )
+
+    assert sub_weights.shape == (zone_count, sample_count)
+    assert (sub_weights[:, [3, 7]] == 0).all()
+    npt.assert_allclose(sub_weights.sum(axis=0), parent_weights, rtol=1e-6)
+    npt.assert_allclose(np.dot(sub_weights, incidence.T), sub_controls, rtol=1e-3)
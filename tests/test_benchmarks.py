@@ -0,0 +1,75 @@
+import pandas as pd
+
+from populationsim.benchmarks import generate_project, run_scale
+from populationsim.benchmarks.suite import (
+    COMPONENTS,
+    append_history,
+    compare,
+    previous_result,
+    read_history,
+)
+from populationsim.core import inject
+
+PARAMS = {
+    "households": 200,
+    "persons_per_household": 2.0,
+    "controls": 4,
+    "sparsity": 0.5,
+    "seed_zones": 2,
+    "sub_zones_per_parent": 2,
+}
+
+
+def teardown_function(func):
+    inject.clear_cache()
+    inject.reinject_decorated_tables()
+
+
+def test_generate_project(tmp_path):
+
+    configs_dir, data_dir = generate_project(str(tmp_path), **PARAMS)
+
+    households = pd.read_csv(tmp_path / "data" / "seed_households.csv")
+    persons = pd.read_csv(tmp_path / "data" / "seed_persons.csv")
+    crosswalk = pd.read_csv(tmp_path / "data" / "geo_cross_walk.csv")
+    controls = pd.read_csv(tmp_path / "configs" / "controls.csv")
+
+    assert len(households.index) == PARAMS["households"]
+    assert len(persons.index) == households.NP.sum()
+    assert (
+        len(crosswalk.index)
+        == PARAMS["seed_zones"] * PARAMS["sub_zones_per_parent"] ** 2
+    )
+    assert len(controls.index) == PARAMS["controls"] + 1
+
+    # controls are aggregated from the same true weights at every geography
+    taz = pd.read_csv(tmp_path / "data" / "taz_controls.csv")
+    tract = pd.read_csv(tmp_path / "data" / "tract_controls.csv")
+    region = pd.read_csv(tmp_path / "data" / "region_controls.csv")
+    assert taz.HHBASE.sum() > 0
+    assert len(tract.index) == crosswalk.TRACT.nunique()
+    assert len(region.index) == 1
+
+
+def test_run_scale(tmp_path):
+
+    result = run_scale("test", PARAMS, work_dir=str(tmp_path))
+
+    assert set(result["seconds"]) == set(COMPONENTS)
+    # initial and final seed balancing
+    assert result["calls"]["ListBalancer"] == 2 * PARAMS["seed_zones"]
+    assert result["calls"]["SimultaneousListBalancer"] > 0
+    assert result["total_seconds"] > 0
+    assert (tmp_path / "test" / "output" / "pipeline.h5").exists()
+
+    history_file = str(tmp_path / "history.json")
+    append_history(history_file, [result])
+    history = read_history(history_file)
+    assert len(history) == 1
+
+    other = dict(result, params=dict(result["params"], controls=8))
+    assert previous_result(history, other) is None
+
+    df = compare(result, previous_result(history, result))
+    assert df.component.tolist() == COMPONENTS + ["total"]
+    assert (df.change_pct.abs() < 1e-9).all()
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from populationsim.core import inject
+from populationsim.steps import setup_data_structures
+
+GEOGRAPHIES = ["REGION", "PUMA", "TRACT", "TAZ"]
+
+
+@pytest.fixture
+def control_data(monkeypatch):
+
+    rng = np.random.default_rng(0)
+    taz = np.arange(1, 49)
+    crosswalk_df = pd.DataFrame(
+        {
+            "REGION": 1,
+            "PUMA": 600 + (taz - 1) // 12,
+            "TRACT": 100 + (taz - 1) // 4,
+            "TAZ": taz,
+        }
+    )
+
+    tables = {
+        # TAZ control data with a (redundant) PUMA column, TRACT and PUMA without
+        "TAZ": pd.DataFrame(
+            {
+                "TAZ": taz,
+                "PUMA": crosswalk_df.PUMA,
+                "HH": rng.integers(0, 50, len(taz)),
+                "SIZE1": rng.integers(0, 20, len(taz)),
+            }
+        ),
+        "TRACT": pd.DataFrame(
+            {
+                "TRACT": crosswalk_df.TRACT.unique(),
+                "KIDS": rng.integers(0, 30, 12),
+            }
+        ),
+        "PUMA": pd.DataFrame(
+            {"PUMA": crosswalk_df.PUMA.unique(), "OCC": rng.integers(0, 90, 4)}
+        ),
+    }
+    # an empty TAZ and a TAZ missing from the crosswalk
+    tables["TAZ"].loc[tables["TAZ"].TAZ == 7, ["HH", "SIZE1"]] = 0
+    tables["TAZ"].loc[len(taz)] = [99, 600, 5, 5]
+
+    control_spec = pd.DataFrame(
+        {
+            "target": ["num_hh", "hh_size_1", "kids", "occ"],
+            "geography": ["TAZ", "TAZ", "TRACT", "PUMA"],
+            "control_field": ["HH", "SIZE1", "KIDS", "OCC"],
+        }
+    )
+
+    inject.add_injectable(
+        "settings", {"geographies": GEOGRAPHIES, "total_hh_control": "num_hh"}
+    )
+    monkeypatch.setattr(
+        setup_data_structures, "get_control_data_table", lambda g: tables[g].copy()
+    )
+
+    yield control_spec, crosswalk_df, tables
+
+    inject.clear_cache()
+    inject.reinject_decorated_tables()
+
+
+def build_control_tables(control_spec, crosswalk_df):
+    """
+    Build the control tables of all geographies as setup_data_structures does
+    """
+
+    control_data = {}
+    controls_tables = {}
+    for geo in GEOGRAPHIES:
+        controls = setup_data_structures.build_control_table(
+            geo, control_spec, crosswalk_df, control_data
+        )
+        # zones of zero-household parent zones are removed from the crosswalk
+        crosswalk_df = crosswalk_df[crosswalk_df[geo].isin(controls.index)]
+        controls_tables[geo] = controls
+
+    assert sorted(control_data) == ["PUMA", "TAZ", "TRACT"]
+    return controls_tables
+
+
+def test_build_control_tables(control_data):
+
+    control_spec, crosswalk_df, tables = control_data
+
+    controls_tables = build_control_tables(control_spec, crosswalk_df)
+
+    taz_controls = controls_tables["TAZ"]
+    assert list(taz_controls.columns) == ["num_hh", "hh_size_1"]
+    assert 7 not in taz_controls.index
+    assert 99 in taz_controls.index
+
+    # higher level totals are the totals of their sub zones' controls (in the crosswalk)
+    taz_df = tables["TAZ"].drop(columns="PUMA").merge(crosswalk_df, on="TAZ")
+    for geo in ["REGION", "TRACT"]:
+        controls = controls_tables[geo]
+        expected = taz_df.groupby(geo)[["HH", "SIZE1"]].sum()
+        expected = expected[expected.HH > 0]
+        np.testing.assert_array_equal(controls.index, expected.index)
+        np.testing.assert_array_equal(controls.num_hh, expected.HH)
+        np.testing.assert_array_equal(controls.hh_size_1, expected.SIZE1)
+
+    # TAZ control data has a PUMA column, which takes precedence over the crosswalk
+    # (so TAZ 99, not in the crosswalk, is in PUMA 600)
+    expected = tables["TAZ"].groupby("PUMA")[["HH", "SIZE1"]].sum()
+    np.testing.assert_array_equal(controls_tables["PUMA"].num_hh, expected.HH)
+    assert controls_tables["PUMA"].num_hh.loc[600] == (
+        controls_tables["TRACT"].num_hh.loc[100:102].sum() + 5
+    )
+
+    assert list(controls_tables["PUMA"].columns) == [
+        "num_hh",
+        "hh_size_1",
+        "kids",
+        "occ",
+    ]
+    tract_df = tables["TRACT"].merge(
+        crosswalk_df[["TRACT", "PUMA"]].drop_duplicates(), on="TRACT"
+    )
+    np.testing.assert_array_equal(
+        controls_tables["PUMA"].kids, tract_df.groupby("PUMA").KIDS.sum()
+    )
+    np.testing.assert_array_equal(
+        controls_tables["REGION"].occ, [tables["PUMA"].OCC.sum()]
+    )
+
+
+def test_build_control_tables_empty_parent_zone(control_data):
+
+    control_spec, crosswalk_df, tables = control_data
+
+    # PUMA 603 (TRACTs 109 to 111) has no households
+    tables["TAZ"].loc[tables["TAZ"].PUMA == 603, ["HH", "SIZE1"]] = 0
+
+    controls_tables = build_control_tables(control_spec, crosswalk_df)
+
+    assert 603 not in controls_tables["PUMA"].index
+    assert not controls_tables["TAZ"].index.isin(range(37, 49)).any()
+
+    # TRACTs of PUMA 603 keep their own controls, but their TAZs were removed from the
+    # crosswalk with PUMA 603, so they have no sub zone totals
+    tract_controls = controls_tables["TRACT"]
+    assert tract_controls.loc[109:111].num_hh.isna().all()
+    np.testing.assert_array_equal(
+        tract_controls.loc[109:111].kids, tables["TRACT"].KIDS.iloc[9:]
+    )
+    assert tract_controls.loc[100:108].num_hh.notna().all()
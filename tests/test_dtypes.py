@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from populationsim.core import inject
+from populationsim.core.dtypes import (
+    compact_controls,
+    compact_ids,
+    compact_incidence,
+    compact_weights,
+    integer_weight_dtype,
+    weight_dtype,
+)
+
+BIG_ID = 2**31
+
+
+@pytest.fixture
+def compact_settings():
+    def settings(**settings):
+        inject.add_injectable("settings", settings)
+
+    yield settings
+    inject.clear_cache()
+    inject.reinject_decorated_tables()
+
+
+def test_weight_dtypes(compact_settings):
+
+    compact_settings()
+    assert weight_dtype() == np.float64
+    assert integer_weight_dtype() == np.int64
+
+    compact_settings(COMPACT_DTYPES=True)
+    assert weight_dtype() == np.float64
+    assert integer_weight_dtype() == np.int32
+
+    compact_settings(COMPACT_DTYPES=True, NUMBA_PRECISION="float32")
+    assert weight_dtype() == np.float32
+
+    # float32 weights only with compact dtypes
+    compact_settings(NUMBA_PRECISION="float32")
+    assert weight_dtype() == np.float64
+    assert integer_weight_dtype() == np.int64
+
+
+def test_compact_incidence(compact_settings):
+
+    compact_settings(COMPACT_DTYPES=True)
+
+    df = pd.DataFrame(
+        {
+            "hh": [1, 1, 0],
+            "persons": [3, 300, 0],
+            "big": [0, 70000, 1],
+            "float_counts": [1.0, 2.0, 0.0],
+            "fraction": [0.5, 1.0, 2.0],
+            "negative": [1, -1, 0],
+        }
+    )
+    df = compact_incidence(df, df.columns)
+
+    assert df.dtypes.to_dict() == {
+        "hh": np.uint8,
+        "persons": np.uint16,
+        "big": np.uint32,
+        "float_counts": np.uint8,
+        # lossy downcasts are skipped
+        "fraction": np.float64,
+        "negative": np.int64,
+    }
+    assert df.persons.tolist() == [3, 300, 0]
+    assert df.fraction.tolist() == [0.5, 1.0, 2.0]
+
+
+def test_compact_ids(compact_settings):
+
+    compact_settings(COMPACT_DTYPES=True)
+
+    df = pd.DataFrame(
+        {
+            "hh_id": [1, 2, 3],
+            "TAZ": [-5, 100, 200],
+            "big_id": [1, 2, BIG_ID],
+            "float_id": [1.0, 2.0, 3.0],
+            "other": [1, 2, 3],
+        },
+        index=pd.Index([10, 20, 30], name="hh_id"),
+    )
+    df = compact_ids(df, ["hh_id", "TAZ", "big_id", "float_id", "missing"])
+
+    assert df.hh_id.dtype == np.int32
+    assert df.TAZ.dtype == np.int32
+    assert df.index.dtype == np.int32
+    # ids outside int32, non-integer ids and other columns are left alone
+    assert df.big_id.dtype == np.int64 and df.big_id.iloc[-1] == BIG_ID
+    assert df.float_id.dtype == np.float64
+    assert df.other.dtype == np.int64
+
+    df = pd.DataFrame({"hh_id": [1, 2]}, index=pd.Index([1, -BIG_ID - 1]))
+    df = compact_ids(df, ["hh_id"])
+    assert df.index.dtype == np.int64 and df.index[-1] == -BIG_ID - 1
+
+    df = compact_ids(pd.DataFrame({"hh_id": [1, 2]}), ["hh_id"], index=False)
+    assert df.index.dtype == np.int64
+
+
+def test_compact_controls(compact_settings):
+
+    compact_settings(COMPACT_DTYPES=True)
+
+    df = pd.DataFrame(
+        {
+            "num_hh": [100, 200],
+            "factored": [10.5, 20.25],
+            "integral_float": [10.0, 20.0],
+            "big": [1, BIG_ID],
+        },
+        index=pd.Index([600, 601], name="PUMA"),
+    )
+    df = compact_controls(df)
+
+    assert df.num_hh.dtype == np.int32
+    assert df.index.dtype == np.int32
+    # float (e.g. factored) controls and controls outside int32 are left alone
+    assert df.factored.dtype == np.float64 and df.factored.tolist() == [10.5, 20.25]
+    assert df.integral_float.dtype == np.float64
+    assert df.big.dtype == np.int64 and df.big.iloc[-1] == BIG_ID
+
+
+@pytest.mark.parametrize("numba_precision", ["float64", "float32"])
+def test_compact_weights(compact_settings, numba_precision):
+
+    compact_settings(COMPACT_DTYPES=True, NUMBA_PRECISION=numba_precision)
+
+    df = pd.DataFrame(
+        {
+            "hh_id": [1, 2, 3],
+            "TAZ": [100, 100, BIG_ID],
+            "balanced_weight": [0.5, 1.25, 3.0],
+            "integer_weight": [1, 1, 3],
+        }
+    )
+    df = compact_weights(df, ["hh_id", "TAZ"])
+
+    assert df.balanced_weight.dtype == np.dtype(numba_precision)
+    assert df.integer_weight.dtype == np.int32
+    assert df.hh_id.dtype == np.int32
+    assert df.TAZ.dtype == np.int64 and df.TAZ.iloc[-1] == BIG_ID
+
+
+def test_compact_weights_lossy_integer_weights(compact_settings):
+
+    compact_settings(COMPACT_DTYPES=True)
+
+    # integer weights that aren't integral or don't fit in int32 are left alone
+    df = pd.DataFrame({"hh_id": [1, 2], "integer_weight": [1.5, 2.0]})
+    df = compact_weights(df, ["hh_id"])
+    assert df.integer_weight.tolist() == [1.5, 2.0]
+
+    df = pd.DataFrame({"hh_id": [1, 2], "integer_weight": [1, BIG_ID]})
+    df = compact_weights(df, ["hh_id"])
+    assert df.integer_weight.dtype == np.int64
+    assert df.integer_weight.iloc[-1] == BIG_ID
+
+    # integral float integer weights are downcast
+    df = pd.DataFrame({"hh_id": [1, 2], "integer_weight": [1.0, 2.0]})
+    df = compact_weights(df, ["hh_id"])
+    assert df.integer_weight.dtype == np.int32
+
+
+def test_compact_dtypes_disabled(compact_settings):
+
+    compact_settings()
+
+    df = pd.DataFrame(
+        {"hh_id": [1, 2], "balanced_weight": [0.5, 1.5], "integer_weight": [1, 2]}
+    )
+    dtypes = df.dtypes.copy()
+
+    df = compact_weights(compact_controls(compact_ids(df, ["hh_id"])), ["hh_id"])
+    df = compact_incidence(df, ["integer_weight"])
+
+    pd.testing.assert_series_equal(df.dtypes, dtypes)
@@ -0,0 +1,146 @@
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+import pytest
+
+from populationsim.steps.expand_households import (
+    choose_in_groups,
+    expand_weights,
+    group_cumulative_probabilities,
+    sort_within_zones,
+)
+
+
+def household_groups():
+    # group 0 has one member, group 2 has a member with zero sample_weight,
+    # and group 4 has zero total sample_weight
+    return pd.DataFrame(
+        {
+            "hh_id": [10, 11, 12, 13, 14, 15, 16, 17, 18, 19],
+            "group_id": [1, 0, 1, 2, 3, 2, 1, 3, 4, 4],
+            "sample_weight": [1.0, 3.0, 2.0, 0.0, 0.5, 4.0, 7.0, 0.25, 0.0, 0.0],
+        }
+    )
+
+
+def prng_choices(household_groups, group_ids, seed):
+    """
+    hh_id choice for each of group_ids, one prng.choice call per row (as expand_households did)
+    """
+    prng = np.random.RandomState(seed)
+    choices = []
+    for group_id in group_ids:
+        df = household_groups[household_groups.group_id == group_id]
+        probs = df.sample_weight / df.sample_weight.sum()
+        choices.append(prng.choice(list(df.hh_id), p=list(probs)))
+    return np.array(choices)
+
+
+def batched_choices(household_groups, group_ids, seed):
+    offsets, hh_ids, cdf = group_cumulative_probabilities(
+        household_groups.group_id.values,
+        household_groups.hh_id.values,
+        household_groups.sample_weight.values,
+    )
+    rands = np.random.RandomState(seed).random_sample(len(group_ids))
+    return hh_ids[choose_in_groups(group_ids, offsets, cdf, rands)]
+
+
+def test_group_cumulative_probabilities():
+
+    df = household_groups()
+
+    with np.errstate(all="raise"):
+        offsets, hh_ids, cdf = group_cumulative_probabilities(
+            df.group_id.values, df.hh_id.values, df.sample_weight.values
+        )
+
+    npt.assert_array_equal(offsets, [0, 1, 4, 6, 8, 10])
+    npt.assert_array_equal(hh_ids, [11, 10, 12, 16, 13, 15, 14, 17, 18, 19])
+    npt.assert_allclose(cdf[:8], [1.0, 0.1, 0.3, 1.0, 0.0, 1.0, 2.0 / 3, 1.0])
+    assert np.isnan(cdf[8:]).all()
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_choose_in_groups(seed):
+
+    df = household_groups()
+    group_ids = np.random.RandomState(100 + seed).randint(0, 4, 500)
+
+    choices = batched_choices(df, group_ids, seed)
+
+    npt.assert_array_equal(choices, prng_choices(df, group_ids, seed))
+
+    # single member group always chooses its member, zero weight member is never chosen
+    assert (choices[group_ids == 0] == 11).all()
+    assert (choices != 13).all()
+
+
+def test_choose_in_groups_fixed_rands():
+
+    df = household_groups()
+    offsets, hh_ids, cdf = group_cumulative_probabilities(
+        df.group_id.values, df.hh_id.values, df.sample_weight.values
+    )
+
+    # rands on cdf steps choose the next member (searchsorted side="right")
+    group_ids = np.array([0, 0, 1, 1, 1, 1, 2, 2, 3, 3])
+    rands = np.array([0.0, 0.999, 0.0, 0.1, 0.2999, 0.6, 0.0, 0.5, 0.5, 0.9])
+
+    choices = choose_in_groups(group_ids, offsets, cdf, rands)
+
+    npt.assert_array_equal(hh_ids[choices], [11, 11, 10, 12, 12, 16, 15, 15, 14, 17])
+
+
+def test_choose_in_groups_zero_weight_group():
+
+    df = household_groups()
+    group_ids = np.array([1, 4, 2])
+
+    # like prng.choice, choosing from a group with zero total sample_weight fails
+    with pytest.raises(ValueError, match="probabilities contain NaN"):
+        prng_choices(df, group_ids, 0)
+    with pytest.raises(ValueError, match="probabilities contain NaN"):
+        batched_choices(df, group_ids, 0)
+
+
+def sparse_weights():
+    # unsorted weight table rows, with zero integer_weight rows
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "TRACT": rng.choice([2, 1], 30).astype(np.int32),
+            "TAZ": rng.choice([200, 100, 101], 30).astype(np.int32),
+            "hh_id": rng.integers(0, 8, 30),
+            "integer_weight": rng.integers(0, 4, 30).astype(np.int32),
+        }
+    )
+
+
+def test_expand_weights():
+
+    weights = sparse_weights()
+    sort_cols = ["TRACT", "TAZ", "hh_id"]
+
+    expanded = expand_weights(weights, sort_cols)
+
+    # as np.repeat of the whole weight table, then sorted
+    expected = pd.DataFrame(
+        data=np.repeat(weights.values, weights.integer_weight.values, axis=0),
+        columns=weights.columns,
+    ).sort_values(sort_cols)
+
+    pd.testing.assert_frame_equal(expanded, expected, check_dtype=False)
+    assert (expanded.dtypes == weights.dtypes).all()
+
+
+def test_sort_within_zones():
+
+    expanded = expand_weights(sparse_weights(), ["TRACT", "TAZ"])
+    rng = np.random.default_rng(1)
+    expanded["hh_id"] = rng.integers(0, 5, len(expanded.index))
+
+    sorted_df = sort_within_zones(expanded, ["TRACT", "TAZ"], "hh_id")
+
+    expected = expanded.sort_values(["TRACT", "TAZ", "hh_id"], kind="stable")
+    pd.testing.assert_frame_equal(sorted_df, expected)
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from populationsim.core import inject
+from populationsim.core.geography import (
+    INJECTABLE_NAME,
+    GeographyIndex,
+    ZoneRows,
+    geography_index,
+)
+
+GEOGRAPHIES = ["REGION", "PUMA", "TRACT", "TAZ"]
+
+
+@pytest.fixture
+def geography_settings():
+    inject.add_injectable("settings", {"geographies": GEOGRAPHIES})
+    yield
+    inject.clear_cache()
+    inject.reinject_decorated_tables()
+
+
+def crosswalk():
+    rng = np.random.default_rng(0)
+    taz = np.arange(1, 41)
+    tract = 100 + (taz - 1) // 4
+    puma = 600 + (tract - 100) // 3
+    crosswalk_df = pd.DataFrame({"TAZ": taz, "TRACT": tract, "PUMA": puma, "REGION": 1})
+    return crosswalk_df.iloc[rng.permutation(len(crosswalk_df))]
+
+
+def incidence(crosswalk_df):
+    rng = np.random.default_rng(1)
+    pumas = crosswalk_df.PUMA.unique()
+    incidence_df = pd.DataFrame(
+        {"PUMA": rng.choice(pumas, 200), "REGION": 1, "hh": rng.integers(0, 2, 200)},
+        index=pd.Index(rng.permutation(1000)[:200], name="hh_id"),
+    )
+    return incidence_df
+
+
+def test_zone_rows():
+
+    values = pd.Series([3, 1, 3, 2, 1, 3, np.nan, 2])
+    zone_rows = ZoneRows(values)
+
+    assert list(zone_rows.ids) == list(values.dropna().unique())
+    for zone_id in zone_rows.ids:
+        expected = np.flatnonzero((values == zone_id).values)
+        assert list(zone_rows.rows(zone_id)) == list(expected)
+
+    assert len(zone_rows.rows(99)) == 0
+
+
+def test_geography_index():
+
+    crosswalk_df = crosswalk()
+    incidence_df = incidence(crosswalk_df)
+    geo_index = GeographyIndex(crosswalk_df, incidence_df, GEOGRAPHIES)
+
+    assert set(geo_index.household_rows) == {"REGION", "PUMA"}
+
+    for g in GEOGRAPHIES:
+        assert list(geo_index.zone_ids(g)) == list(crosswalk_df[g].unique())
+
+    for puma in geo_index.zone_ids("PUMA"):
+        pd.testing.assert_frame_equal(
+            incidence_df.iloc[geo_index.household_positions("PUMA", puma)],
+            incidence_df[incidence_df.PUMA == puma],
+        )
+        pd.testing.assert_frame_equal(
+            crosswalk_df.iloc[geo_index.crosswalk_positions("PUMA", puma)],
+            crosswalk_df[crosswalk_df.PUMA == puma],
+        )
+
+    for g, sub_g in [("REGION", "PUMA"), ("PUMA", "TRACT"), ("TRACT", "TAZ")]:
+        for zone_id in geo_index.zone_ids(g):
+            expected = crosswalk_df.loc[crosswalk_df[g] == zone_id, sub_g].unique()
+            assert list(geo_index.sub_zone_ids(g, zone_id, sub_g)) == list(expected)
+
+    assert len(geo_index.sub_zone_ids("PUMA", 999, "TRACT")) == 0
+
+
+def test_geography_index_rebuilt(geography_settings):
+
+    crosswalk_df = crosswalk()
+    incidence_df = incidence(crosswalk_df)
+
+    geo_index = geography_index(crosswalk_df, incidence_df)
+    assert inject.get_injectable(INJECTABLE_NAME) is geo_index
+    assert geography_index(crosswalk_df, incidence_df.copy()) is geo_index
+
+    # e.g. multiprocess slice of the tables
+    puma = geo_index.zone_ids("PUMA")[0]
+    sliced_crosswalk_df = crosswalk_df[crosswalk_df.PUMA == puma]
+    sliced_incidence_df = incidence_df[incidence_df.PUMA == puma]
+    assert not geo_index.matches(sliced_crosswalk_df, sliced_incidence_df)
+
+    sliced_index = geography_index(sliced_crosswalk_df, sliced_incidence_df)
+    assert sliced_index is not geo_index
+    assert list(sliced_index.zone_ids("PUMA")) == [puma]
+    assert inject.get_injectable(INJECTABLE_NAME) is sliced_index
@@ -0,0 +1,51 @@
+import subprocess
+import sys
+
+# budget for importing the command line entry point (seconds), generous as import times vary
+# a lot between machines and runs (heavy imports are caught by the module assertions)
+CLI_IMPORT_TIME_BUDGET = 2.0
+
+
+def import_in_subprocess(statement):
+    """
+    Run statement in a fresh interpreter with -X importtime
+
+    Returns the cumulative import times (seconds) by module and the modules imported.
+    """
+
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            "%s; import sys; print(' '.join(sys.modules))" % statement,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        import_times[module.strip()] = int(cumulative) / 1e6
+
+    return import_times, set(result.stdout.split())
+
+
+def test_cli_import_time():
+
+    import_times, modules = import_in_subprocess("import populationsim.__main__")
+
+    assert import_times["populationsim.__main__"] < CLI_IMPORT_TIME_BUDGET
+    assert not modules & {"pandas", "orca", "numba", "psutil", "tables"}
+
+
+def test_steps_import_lazily():
+
+    _, modules = import_in_subprocess("import populationsim.steps")
+
+    assert not modules & {"numba", "psutil", "ortools", "cvxpy"}
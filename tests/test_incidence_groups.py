@@ -0,0 +1,74 @@
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+import pytest
+
+from populationsim.steps.setup_data_structures import incidence_signature_groups
+
+
+def expected_groups(incidence_table, columns):
+    group_ids = incidence_table.groupby(columns, sort=True).ngroup().to_numpy()
+    _, first_rows = np.unique(group_ids, return_index=True)
+    return first_rows, group_ids
+
+
+def incidence_table(rng, row_count=200):
+    return pd.DataFrame(
+        {
+            "num_hh": np.ones(row_count, dtype=np.int8),
+            "hh_size": rng.integers(1, 4, row_count).astype(np.int16),
+            "workers": rng.integers(-1, 2, row_count),
+            "income": rng.choice([0.5, 1.5, 2.5], row_count),
+            "tenure": rng.choice(["own", "rent"], row_count),
+            "PUMA": rng.choice([600, 601, 700], row_count),
+        },
+        index=pd.Index(rng.permutation(1000)[:row_count], name="hh_id"),
+    )
+
+
+def test_incidence_signature_groups():
+
+    rng = np.random.default_rng(0)
+    df = incidence_table(rng)
+    columns = ["num_hh", "hh_size", "workers", "income", "tenure", "PUMA"]
+
+    first_rows, group_ids = incidence_signature_groups(df, columns)
+    expected_first_rows, expected_group_ids = expected_groups(df, columns)
+
+    # some rows share a signature
+    assert len(first_rows) < len(df.index)
+    npt.assert_array_equal(group_ids, expected_group_ids)
+    npt.assert_array_equal(first_rows, expected_first_rows)
+
+
+def test_incidence_signature_groups_wide_keys():
+
+    # radix product of these columns does not fit in uint64, so rows of codes are compared
+    rng = np.random.default_rng(1)
+    df = incidence_table(rng)
+    for i in range(3):
+        df["big_%s" % i] = rng.choice([-(2**40), 0, 2**40], len(df.index))
+    columns = ["big_0", "hh_size", "big_1", "tenure", "big_2", "PUMA"]
+
+    radixes = [
+        int(df[c].max()) - int(df[c].min()) + 1 for c in ["big_0", "big_1", "big_2"]
+    ]
+    assert np.prod(radixes, dtype=object) > np.iinfo(np.uint64).max
+
+    first_rows, group_ids = incidence_signature_groups(df, columns)
+    expected_first_rows, expected_group_ids = expected_groups(df, columns)
+
+    npt.assert_array_equal(group_ids, expected_group_ids)
+    npt.assert_array_equal(first_rows, expected_first_rows)
+
+
+@pytest.mark.parametrize("row_count", [0, 1])
+def test_incidence_signature_groups_small(row_count):
+
+    df = incidence_table(np.random.default_rng(2), row_count)
+    columns = ["hh_size", "workers", "tenure"]
+
+    first_rows, group_ids = incidence_signature_groups(df, columns)
+
+    assert len(group_ids) == row_count
+    npt.assert_array_equal(first_rows, np.arange(row_count))
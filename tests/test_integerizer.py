@@ -7,11 +7,16 @@ import pandas as pd
 
 from populationsim.core import inject, config
 
-from populationsim.integerizing import do_integerizing
+import numpy as np
 
+from populationsim.integerizing import do_integerizing, np_integerize
+from populationsim.integerizing.constants import STATUS_SUCCESS
+from populationsim.integerizing.presolve import HouseholdGroups
 
+
+@pytest.mark.parametrize("presolve", [False, True], ids=["full", "presolve"])
 @pytest.mark.parametrize("use_cvpxy", [True, False], ids=["cvxpy", "ortools"])
-def test_integerizer(use_cvpxy):
+def test_integerizer(use_cvpxy, presolve):
     example_dir = Path(__file__).parent.parent / "examples"
 
     configs_dir = example_dir / "example_test" / "configs"
@@ -64,6 +69,7 @@ def test_integerizer(use_cvpxy):
     config.override_setting(
         "USE_CVXPY", use_cvpxy  # use ortools integerizer instead of cvxpy
     )
+    config.override_setting("INTEGERIZER_PRESOLVE", presolve)
     integerized_weights, status = do_integerizing(
         trace_label="label",
         control_spec=control_spec,
@@ -73,14 +79,181 @@ def test_integerizer(use_cvpxy):
         total_hh_control_col="num_hh",
     )
 
+    config.override_setting("INTEGERIZER_PRESOLVE", False)
+
     print("do_integerizing status", status)
     print("sum", integerized_weights.sum())
     print("do_integerizing integerized_weights\n", integerized_weights)
 
     assert integerized_weights.sum() == 100
+    assert (integerized_weights >= incidence_table["float_weights"].astype(int)).all()
 
     # exact outcome is variable from version to version of ortools integerizer!
     # ortools cbc
     # assert (integerized_weights.values == [
     #      1, 26, 8, 28, 18, 8, 2, 9,
     # ]).all()
+
+
+def test_household_groups():
+    incidence = np.array([[1, 0], [0, 1], [1, 0], [1, 0], [0, 1]])
+    groups = HouseholdGroups(incidence)
+
+    assert groups.group_count == 2
+    assert groups.first_rows.tolist() == [0, 1]
+    assert groups.group_ids.tolist() == [0, 1, 0, 0, 1]
+
+    x_max = np.array([[1.0, 1.0, 0.0, 1.0, 1.0], [1.0, 0.0, 1.0, 1.0, 0.0]])
+    resid_weights = np.array([[0.2, 0.5, 0.0, 0.8, 0.1], [0.3, 0.0, 0.6, 0.9, 0.0]])
+
+    assert groups.sum(x_max).tolist() == [[2.0, 2.0], [3.0, 0.0]]
+
+    merged = groups.resid_weights(resid_weights, x_max)
+    assert np.allclose(merged, [[0.4, np.sqrt(0.05)], [np.cbrt(0.162), 1.0]])
+
+    # each group's solution goes to its members with the largest residual weights first
+    x = groups.disaggregate(np.array([[1.5, 1.0], [2.0, 0.0]]), x_max, resid_weights)
+    assert x.tolist() == [[0.5, 1.0, 0.0, 1.0, 0.0], [0.0, 0.0, 1.0, 1.0, 0.0]]
+
+
+def test_cvx_problem_cache(monkeypatch):
+    from populationsim.integerizing import lp_cvx
+
+    monkeypatch.setattr(lp_cvx, "CVX_PROBLEM_CACHE_SIZE", 2)
+    lp_cvx.problem_cache().clear()
+
+    def integerize(sample_count, lp_right_hand_side):
+        incidence = np.vstack([np.ones(sample_count), np.arange(sample_count) % 2])
+        resid_weights = np.linspace(0.9, 0.1, sample_count)
+        return lp_cvx.np_integerizer_cvx(
+            incidence=incidence,
+            resid_weights=resid_weights,
+            log_resid_weights=np.log(resid_weights),
+            control_importance_weights=np.array([0.0, 1000.0]),
+            total_hh_control_index=0,
+            lp_right_hand_side=np.array(lp_right_hand_side, dtype=float),
+            relax_ge_upper_bound=np.array([0.0, 2.0]),
+            hh_constraint_ge_bound=np.full(2, float(sample_count)),
+            timeout_in_seconds=60,
+        )
+
+    # zones of the same shape reuse the cached problem with their own parameter values
+    x, status = integerize(4, [2, 1])
+    problem = lp_cvx.problem_cache()["integerizer", 4, 2]
+    assert status == "OPTIMAL"
+    assert np.allclose(x, [1, 1, 0, 0])
+
+    x, status = integerize(4, [5, 1])
+    assert status == "INFEASIBLE"
+
+    x, status = integerize(4, [2, 2])
+    assert lp_cvx.problem_cache()["integerizer", 4, 2] is problem
+    assert status == "OPTIMAL"
+    assert np.allclose(x, [0, 1, 0, 1])
+
+    # least recently used problems are dropped
+    integerize(5, [2, 1])
+    integerize(6, [2, 1])
+    assert list(lp_cvx.problem_cache()) == [
+        ("integerizer", 5, 2),
+        ("integerizer", 6, 2),
+    ]
+
+    lp_cvx.problem_cache().clear()
+
+
+@pytest.mark.parametrize("use_cvpxy", [True, False], ids=["cvxpy", "ortools"])
+def test_integerizer_solution_hint(use_cvpxy):
+    from populationsim.integerizing import lp_cvx, lp_ortools
+
+    integerizer_func = (
+        lp_cvx.np_integerizer_cvx if use_cvpxy else lp_ortools.np_integerizer_ortools
+    )
+
+    incidence = np.array([[1, 1, 1, 1, 1], [1, 0, 1, 0, 1]], dtype=float)
+    resid_weights = np.array([0.9, 0.7, 0.0, 0.5, 0.2])
+
+    def integerize(x_hint):
+        return integerizer_func(
+            incidence=incidence,
+            resid_weights=resid_weights,
+            log_resid_weights=np.log(np.maximum(resid_weights, np.exp(-725))),
+            control_importance_weights=np.array([0.0, 1000.0]),
+            total_hh_control_index=0,
+            lp_right_hand_side=np.array([2.0, 1.0]),
+            relax_ge_upper_bound=np.array([0.0, 2.0]),
+            hh_constraint_ge_bound=np.array([5.0, 5.0]),
+            timeout_in_seconds=60,
+            x_hint=x_hint,
+        )
+
+    x, status = integerize(None)
+    assert status == "OPTIMAL"
+    assert np.allclose(x, [1, 1, 0, 0, 0])
+
+    # hints are a starting point only, infeasible ones included
+    for x_hint in [x, np.array([1.0, 0.0, 1.0, 1.0, 0.0])]:
+        hinted_x, status = integerize(x_hint)
+        assert status == "OPTIMAL"
+        assert np.allclose(hinted_x, x)
+
+
+@pytest.mark.parametrize("use_cvpxy", [True, False], ids=["cvxpy", "ortools"])
+def test_np_integerize(use_cvpxy):
+    example_dir = Path(__file__).parent.parent / "examples"
+    inject.add_injectable("configs_dir", example_dir / "example_test" / "configs")
+
+    incidence = np.array(
+        [
+            [1, 1, 1, 1, 1, 1, 1, 1],
+            [1, 1, 1, 0, 0, 0, 0, 0],
+            [0, 0, 0, 1, 1, 1, 1, 1],
+            [1, 1, 2, 1, 0, 1, 2, 1],
+            [1, 0, 1, 0, 2, 1, 1, 1],
+            [1, 1, 0, 2, 1, 0, 2, 0],
+        ],
+        dtype=np.float64,
+    )
+    float_weights = np.array(
+        [
+            1.362893,
+            25.65829,
+            7.978812,
+            27.789651,
+            18.451021,
+            8.641589,
+            1.476104,
+            8.641589,
+        ]
+    )
+    relaxed_control_totals = np.array([100, 35, 65, 91, 65, 104], dtype=np.float64)
+
+    # float64 inputs are not copied by conversion, so must not be changed by integerizing
+    control_importance_weights = pd.Series(
+        [10000000, 1000, 1000, 1000, 1000, 1000], dtype=np.float64
+    )
+    inputs = [
+        incidence,
+        float_weights,
+        relaxed_control_totals,
+        control_importance_weights,
+    ]
+    copies = [value.copy() for value in inputs]
+
+    integerized_weights, status = np_integerize(
+        incidence,
+        float_weights,
+        relaxed_control_totals=relaxed_control_totals,
+        control_importance_weights=control_importance_weights,
+        total_hh_control_value=100,
+        total_hh_control_index=0,
+        control_is_hh_based=np.array([True, True, True, False, False, False]),
+        use_cvxpy=use_cvpxy,
+    )
+
+    assert status in STATUS_SUCCESS
+    assert integerized_weights.sum() == 100
+    assert (integerized_weights >= float_weights.astype(int)).all()
+
+    for value, copy in zip(inputs, copies):
+        np.testing.assert_array_equal(value, copy)
@@ -0,0 +1,133 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+from populationsim.core import inject, mem
+from populationsim.steps.write_synthetic_population import merge_seed_data
+
+GB = 1024**3
+
+
+def setup_function():
+    inject.reinject_decorated_tables()
+    inject.remove_injectable("num_processes")
+    inject.clear_cache()
+
+
+def teardown_function(func):
+    inject.remove_injectable("num_processes")
+    inject.clear_cache()
+    inject.reinject_decorated_tables()
+
+
+def test_trace_step_memory(tmp_path):
+
+    inject.add_injectable("settings", {"trace_step_memory": True})
+    inject.add_injectable("output_dir", str(tmp_path))
+
+    with mem.trace_step_memory("expand_households"):
+        data = np.ones(16 * 1024**2)  # 128 MB
+        time.sleep(3 * mem.STEP_MEM_SAMPLE_INTERVAL)
+        del data
+
+    df = pd.read_csv(tmp_path / mem.STEP_MEM_LOG_FILE_NAME)
+    assert df.model.tolist() == ["expand_households"]
+    assert df.peak_rss_delta.iloc[0] >= 64 * 1024**2
+    assert df.peak_rss.iloc[0] >= df.end_rss.iloc[0]
+    assert mem.STEP_PEAK_RSS["expand_households"] == df.peak_rss.iloc[0]
+
+    mem.trace_table_size("expand_households", "households", pd.DataFrame({"a": [1]}))
+    df = pd.read_csv(tmp_path / mem.TABLE_MEM_LOG_FILE_NAME)
+    assert df.table.tolist() == ["households"]
+    assert df["size"].iloc[0].startswith("(1, 1) ")
+
+
+def test_trace_step_memory_disabled(tmp_path):
+
+    inject.add_injectable("settings", {})
+    inject.add_injectable("output_dir", str(tmp_path))
+    mem.STEP_PEAK_RSS.pop("sub_balancing", None)
+
+    with mem.trace_step_memory("sub_balancing"):
+        pass
+    mem.trace_table_size("sub_balancing", "households", pd.DataFrame({"a": [1]}))
+
+    assert "sub_balancing" not in mem.STEP_PEAK_RSS
+    assert list(tmp_path.iterdir()) == []
+
+    # peak rss is sampled for memory_budget scheduling, but not logged
+    inject.add_injectable("settings", {"memory_budget": 1000 * GB})
+    with mem.trace_step_memory("sub_balancing"):
+        pass
+
+    assert mem.STEP_PEAK_RSS["sub_balancing"] > 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_memory_budget():
+
+    inject.add_injectable("settings", {})
+    assert mem.memory_budget() is None
+    assert mem.budget_chunk_rows(10**9, 1000, "test") == 10**9
+    assert not mem.near_memory_budget("test")
+
+    inject.add_injectable("settings", {"memory_budget": 1000 * GB})
+    assert mem.budget_chunk_rows(10**6, 100, "test") == 10**6
+
+    # sub-processes share the budget
+    inject.add_injectable("num_processes", 4)
+    assert mem.memory_budget() == 250 * GB
+
+    inject.add_injectable("settings", {"memory_budget": 1})
+    assert mem.near_memory_budget("test")
+    assert mem.budget_chunk_rows(10**6, 100, "test") == mem.MEMORY_BUDGET_MIN_CHUNK_ROWS
+    assert mem.budget_chunk_rows(100, 100, "test") == 100
+
+
+def test_processes_within_budget():
+
+    inject.add_injectable("settings", {"memory_budget": 10 * GB})
+    assert mem.processes_within_budget(8, None, "test") == 8
+    assert mem.processes_within_budget(8, 3 * GB, "test") == 3
+    assert mem.processes_within_budget(8, 20 * GB, "test") == 1
+    assert mem.processes_within_budget(2, 1 * GB, "test") == 2
+
+
+def test_merge_seed_data_chunks(monkeypatch):
+
+    expanded_household_ids = pd.DataFrame(
+        {"PUMA": 100, "TAZ": np.arange(6) // 2, "hh_id": [1, 2, 3, 1, 4, 2]}
+    )
+    expanded_household_ids["synthetic_hh_id"] = expanded_household_ids.index + 1
+
+    # household 4 has no persons
+    persons = pd.DataFrame(
+        {
+            "hh_id": [1, 1, 2, 3, 3, 3],
+            "per_num": [1, 2, 1, 1, 2, 3],
+            "age": [30, 28, 70, 45, 12, 8],
+            "PUMA": 100,
+        }
+    )
+
+    def merged(settings):
+        inject.add_injectable(
+            "settings", dict(settings, seed_geography="PUMA", household_id_col="hh_id")
+        )
+        return list(
+            merge_seed_data(
+                expanded_household_ids, persons, ["hh_id", "per_num", "age"], "persons"
+            )
+        )
+
+    (df,) = merged({})
+
+    monkeypatch.setattr(mem, "MEMORY_BUDGET_MIN_CHUNK_ROWS", 4)
+    chunks = merged({"memory_budget": 1})
+
+    assert [len(chunk.index) for chunk in chunks] == [4, 4, 2]
+    # all chunks upcast age for the unmatched household, not just the one that has it
+    assert all(chunk.age.dtype == np.float64 for chunk in chunks)
+    pdt.assert_frame_equal(pd.concat(chunks, ignore_index=True), df)
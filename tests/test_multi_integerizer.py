@@ -3,14 +3,23 @@
 
 import pytest
 from pathlib import Path
+import numpy as np
 import pandas as pd
 
-from populationsim.core import inject, config
+from populationsim.core import inject, config, time_budget
 
 from populationsim.integerizing import (
     do_simul_integerizing,
     do_sequential_integerizing,
+    np_simul_integerize,
 )
+from populationsim.integerizing.constants import STATUS_SUCCESS
+from populationsim.integerizing.feasibility import (
+    RESID_SUM_MISMATCH,
+    infeasible_sub_zones,
+)
+from populationsim.integerizing.simul_integerizer import SimulIntegerizer, block_lp
+from populationsim.integerizing.wrappers import screen_simul_integerizing
 
 example_dir = Path(__file__).parent.parent / "examples"
 configs_dir = example_dir / "example_test" / "configs"
@@ -136,17 +145,19 @@ control_spec = pd.DataFrame(
 sub_control_zones = pd.Series(["TRACT_1", "TRACT_2"], index=[1, 2])
 
 
+@pytest.mark.parametrize("presolve", [False, True], ids=["full", "presolve"])
 @pytest.mark.parametrize(
     "use_cvpxy",
     [True, False],
     ids=["use_cvpxy", "use_ortools"],
 )
-def test_simul_integerizer(use_cvpxy):
+def test_simul_integerizer(use_cvpxy, presolve):
     inject.add_injectable("configs_dir", configs_dir)
 
     config.override_setting(
         "USE_CVXPY", use_cvpxy  # use ortools integerizer instead of cvxpy
     )
+    config.override_setting("INTEGERIZER_PRESOLVE", presolve)
     integer_weights_df = do_simul_integerizing(
         trace_label="label",
         incidence_df=incidence_df,
@@ -157,6 +168,7 @@ def test_simul_integerizer(use_cvpxy):
         sub_geography="TRACT",
         sub_control_zones=sub_control_zones,
     )
+    config.override_setting("INTEGERIZER_PRESOLVE", False)
 
     assert (
         integer_weights_df.integer_weight.values
@@ -194,3 +206,272 @@ def test_sequential_integerizer(use_cvpxy):
         integer_weights_df.integer_weight.values
         == [0, 14, 10, 49, 1, 1, 0, 0, 0, 0, 46, 29]
     ).all()
+
+
+def test_screen_simul_integerizing():
+    inject.add_injectable("configs_dir", configs_dir)
+
+    infeasible = screen_simul_integerizing(
+        incidence_df=incidence_df,
+        sub_weights=sub_zone_weights,
+        sub_controls_df=sub_controls_df,
+        control_spec=control_spec,
+        total_hh_control_col="num_hh",
+    )
+
+    assert len(infeasible) == 0
+
+
+def test_infeasible_sub_zones_parent_total_hh_control():
+
+    # one sub zone must round up one of its two households, whose parent controls are a
+    # total households control (with no room above its lp_right_hand_side) and persons
+    def reasons(total_hh_parent_control_index, persons_bound=10.0):
+        return infeasible_sub_zones(
+            sub_int_weights=np.array([[1, 2]]),
+            sub_float_weights=np.array([[1.5, 2.5]]),
+            sub_incidence=np.array([[1.0], [1.0]]),
+            lp_right_hand_side=np.array([[1.0]]),
+            relax_ge_upper_bound=np.array([[0.0]]),
+            hh_constraint_ge_bound=np.array([[2.0]]),
+            total_hh_sub_control_index=0,
+            parent_incidence=np.array([[1.0, 2.0], [1.0, 3.0]]),
+            parent_lp_right_hand_side=np.array([0.0, 5.0]),
+            parent_hh_constraint_ge_bound=np.array([0.0, persons_bound]),
+            total_hh_parent_control_index=total_hh_parent_control_index,
+        ).tolist()
+
+    # the LP has no constraints for the parent total households control
+    assert reasons(0) == [""]
+    assert reasons(-1) == [RESID_SUM_MISMATCH]
+
+    # other parent controls are still checked
+    assert reasons(0, persons_bound=0.0) == [RESID_SUM_MISMATCH]
+
+
+@pytest.mark.parametrize(
+    "use_cvpxy",
+    [True, False],
+    ids=["use_cvpxy", "use_ortools"],
+)
+def test_simul_integerizer_screened(use_cvpxy):
+    inject.add_injectable("configs_dir", configs_dir)
+
+    config.override_setting("USE_CVXPY", use_cvpxy)
+
+    # TRACT_3 must round up one of its two households with residual weights, but both
+    # contribute to a household size control whose total is already met
+    weights = sub_zone_weights.copy()
+    weights["TRACT_3"] = [0.0, 0.0, 9.3, 48.3, 0.0, 0.0]
+    controls = pd.concat(
+        [
+            sub_controls_df,
+            pd.DataFrame(
+                {
+                    "num_hh": [58],
+                    "hh_size_1": [0],
+                    "hh_size_2": [0],
+                    "hh_size_3": [48],
+                    "hh_size_4_plus": [9],
+                    "students_by_housing_type": [76],
+                    "hh_by_type": [58],
+                },
+                index=pd.Index([3], name="TRACT"),
+            ),
+        ]
+    )
+    zones = pd.Series(["TRACT_1", "TRACT_2", "TRACT_3"], index=[1, 2, 3])
+
+    infeasible = screen_simul_integerizing(
+        incidence_df=incidence_df,
+        sub_weights=weights,
+        sub_controls_df=controls,
+        control_spec=control_spec,
+        total_hh_control_col="num_hh",
+    )
+
+    assert infeasible.to_dict() == {3: RESID_SUM_MISMATCH}
+
+    integer_weights_df = do_simul_integerizing(
+        trace_label="label",
+        incidence_df=incidence_df,
+        sub_weights=weights,
+        sub_controls_df=controls,
+        control_spec=control_spec,
+        total_hh_control_col="num_hh",
+        sub_geography="TRACT",
+        sub_control_zones=zones,
+    )
+
+    # feasible zones are simul integerized as before, TRACT_3 is smart rounded
+    assert (
+        integer_weights_df.integer_weight.values[:12]
+        == [0, 14, 10, 49, 1, 1, 0, 0, 0, 0, 46, 29]
+    ).all()
+    rounded_df = integer_weights_df[integer_weights_df.TRACT == 3]
+    assert rounded_df.integer_weight.sum() == 58
+    assert (rounded_df.integer_weight >= rounded_df.balanced_weight.astype(int)).all()
+
+
+@pytest.mark.parametrize(
+    "use_cvpxy",
+    [True, False],
+    ids=["use_cvpxy", "use_ortools"],
+)
+def test_simul_integerizer_presolve_duplicates(use_cvpxy):
+    inject.add_injectable("configs_dir", configs_dir)
+
+    config.override_setting("USE_CVXPY", use_cvpxy)
+    config.override_setting("INTEGERIZER_PRESOLVE", True)
+
+    # split each household in two identical households with half its weight
+    duplicates_df = pd.concat(
+        [incidence_df, incidence_df.set_index(incidence_df.index + 1)]
+    )
+    weights = pd.concat(
+        [
+            sub_zone_weights / 2,
+            (sub_zone_weights / 2).set_index(sub_zone_weights.index + 1),
+        ]
+    )
+
+    integer_weights_df = do_simul_integerizing(
+        trace_label="label",
+        incidence_df=duplicates_df,
+        sub_weights=weights,
+        sub_controls_df=sub_controls_df,
+        control_spec=control_spec,
+        total_hh_control_col="num_hh",
+        sub_geography="TRACT",
+        sub_control_zones=sub_control_zones,
+    )
+    config.override_setting("INTEGERIZER_PRESOLVE", False)
+
+    totals = integer_weights_df.groupby("TRACT").integer_weight.sum()
+    assert totals.tolist() == [75, 75]
+    assert (
+        integer_weights_df.integer_weight
+        >= integer_weights_df.balanced_weight.astype(int)
+    ).all()
+
+
+@pytest.mark.parametrize(
+    "use_cvpxy",
+    [True, False],
+    ids=["use_cvpxy", "use_ortools"],
+)
+def test_simul_integerizer_time_budget(use_cvpxy):
+    inject.add_injectable("configs_dir", configs_dir)
+
+    config.override_setting("USE_CVXPY", use_cvpxy)
+    config.override_setting("INTEGERIZER_TIME_BUDGET", 0.01)
+    time_budget.reset()
+
+    integer_weights_df = do_simul_integerizing(
+        trace_label="label",
+        incidence_df=incidence_df,
+        sub_weights=sub_zone_weights,
+        sub_controls_df=sub_controls_df,
+        control_spec=control_spec,
+        total_hh_control_col="num_hh",
+        sub_geography="TRACT",
+        sub_control_zones=sub_control_zones,
+    )
+    downgrades = time_budget.downgrades()
+
+    config.override_setting("INTEGERIZER_TIME_BUDGET", None)
+    time_budget.reset()
+
+    # no time to solve, so all sub zones are smart rounded (without sequential integerizing)
+    assert downgrades == [(None, "label")]
+    totals = integer_weights_df.groupby("TRACT").integer_weight.sum()
+    assert totals.tolist() == sub_controls_df.num_hh.tolist()
+    assert (
+        integer_weights_df.integer_weight
+        >= integer_weights_df.balanced_weight.astype(int)
+    ).all()
+
+
+@pytest.mark.parametrize("threads", [1, 2])
+@pytest.mark.parametrize(
+    "use_cvpxy",
+    [True, False],
+    ids=["use_cvpxy", "use_ortools"],
+)
+def test_simul_integerizer_blocks(use_cvpxy, threads):
+    inject.add_injectable("configs_dir", configs_dir)
+
+    config.override_setting("USE_CVXPY", use_cvpxy)
+    config.override_setting("SIMUL_INTEGERIZER_BLOCK_SIZE", 1)
+    config.override_setting("SIMUL_INTEGERIZER_BLOCK_THREADS", threads)
+
+    integer_weights_df = do_simul_integerizing(
+        trace_label="label",
+        incidence_df=incidence_df,
+        sub_weights=sub_zone_weights,
+        sub_controls_df=sub_controls_df,
+        control_spec=control_spec,
+        total_hh_control_col="num_hh",
+        sub_geography="TRACT",
+        sub_control_zones=sub_control_zones,
+    )
+    config.override_setting("SIMUL_INTEGERIZER_BLOCK_SIZE", 0)
+    config.override_setting("SIMUL_INTEGERIZER_BLOCK_THREADS", 1)
+
+    # TRACT_1 is integerized to its share of the parent controls, and TRACT_2 to the rest
+    assert (
+        integer_weights_df.integer_weight.values
+        == [0, 14, 10, 49, 1, 1, 0, 0, 0, 0, 46, 29]
+    ).all()
+
+
+def test_simul_integerizer_block_lp():
+    inject.add_injectable("configs_dir", configs_dir)
+
+    integerizer = SimulIntegerizer(
+        incidence_df,
+        sub_zone_weights,
+        sub_controls_df,
+        control_spec,
+        "num_hh",
+    )
+    lp = integerizer.lp_problem()
+
+    # a block of all sub zones has the LP's own parent controls
+    block = block_lp(lp, np.arange(2))
+    for name, value in lp.items():
+        assert np.array_equal(block[name], value), name
+
+    # blocks have the sub zone rows of their own sub zones, and parent controls apportioned
+    # by their balanced weights, unless given
+    block = block_lp(lp, np.array([1]))
+    assert np.array_equal(block["lp_right_hand_side"], lp["lp_right_hand_side"][[1]])
+    parent_lp_right_hand_side = np.round(
+        np.dot(sub_zone_weights.TRACT_2.values, block["parent_incidence"])
+    ) - np.dot(sub_zone_weights.TRACT_2.values.astype(int), block["parent_incidence"])
+    assert np.array_equal(block["parent_lp_right_hand_side"], parent_lp_right_hand_side)
+
+    block = block_lp(lp, np.array([1]), np.array([2.0, -1.0, 3.0]))
+    assert block["parent_lp_right_hand_side"].tolist() == [2.0, 0.0, 3.0]
+
+
+def test_np_simul_integerize():
+    inject.add_injectable("configs_dir", configs_dir)
+
+    sub_cols = sub_controls_df.columns
+    parent_cols = control_spec.target[~control_spec.target.isin(sub_cols)]
+    importance = control_spec.set_index("target").importance
+
+    # household 0 has zero weight in both sub zones, and is integerized to zero
+    integerized_weights, status = np_simul_integerize(
+        incidence_df[sub_cols].values.T,
+        incidence_df[parent_cols].values.T,
+        sub_zone_weights.values.T,
+        sub_controls_df.values,
+        importance[sub_cols].values,
+        importance[parent_cols].values,
+        sub_cols.get_loc("num_hh"),
+    )
+
+    assert status in STATUS_SUCCESS
+    assert integerized_weights.tolist() == [[0, 14, 10, 49, 1, 1], [0, 0, 0, 0, 46, 29]]
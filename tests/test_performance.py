@@ -0,0 +1,173 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+from orca import orca
+
+from populationsim.balancing import do_balancing
+from populationsim.core import inject, performance
+from populationsim.integerizing import do_integerizing
+
+
+def setup_function():
+    inject.reinject_decorated_tables()
+    inject.clear_cache()
+    performance.clear()
+
+
+def teardown_function(func):
+    performance.clear()
+    inject.clear_cache()
+    inject.reinject_decorated_tables()
+
+
+@performance.recorded("integerizing")
+def integerize(households, status):
+    performance.update(households=households)
+    if status != "OPTIMAL":
+        performance.add_fallback("smart_round")
+    performance.update(status=status)
+    return status
+
+
+@performance.recorded("simul_integerizing")
+def simul_integerize(zone_ids):
+    performance.update(households=10, sub_zones=len(zone_ids))
+    performance.add_fallback("sequential_integerizing")
+    for zone_id in zone_ids:
+        with performance.zone("TAZ", zone_id):
+            integerize(5, "INFEASIBLE" if zone_id == 2 else "OPTIMAL")
+
+
+def test_performance_table(tmp_path):
+
+    inject.add_injectable(
+        "settings",
+        {"PERFORMANCE_TELEMETRY": True, "PERFORMANCE_TELEMETRY_EXPORT": "csv"},
+    )
+    inject.add_injectable("output_dir", str(tmp_path))
+
+    with performance.zone("TRACT", 10):
+        simul_integerize([1, 2])
+
+    # calls outside a zone are recorded without geography
+    integerize(3, "OPTIMAL")
+
+    performance.write_table("sub_balancing.geography=TAZ")
+
+    table_name = "performance_sub_balancing_geography_TAZ"
+    df = inject.get_table(table_name).to_frame()
+
+    assert df.kind.tolist() == [
+        "simul_integerizing",
+        "integerizing",
+        "integerizing",
+        "integerizing",
+    ]
+    assert df.geography.tolist()[:3] == ["TRACT", "TAZ", "TAZ"]
+    assert df.zone_id.tolist()[:3] == [10, 1, 2]
+    assert df.geography.iloc[3] == ""
+    assert df.fallbacks.tolist() == ["sequential_integerizing", "", "smart_round", ""]
+    assert (df.model == "sub_balancing.geography=TAZ").all()
+    assert df.columns[-2:].tolist() == ["fallbacks", "seconds"]
+
+    # enclosing call takes at least as long as the calls it makes
+    assert df.seconds.iloc[0] >= df.seconds.iloc[1:3].sum()
+
+    exported = pd.read_csv(tmp_path / ("%s.csv" % table_name), keep_default_na=False)
+    pdt.assert_series_equal(exported.status, df.status.fillna(""), check_dtype=False)
+
+    # records are cleared once written
+    performance.write_table("summarize")
+    assert "performance_summarize" not in orca.list_tables()
+
+
+def test_performance_disabled():
+
+    inject.add_injectable("settings", {})
+
+    assert integerize(3, "INFEASIBLE") == "INFEASIBLE"
+
+    performance.write_table("integerize_final_seed_weights")
+    assert "performance_integerize_final_seed_weights" not in orca.list_tables()
+
+
+def test_performance_table_name():
+
+    for model_name in ["sub_balancing.geography=TAZ", "summarize", "repop_balancing."]:
+        assert performance.performance_table_name(model_name).isidentifier()
+
+
+def test_performance_table_recorded_calls(tmp_path):
+
+    inject.add_injectable("settings", {"PERFORMANCE_TELEMETRY": True})
+
+    control_spec = pd.DataFrame(
+        {
+            "target": ["num_hh", "hh_1", "hh_2", "p1", "p2", "p3"],
+            "seed_table": ["households"] * 3 + ["persons"] * 3,
+            "importance": [10000000, 1000, 1000, 1000, 1000, 1000],
+        }
+    )
+    incidence_df = pd.DataFrame(
+        {
+            "num_hh": [1, 1, 1, 1, 1, 1, 1, 1],
+            "hh_1": [1, 1, 1, 0, 0, 0, 0, 0],
+            "hh_2": [0, 0, 0, 1, 1, 1, 1, 1],
+            "p1": [1, 1, 2, 1, 0, 1, 2, 1],
+            "p2": [1, 0, 1, 0, 2, 1, 1, 1],
+            "p3": [1, 1, 0, 2, 1, 0, 2, 0],
+        }
+    )
+    control_totals = pd.Series(
+        [100, 35, 65, 91, 65, 104], index=control_spec.target.values
+    )
+
+    with performance.zone("PUMA", 600):
+        status, weights, _ = do_balancing(
+            control_spec=control_spec,
+            total_hh_control_col="num_hh",
+            max_expansion_factor=None,
+            min_expansion_factor=None,
+            absolute_upper_bound=None,
+            absolute_lower_bound=None,
+            incidence_df=incidence_df,
+            control_totals=control_totals,
+            initial_weights=pd.Series(np.ones(8)),
+            use_hard_constraints=False,
+            use_numba=False,
+            numba_precision="float64",
+        )
+        _, integerizer_status = do_integerizing(
+            trace_label="PUMA_600",
+            control_spec=control_spec,
+            control_totals=control_totals,
+            incidence_table=incidence_df,
+            float_weights=weights.final,
+            total_hh_control_col="num_hh",
+        )
+
+    performance.write_table("final_seed_balancing")
+
+    df = inject.get_table("performance_final_seed_balancing").to_frame()
+
+    assert df.kind.tolist() == ["balancing", "integerizing"]
+    assert df.geography.tolist() == ["PUMA", "PUMA"]
+    assert df.zone_id.tolist() == [600, 600]
+    assert df.households.tolist() == [8, 8]
+    assert df.controls.tolist() == [6, 6]
+    assert df.converged.iloc[0] == float(status["converged"])
+    assert pd.isna(df.converged.iloc[1])
+    assert df.iterations.iloc[0] == status["iter"]
+    assert df.status.tolist() == ["", integerizer_status]
+    assert (df.seconds > 0).all()
+
+    # no object columns for PyTables to pickle
+    assert set(df.dtypes.map(lambda dtype: dtype.kind)) <= set("fiO")
+    for column in df.select_dtypes(include="object").columns:
+        assert df[column].map(type).eq(str).all(), column
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", pd.errors.PerformanceWarning)
+        df.to_hdf(tmp_path / "performance.h5", key="performance_final_seed_balancing")
@@ -0,0 +1,93 @@
+import os
+import pstats
+
+import pandas as pd
+import pytest
+
+from populationsim.core import inject, profiling
+
+
+def setup_function():
+    inject.reinject_decorated_tables()
+    inject.remove_injectable("profile_dir")
+    inject.clear_cache()
+
+
+def teardown_function(func):
+    inject.remove_injectable("profile_dir")
+    inject.clear_cache()
+    inject.reinject_decorated_tables()
+
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+
+def test_instrument_step():
+
+    inject.add_injectable("settings", {"instrument": ["sub_balancing"]})
+    assert profiling.instrument_step("sub_balancing.geography=TAZ", "sub_balancing")
+    assert not profiling.instrument_step("summarize", "summarize")
+
+    inject.add_injectable("settings", {"instrument": True})
+    assert profiling.instrument_step("summarize", "summarize")
+
+    inject.add_injectable("settings", {})
+    assert not profiling.instrument_step("summarize", "summarize")
+
+
+def test_instrumented_cprofile(tmp_path):
+
+    inject.add_injectable(
+        "settings", {"instrument": ["summarize"], "instrument_profiler": "cprofile"}
+    )
+    inject.add_injectable("output_dir", str(tmp_path))
+
+    with profiling.instrumented("sub_balancing.geography=TAZ", "sub_balancing"):
+        busy(10000)
+    with profiling.instrumented("summarize", "summarize"):
+        busy(10000)
+
+    assert os.listdir(profiling.profile_dir()) == ["summarize.prof"]
+
+    inject.add_injectable("settings", {"instrument": True, "instrument_profiler": "x"})
+    with pytest.raises(RuntimeError, match="instrument_profiler"):
+        with profiling.instrumented("summarize", "summarize"):
+            pass
+
+
+def test_profiled(tmp_path):
+
+    inject.add_injectable("settings", {"profile_top_n": 3})
+    inject.add_injectable("output_dir", str(tmp_path))
+
+    with profiling.profiled("sub_balancing.geography=TAZ"):
+        busy(10000)
+    with profiling.profiled("summarize"):
+        busy(10000)
+
+    profile_dir = profiling.profile_dir()
+    assert sorted(os.listdir(profile_dir)) == [
+        "sub_balancing_geography_TAZ.prof",
+        "summarize.prof",
+    ]
+    stats = pstats.Stats(os.path.join(profile_dir, "summarize.prof"))
+    assert any(function == "busy" for (_, _, function) in stats.stats)
+
+    df = pd.read_csv(tmp_path / profiling.HOTSPOTS_FILE_NAME)
+    assert df.model.tolist() == ["sub_balancing.geography=TAZ"] * 3 + ["summarize"] * 3
+    assert df["rank"].tolist() == [1, 2, 3] * 2
+    assert (df.tottime.diff().fillna(0)[df["rank"] > 1] <= 0).all()
+
+
+def test_instrumented_pyinstrument(tmp_path):
+
+    pytest.importorskip("pyinstrument")
+
+    inject.add_injectable("settings", {"instrument": True})
+    inject.add_injectable("output_dir", str(tmp_path))
+
+    with profiling.instrumented("summarize", "summarize"):
+        busy(10000)
+
+    assert os.listdir(profiling.profile_dir()) == ["summarize.html"]
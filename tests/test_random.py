@@ -0,0 +1,88 @@
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+import pytest
+
+from populationsim.core import random
+
+
+def channel_rng(backend, index):
+    rng = random.Random()
+    rng.set_base_seed(42)
+    rng.set_backend(backend)
+    rng.add_channel("households", pd.DataFrame({"x": 0}, index=index))
+    rng.begin_step("expand_households")
+    return rng
+
+
+def test_philox4x32():
+
+    # Random123 known answers for philox4x32-10
+    counters = np.array(
+        [
+            [0, 0, 0, 0],
+            [0xFFFFFFFF] * 4,
+            [0x243F6A88, 0x85A308D3, 0x13198A2E, 0x03707344],
+        ],
+        dtype=np.uint32,
+    )
+    keys = [(0, 0), (0xFFFFFFFF, 0xFFFFFFFF), (0xA4093822, 0x299F31D0)]
+    expected = [
+        [0x6627E8D5, 0xE169C58D, 0xBC57AC4C, 0x9B00DBD8],
+        [0x408F276D, 0x41C83B0E, 0xA20BC7C6, 0x6D5451FD],
+        [0xD16CFE09, 0x94FDCCEB, 0x5001E420, 0x24126EA1],
+    ]
+
+    for counter, key, words in zip(counters, keys, expected):
+        assert random.philox4x32(counter[np.newaxis], key)[0].tolist() == words
+
+
+def test_mt19937_row_streams():
+
+    index = pd.Index([3, 1, 2], name="household_id")
+    rng = channel_rng(random.MT19937, index)
+    channel = rng.get_channel_for_df(index.to_frame())
+
+    rands = rng.random_for_df(index.to_frame(), n=2)
+
+    # each row still replays its own reseeded RandomState stream
+    for row, row_rands in zip(index, rands):
+        seed = (42 + channel.channel_seed + channel.step_seed + row) % random._MAX_SEED
+        npt.assert_array_equal(row_rands, np.random.RandomState(seed).rand(2))
+
+
+def test_philox_row_streams():
+
+    index = pd.Index(np.arange(1000, 1010), name="household_id")
+    df = index.to_frame()
+
+    rands = channel_rng(random.PHILOX, index).random_for_df(df, n=3)
+    assert rands.shape == (10, 3)
+    assert ((rands >= 0) & (rands < 1)).all()
+
+    # rands of a row don't depend on the other rows (e.g. in other processes)
+    rng = channel_rng(random.PHILOX, index)
+    some_rands = rng.random_for_df(df.iloc[[7, 2]], n=1)
+    npt.assert_array_equal(some_rands, rands[[7, 2], :1])
+
+    # and subsequent calls continue each row's stream
+    next_rands = rng.random_for_df(df.iloc[[2]], n=2)
+    npt.assert_array_equal(next_rands, rands[[2], 1:])
+
+    choices = rng.choice_for_df(df, a=5, size=3, replace=False).reshape(10, 3)
+    assert all(len(set(row)) == 3 for row in choices)
+    assert rng.normal_for_df(df, size=2).shape == (10, 2)
+
+
+def test_set_backend():
+
+    rng = random.Random()
+    with pytest.raises(ValueError):
+        rng.set_backend("xorshift")
+
+    rng.set_backend(random.PHILOX)
+    assert isinstance(rng.get_external_rng("expand_households"), np.random.RandomState)
+
+    rng.begin_step("expand_households")
+    with pytest.raises(RuntimeError):
+        rng.set_backend(random.MT19937)
@@ -0,0 +1,89 @@
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+import pandas.testing as pdt
+
+from populationsim.steps.summarize import (
+    rollup_zone_results,
+    weighted_incidence_totals,
+    zone_results,
+)
+
+
+def weight_table():
+    rng = np.random.default_rng(0)
+    # TAZ 3 straddles TRACTs 10 and 11, so TAZs are not nested in TRACTs
+    return pd.DataFrame(
+        {
+            "hh_id": rng.integers(0, 20, 60),
+            "TAZ": np.repeat([1, 2, 3, 3, 4, 5], 10),
+            "TRACT": np.repeat([10, 10, 10, 11, 11, 11], 10),
+            "PUMA": 600,
+            "balanced_weight": rng.uniform(0, 10, 60).astype(np.float32),
+            "integer_weight": rng.integers(0, 10, 60).astype(np.int32),
+        }
+    )
+
+
+def incidence_table():
+    rng = np.random.default_rng(1)
+    return pd.DataFrame(
+        {"num_hh": 1, "hh_size_1": rng.integers(0, 2, 20), "persons": 3},
+        index=pd.Index(np.arange(20), name="hh_id"),
+        dtype=np.int32,
+    )
+
+
+def expected_totals(weights_df, incidence_df, weight_col, geography):
+    weighted = incidence_df.loc[weights_df.hh_id].to_numpy().astype(
+        np.float64
+    ) * weights_df[weight_col].to_numpy().astype(np.float64).reshape(-1, 1)
+    return (
+        pd.DataFrame(weighted, columns=incidence_df.columns)
+        .groupby(weights_df[geography].to_numpy())
+        .sum()
+    )
+
+
+def test_weighted_incidence_totals_float64():
+
+    zone_codes = np.zeros(100000, dtype=np.int64)
+    hh_positions = np.zeros(100000, dtype=np.int64)
+    weights = np.full(100000, 0.1, dtype=np.float32)
+    incidence = np.ones((1, 2), dtype=np.float32)
+
+    totals = weighted_incidence_totals(zone_codes, 1, hh_positions, weights, incidence)
+
+    # accumulated in float64, not float32 (which would be off by more than 1 here)
+    assert totals.dtype == np.float64
+    npt.assert_allclose(totals, 100000 * np.float64(np.float32(0.1)), rtol=1e-12)
+
+    # integer weights and incidence keep their integer result type
+    totals = weighted_incidence_totals(
+        zone_codes, 1, hh_positions, weights.astype(np.int32), incidence.astype(np.int8)
+    )
+    assert totals.dtype == np.int32
+
+
+def test_rollup_zone_results_not_nested():
+
+    weights_df = weight_table()
+    incidence_df = incidence_table()
+
+    for weight_col in ["balanced_weight", "integer_weight"]:
+
+        results_df = zone_results(
+            ["TAZ", "TRACT", "PUMA"], weight_col, "hh_id", weights_df, incidence_df
+        )
+
+        for geography in ["TAZ", "TRACT", "PUMA"]:
+            rolled_up = rollup_zone_results(results_df, geography)
+            expected = expected_totals(weights_df, incidence_df, weight_col, geography)
+
+            assert rolled_up.index.tolist() == expected.index.tolist()
+            pdt.assert_frame_equal(
+                rolled_up.astype(np.float64),
+                expected,
+                check_index_type=False,
+                check_names=False,
+            )
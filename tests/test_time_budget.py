@@ -0,0 +1,95 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import pytest
+
+from populationsim.core import inject, performance, time_budget
+
+MODELS = [
+    "input_pre_processor",
+    "integerize_final_seed_weights",
+    "sub_balancing.geography=TRACT",
+    "sub_balancing.geography=TAZ",
+    "expand_households",
+]
+
+
+@pytest.fixture
+def budget():
+    inject.add_injectable("settings", {"INTEGERIZER_TIME_BUDGET": 90})
+    time_budget.reset(MODELS)
+    yield time_budget.budget()
+    time_budget.reset()
+    inject.add_injectable("settings", {})
+
+
+def test_time_budget_disabled():
+    inject.add_injectable("settings", {})
+    time_budget.reset(MODELS)
+
+    time_budget.begin_step("integerize_final_seed_weights")
+    time_budget.queue(3)
+    with time_budget.zone():
+        assert time_budget.timeout(60, size=100) == 60
+
+    assert time_budget.budget() is None
+    assert time_budget.downgrades() == []
+
+
+def test_time_budget_shares(budget):
+
+    # non integerizing steps don't get a share
+    time_budget.begin_step("input_pre_processor")
+    assert budget.step_seconds is None
+
+    # the budget is split evenly with the integerizing steps still to run
+    time_budget.begin_step("integerize_final_seed_weights")
+    assert budget.step_seconds == 30
+
+    time_budget.queue(3)
+    with time_budget.zone():
+        assert time_budget.timeout(60, size=100) == 10
+        budget.add_solve(100, 4.0)
+        assert time_budget.timeout(60, size=100) == 6
+        assert time_budget.timeout(5, size=100) == 5
+
+    # the other zones are predicted to need 4 seconds each, so this one can take the rest
+    with time_budget.zone():
+        assert time_budget.timeout(60, size=100) == 26 - 4
+
+    time_budget.end_step("integerize_final_seed_weights")
+
+    # the next step gets its share of what is left
+    time_budget.begin_step("sub_balancing.geography=TRACT")
+    assert budget.step_seconds == (90 - 4) / 2
+
+
+def test_time_budget_downgrade(budget):
+
+    inject.add_injectable(
+        "settings", {"INTEGERIZER_TIME_BUDGET": 90, "PERFORMANCE_TELEMETRY": True}
+    )
+    performance.clear()
+
+    time_budget.begin_step("sub_balancing.geography=TAZ")
+    time_budget.queue(2)
+
+    with time_budget.zone():
+        budget.add_solve(100, 40.0)
+
+    # 50 seconds left, but a problem 10 times the size is predicted to take 400
+    with performance.call("simul_integerizing"), time_budget.zone():
+        assert time_budget.timeout(60, size=1000, trace_label="TRACT_2") is None
+
+    assert time_budget.downgrades() == [("sub_balancing.geography=TAZ", "TRACT_2")]
+    assert performance._RECORDS[-1]["fallbacks"] == [time_budget.DOWNGRADE_FALLBACK]
+    performance.clear()
+
+    # solves are never downgraded if they get INTEGIZER_TIMEOUT
+    with time_budget.zone():
+        assert time_budget.timeout(10, size=1000, trace_label="TRACT_3") == 10
+
+    # or if what little time is left is below MIN_SOLVE_SECONDS
+    budget.add_solve(100, 50.0 - time_budget.MIN_SOLVE_SECONDS / 2)
+    with time_budget.zone():
+        assert time_budget.timeout(10, size=1, trace_label="TRACT_4") is None
@@ -0,0 +1,56 @@
+import os
+
+import numba
+import pytest
+
+from populationsim.balancing import warmup
+from populationsim.core import inject
+
+
+@pytest.fixture
+def numba_cache_config():
+    cache_dir = numba.config.CACHE_DIR
+    env = os.environ.get("NUMBA_CACHE_DIR")
+    yield
+    numba.config.CACHE_DIR = cache_dir
+    if env is None:
+        os.environ.pop("NUMBA_CACHE_DIR", None)
+    else:
+        os.environ["NUMBA_CACHE_DIR"] = env
+    for kernel in warmup.KERNELS:
+        kernel.enable_caching()
+    inject.clear_cache()
+    inject.reinject_decorated_tables()
+
+
+def test_numba_cache_dir(tmp_path, numba_cache_config):
+
+    inject.add_injectable("output_dir", str(tmp_path))
+
+    inject.add_injectable("settings", {})
+    assert warmup.numba_cache_dir() is None
+
+    inject.add_injectable("settings", {"numba_cache_dir": True})
+    assert warmup.numba_cache_dir() == os.path.join(str(tmp_path), "cache", "numba")
+
+    inject.add_injectable("settings", {"numba_cache_dir": "shared"})
+    assert warmup.numba_cache_dir() == "shared"
+
+
+def test_warmup(tmp_path, numba_cache_config):
+
+    cache_dir = str(tmp_path / "numba")
+    warmup.set_numba_cache_dir(cache_dir)
+    assert os.environ["NUMBA_CACHE_DIR"] == cache_dir
+
+    kernels, seconds = warmup.warmup()
+    assert (kernels.signatures > 0).all()
+
+    cached = [f for _, _, files in os.walk(cache_dir) for f in files]
+    assert any(f.endswith(".nbi") for f in cached)
+    assert any(f.endswith(".nbc") for f in cached)
+
+    # warming up again compiles nothing new
+    signatures = {k.__name__: list(k.signatures) for k in warmup.KERNELS}
+    warmup.warmup()
+    assert signatures == {k.__name__: list(k.signatures) for k in warmup.KERNELS}
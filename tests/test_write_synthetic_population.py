@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from populationsim.steps.write_synthetic_population import (
+    seed_column_join_positions,
+    seed_index_join_positions,
+    take_join_columns,
+)
+
+
+def expanded_household_ids():
+    # hh_ids 7 and 9 are not in the seed tables
+    return pd.DataFrame(
+        {
+            "TAZ": np.array([100, 100, 101, 101, 102, 102, 103, 103], dtype=np.int32),
+            "PUMA": 600,
+            "hh_id": [3, 1, 7, 3, 2, 9, 1, 3],
+            "synthetic_hh_id": np.arange(1, 9),
+        }
+    )
+
+
+def seed_households():
+    return pd.DataFrame(
+        {
+            "PUMA": [600, 600, 601, 601],
+            "VEH": np.array([0, 2, 1, 3], dtype=np.int8),
+            "income": [10.5, 20.0, 30.0, 40.0],
+            "own": [True, False, True, True],
+            "type": ["a", "b", "a", "c"],
+        },
+        index=pd.Index([1, 2, 3, 4], name="hh_id"),
+    )
+
+
+def seed_persons():
+    # hh 4 has no persons, persons of hh 1 and 3 are not contiguous
+    return pd.DataFrame(
+        {
+            "hh_id": [3, 1, 2, 3, 1, 3, 2],
+            "PUMA": [601, 600, 600, 601, 600, 601, 600],
+            "per_num": np.array([1, 1, 1, 2, 2, 3, 2], dtype=np.int16),
+            "age": [40, 30, 50, 10, 35, 5, 52],
+            "worker": [True, True, False, False, True, False, False],
+        }
+    )
+
+
+def test_seed_index_join():
+
+    left_df = expanded_household_ids()
+    right_df = seed_households()
+
+    left_rows, right_rows = seed_index_join_positions(left_df.hh_id, right_df.index)
+    joined = take_join_columns(left_df, right_df, left_rows, right_rows)
+
+    expected = pd.merge(
+        how="left", left=left_df, right=right_df, left_on="hh_id", right_index=True
+    ).reset_index(drop=True)
+
+    # PUMA_x, PUMA_y, and unmatched rows upcast ints to float and bools to object
+    assert "PUMA_y" in joined and joined.VEH.dtype == np.float64
+    pdt.assert_frame_equal(joined, expected)
+
+
+def test_seed_column_join():
+
+    left_df = expanded_household_ids()
+    right_df = seed_persons()
+
+    left_rows, right_rows = seed_column_join_positions(left_df.hh_id, right_df.hh_id)
+    joined = take_join_columns(left_df, right_df, left_rows, right_rows, on="hh_id")
+
+    expected = pd.merge(
+        how="left", left=left_df, right=right_df, left_on="hh_id", right_on="hh_id"
+    )
+
+    assert joined.per_num.isna().sum() == 2
+    pdt.assert_frame_equal(joined, expected)
+
+
+def test_seed_column_join_all_matched():
+
+    left_df = expanded_household_ids()
+    left_df = left_df[~left_df.hh_id.isin([7, 9])]
+    right_df = seed_persons()
+
+    left_rows, right_rows = seed_column_join_positions(left_df.hh_id, right_df.hh_id)
+    joined = take_join_columns(left_df, right_df, left_rows, right_rows, on="hh_id")
+
+    expected = pd.merge(
+        how="left", left=left_df, right=right_df, left_on="hh_id", right_on="hh_id"
+    )
+
+    # no unmatched rows, so no upcasting
+    assert joined.per_num.dtype == np.int16
+    pdt.assert_frame_equal(joined, expected)
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 3, 5])
+def test_take_join_columns_chunks(chunk_rows):
+
+    left_df = expanded_household_ids()
+    right_df = seed_persons()
+
+    left_rows, right_rows = seed_column_join_positions(left_df.hh_id, right_df.hh_id)
+    allow_fill = bool((right_rows < 0).any())
+
+    chunks = [
+        take_join_columns(
+            left_df,
+            right_df,
+            left_rows[start : start + chunk_rows],
+            right_rows[start : start + chunk_rows],
+            on="hh_id",
+            allow_fill=allow_fill,
+        )
+        for start in range(0, len(left_rows), chunk_rows)
+    ]
+
+    # chunks without unmatched rows have the dtypes of the whole join
+    joined = take_join_columns(left_df, right_df, left_rows, right_rows, on="hh_id")
+    for chunk in chunks:
+        pdt.assert_series_equal(chunk.dtypes, joined.dtypes)
+
+    pdt.assert_frame_equal(pd.concat(chunks, ignore_index=True), joined)